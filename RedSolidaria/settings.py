@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'inscripciones',      # Sistema de inscripción a oportunidades de voluntariado
     'organizaciones',     # Gestión de organizaciones que publican oportunidades
     'permutaciones',      # Sistema de intercambio de turnos entre voluntarios
+    'eventos',            # Bandeja de salida de eventos y notificaciones diferidas
 ]
 
 MIDDLEWARE = [
@@ -101,6 +102,18 @@ DATABASES = {
     }
 }
 
+# Caché compartida por todos los procesos del servidor y los comandos de gestión
+# Los contadores de inscripciones (inscripciones/contadores.py) se invalidan desde
+# cualquier proceso, así que no sirve la caché en memoria local de cada uno. La tabla
+# se crea con la migración inscripciones 0006 (o con manage.py createcachetable).
+# Con Redis o Memcached disponibles basta cambiar BACKEND y LOCATION.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'redsolidaria_cache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -181,4 +194,30 @@ MESSAGE_TAGS = {
 }
 
 # Configuración de almacenamiento de mensajes
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
\ No newline at end of file
+MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# Días que los registros del historial de permutaciones permanecen en la tabla activa
+# antes de trasladarse al archivo (comando archivar_historial)
+HISTORIAL_PERMUTACION_DIAS_ACTIVOS = 180
+# Días que una solicitud de permutación puede seguir pendiente sin respuesta antes de
+# expirar (comando expirar_solicitudes)
+SOLICITUD_PERMUTACION_DIAS_EXPIRACION = 30
+# Segundos que los contadores de las pestañas de gestión de inscripciones permanecen en
+# caché; las escrituras los invalidan antes, esto solo acota el avance de la ventana del historial
+GESTION_CONTADORES_SEGUNDOS = 300
+# Segundos que la insignia de inscripciones pendientes permanece en caché: las
+# escrituras la ajustan, pero sin garantía de atomicidad con la caché de base de datos;
+# al vencer se vuelve a contar y se corrige cualquier desfase (es el límite del error)
+INSCRIPCIONES_PENDIENTES_SEGUNDOS = 60
+
+# Bandeja de salida de eventos (comando procesar_eventos)
+# Número máximo de intentos de entrega antes de marcar un evento como fallido
+EVENTOS_MAX_INTENTOS = 5
+# Segundos de espera tras el primer fallo; se duplica en cada reintento
+EVENTOS_RETRASO_BASE = 30
+# Segundos que un evento reclamado queda reservado para el proceso que lo entrega
+EVENTOS_PLAZO = 300
+
+# Configuración de correo para las notificaciones
+# En desarrollo los correos se muestran en la consola del worker
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'RedSolidaria <no-responder@puce.edu.ec>'
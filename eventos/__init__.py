@@ -0,0 +1,14 @@
+"""
+Módulo de eventos para la aplicación RedSolidaria.
+
+Implementa una bandeja de salida transaccional (patrón outbox): los cambios de
+estado de solicitudes de permutación e inscripciones registran un evento en la
+misma transacción que los produce, y el comando procesar_eventos los entrega
+después, fuera del ciclo de la petición (notificaciones por correo y datos derivados).
+
+Las funcionalidades principales están organizadas en los siguientes módulos:
+- models.py: Define el modelo EventoSalida
+- bandeja.py: Registro de eventos, manejadores y procesamiento por lotes
+- manejadores.py: Manejadores de cada tipo de evento
+- admin.py: Configuración del panel de administración
+"""
@@ -0,0 +1,36 @@
+# Importa el módulo de administración de Django
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import EventoSalida
+
+
+@admin.register(EventoSalida)
+class EventoSalidaAdmin(admin.ModelAdmin):
+    """
+    Consulta de la bandeja de salida. Los eventos son de solo lectura; la acción
+    de reintento devuelve a la cola los eventos fallidos.
+    """
+    list_display = ('id', 'tipo', 'estado', 'intentos', 'fecha_creacion', 'fecha_procesado')
+    list_filter = ('estado', 'tipo')
+    search_fields = ('clave', 'ultimo_error')
+    date_hierarchy = 'fecha_creacion'
+    readonly_fields = (
+        'tipo', 'clave', 'datos', 'estado', 'intentos', 'disponible_desde',
+        'ultimo_error', 'fecha_creacion', 'fecha_procesado'
+    )
+    actions = ['reintentar']
+
+    @admin.action(description='Reintentar los eventos seleccionados')
+    def reintentar(self, request, queryset):
+        # Los eventos vuelven a estar pendientes con el contador de intentos a cero
+        actualizados = queryset.exclude(estado='procesado').update(
+            estado='pendiente', intentos=0, ultimo_error='', disponible_desde=timezone.now()
+        )
+        self.message_user(request, f'{actualizados} eventos devueltos a la cola.')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,185 @@
+# Bandeja de salida transaccional (patrón outbox)
+# Los cambios de estado registran eventos en la misma transacción que los produce;
+# el comando procesar_eventos los entrega después en lotes, fuera de la petición.
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EventoSalida
+
+# Número de eventos que toma cada lote
+TAMANO_LOTE = 100
+
+# Manejadores registrados por tipo de evento
+MANEJADORES = {}
+
+
+def manejador(tipo):
+    """
+    Decorador que registra una función como manejador de un tipo de evento.
+    La función recibe el EventoSalida y debe ser idempotente: un evento puede
+    entregarse más de una vez si el proceso se interrumpe antes de confirmarlo o
+    si tarda más que EVENTOS_PLAZO.
+
+    Args:
+        tipo: Tipo de evento que atiende la función
+    """
+    def registrar_manejador(funcion):
+        MANEJADORES.setdefault(tipo, []).append(funcion)
+        return funcion
+    return registrar_manejador
+
+
+def registrar(tipo, clave=None, disponible_desde=None, **datos):
+    """
+    Registra un evento en la bandeja de salida. Debe llamarse dentro de la transacción
+    del cambio de estado para que el evento se confirme (o se descarte) junto con él.
+
+    Args:
+        tipo: Tipo del evento
+        clave: Clave de idempotencia; si ya existe un evento con ella no se registra de nuevo
+        disponible_desde: Momento a partir del cual se entrega (por defecto, de inmediato)
+        **datos: Contenido del evento (valores serializables en JSON)
+    """
+    registrar_varios([(tipo, clave, datos)], disponible_desde)
+
+
+def registrar_varios(eventos, disponible_desde=None):
+    """
+    Registra varios eventos con una sola inserción.
+
+    Args:
+        eventos: Iterable de tuplas (tipo, clave, datos)
+        disponible_desde: Momento a partir del cual se entregan (por defecto, de inmediato)
+    """
+    disponible_desde = disponible_desde or timezone.now()
+    EventoSalida.objects.bulk_create([
+        EventoSalida(
+            tipo=tipo,
+            clave=clave or f'{tipo}:{uuid.uuid4().hex}',
+            datos=datos,
+            disponible_desde=disponible_desde
+        )
+        for tipo, clave, datos in eventos
+    ], ignore_conflicts=True)
+
+
+def _retraso(intentos):
+    """Espera antes del siguiente intento: crece exponencialmente con cada fallo."""
+    base = getattr(settings, 'EVENTOS_RETRASO_BASE', 30)
+    return timedelta(seconds=min(base * 2 ** (intentos - 1), 6 * 3600))
+
+
+def reclamar(tamano_lote=TAMANO_LOTE):
+    """
+    Reclama un lote de eventos pendientes en una transacción corta.
+
+    Las filas se bloquean con SELECT ... FOR UPDATE SKIP LOCKED, por lo que varios
+    procesos pueden trabajar en paralelo sin tomar los mismos eventos. Al reclamarlos
+    se cuenta el intento y se posponen EVENTOS_PLAZO segundos; la transacción se
+    confirma enseguida, de modo que los manejadores se ejecutan sin bloqueos sobre la
+    bandeja. Si el proceso muere antes de terminar, los eventos vuelven a estar
+    disponibles al vencer el plazo.
+
+    Args:
+        tamano_lote: Número máximo de eventos del lote
+
+    Returns:
+        list: Eventos reclamados
+    """
+    ahora = timezone.now()
+    with transaction.atomic():
+        eventos = list(
+            EventoSalida.objects.select_for_update(skip_locked=True).filter(
+                estado='pendiente',
+                disponible_desde__lte=ahora
+            ).order_by('disponible_desde', 'id')[:tamano_lote]
+        )
+        for evento in eventos:
+            evento.intentos += 1
+            evento.disponible_desde = ahora + timedelta(seconds=getattr(settings, 'EVENTOS_PLAZO', 300))
+        if eventos:
+            EventoSalida.objects.bulk_update(eventos, ['intentos', 'disponible_desde'])
+    return eventos
+
+
+def _cerrar(evento, **cambios):
+    """
+    Guarda el resultado de un evento reclamado, solo si nadie lo reclamó de nuevo
+    mientras tanto (el número de intentos sigue siendo el de este reclamo).
+
+    Raises:
+        EventoSalida.DoesNotExist: Si el evento fue reclamado por otro proceso
+    """
+    actualizados = EventoSalida.objects.filter(
+        pk=evento.pk,
+        estado='pendiente',
+        intentos=evento.intentos
+    ).update(**cambios)
+    if not actualizados:
+        raise EventoSalida.DoesNotExist(f'El evento {evento.pk} fue reclamado por otro proceso')
+
+
+def procesar_lote(tamano_lote=TAMANO_LOTE):
+    """
+    Reclama un lote de eventos pendientes y los entrega a sus manejadores.
+
+    Cada evento se ejecuta en su propia transacción, fuera de la que reclamó el lote:
+    los efectos de base de datos de los manejadores se confirman junto con la marca
+    de procesado, o se deshacen si el evento ya no pertenece a este proceso. Si un
+    manejador falla se anota el error y el evento se pospone; al agotar
+    EVENTOS_MAX_INTENTOS queda como fallido. La entrega es al menos una vez: un
+    efecto externo, como un correo, puede repetirse si el proceso muere (o el plazo
+    vence) después de enviarlo y antes de confirmar la marca.
+
+    Args:
+        tamano_lote: Número máximo de eventos del lote
+
+    Returns:
+        tuple: (procesados, fallidos) en este lote
+    """
+    max_intentos = getattr(settings, 'EVENTOS_MAX_INTENTOS', 5)
+    procesados = fallidos = 0
+
+    for evento in reclamar(tamano_lote):
+        try:
+            with transaction.atomic():
+                for funcion in MANEJADORES.get(evento.tipo, ()):
+                    funcion(evento)
+                _cerrar(evento, estado='procesado', fecha_procesado=timezone.now())
+        except EventoSalida.DoesNotExist:
+            # Otro proceso lo reclamó al vencer el plazo: él registrará el resultado
+            continue
+        except Exception as e:
+            fallidos += 1
+            error = f'{type(e).__name__}: {e}'
+            try:
+                if evento.intentos >= max_intentos:
+                    _cerrar(evento, estado='fallido', ultimo_error=error)
+                else:
+                    _cerrar(
+                        evento,
+                        ultimo_error=error,
+                        disponible_desde=timezone.now() + _retraso(evento.intentos)
+                    )
+            except EventoSalida.DoesNotExist:
+                pass
+        else:
+            procesados += 1
+
+    return procesados, fallidos
+
+
+def purgar(dias):
+    """
+    Elimina los eventos procesados hace más de `dias` días.
+
+    Returns:
+        int: Número de eventos eliminados
+    """
+    corte = timezone.now() - timedelta(days=dias)
+    eliminados, _ = EventoSalida.objects.filter(estado='procesado', fecha_procesado__lt=corte).delete()
+    return eliminados
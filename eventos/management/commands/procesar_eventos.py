@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from eventos import bandeja
+
+
+class Command(BaseCommand):
+    help = 'Entrega los eventos pendientes de la bandeja de salida a sus manejadores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=bandeja.TAMANO_LOTE,
+            help='Número máximo de eventos tomados por transacción',
+        )
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Seguir esperando eventos nuevos en lugar de terminar cuando la bandeja quede vacía',
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=5,
+            help='Segundos de espera cuando no hay eventos pendientes (modo continuo)',
+        )
+        parser.add_argument(
+            '--purgar',
+            type=int,
+            default=None,
+            metavar='DIAS',
+            help='Eliminar al terminar los eventos procesados hace más de DIAS días',
+        )
+
+    def handle(self, *args, **options):
+        total_procesados = 0
+        total_fallidos = 0
+        lotes = 0
+
+        # Varios procesos pueden ejecutar este comando a la vez: cada lote se reclama con
+        # SKIP LOCKED y queda reservado durante EVENTOS_PLAZO, así que no toman el mismo evento
+        try:
+            while True:
+                procesados, fallidos = bandeja.procesar_lote(options['lote'])
+                if procesados or fallidos:
+                    lotes += 1
+                    total_procesados += procesados
+                    total_fallidos += fallidos
+                    self.stdout.write(f'Lote {lotes}: {procesados} procesados, {fallidos} con error')
+                    continue
+                if not options['continuo']:
+                    break
+                time.sleep(options['pausa'])
+        except KeyboardInterrupt:
+            self.stdout.write('Interrumpido por el usuario')
+
+        eliminados = bandeja.purgar(options['purgar']) if options['purgar'] is not None else 0
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado.\n'
+            f'Lotes procesados: {lotes}\n'
+            f'Eventos procesados: {total_procesados}\n'
+            f'Eventos con error: {total_fallidos}\n'
+            f'Eventos purgados: {eliminados}'
+        ))
@@ -0,0 +1,140 @@
+# Manejadores de los eventos de la bandeja de salida
+# Envían las notificaciones por correo de los cambios de estado. Se ejecutan en el
+# comando procesar_eventos, nunca durante la petición que originó el evento.
+from django.core.mail import send_mail
+
+from inscripciones.models import Inscripcion
+from permutaciones import expiracion
+from permutaciones.models import SolicitudPermutacion, HistorialPermutacion
+from .bandeja import manejador
+
+
+def _notificar(usuario, asunto, mensaje):
+    """Envía un correo al usuario si tiene dirección registrada."""
+    if usuario.email:
+        send_mail(f'RedSolidaria: {asunto}', mensaje, None, [usuario.email])
+
+
+def _solicitud(evento):
+    """Obtiene la solicitud del evento con sus relaciones (None si ya no existe)."""
+    return SolicitudPermutacion.objects.select_related(
+        'solicitante', 'receptor', 'oportunidad_origen', 'oportunidad_destino'
+    ).filter(pk=evento.datos.get('solicitud_id')).first()
+
+
+@manejador('permutacion.creada')
+def notificar_solicitud_creada(evento):
+    """Avisa al receptor de que tiene una nueva solicitud de intercambio."""
+    solicitud = _solicitud(evento)
+    if solicitud is None:
+        return
+    _notificar(
+        solicitud.receptor,
+        'Nueva solicitud de intercambio',
+        f'{solicitud.solicitante.get_full_name()} quiere intercambiar su turno en '
+        f'"{solicitud.oportunidad_origen.titulo}" por tu turno en "{solicitud.oportunidad_destino.titulo}".'
+    )
+
+
+@manejador('permutacion.aceptada')
+def notificar_solicitud_aceptada(evento):
+    """Avisa al solicitante de que su intercambio se realizó."""
+    solicitud = _solicitud(evento)
+    if solicitud is None:
+        return
+    _notificar(
+        solicitud.solicitante,
+        'Intercambio realizado',
+        f'Tu solicitud de intercambio fue aceptada. Ahora tienes el turno en '
+        f'"{solicitud.oportunidad_destino.titulo}".'
+    )
+
+
+@manejador('permutacion.rechazada')
+def notificar_solicitud_rechazada(evento):
+    """Avisa al solicitante del rechazo, con el motivo registrado en el historial."""
+    solicitud = _solicitud(evento)
+    if solicitud is None:
+        return
+    registro = solicitud.historial.filter(accion__in=('rechazo', 'error')).order_by('-fecha').first()
+    motivo = HistorialPermutacion.MOTIVOS.get(registro.datos.get('motivo'), '') if registro else ''
+    _notificar(
+        solicitud.solicitante,
+        'Solicitud de intercambio rechazada',
+        f'Tu solicitud para intercambiar tu turno en "{solicitud.oportunidad_origen.titulo}" '
+        f'por "{solicitud.oportunidad_destino.titulo}" fue rechazada.'
+        + (f'\nMotivo: {motivo}' if motivo else '')
+    )
+
+
+@manejador('permutacion.cancelada')
+def notificar_solicitud_cancelada(evento):
+    """Avisa al receptor de que el solicitante retiró la solicitud."""
+    solicitud = _solicitud(evento)
+    if solicitud is None:
+        return
+    _notificar(
+        solicitud.receptor,
+        'Solicitud de intercambio cancelada',
+        f'{solicitud.solicitante.get_full_name()} canceló la solicitud de intercambio '
+        f'para tu turno en "{solicitud.oportunidad_destino.titulo}".'
+    )
+
+
+@manejador('permutacion.expirada')
+def notificar_solicitud_expirada(evento):
+    """Avisa al solicitante de que su solicitud expiró sin respuesta."""
+    solicitud = _solicitud(evento)
+    if solicitud is None:
+        return
+    registro = solicitud.historial.filter(accion='expiracion').order_by('-fecha').first()
+    motivo = HistorialPermutacion.MOTIVOS.get(registro.datos.get('motivo'), '') if registro else ''
+    _notificar(
+        solicitud.solicitante,
+        'Solicitud de intercambio expirada',
+        f'Tu solicitud para intercambiar tu turno en "{solicitud.oportunidad_origen.titulo}" '
+        f'por "{solicitud.oportunidad_destino.titulo}" expiró.'
+        + (f'\nMotivo: {motivo}' if motivo else '')
+    )
+
+
+@manejador('oportunidad.finalizada')
+def expirar_solicitudes_oportunidad(evento):
+    """Expira las solicitudes pendientes de una oportunidad cuando pasa su fecha de fin."""
+    expiracion.expirar_oportunidad(evento.datos['oportunidad_id'])
+
+
+@manejador('inscripcion.aceptada')
+@manejador('inscripcion.rechazada')
+def notificar_inscripcion(evento):
+    """Avisa al voluntario de la decisión sobre su inscripción."""
+    inscripcion = Inscripcion.objects.select_related('usuario', 'oportunidad').filter(
+        pk=evento.datos.get('inscripcion_id')
+    ).first()
+    if inscripcion is None:
+        return
+    # La inscripción pudo cambiar de nuevo antes de procesar el evento
+    estado = evento.tipo.split('.')[1]
+    if inscripcion.estado != estado:
+        return
+    _notificar(
+        inscripcion.usuario,
+        f'Inscripción {inscripcion.get_estado_display().lower()}',
+        f'Tu inscripción en "{inscripcion.oportunidad.titulo}" fue {inscripcion.get_estado_display().lower()}.'
+    )
+
+
+@manejador('inscripcion.promovida')
+def notificar_inscripcion_promovida(evento):
+    """Avisa al voluntario de que obtuvo un cupo desde la lista de espera."""
+    inscripcion = Inscripcion.objects.select_related('usuario', 'oportunidad').filter(
+        pk=evento.datos.get('inscripcion_id')
+    ).first()
+    if inscripcion is None:
+        return
+    _notificar(
+        inscripcion.usuario,
+        'Cupo disponible',
+        f'Se liberó un cupo en "{inscripcion.oportunidad.titulo}" y te inscribimos desde la lista de espera. '
+        f'Tu inscripción quedó {inscripcion.get_estado_display().lower()}.'
+    )
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoSalida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50, verbose_name='tipo')),
+                ('clave', models.CharField(max_length=100, unique=True, verbose_name='clave de idempotencia')),
+                ('datos', models.JSONField(blank=True, default=dict, verbose_name='datos')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesado', 'Procesado'), ('fallido', 'Fallido')], default='pendiente', max_length=20, verbose_name='estado')),
+                ('intentos', models.PositiveIntegerField(default=0, verbose_name='intentos')),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now, verbose_name='disponible desde')),
+                ('ultimo_error', models.TextField(blank=True, default='', verbose_name='último error')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='fecha de creación')),
+                ('fecha_procesado', models.DateTimeField(blank=True, null=True, verbose_name='fecha de procesado')),
+            ],
+            options={
+                'verbose_name': 'evento de salida',
+                'verbose_name_plural': 'eventos de salida',
+                'ordering': ['id'],
+                'indexes': [models.Index(condition=models.Q(('estado', 'pendiente')), fields=['disponible_desde', 'id'], name='evento_pendiente_idx')],
+            },
+        ),
+    ]
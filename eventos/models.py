@@ -0,0 +1,92 @@
+# Importa los modelos de Django
+from django.db import models
+from django.utils import timezone
+
+
+class EventoSalida(models.Model):
+    """
+    Evento pendiente de entrega en la bandeja de salida.
+
+    Se escribe en la misma transacción que el cambio de estado que lo origina, de modo
+    que solo existe si ese cambio se confirmó. El comando procesar_eventos lo entrega a
+    los manejadores registrados para su tipo y lo marca como procesado.
+    """
+    # Estados del ciclo de vida del evento
+    ESTADOS = (
+        ('pendiente', 'Pendiente'),
+        ('procesado', 'Procesado'),
+        ('fallido', 'Fallido'),  # Agotó los reintentos; requiere revisión manual
+    )
+
+    # Tipo del evento, p. ej. 'permutacion.aceptada' o 'inscripcion.aceptada'
+    tipo = models.CharField(
+        max_length=50,
+        verbose_name='tipo'
+    )
+
+    # Clave de idempotencia: registrar dos veces el mismo evento no lo duplica
+    clave = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name='clave de idempotencia'
+    )
+
+    # Contenido del evento (ids de los objetos afectados)
+    datos = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='datos'
+    )
+
+    estado = models.CharField(
+        max_length=20,
+        choices=ESTADOS,
+        default='pendiente',
+        verbose_name='estado'
+    )
+
+    # Número de entregas intentadas
+    intentos = models.PositiveIntegerField(
+        default=0,
+        verbose_name='intentos'
+    )
+
+    # Momento a partir del cual puede entregarse (se pospone tras cada fallo)
+    disponible_desde = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='disponible desde'
+    )
+
+    # Último error producido por un manejador
+    ultimo_error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='último error'
+    )
+
+    fecha_creacion = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='fecha de creación'
+    )
+
+    fecha_procesado = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='fecha de procesado'
+    )
+
+    class Meta:
+        verbose_name = 'evento de salida'
+        verbose_name_plural = 'eventos de salida'
+        ordering = ['id']
+        indexes = [
+            # Índice parcial: el worker solo consulta los eventos pendientes
+            models.Index(
+                fields=['disponible_desde', 'id'],
+                name='evento_pendiente_idx',
+                condition=models.Q(estado='pendiente')
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} ({self.get_estado_display()})"
@@ -0,0 +1,62 @@
+from django.core import mail
+from django.test import TestCase, override_settings
+
+from organizaciones.models import Organizacion
+from . import bandeja
+from .models import EventoSalida
+
+
+class ProcesarLoteTests(TestCase):
+    """Entrega de la bandeja de salida: reclamo en bloque y manejadores fuera del bloqueo."""
+
+    def setUp(self):
+        # Solo los manejadores de cada prueba; los reales se restauran al terminar
+        self.addCleanup(bandeja.MANEJADORES.update, dict(bandeja.MANEJADORES))
+        self.addCleanup(bandeja.MANEJADORES.clear)
+        bandeja.MANEJADORES.clear()
+
+    def test_entrega_y_marca_procesado(self):
+        bandeja.manejador('prueba')(lambda evento: mail.send_mail('Asunto', 'Cuerpo', None, ['a@puce.edu.ec']))
+        bandeja.registrar('prueba', 'prueba:1')
+
+        self.assertEqual(bandeja.procesar_lote(), (1, 0))
+        evento = EventoSalida.objects.get()
+        self.assertEqual((evento.estado, evento.intentos), ('procesado', 1))
+        self.assertEqual(len(mail.outbox), 1)
+        # Un evento procesado no se entrega de nuevo
+        self.assertEqual(bandeja.procesar_lote(), (0, 0))
+
+    @override_settings(EVENTOS_MAX_INTENTOS=2, EVENTOS_RETRASO_BASE=0)
+    def test_fallo_deshace_y_reintenta(self):
+        def fallar(evento):
+            Organizacion.objects.create(nombre='Efecto', descripcion='x', contacto_email='o@puce.edu.ec')
+            raise RuntimeError('sin servidor de correo')
+        bandeja.manejador('prueba')(fallar)
+        bandeja.registrar('prueba', 'prueba:1')
+
+        self.assertEqual(bandeja.procesar_lote(), (0, 1))
+        evento = EventoSalida.objects.get()
+        self.assertEqual((evento.estado, evento.intentos), ('pendiente', 1))
+        self.assertIn('sin servidor de correo', evento.ultimo_error)
+        self.assertFalse(Organizacion.objects.exists())
+
+        self.assertEqual(bandeja.procesar_lote(), (0, 1))
+        self.assertEqual(EventoSalida.objects.get().estado, 'fallido')
+
+    def test_reclamado_por_otro_proceso_deshace_efectos(self):
+        def reclamar_de_nuevo(evento):
+            Organizacion.objects.create(nombre='Efecto', descripcion='x', contacto_email='o@puce.edu.ec')
+            # Otro proceso lo reclama al vencer el plazo mientras este aún lo entrega
+            EventoSalida.objects.filter(pk=evento.pk).update(intentos=evento.intentos + 1)
+        bandeja.manejador('prueba')(reclamar_de_nuevo)
+        bandeja.registrar('prueba', 'prueba:1')
+
+        self.assertEqual(bandeja.procesar_lote(), (0, 0))
+        self.assertEqual(EventoSalida.objects.get().estado, 'pendiente')
+        self.assertFalse(Organizacion.objects.exists())
+
+    def test_reclamo_reserva_los_eventos(self):
+        bandeja.registrar('prueba', 'prueba:1')
+        self.assertEqual(len(bandeja.reclamar()), 1)
+        # Mientras dura el plazo ningún otro proceso puede tomarlo
+        self.assertEqual(bandeja.reclamar(), [])
@@ -1,6 +1,10 @@
 # Importaciones de Django
-from django.contrib import admin
-from .models import Inscripcion
+from collections import Counter
+
+from django.contrib import admin, messages
+from django.db import transaction
+from .models import Inscripcion, ListaEspera
+from . import gestion
 
 
 @admin.register(Inscripcion)
@@ -21,8 +25,80 @@ class InscripcionAdmin(admin.ModelAdmin):
     # Campos por los que se puede buscar
     search_fields = ('usuario__email', 'oportunidad__titulo')
     
-    # Campos de solo lectura (no editables)
-    readonly_fields = ('fecha_inscripcion',)
+    # Campos de solo lectura (no editables). El estado solo cambia con las acciones
+    # masivas, que mueven los cupos y la lista de espera (ver gestion.decidir_en_bloque)
+    readonly_fields = ('fecha_inscripcion', 'estado')
+    
+    # Decisiones masivas sobre las inscripciones seleccionadas
+    actions = ('aceptar_seleccionadas', 'rechazar_seleccionadas')
+    
+    def get_readonly_fields(self, request, obj=None):
+        """Una inscripción existente tampoco cambia de voluntario ni de oportunidad: ocupa su cupo."""
+        if obj is not None:
+            return self.readonly_fields + ('usuario', 'oportunidad')
+        return self.readonly_fields
+    
+    def has_add_permission(self, request):
+        """
+        Las inscripciones se crean al inscribirse o con la importación masiva, que
+        reservan el cupo; el formulario del admin lo crearía sin descontarlo.
+        """
+        return False
+    
+    def delete_model(self, request, obj):
+        """Borra la inscripción liberando su cupo, igual que al cancelarla."""
+        self.delete_queryset(request, Inscripcion.objects.filter(pk=obj.pk))
+    
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        """
+        Borra las inscripciones (también desde la acción delete_selected) y entrega los
+        cupos que ocupaban a la lista de espera, con una liberación por oportunidad.
+        Las señales de borrado descuentan los contadores de cada inscripción.
+        """
+        # Bloquear las filas en orden de clave: un borrado doble no libera dos veces el cupo
+        filas = list(
+            queryset.select_for_update(of=('self',)).order_by('pk').values_list('pk', 'oportunidad_id', 'estado')
+        )
+        liberados = Counter(
+            oportunidad_id for _, oportunidad_id, estado in filas if estado in Inscripcion.ESTADOS_CON_CUPO
+        )
+        for oportunidad_id, cantidad in sorted(liberados.items()):
+            gestion.liberar_cupo(oportunidad_id, cantidad)
+        Inscripcion.objects.filter(pk__in=[pk for pk, _, _ in filas]).delete()
+    
+    @admin.action(description='Aceptar las inscripciones seleccionadas')
+    def aceptar_seleccionadas(self, request, queryset):
+        """Acepta las inscripciones con un único UPDATE, reservando los cupos necesarios."""
+        cambiadas, sin_cupo = gestion.decidir_en_bloque(queryset, 'aceptada', request.user)
+        self.message_user(request, f'{cambiadas} inscripciones aceptadas.', messages.SUCCESS)
+        if sin_cupo:
+            self.message_user(request, f'{sin_cupo} inscripciones no se aceptaron por falta de cupos.', messages.ERROR)
+    
+    @admin.action(description='Rechazar las inscripciones seleccionadas')
+    def rechazar_seleccionadas(self, request, queryset):
+        """Rechaza las inscripciones con un único UPDATE; los cupos pasan a la lista de espera."""
+        cambiadas, _ = gestion.decidir_en_bloque(queryset, 'rechazada', request.user)
+        self.message_user(request, f'{cambiadas} inscripciones rechazadas.', messages.WARNING)
+
+
+@admin.register(ListaEspera)
+class ListaEsperaAdmin(admin.ModelAdmin):
+    """
+    Configuración del panel de administración para las listas de espera.
+    Las entradas se muestran en el orden de atención (FIFO) de cada oportunidad.
+    """
+    
+    list_display = ('usuario', 'oportunidad', 'fecha_solicitud', 'posicion')
+    list_filter = ('oportunidad',)
+    search_fields = ('usuario__email', 'oportunidad__titulo')
+    readonly_fields = ('fecha_solicitud',)
+    list_select_related = ('usuario', 'oportunidad')
+    
+    def get_queryset(self, request):
+        """Anota la posición de cada entrada con una sola consulta."""
+        return ListaEspera.con_posicion(super().get_queryset(request))
     
-    # Campos editables directamente desde la lista de objetos
-    list_editable = ('estado',)
\ No newline at end of file
+    @admin.display(description='Posición', ordering='posicion')
+    def posicion(self, obj):
+        return obj.posicion
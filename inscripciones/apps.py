@@ -14,4 +14,8 @@ class InscripcionesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     
     # Nombre completo de Python de la aplicación
-    name = 'inscripciones'
\ No newline at end of file
+    name = 'inscripciones'
+
+    def ready(self):
+        # Registra las señales que invalidan los contadores de gestión
+        from . import signals  # noqa: F401
@@ -0,0 +1,202 @@
+# Contadores de inscripciones servidos desde la caché
+# Los de las pestañas de gestión se calculan con un único agregado condicional sobre
+# las inscripciones (más el conteo del historial de intercambios, que está en otra
+# tabla). Cualquier escritura sobre inscripciones o historial los invalida al
+# confirmarse la transacción; el tiempo de vida acota el desfase del historial, cuya
+# ventana activa avanza con el reloj sin que nada se escriba.
+#
+# El de pendientes (la insignia del menú, en cada página de los administradores) no se
+# invalida: las escrituras lo ajustan con incr() sobre la caché y su tiempo de vida
+# corto acota cualquier desfase (ver ajustar_pendientes).
+#
+# La caché debe ser compartida por todos los procesos (settings.CACHES): con la caché en
+# memoria local, invalidar o ajustar en un proceso no afectaría a los demás.
+#
+# Los contadores por oportunidad (pendientes, aceptadas y capacidad_total) no están en la
+# caché sino desnormalizados en OportunidadVoluntariado: las escrituras los ajustan en la
+# misma transacción y reconciliar() los recalcula a partir de las inscripciones.
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from oportunidades.models import OportunidadVoluntariado
+from .models import Inscripcion
+
+# Tamaño máximo de las listas de ids que se corrigen en una sola sentencia
+TAMANO_LOTE = 500
+
+CLAVE = 'inscripciones:contadores_gestion'
+CLAVE_PENDIENTES = 'inscripciones:pendientes'
+
+
+def calcular():
+    """
+    Calcula los contadores con dos consultas: un agregado condicional con los
+    conteos por estado y el total de inscripciones, y el conteo del historial activo.
+
+    Returns:
+        dict: Contadores por pestaña ('pendiente', 'aceptada', 'rechazada', 'historial', 'total')
+    """
+    # Importación diferida: permutaciones.models depende de inscripciones.models
+    from permutaciones.models import HistorialPermutacion
+
+    contadores = Inscripcion.objects.aggregate(
+        pendiente=models.Count('id', filter=models.Q(estado='pendiente')),
+        aceptada=models.Count('id', filter=models.Q(estado='aceptada')),
+        rechazada=models.Count('id', filter=models.Q(estado='rechazada')),
+        total=models.Count('id')
+    )
+    contadores['historial'] = HistorialPermutacion.objects.filter(
+        fecha__gte=HistorialPermutacion.fecha_corte()
+    ).count()
+    return contadores
+
+
+def obtener():
+    """Devuelve los contadores desde la caché, calculándolos solo si no están."""
+    contadores = cache.get(CLAVE)
+    if contadores is None:
+        contadores = calcular()
+        cache.set(CLAVE, contadores, getattr(settings, 'GESTION_CONTADORES_SEGUNDOS', 300))
+    return contadores
+
+
+def invalidar():
+    """
+    Descarta los contadores en caché cuando se confirme la transacción en curso (de
+    inmediato fuera de una transacción). Invalidar antes de confirmar permitiría que una
+    lectura simultánea volviera a guardar los valores anteriores.
+
+    Las señales de inscripciones/signals.py lo invocan en cada save() o delete(); las
+    escrituras masivas (update(), bulk_create) deben invocarlo explícitamente.
+    """
+    transaction.on_commit(lambda: cache.delete(CLAVE))
+
+
+def pendientes():
+    """Devuelve el número de inscripciones pendientes desde la caché, contándolas si no está."""
+    total = cache.get(CLAVE_PENDIENTES)
+    if total is None:
+        total = Inscripcion.objects.filter(estado='pendiente').count()
+        # add() no pisa un valor que otra petición ya haya guardado y ajustado
+        cache.add(CLAVE_PENDIENTES, total, getattr(settings, 'INSCRIPCIONES_PENDIENTES_SEGUNDOS', 60))
+    return total
+
+
+def ajustar_pendientes(diferencia):
+    """
+    Suma la diferencia al contador de pendientes cuando se confirme la transacción en
+    curso; si la clave no está, el siguiente pendientes() vuelve a contar. Con la caché
+    de base de datos incr() lee y escribe en dos pasos, así que dos ajustes simultáneos
+    pueden perder uno: la única garantía es INSCRIPCIONES_PENDIENTES_SEGUNDOS, al vencer
+    se cuenta de nuevo y el desfase desaparece. Con Redis o Memcached incr() es atómico.
+
+    Las señales de inscripciones/signals.py lo invocan en cada save() o delete(); las
+    escrituras masivas deben invocarlo explícitamente.
+
+    Args:
+        diferencia: Inscripciones pendientes añadidas (negativo si se quitaron)
+    """
+    if not diferencia:
+        return
+
+    def aplicar():
+        try:
+            cache.incr(CLAVE_PENDIENTES, diferencia)
+        except ValueError:
+            pass
+
+    transaction.on_commit(aplicar)
+
+
+def ajustar_oportunidades(salidas=(), entradas=()):
+    """
+    Ajusta los contadores de inscripciones de las oportunidades afectadas, con un
+    incremento atómico por oportunidad. Una inscripción que cambia de estado o de
+    oportunidad (un intercambio) sale con sus valores anteriores y entra con los nuevos.
+
+    Las señales de inscripciones/signals.py lo invocan en cada save() o delete(); las
+    escrituras masivas deben invocarlo explícitamente.
+
+    Args:
+        salidas: Iterable de (oportunidad_id, estado) de las inscripciones que se quitan
+        entradas: Iterable de (oportunidad_id, estado) de las inscripciones que se añaden
+    """
+    cambios = defaultdict(lambda: [0, 0])
+    for signo, filas in ((-1, salidas), (1, entradas)):
+        for oportunidad_id, estado in filas:
+            if estado == 'pendiente':
+                cambios[oportunidad_id][0] += signo
+            elif estado == 'aceptada':
+                cambios[oportunidad_id][1] += signo
+    OportunidadVoluntariado.ajustar_inscritas(cambios)
+
+
+# Oportunidad cuyos contadores no coinciden con las inscripciones
+Diferencia = namedtuple(
+    'Diferencia',
+    'oportunidad_id titulo pendientes pendientes_reales aceptadas aceptadas_reales capacidad_total capacidad_real'
+)
+
+
+def _conteo(estado):
+    """Subconsulta con el número de inscripciones de la oportunidad en un estado."""
+    return Coalesce(models.Subquery(
+        Inscripcion.objects.filter(
+            oportunidad_id=models.OuterRef('pk'), estado=estado
+        ).order_by().values('oportunidad_id').annotate(total=models.Count('id')).values('total'),
+        output_field=models.IntegerField()
+    ), 0)
+
+
+def diferencias():
+    """
+    Compara los contadores de todas las oportunidades con las inscripciones en una
+    sola consulta agregada (las coincidencias se descartan en el HAVING).
+
+    Returns:
+        list: Diferencia de cada oportunidad con algún contador desviado
+    """
+    reales = OportunidadVoluntariado.objects.annotate(
+        pendientes_reales=models.Count('inscripciones', filter=models.Q(inscripciones__estado='pendiente')),
+        aceptadas_reales=models.Count('inscripciones', filter=models.Q(inscripciones__estado='aceptada')),
+    ).annotate(
+        capacidad_real=models.ExpressionWrapper(
+            models.F('cupos') + models.F('pendientes_reales') + models.F('aceptadas_reales'),
+            output_field=models.IntegerField()
+        )
+    ).exclude(
+        pendientes=models.F('pendientes_reales'),
+        aceptadas=models.F('aceptadas_reales'),
+        capacidad_total=models.F('capacidad_real')
+    ).order_by('pk')
+    return [Diferencia(*fila) for fila in reales.values_list('pk', *Diferencia._fields[1:])]
+
+
+def reconciliar(oportunidad_ids):
+    """
+    Recalcula los contadores de las oportunidades indicadas con un UPDATE por lote
+    cuyos valores salen de subconsultas sobre las inscripciones.
+
+    Las filas se bloquean antes de recalcular: una transacción que esté inscribiendo
+    en la oportunidad ya tiene la fila bloqueada (al reservar el cupo), así que el
+    recálculo espera a que confirme y cuenta su inscripción.
+
+    Returns:
+        int: Número de oportunidades actualizadas
+    """
+    actualizadas = 0
+    ids = sorted(set(oportunidad_ids))
+    for inicio in range(0, len(ids), TAMANO_LOTE):
+        lote = ids[inicio:inicio + TAMANO_LOTE]
+        with transaction.atomic():
+            list(OportunidadVoluntariado.objects.select_for_update().filter(pk__in=lote).values_list('pk'))
+            actualizadas += OportunidadVoluntariado.objects.filter(pk__in=lote).update(
+                pendientes=_conteo('pendiente'),
+                aceptadas=_conteo('aceptada'),
+                capacidad_total=models.F('cupos') + _conteo('pendiente') + _conteo('aceptada')
+            )
+    return actualizadas
@@ -1,29 +1,32 @@
-# Importación del modelo Inscripcion
-from .models import Inscripcion
+# Importaciones de Django
+from django.utils.functional import SimpleLazyObject
+# Contador de pendientes servido desde la caché
+from . import contadores
 
 
 def inscripciones_pendientes(request):
     """
     Procesador de contexto que agrega el conteo de inscripciones pendientes.
     
-    Este procesador solo está disponible para superusuarios autenticados.
-    Agrega al contexto la variable 'inscripciones_pendientes_count' que contiene
-    el número total de inscripciones con estado 'pendiente'.
+    Disponible para superusuarios y usuarios con acceso de administrador. Agrega al
+    contexto la variable 'inscripciones_pendientes_count' con el número total de
+    inscripciones con estado 'pendiente'.
+    
+    El valor es perezoso: solo se resuelve si la plantilla lo usa, y entonces se lee
+    de la caché (ver contadores.pendientes), por lo que las redirecciones y las páginas
+    que no muestran la insignia no hacen ninguna consulta.
     
     Args:
         request: Objeto HttpRequest con la información de la petición.
         
     Returns:
-        dict: Diccionario con el contexto actualizado o vacío si el usuario no es superusuario.
+        dict: Diccionario con el contexto actualizado.
     """
-    # Diccionario de contexto inicialmente vacío
-    context = {}
-    
-    # Verifica si el usuario está autenticado y es superusuario
-    if request.user.is_authenticated and request.user.is_superuser:
-        # Cuenta las inscripciones pendientes y las agrega al contexto
-        context['inscripciones_pendientes_count'] = Inscripcion.objects.filter(
-            estado='pendiente'
-        ).count()
+    def contar():
+        # Verifica si el usuario está autenticado y es administrador
+        usuario = request.user
+        if usuario.is_authenticated and (usuario.is_superuser or getattr(usuario, 'acceso_admin', False)):
+            return contadores.pendientes()
+        return 0
     
-    return context
\ No newline at end of file
+    return {'inscripciones_pendientes_count': SimpleLazyObject(contar)}
@@ -0,0 +1,164 @@
+# Exportación de inscripciones y del historial de intercambios
+# Las filas se leen con cursores del lado del servidor (iterator con chunk_size) y se
+# escriben a medida que llegan: exportar cientos de miles de filas no las carga todas
+# en memoria. El CSV se genera como un iterador de líneas apto para
+# StreamingHttpResponse; el XLSX se escribe con XlsxWriter en modo de memoria
+# constante (dependencia opcional).
+import csv
+from heapq import merge
+
+from django.utils import timezone
+
+from permutaciones.models import HistorialPermutacion
+from .models import Inscripcion
+from . import gestion
+
+try:
+    import xlsxwriter
+except ImportError:
+    # Dependencia opcional: sin ella solo se exporta a CSV
+    xlsxwriter = None
+
+# Filas leídas de la base de datos por bloque del cursor
+TAMANO_BLOQUE = 2000
+
+COLUMNAS_INSCRIPCIONES = (
+    'ID', 'Fecha de inscripción', 'Estado', 'Correo', 'Voluntario',
+    'ID oportunidad', 'Oportunidad', 'Organización', 'Comentarios'
+)
+
+COLUMNAS_HISTORIAL = (
+    'ID', 'Fecha', 'Acción', 'Motivo', 'ID solicitud', 'Solicitante', 'Receptor',
+    'Oportunidad de origen', 'Oportunidad de destino', 'Realizada por'
+)
+
+
+def filas_inscripciones(estado, oportunidad_id=None, organizacion_id=None):
+    """
+    Filas de las inscripciones de una pestaña de gestión, de la más reciente a la más
+    antigua, con los mismos filtros que el listado.
+
+    Yields:
+        tuple: Valores en el orden de COLUMNAS_INSCRIPCIONES
+    """
+    estados = dict(Inscripcion.ESTADOS)
+    filas = gestion.filtrar_inscripciones(estado, oportunidad_id, organizacion_id).order_by(
+        '-fecha_inscripcion', '-id'
+    ).values_list(
+        'id', 'fecha_inscripcion', 'estado', 'usuario__email', 'usuario__nombre_completo',
+        'oportunidad_id', 'oportunidad__titulo', 'oportunidad__organizacion__nombre', 'comentarios'
+    ).iterator(chunk_size=TAMANO_BLOQUE)
+    for pk, fecha, estado_fila, email, nombre, oportunidad_id, titulo, organizacion, comentarios in filas:
+        yield (
+            pk, timezone.localtime(fecha), estados.get(estado_fila, estado_fila), email, nombre,
+            oportunidad_id, titulo, organizacion, comentarios or ''
+        )
+
+
+def filas_historial(ver_archivo=False, oportunidad_id=None, organizacion_id=None):
+    """
+    Filas del historial de intercambios, de la más reciente a la más antigua, con los
+    mismos filtros que la pestaña de historial. Con `ver_archivo` se mezclan en orden
+    la tabla activa y el archivo, leyendo ambas a la vez con un cursor cada una.
+
+    Yields:
+        tuple: Valores en el orden de COLUMNAS_HISTORIAL
+    """
+    acciones = dict(HistorialPermutacion.TIPOS_ACCION)
+    cursores = [
+        consulta.order_by('-fecha', f'-{campo_id}').values_list(
+            'fecha', campo_id, 'accion', 'datos', 'solicitud_id',
+            'solicitud__solicitante__email', 'solicitud__receptor__email',
+            'solicitud__oportunidad_origen__titulo', 'solicitud__oportunidad_destino__titulo',
+            'usuario__email'
+        ).iterator(chunk_size=TAMANO_BLOQUE)
+        for consulta, campo_id in gestion.filtrar_historial(ver_archivo, oportunidad_id, organizacion_id)
+    ]
+    for fecha, pk, accion, datos, *resto, usuario in merge(*cursores, key=lambda fila: fila[:2], reverse=True):
+        motivo = HistorialPermutacion.MOTIVOS.get((datos or {}).get('motivo'), '')
+        yield (pk, timezone.localtime(fecha), acciones.get(accion, accion), motivo, *resto, usuario or 'Sistema')
+
+
+class _Eco:
+    """Pseudoarchivo para csv.writer: devuelve cada línea en lugar de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def csv_por_lineas(columnas, filas):
+    """
+    Convierte las filas en líneas CSV una a una, para StreamingHttpResponse o para
+    escribirlas en un archivo. La primera línea lleva la marca BOM para que Excel
+    reconozca el UTF-8.
+
+    Yields:
+        str: Líneas del CSV
+    """
+    escritor = csv.writer(_Eco())
+    yield '\ufeff' + escritor.writerow(columnas)
+    for fila in filas:
+        yield escritor.writerow(
+            [valor.strftime('%Y-%m-%d %H:%M:%S') if hasattr(valor, 'strftime') else valor for valor in fila]
+        )
+
+
+def escribir_xlsx(destino, columnas, filas, titulo='Datos'):
+    """
+    Escribe las filas en un libro XLSX en modo de memoria constante: cada fila se
+    vuelca a un archivo temporal en cuanto se escribe, por lo que solo la fila actual
+    permanece en memoria.
+
+    Args:
+        destino: Ruta u objeto archivo donde guardar el libro
+        columnas: Encabezados
+        filas: Iterable de tuplas
+        titulo: Nombre de la hoja
+
+    Returns:
+        int: Número de filas escritas (sin el encabezado)
+
+    Raises:
+        RuntimeError: Si XlsxWriter no está instalado
+    """
+    if xlsxwriter is None:
+        raise RuntimeError('La exportación a Excel requiere el paquete XlsxWriter (pip install XlsxWriter).')
+
+    libro = xlsxwriter.Workbook(destino, {'constant_memory': True, 'remove_timezone': True})
+    hoja = libro.add_worksheet(titulo)
+    negrita = libro.add_format({'bold': True})
+    formato_fecha = libro.add_format({'num_format': 'dd/mm/yyyy hh:mm'})
+    hoja.write_row(0, 0, columnas, negrita)
+    total = 0
+    for total, fila in enumerate(filas, start=1):
+        for columna, valor in enumerate(fila):
+            if hasattr(valor, 'strftime'):
+                hoja.write_datetime(total, columna, valor, formato_fecha)
+            else:
+                hoja.write(total, columna, valor)
+    libro.close()
+    return total
+
+
+def exportacion(estado, oportunidad_id=None, organizacion_id=None, ver_archivo=False):
+    """
+    Columnas, filas y nombre base del archivo para una pestaña de gestión.
+
+    Args:
+        estado: Estado de las inscripciones, 'todas' o 'historial'
+
+    Returns:
+        tuple: (columnas, iterador de filas, nombre base del archivo)
+    """
+    fecha = timezone.localdate().isoformat()
+    if estado == 'historial':
+        return (
+            COLUMNAS_HISTORIAL,
+            filas_historial(ver_archivo, oportunidad_id, organizacion_id),
+            f'historial-intercambios{"-archivo" if ver_archivo else ""}-{fecha}'
+        )
+    return (
+        COLUMNAS_INSCRIPCIONES,
+        filas_inscripciones(estado, oportunidad_id, organizacion_id),
+        f'inscripciones-{estado}-{fecha}'
+    )
@@ -0,0 +1,199 @@
+# Decisiones de los coordinadores sobre las inscripciones
+# Aceptar o rechazar inscripciones mueve cupos (la oportunidad, la lista de espera) y
+# cambia los turnos disponibles para intercambios. Aquí se concentra esa lógica para
+# que la decisión individual, la masiva y la acción del admin se comporten igual.
+import json
+from collections import Counter
+
+from django.contrib.admin.models import LogEntry, CHANGE
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+
+from eventos import bandeja
+from oportunidades.models import OportunidadVoluntariado
+from permutaciones import candidatos
+from permutaciones.models import HistorialPermutacion, HistorialPermutacionArchivo
+from .models import Inscripcion, ListaEspera
+from . import contadores
+
+
+def filtrar_inscripciones(estado, oportunidad_id=None, organizacion_id=None):
+    """
+    Inscripciones de una pestaña de gestión con los filtros aplicados. Lo comparten
+    el listado, la exportación y el comando exportar_inscripciones.
+
+    Args:
+        estado: Estado de las inscripciones, o 'todas'
+        oportunidad_id: Id de la oportunidad (opcional)
+        organizacion_id: Id de la organización (opcional)
+
+    Returns:
+        QuerySet: Inscripciones sin ordenar
+    """
+    consulta = Inscripcion.objects.all()
+    if estado != 'todas':
+        consulta = consulta.filter(estado=estado)
+    if oportunidad_id:
+        consulta = consulta.filter(oportunidad_id=oportunidad_id)
+    if organizacion_id:
+        consulta = consulta.filter(oportunidad__organizacion_id=organizacion_id)
+    return consulta
+
+
+def filtrar_historial(ver_archivo=False, oportunidad_id=None, organizacion_id=None):
+    """
+    Registros del historial de intercambios con los filtros aplicados: la ventana
+    activa o, con `ver_archivo`, los registros anteriores a ella que aún no se
+    trasladaron junto con los del archivo (que conservan su id original en
+    `historial_id`). Una solicitud coincide si su origen o su destino coincide.
+
+    Returns:
+        list: Tuplas (QuerySet sin ordenar, campo de id) de cada tabla
+    """
+    filtro = Q()
+    if oportunidad_id:
+        filtro &= (
+            Q(solicitud__oportunidad_origen_id=oportunidad_id) |
+            Q(solicitud__oportunidad_destino_id=oportunidad_id)
+        )
+    if organizacion_id:
+        filtro &= (
+            Q(solicitud__oportunidad_origen__organizacion_id=organizacion_id) |
+            Q(solicitud__oportunidad_destino__organizacion_id=organizacion_id)
+        )
+    corte = HistorialPermutacion.fecha_corte()
+    if not ver_archivo:
+        return [(HistorialPermutacion.objects.filter(filtro, fecha__gte=corte), 'id')]
+    return [
+        (HistorialPermutacion.objects.filter(filtro, fecha__lt=corte), 'id'),
+        (HistorialPermutacionArchivo.objects.filter(filtro), 'historial_id'),
+    ]
+
+
+def liberar_cupo(oportunidad_id, cantidad=1):
+    """
+    Entrega los cupos liberados a los primeros de la lista de espera o los devuelve a
+    la oportunidad. Debe invocarse dentro de la transacción que libera los cupos.
+
+    Returns:
+        list: Inscripciones creadas para los usuarios promovidos
+    """
+    promovidas, reabierta = ListaEspera.liberar_cupo(oportunidad_id, cantidad)
+    # bulk_create no emite señales: las promovidas cuentan como pendientes
+    if promovidas:
+        contadores.invalidar()
+        contadores.ajustar_pendientes(len(promovidas))
+        contadores.ajustar_oportunidades(entradas=[(oportunidad_id, 'pendiente')] * len(promovidas))
+    # update() no emite señales: al reabrirse vuelve a ser destino de intercambios
+    if reabierta:
+        candidatos.refrescar_oportunidades([oportunidad_id])
+    return promovidas
+
+
+@transaction.atomic
+def decidir_en_bloque(inscripciones, estado, usuario):
+    """
+    Acepta o rechaza un conjunto de inscripciones con un número constante de
+    consultas por oportunidad afectada: una lectura de las filas bloqueadas, el
+    movimiento de cupos de cada oportunidad, un único UPDATE del estado, un
+    bulk_create del registro de auditoría del admin y otro de los eventos.
+
+    Al rechazar, los cupos que ocupaban pasan a la lista de espera (ver
+    ListaEspera.liberar_cupo). Al aceptar inscripciones que ya no tenían cupo (las
+    rechazadas), los cupos se reservan por oportunidad; las de una oportunidad sin
+    cupos suficientes se dejan como estaban.
+
+    Args:
+        inscripciones: QuerySet de Inscripcion a decidir
+        estado: 'aceptada' o 'rechazada'
+        usuario: Coordinador que decide (se registra en el LogEntry del admin)
+
+    Returns:
+        tuple: (número de inscripciones cambiadas, número de las que no tenían cupo)
+    """
+    # Bloquear solo las inscripciones (no usuarios ni oportunidades de la consulta)
+    # en orden de clave para que dos decisiones masivas no se bloqueen mutuamente
+    filas = list(
+        inscripciones.exclude(estado=estado).select_for_update(of=('self',)).order_by('pk').values_list(
+            'pk', 'usuario_id', 'oportunidad_id', 'estado', 'usuario__email', 'oportunidad__titulo'
+        )
+    )
+    if not filas:
+        return 0, 0
+
+    # Oportunidades cuyo estado abierta/cerrada cambia y deben refrescar el índice de candidatos
+    modificadas = set()
+    sin_cupo = 0
+    if estado == 'aceptada':
+        # Las que no ocupan cupo vuelven a necesitarlo: reservarlos de una vez por oportunidad
+        necesarios = Counter(
+            oportunidad_id for _, _, oportunidad_id, anterior, _, _ in filas
+            if anterior not in Inscripcion.ESTADOS_CON_CUPO
+        )
+        agotadas = set()
+        for oportunidad_id, cantidad in necesarios.items():
+            reservado, cerrada = OportunidadVoluntariado.reservar_cupo(oportunidad_id, cantidad)
+            if not reservado:
+                agotadas.add(oportunidad_id)
+            elif cerrada:
+                modificadas.add(oportunidad_id)
+        if agotadas:
+            aceptables = [
+                fila for fila in filas
+                if fila[2] not in agotadas or fila[3] in Inscripcion.ESTADOS_CON_CUPO
+            ]
+            sin_cupo = len(filas) - len(aceptables)
+            filas = aceptables
+    else:
+        # Los cupos liberados se entregan a la lista de espera o vuelven a la oportunidad
+        liberados = Counter(
+            oportunidad_id for _, _, oportunidad_id, anterior, _, _ in filas
+            if anterior in Inscripcion.ESTADOS_CON_CUPO
+        )
+        for oportunidad_id, cantidad in liberados.items():
+            liberar_cupo(oportunidad_id, cantidad)
+
+    if not filas:
+        return 0, sin_cupo
+
+    Inscripcion.objects.filter(pk__in=[fila[0] for fila in filas]).update(estado=estado)
+    contadores.invalidar()
+    contadores.ajustar_pendientes(-sum(fila[3] == 'pendiente' for fila in filas))
+    contadores.ajustar_oportunidades(
+        salidas=[(oportunidad_id, anterior) for _, _, oportunidad_id, anterior, _, _ in filas],
+        entradas=[(oportunidad_id, estado) for _, _, oportunidad_id, _, _, _ in filas]
+    )
+
+    # Auditoría en el mismo formato que los cambios hechos desde el admin
+    tipo = ContentType.objects.get_for_model(Inscripcion)
+    cambio = json.dumps([{'changed': {'fields': ['Estado']}}])
+    LogEntry.objects.bulk_create([
+        LogEntry(
+            user_id=usuario.pk,
+            content_type=tipo,
+            object_id=str(pk),
+            object_repr=f"Inscripción de {email} a {titulo}"[:200],
+            action_flag=CHANGE,
+            change_message=cambio
+        )
+        for pk, _, _, _, email, titulo in filas
+    ])
+
+    # Notificaciones: el correo lo envía procesar_eventos
+    bandeja.registrar_varios([
+        (f'inscripcion.{estado}', None, {'inscripcion_id': pk})
+        for pk, *_ in filas
+    ])
+
+    # update() no emite señales: los turnos que se aceptan o dejan de estar aceptados
+    # cambian los candidatos para intercambios de sus usuarios
+    afectados = {
+        usuario_id for _, usuario_id, _, anterior, _, _ in filas
+        if 'aceptada' in (estado, anterior)
+    }
+    if afectados:
+        candidatos.refrescar_usuarios(afectados)
+    if modificadas:
+        candidatos.refrescar_oportunidades(modificadas)
+    return len(filas), sin_cupo
@@ -0,0 +1,394 @@
+# Importación masiva de inscripciones desde un CSV (listas de voluntarios preaprobados)
+# El archivo se recorre una sola vez para numerar y normalizar las filas, que se cargan
+# en una tabla temporal de preparación: con COPY en PostgreSQL y con inserciones por
+# bloques en otros motores. A partir de ahí todo es SQL de conjunto: cada validación es
+# un UPDATE sobre la tabla de preparación, las inscripciones se crean con un único
+# INSERT ... SELECT, las existentes se actualizan con un único UPDATE ... FROM y los
+# cupos se descuentan con una sentencia por oportunidad.
+import csv
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from oportunidades.models import OportunidadVoluntariado
+from permutaciones import candidatos
+from .exportacion import _Eco
+from .models import Inscripcion, ListaEspera
+from . import contadores
+
+# Filas por sentencia al cargar la tabla de preparación sin COPY
+TAMANO_BLOQUE = 5000
+
+# Por encima de este número de usuarios afectados se reconstruye el índice de
+# candidatos completo en lugar de refrescarlo usuario por usuario
+MAX_USUARIOS_REFRESCO = 10000
+
+# Estados con los que se puede importar una inscripción (ambos ocupan cupo)
+ESTADOS_IMPORTABLES = Inscripcion.ESTADOS_CON_CUPO
+
+# Motivos de rechazo de una fila, en el orden en que se comprueban
+MOTIVOS = {
+    'email_vacio': 'La fila no tiene correo',
+    'oportunidad_invalida': 'El id de oportunidad no es un número',
+    'estado_invalido': 'El estado debe ser pendiente o aceptada',
+    'usuario_inexistente': 'No existe un usuario con ese correo',
+    'oportunidad_inexistente': 'No existe la oportunidad',
+    'duplicada': 'El usuario ya aparece en una fila anterior para la misma oportunidad',
+    'oportunidad_cerrada': 'La oportunidad está cerrada a nuevas inscripciones',
+    'sin_cupo': 'No quedan cupos en la oportunidad',
+}
+
+TABLA = 'importacion_inscripcion'
+
+COLUMNAS = ('linea', 'email', 'oportunidad_texto', 'oportunidad_id', 'estado', 'comentarios', 'motivo')
+
+
+def _tablas():
+    """Nombres entrecomillados de las tablas que intervienen en la importación."""
+    q = connection.ops.quote_name
+    return {
+        'imp': q(TABLA),
+        'inscripcion': q(Inscripcion._meta.db_table),
+        'oportunidad': q(OportunidadVoluntariado._meta.db_table),
+        'usuario': q(Inscripcion._meta.get_field('usuario').related_model._meta.db_table),
+        'espera': q(ListaEspera._meta.db_table),
+    }
+
+
+def filas_csv(archivo):
+    """
+    Recorre el CSV de entrada y normaliza cada fila. El archivo debe tener encabezado
+    con las columnas `email` y `oportunidad` (u `oportunidad_id`); `estado` (por
+    defecto aceptada) y `comentarios` son opcionales.
+
+    Las filas con valores que no se pueden interpretar se devuelven ya rechazadas para
+    que figuren en el archivo de rechazos con su número de línea.
+
+    Yields:
+        tuple: Valores en el orden de COLUMNAS
+    """
+    lector = csv.DictReader(archivo)
+    campos = {campo.strip().lower(): campo for campo in lector.fieldnames or ()}
+    columna_oportunidad = campos.get('oportunidad') or campos.get('oportunidad_id')
+    if 'email' not in campos or columna_oportunidad is None:
+        raise ValueError('El CSV debe tener las columnas "email" y "oportunidad".')
+
+    for fila in lector:
+        email = (fila.get(campos['email']) or '').strip().lower()
+        oportunidad = (fila.get(columna_oportunidad) or '').strip()
+        estado = (fila.get(campos.get('estado', ''), '') or '').strip().lower() or 'aceptada'
+        comentarios = (fila.get(campos.get('comentarios', ''), '') or '').strip() or None
+        if not email:
+            motivo = 'email_vacio'
+        elif not oportunidad.isdigit():
+            motivo = 'oportunidad_invalida'
+        elif estado not in ESTADOS_IMPORTABLES:
+            motivo = 'estado_invalido'
+        else:
+            motivo = None
+        yield (
+            lector.line_num, email, oportunidad[:50],
+            int(oportunidad) if motivo is None else None,
+            estado[:20], comentarios, motivo
+        )
+
+
+class _FlujoCopy:
+    """Archivo de solo lectura que entrega a COPY las filas en CSV a medida que se generan."""
+
+    def __init__(self, filas):
+        self._lineas = self._csv(filas)
+        self._pendiente = ''
+
+    @staticmethod
+    def _csv(filas):
+        escritor = csv.writer(_Eco())
+        for fila in filas:
+            yield escritor.writerow(fila)
+
+    def read(self, tamano=-1):
+        partes = [self._pendiente]
+        longitud = len(self._pendiente)
+        for linea in self._lineas:
+            partes.append(linea)
+            longitud += len(linea)
+            if 0 <= tamano <= longitud:
+                break
+        texto = ''.join(partes)
+        if tamano < 0:
+            self._pendiente = ''
+            return texto
+        self._pendiente = texto[tamano:]
+        return texto[:tamano]
+
+
+def preparar(cursor, filas):
+    """
+    Crea la tabla temporal de preparación y la carga con las filas.
+
+    Args:
+        cursor: Cursor de la conexión (la tabla temporal solo existe en ella)
+        filas: Iterable de tuplas en el orden de COLUMNAS
+
+    Returns:
+        int: Número de filas cargadas
+    """
+    t = _tablas()
+    cursor.execute(f"DROP TABLE IF EXISTS {t['imp']}")
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {t['imp']} (
+            linea BIGINT PRIMARY KEY,
+            email VARCHAR(254),
+            oportunidad_texto VARCHAR(50),
+            oportunidad_id BIGINT,
+            estado VARCHAR(20),
+            comentarios TEXT,
+            motivo VARCHAR(40),
+            usuario_id BIGINT,
+            inscripcion_id BIGINT,
+            estado_anterior VARCHAR(20)
+        )
+    """)
+
+    if connection.vendor == 'postgresql':
+        cursor.copy_expert(
+            f"COPY {t['imp']} ({', '.join(COLUMNAS)}) FROM STDIN WITH (FORMAT csv)",
+            _FlujoCopy(filas)
+        )
+    else:
+        sql = f"INSERT INTO {t['imp']} ({', '.join(COLUMNAS)}) VALUES ({', '.join(['%s'] * len(COLUMNAS))})"
+        bloque = []
+        for fila in filas:
+            bloque.append(fila)
+            if len(bloque) >= TAMANO_BLOQUE:
+                cursor.executemany(sql, bloque)
+                bloque = []
+        if bloque:
+            cursor.executemany(sql, bloque)
+
+    cursor.execute(f"CREATE INDEX importacion_email_idx ON {t['imp']} (email)")
+    cursor.execute(f"SELECT COUNT(*) FROM {t['imp']}")
+    return cursor.fetchone()[0]
+
+
+def validar(cursor):
+    """
+    Resuelve usuarios e inscripciones existentes y marca las filas rechazadas, cada
+    comprobación con una sola sentencia sobre la tabla de preparación. Bloquea las
+    oportunidades afectadas hasta el final de la transacción para que el reparto de
+    cupos no cambie mientras se importa.
+
+    Returns:
+        dict: Id de oportunidad -> número de cupos que consumen sus filas válidas
+    """
+    t = _tablas()
+    # Usuarios y oportunidades
+    cursor.execute(f"""
+        UPDATE {t['imp']} SET usuario_id = u.id
+        FROM {t['usuario']} u
+        WHERE LOWER(u.email) = {t['imp']}.email AND {t['imp']}.motivo IS NULL
+    """)
+    cursor.execute(f"""
+        UPDATE {t['imp']} SET motivo = 'usuario_inexistente'
+        WHERE motivo IS NULL AND usuario_id IS NULL
+    """)
+    cursor.execute(f"""
+        UPDATE {t['imp']} SET motivo = 'oportunidad_inexistente'
+        WHERE motivo IS NULL AND oportunidad_id NOT IN (SELECT id FROM {t['oportunidad']})
+    """)
+
+    # Pares repetidos dentro del archivo: vale la primera aparición
+    cursor.execute(f"CREATE INDEX importacion_par_idx ON {t['imp']} (usuario_id, oportunidad_id, linea)")
+    cursor.execute(f"""
+        UPDATE {t['imp']} SET motivo = 'duplicada'
+        WHERE motivo IS NULL AND EXISTS (
+            SELECT 1 FROM {t['imp']} p
+            WHERE p.usuario_id = {t['imp']}.usuario_id
+                AND p.oportunidad_id = {t['imp']}.oportunidad_id
+                AND p.linea < {t['imp']}.linea
+        )
+    """)
+
+    # Inscripciones existentes (unique_together usuario, oportunidad): se actualizan
+    cursor.execute(f"""
+        UPDATE {t['imp']} SET inscripcion_id = i.id, estado_anterior = i.estado
+        FROM {t['inscripcion']} i
+        WHERE i.usuario_id = {t['imp']}.usuario_id
+            AND i.oportunidad_id = {t['imp']}.oportunidad_id
+            AND {t['imp']}.motivo IS NULL
+    """)
+
+    # Bloquear las oportunidades afectadas antes de repartir sus cupos
+    cursor.execute(f"SELECT DISTINCT oportunidad_id FROM {t['imp']} WHERE motivo IS NULL")
+    oportunidad_ids = [fila[0] for fila in cursor.fetchall()]
+    for inicio in range(0, len(oportunidad_ids), TAMANO_BLOQUE):
+        list(OportunidadVoluntariado.objects.select_for_update().filter(
+            pk__in=oportunidad_ids[inicio:inicio + TAMANO_BLOQUE]
+        ).values_list('pk'))
+
+    # Las filas nuevas, y las existentes que no ocupaban cupo, necesitan uno
+    necesita_cupo = "(inscripcion_id IS NULL OR estado_anterior NOT IN ('pendiente', 'aceptada'))"
+    cursor.execute(f"""
+        UPDATE {t['imp']} SET motivo = 'oportunidad_cerrada'
+        WHERE motivo IS NULL AND {necesita_cupo} AND oportunidad_id IN (
+            SELECT id FROM {t['oportunidad']} WHERE estado <> 'abierta' AND cupos > 0
+        )
+    """)
+    # Los cupos se reparten por orden de línea dentro de cada oportunidad
+    cursor.execute(f"""
+        UPDATE {t['imp']} SET motivo = 'sin_cupo'
+        WHERE linea IN (
+            SELECT linea FROM (
+                SELECT s.linea, o.cupos,
+                    ROW_NUMBER() OVER (PARTITION BY s.oportunidad_id ORDER BY s.linea) AS orden
+                FROM {t['imp']} s
+                INNER JOIN {t['oportunidad']} o ON o.id = s.oportunidad_id
+                WHERE s.motivo IS NULL AND {necesita_cupo}
+            ) repartidas
+            WHERE orden > cupos
+        )
+    """)
+
+    cursor.execute(f"""
+        SELECT oportunidad_id, COUNT(*) FROM {t['imp']}
+        WHERE motivo IS NULL AND {necesita_cupo}
+        GROUP BY oportunidad_id
+    """)
+    return dict(cursor.fetchall())
+
+
+def aplicar(cursor, cupos_por_oportunidad):
+    """
+    Vuelca las filas válidas en Inscripcion y descuenta los cupos.
+
+    Returns:
+        tuple: (inscripciones creadas, inscripciones actualizadas)
+    """
+    t = _tablas()
+
+    # Diferencias de pendientes y aceptadas por oportunidad para los contadores (ver contadores.py)
+    cursor.execute(f"""
+        SELECT oportunidad_id,
+            SUM(CASE WHEN estado = 'pendiente' THEN 1 ELSE 0 END)
+                - SUM(CASE WHEN estado_anterior = 'pendiente' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN estado = 'aceptada' THEN 1 ELSE 0 END)
+                - SUM(CASE WHEN estado_anterior = 'aceptada' THEN 1 ELSE 0 END)
+        FROM {t['imp']} WHERE motivo IS NULL
+        GROUP BY oportunidad_id
+    """)
+    cambios = {oportunidad_id: (pendientes, aceptadas) for oportunidad_id, pendientes, aceptadas in cursor.fetchall()}
+
+    cursor.execute(f"""
+        UPDATE {t['inscripcion']} SET
+            estado = s.estado,
+            comentarios = COALESCE(s.comentarios, {t['inscripcion']}.comentarios)
+        FROM {t['imp']} s
+        WHERE {t['inscripcion']}.id = s.inscripcion_id AND s.motivo IS NULL
+    """)
+    actualizadas = cursor.rowcount
+
+    # ON CONFLICT: una inscripción simultánea del mismo usuario no aborta la importación
+    cursor.execute(f"""
+        INSERT INTO {t['inscripcion']} (usuario_id, oportunidad_id, estado, comentarios, fecha_inscripcion)
+        SELECT usuario_id, oportunidad_id, estado, comentarios, %s
+        FROM {t['imp']}
+        WHERE motivo IS NULL AND inscripcion_id IS NULL
+        ON CONFLICT (usuario_id, oportunidad_id) DO NOTHING
+    """, [timezone.now()])
+    creadas = cursor.rowcount
+
+    # Un decremento condicional por oportunidad; las que se agotan se cierran
+    cerradas = []
+    for oportunidad_id, cantidad in cupos_por_oportunidad.items():
+        _, cerrada = OportunidadVoluntariado.reservar_cupo(oportunidad_id, cantidad)
+        if cerrada:
+            cerradas.append(oportunidad_id)
+
+    # Quien obtuvo la inscripción deja de esperar en la lista de espera
+    cursor.execute(f"""
+        DELETE FROM {t['espera']}
+        WHERE EXISTS (
+            SELECT 1 FROM {t['imp']} s
+            WHERE s.motivo IS NULL
+                AND s.usuario_id = {t['espera']}.usuario_id
+                AND s.oportunidad_id = {t['espera']}.oportunidad_id
+        )
+    """)
+
+    # Las escrituras en SQL no emiten señales: contadores e índice de candidatos
+    contadores.invalidar()
+    contadores.ajustar_pendientes(sum(pendientes for pendientes, _ in cambios.values()))
+    OportunidadVoluntariado.ajustar_inscritas(cambios)
+    cursor.execute(f"""
+        SELECT DISTINCT usuario_id FROM {t['imp']}
+        WHERE motivo IS NULL AND (estado = 'aceptada' OR estado_anterior = 'aceptada')
+    """)
+    usuarios = [fila[0] for fila in cursor.fetchall()]
+    if len(usuarios) > MAX_USUARIOS_REFRESCO:
+        candidatos.reconstruir()
+    elif usuarios:
+        candidatos.refrescar_usuarios(usuarios)
+    if cerradas:
+        candidatos.refrescar_oportunidades(cerradas)
+    return creadas, actualizadas
+
+
+def rechazadas(cursor, tamano=TAMANO_BLOQUE):
+    """
+    Filas rechazadas en orden de línea, leídas por bloques.
+
+    Yields:
+        tuple: (línea, email, oportunidad, estado, comentarios, motivo, descripción)
+    """
+    t = _tablas()
+    cursor.execute(f"""
+        SELECT linea, email, oportunidad_texto, estado, comentarios, motivo
+        FROM {t['imp']} WHERE motivo IS NOT NULL ORDER BY linea
+    """)
+    while True:
+        bloque = cursor.fetchmany(tamano)
+        if not bloque:
+            return
+        for *fila, motivo in bloque:
+            yield (*fila, motivo, MOTIVOS.get(motivo, motivo))
+
+
+def importar(archivo, salida_rechazadas, simular=False):
+    """
+    Importa las inscripciones de un CSV y escribe las filas rechazadas en otro.
+
+    Args:
+        archivo: Archivo de texto abierto con el CSV de entrada
+        salida_rechazadas: Archivo de texto abierto donde escribir los rechazos
+        simular: Validar y escribir los rechazos sin modificar las inscripciones
+
+    Returns:
+        dict: Totales ('leidas', 'creadas', 'actualizadas', 'rechazadas') y rechazos por motivo
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        leidas = preparar(cursor, filas_csv(archivo))
+        cupos_por_oportunidad = validar(cursor)
+
+        escritor = csv.writer(salida_rechazadas)
+        escritor.writerow(('linea', 'email', 'oportunidad', 'estado', 'comentarios', 'motivo', 'descripcion'))
+        total_rechazadas = 0
+        por_motivo = {}
+        for fila in rechazadas(cursor):
+            escritor.writerow(fila)
+            total_rechazadas += 1
+            por_motivo[fila[5]] = por_motivo.get(fila[5], 0) + 1
+
+        creadas = actualizadas = 0
+        if not simular:
+            creadas, actualizadas = aplicar(cursor, cupos_por_oportunidad)
+        cursor.execute(f"DROP TABLE {_tablas()['imp']}")
+        if simular:
+            transaction.set_rollback(True)
+
+    return {
+        'leidas': leidas,
+        'creadas': creadas,
+        'actualizadas': actualizadas,
+        'rechazadas': total_rechazadas,
+        'por_motivo': por_motivo,
+    }
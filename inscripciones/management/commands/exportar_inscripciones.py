@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+from inscripciones import exportacion
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta las inscripciones (o el historial de intercambios) a CSV o XLSX con los '
+        'mismos filtros que la gestión de inscripciones, leyendo las filas por bloques'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--estado',
+            default='todas',
+            choices=('pendiente', 'aceptada', 'rechazada', 'completada', 'todas', 'historial'),
+            help='Pestaña a exportar: un estado de inscripción, todas o historial (por defecto todas)',
+        )
+        parser.add_argument(
+            '--oportunidad',
+            type=int,
+            default=None,
+            help='Id de la oportunidad por la que filtrar',
+        )
+        parser.add_argument(
+            '--organizacion',
+            type=int,
+            default=None,
+            help='Id de la organización por la que filtrar',
+        )
+        parser.add_argument(
+            '--archivo',
+            action='store_true',
+            help='Con --estado historial, exportar los registros fuera de la ventana activa y el archivo',
+        )
+        parser.add_argument(
+            '--formato',
+            default='csv',
+            choices=('csv', 'xlsx'),
+            help='Formato del archivo (xlsx requiere XlsxWriter)',
+        )
+        parser.add_argument(
+            '--salida',
+            default=None,
+            help='Ruta del archivo a generar (por defecto <nombre>.<formato>; "-" escribe el CSV en la salida estándar)',
+        )
+
+    def handle(self, *args, **options):
+        columnas, filas, nombre = exportacion.exportacion(
+            options['estado'], options['oportunidad'], options['organizacion'], options['archivo']
+        )
+        salida = options['salida'] or f'{nombre}.{options["formato"]}'
+
+        # Contar las filas a medida que se escriben, sin materializarlas
+        total = 0
+
+        def contadas():
+            nonlocal total
+            for total, fila in enumerate(filas, start=1):
+                yield fila
+
+        if options['formato'] == 'xlsx':
+            if salida == '-':
+                raise CommandError('El formato xlsx necesita un archivo de salida.')
+            try:
+                exportacion.escribir_xlsx(
+                    salida, columnas, contadas(),
+                    titulo='Historial' if options['estado'] == 'historial' else 'Inscripciones'
+                )
+            except RuntimeError as error:
+                raise CommandError(str(error))
+        elif salida == '-':
+            for linea in exportacion.csv_por_lineas(columnas, contadas()):
+                self.stdout.write(linea, ending='')
+            return
+        else:
+            with open(salida, 'w', encoding='utf-8', newline='') as archivo:
+                archivo.writelines(exportacion.csv_por_lineas(columnas, contadas()))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado.\n'
+            f'Filas exportadas: {total}\n'
+            f'Archivo: {salida}'
+        ))
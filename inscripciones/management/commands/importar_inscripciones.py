@@ -0,0 +1,51 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from inscripciones import importacion
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa inscripciones desde un CSV (email, oportunidad, estado, comentarios) '
+        'validando y escribiendo en bloque; las filas rechazadas se guardan en otro CSV'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'archivo',
+            help='Ruta del CSV a importar',
+        )
+        parser.add_argument(
+            '--rechazadas',
+            default=None,
+            help='Ruta del CSV con las filas rechazadas (por defecto <archivo>.rechazadas.csv)',
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Validar y generar el archivo de rechazos sin guardar las inscripciones',
+        )
+
+    def handle(self, *args, **options):
+        archivo = options['archivo']
+        if not os.path.exists(archivo):
+            raise CommandError(f'No existe el archivo {archivo}.')
+        rechazadas = options['rechazadas'] or f'{os.path.splitext(archivo)[0]}.rechazadas.csv'
+
+        try:
+            with open(archivo, encoding='utf-8-sig', newline='') as entrada, \
+                    open(rechazadas, 'w', encoding='utf-8', newline='') as salida:
+                resultado = importacion.importar(entrada, salida, simular=options['simular'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        for motivo, total in sorted(resultado['por_motivo'].items()):
+            self.stdout.write(f'  {importacion.MOTIVOS.get(motivo, motivo)}: {total}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado{" (simulación, no se guardó ningún cambio)" if options["simular"] else ""}.\n'
+            f'Filas leídas: {resultado["leidas"]}\n'
+            f'Inscripciones creadas: {resultado["creadas"]}\n'
+            f'Inscripciones actualizadas: {resultado["actualizadas"]}\n'
+            f'Filas rechazadas: {resultado["rechazadas"]} (ver {rechazadas})'
+        ))
@@ -0,0 +1,118 @@
+import csv
+import tempfile
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from inscripciones import importacion
+from oportunidades.models import OportunidadVoluntariado
+from organizaciones.models import Organizacion
+
+# Una de cada INTERVALO_RECHAZO filas apunta a un correo inexistente
+INTERVALO_RECHAZO = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la importación masiva de inscripciones con datos sintéticos: crea usuarios, '
+        'oportunidades y un CSV de N filas, lo importa y deshace todos los cambios al terminar'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filas',
+            type=int,
+            default=1000000,
+            help='Número de filas del CSV sintético (por defecto 1.000.000)',
+        )
+        parser.add_argument(
+            '--oportunidades',
+            type=int,
+            default=20,
+            help='Número de oportunidades entre las que se reparten las filas',
+        )
+
+    def handle(self, *args, **options):
+        filas = options['filas']
+        oportunidades = options['oportunidades']
+        if filas < 1 or oportunidades < 1:
+            raise CommandError('--filas y --oportunidades deben ser positivos.')
+        # Cada usuario aparece una vez por oportunidad: las filas válidas no se repiten
+        usuarios = -(-filas // oportunidades)
+
+        # Todo ocurre en una transacción que se deshace: la base de datos queda como estaba
+        with transaction.atomic(), tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as entrada, \
+                tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as salida:
+            inicio = time.monotonic()
+            marca, ids = self._crear_datos(usuarios, oportunidades, filas)
+            self._escribir_csv(entrada, marca, ids, filas)
+            entrada.seek(0)
+            preparacion = time.monotonic() - inicio
+
+            inicio = time.monotonic()
+            resultado = importacion.importar(entrada, salida)
+            duracion = time.monotonic() - inicio
+
+            transaction.set_rollback(True)
+
+        for motivo, total in sorted(resultado['por_motivo'].items()):
+            self.stdout.write(f'  {importacion.MOTIVOS.get(motivo, motivo)}: {total}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado (los datos sintéticos se descartaron).\n'
+            f'Preparación de datos y CSV: {preparacion:.1f} s\n'
+            f'Importación: {duracion:.1f} s ({resultado["leidas"] / max(duracion, 0.001):,.0f} filas/s)\n'
+            f'Filas leídas: {resultado["leidas"]}\n'
+            f'Inscripciones creadas: {resultado["creadas"]}\n'
+            f'Filas rechazadas: {resultado["rechazadas"]}'
+        ))
+
+    def _crear_datos(self, usuarios, oportunidades, filas):
+        """
+        Crea los usuarios y las oportunidades sintéticos.
+
+        Returns:
+            tuple: (marca que distingue los correos de esta medición, ids de las oportunidades)
+        """
+        Usuario = get_user_model()
+        marca = timezone.now().strftime('%Y%m%d%H%M%S')
+        hoy = timezone.localdate()
+        organizacion = Organizacion.objects.create(
+            nombre=f'Medición de importación {marca}',
+            descripcion='Datos sintéticos',
+            contacto_email='medicion@puce.edu.ec'
+        )
+        Usuario.objects.bulk_create([
+            Usuario(email=f'medicion{marca}.{indice}@puce.edu.ec', nombre_completo=f'Medición {indice}', password='!')
+            for indice in range(usuarios)
+        ], batch_size=importacion.TAMANO_BLOQUE)
+        # Cupos de sobra: se mide la carga, no el rechazo por falta de cupos
+        creadas = OportunidadVoluntariado.objects.bulk_create([
+            OportunidadVoluntariado(
+                titulo=f'Medición {indice}',
+                descripcion='Datos sintéticos',
+                fecha_inicio=hoy,
+                fecha_fin=hoy + timedelta(days=30),
+                organizacion=organizacion,
+                ubicacion='Quito',
+                cupos=filas,
+                capacidad_total=filas
+            )
+            for indice in range(oportunidades)
+        ])
+        return marca, [oportunidad.id for oportunidad in creadas]
+
+    def _escribir_csv(self, archivo, marca, ids, filas):
+        """Escribe el CSV sintético: inscripciones pendientes y algunos correos inexistentes."""
+        escritor = csv.writer(archivo)
+        escritor.writerow(('email', 'oportunidad', 'estado', 'comentarios'))
+        for numero in range(filas):
+            usuario, posicion = divmod(numero, len(ids))
+            if numero % INTERVALO_RECHAZO == INTERVALO_RECHAZO - 1:
+                email = f'inexistente{numero}@puce.edu.ec'
+            else:
+                email = f'medicion{marca}.{usuario}@puce.edu.ec'
+            escritor.writerow((email, ids[posicion], 'pendiente', ''))
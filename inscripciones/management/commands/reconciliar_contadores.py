@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from oportunidades.models import OportunidadVoluntariado
+from inscripciones import contadores
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los contadores de inscripciones de las oportunidades (pendientes, '
+        'aceptadas y capacidad total) a partir de las inscripciones y reporta las diferencias'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--solo-verificar',
+            action='store_true',
+            help='Reportar las diferencias sin corregirlas',
+        )
+
+    def handle(self, *args, **options):
+        # Una sola consulta agregada con las oportunidades desviadas
+        diferencias = contadores.diferencias()
+        for diferencia in diferencias:
+            self.stdout.write(self.style.WARNING(
+                f'Diferencia en oportunidad {diferencia.oportunidad_id} ({diferencia.titulo}): '
+                f'pendientes {diferencia.pendientes} -> {diferencia.pendientes_reales}, '
+                f'aceptadas {diferencia.aceptadas} -> {diferencia.aceptadas_reales}, '
+                f'capacidad total {diferencia.capacidad_total} -> {diferencia.capacidad_real}'
+            ))
+
+        corregidas = 0
+        if diferencias and not options['solo_verificar']:
+            corregidas = contadores.reconciliar([diferencia.oportunidad_id for diferencia in diferencias])
+
+        estilo = self.style.SUCCESS if len(diferencias) == corregidas else self.style.ERROR
+        self.stdout.write(estilo(
+            f'\nProceso completado.\n'
+            f'Oportunidades revisadas: {OportunidadVoluntariado.objects.count()}\n'
+            f'Oportunidades con diferencias: {len(diferencias)}\n'
+            f'Oportunidades corregidas: {corregidas}'
+        ))
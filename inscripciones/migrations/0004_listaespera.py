@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oportunidades', '0003_franjahoraria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inscripciones', '0003_alter_inscripcion_oportunidad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListaEspera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_solicitud', models.DateTimeField(auto_now_add=True)),
+                ('oportunidad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to='oportunidades.oportunidadvoluntariado', verbose_name='oportunidad')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listas_espera', to=settings.AUTH_USER_MODEL, verbose_name='usuario')),
+            ],
+            options={
+                'verbose_name': 'entrada de lista de espera',
+                'verbose_name_plural': 'lista de espera',
+                'ordering': ['oportunidad', 'id'],
+                'indexes': [models.Index(fields=['oportunidad', 'id'], name='lista_espera_orden_idx')],
+                'unique_together': {('usuario', 'oportunidad')},
+            },
+        ),
+    ]
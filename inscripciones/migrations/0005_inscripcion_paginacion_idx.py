@@ -0,0 +1,25 @@
+# Generated by Django 4.2.23 on 2026-10-17 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inscripciones', '0004_listaespera'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inscripcion',
+            index=models.Index(fields=['estado', 'fecha_inscripcion', 'id'], name='inscripcion_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inscripcion',
+            index=models.Index(fields=['oportunidad', 'estado', 'fecha_inscripcion', 'id'], name='inscripcion_oport_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inscripcion',
+            index=models.Index(fields=['fecha_inscripcion', 'id'], name='inscripcion_fecha_idx'),
+        ),
+    ]
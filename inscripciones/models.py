@@ -1,9 +1,14 @@
 # Importa los modelos de Django
 from django.db import models
+from django.db.models.functions import Coalesce
 # Importa la configuración de Django
 from django.conf import settings
+# Fecha actual para no promover la lista de espera de oportunidades terminadas
+from django.utils import timezone
 # Importa el modelo OportunidadVoluntariado de la app oportunidades
-from oportunidades.models import OportunidadVoluntariado
+from oportunidades.models import OportunidadVoluntariado, FranjaHoraria
+# Bandeja de salida para notificar las promociones desde la lista de espera
+from eventos import bandeja
 
 
 # Define el modelo Inscripcion que hereda de models.Model
@@ -16,6 +21,9 @@ class Inscripcion(models.Model):
         ('rechazada', 'Rechazada'),  # Inscripción denegada
         ('completada', 'Completada'),# Actividad finalizada
     ]
+    
+    # Estados que ocupan un cupo de la oportunidad: al salir de ellos el cupo se libera
+    ESTADOS_CON_CUPO = ('pendiente', 'aceptada')
 
     # Campo que relaciona con el modelo de Usuario
     # CASCADE: si se borra el usuario, se borran sus inscripciones
@@ -54,8 +62,165 @@ class Inscripcion(models.Model):
         verbose_name_plural = 'inscripciones'  # Nombre plural en el admin
         # Evita que un usuario se inscriba dos veces a la misma oportunidad
         unique_together = ['usuario', 'oportunidad']
+        # Paginación por clave (fecha_inscripcion, id) de la gestión, por pestaña y filtro
+        indexes = [
+            models.Index(fields=['estado', 'fecha_inscripcion', 'id'], name='inscripcion_estado_fecha_idx'),
+            models.Index(
+                fields=['oportunidad', 'estado', 'fecha_inscripcion', 'id'],
+                name='inscripcion_oport_fecha_idx'
+            ),
+            models.Index(fields=['fecha_inscripcion', 'id'], name='inscripcion_fecha_idx'),
+        ]
     
     # Método que devuelve una representación en string del objeto
     def __str__(self):
         # Muestra el email del usuario y el título de la oportunidad
-        return f"Inscripción de {self.usuario.email} a {self.oportunidad.titulo}"
\ No newline at end of file
+        return f"Inscripción de {self.usuario.email} a {self.oportunidad.titulo}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Recuerda el estado y la oportunidad leídos para ajustar los contadores al guardar."""
+        instancia = super().from_db(db, field_names, values)
+        instancia._estado_guardado = instancia.__dict__.get('estado')
+        instancia._oportunidad_guardada = instancia.__dict__.get('oportunidad_id')
+        return instancia
+
+
+class ListaEspera(models.Model):
+    """
+    Lista de espera de una oportunidad sin cupos, atendida en orden de llegada (FIFO).
+
+    El orden es el de la clave primaria, que crece con cada alta: la posición de una
+    entrada es el número de entradas anteriores de la misma oportunidad más uno, y se
+    obtiene con un conteo por rango sobre el índice (oportunidad, id).
+    """
+    # Usuario que espera un cupo
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='listas_espera',
+        verbose_name='usuario'
+    )
+
+    # Oportunidad sin cupos en la que espera
+    oportunidad = models.ForeignKey(
+        OportunidadVoluntariado,
+        on_delete=models.CASCADE,
+        related_name='lista_espera',
+        verbose_name='oportunidad'
+    )
+
+    # Momento en que se unió a la lista
+    fecha_solicitud = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'entrada de lista de espera'
+        verbose_name_plural = 'lista de espera'
+        ordering = ['oportunidad', 'id']
+        # Un usuario espera como mucho una vez en cada oportunidad
+        unique_together = ['usuario', 'oportunidad']
+        indexes = [
+            # Cabeza de la cola y conteo de posiciones por oportunidad
+            models.Index(fields=['oportunidad', 'id'], name='lista_espera_orden_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.email} en espera de {self.oportunidad.titulo}"
+
+    def posicion_en_cola(self):
+        """Posición en la cola (1 = siguiente en recibir un cupo), con un conteo indexado."""
+        return ListaEspera.objects.filter(oportunidad_id=self.oportunidad_id, id__lt=self.id).count() + 1
+
+    @staticmethod
+    def con_posicion(entradas):
+        """
+        Anota la posición de cada entrada del QuerySet (`posicion`) con una subconsulta
+        de conteo por rango, sin cargar el resto de la cola.
+        """
+        anteriores = ListaEspera.objects.filter(
+            oportunidad=models.OuterRef('oportunidad'),
+            id__lt=models.OuterRef('id')
+        ).order_by().values('oportunidad').annotate(total=models.Count('id')).values('total')
+        return entradas.annotate(
+            posicion=Coalesce(models.Subquery(anteriores), 0) + 1
+        )
+
+    @staticmethod
+    def liberar_cupo(oportunidad_id, cantidad=1):
+        """
+        Entrega los cupos liberados (por cancelación, rechazo o ampliación de cupos) a
+        los primeros usuarios de la lista de espera, que quedan inscritos en estado
+        pendiente. Los cupos que nadie espera se devuelven a la oportunidad. Si la
+        oportunidad ya terminó no se promueve a nadie: todos los cupos se devuelven y
+        no se reabre.
+
+        Como en inscribirse_oportunidad, no se promueve a quien tiene el horario ocupado
+        por otra inscripción: conserva su lugar y el cupo pasa al siguiente. Las entradas
+        de usuarios que ya se inscribieron por otra vía se eliminan de la cola.
+
+        La cola se recorre en bloques bloqueados con SELECT ... FOR UPDATE SKIP LOCKED:
+        dos cancelaciones simultáneas promueven a usuarios distintos sin esperarse entre
+        sí. Debe invocarse dentro de la transacción que libera los cupos.
+
+        Args:
+            oportunidad_id: Id de la oportunidad cuyos cupos se liberan
+            cantidad: Número de cupos liberados
+
+        Returns:
+            tuple: (lista de inscripciones creadas, si la oportunidad se reabrió)
+        """
+        ya_inscrito = Inscripcion.objects.filter(
+            usuario=models.OuterRef('usuario'),
+            oportunidad=models.OuterRef('oportunidad')
+        )
+        franjas = FranjaHoraria.de_oportunidades([oportunidad_id]).get(oportunidad_id)
+        hoy = timezone.localdate()
+
+        siguientes = []
+        descartadas = []
+        ultima = 0
+        while len(siguientes) < cantidad:
+            # La fecha de fin se comprueba en la misma consulta; solo se bloquea la cola
+            bloque = list(ListaEspera.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                oportunidad_id=oportunidad_id,
+                oportunidad__fecha_fin__gte=hoy,
+                id__gt=ultima
+            ).annotate(
+                inscrito=models.Exists(ya_inscrito)
+            ).order_by('id').values_list('id', 'usuario_id', 'inscrito')[:cantidad - len(siguientes)])
+            if not bloque:
+                break
+            ultima = bloque[-1][0]
+
+            descartadas.extend(entrada_id for entrada_id, _, inscrito in bloque if inscrito)
+            candidatas = [(entrada_id, usuario_id) for entrada_id, usuario_id, inscrito in bloque if not inscrito]
+            if franjas and candidatas:
+                indices = FranjaHoraria.indices_de_usuarios(
+                    [usuario_id for _, usuario_id in candidatas], Inscripcion.ESTADOS_CON_CUPO
+                )
+                candidatas = [
+                    (entrada_id, usuario_id) for entrada_id, usuario_id in candidatas
+                    if usuario_id not in indices
+                    or not indices[usuario_id].oportunidades_en_conflicto(franjas, ignorar=oportunidad_id)
+                ]
+            siguientes.extend(candidatas)
+
+        reabierta = False
+        if len(siguientes) < cantidad:
+            reabierta = OportunidadVoluntariado.devolver_cupo(oportunidad_id, cantidad - len(siguientes))
+        if siguientes or descartadas:
+            ListaEspera.objects.filter(
+                pk__in=[entrada_id for entrada_id, _ in siguientes] + descartadas
+            ).delete()
+        if not siguientes:
+            return [], reabierta
+
+        promovidas = Inscripcion.objects.bulk_create([
+            Inscripcion(usuario_id=usuario_id, oportunidad_id=oportunidad_id, estado='pendiente')
+            for _, usuario_id in siguientes
+        ])
+        bandeja.registrar_varios([
+            ('inscripcion.promovida', None, {'inscripcion_id': inscripcion.pk})
+            for inscripcion in promovidas
+        ])
+        return promovidas, reabierta
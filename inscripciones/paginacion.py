@@ -0,0 +1,109 @@
+# Paginación por clave (keyset) para los listados de gestión
+# Las páginas se recorren de la más reciente a la más antigua por (fecha, id). En lugar
+# de OFFSET, cada enlace lleva la clave del último (o primer) elemento mostrado y la
+# página siguiente se lee con un rango sobre el índice compuesto: el costo no crece con
+# el número de página y las filas insertadas mientras se navega no desplazan las demás.
+import base64
+from collections import namedtuple
+from datetime import datetime
+from heapq import merge
+
+from django.db.models import Q
+
+# Elementos por página
+TAMANO_PAGINA = 50
+
+# Página obtenida: elementos en orden descendente y cursores para los enlaces
+# (None si no hay página en esa dirección)
+Pagina = namedtuple('Pagina', 'elementos siguiente anterior')
+
+# Consulta paginable: QuerySet y nombres de los campos de fecha e id que forman la clave
+Fuente = namedtuple('Fuente', 'consulta campo_fecha campo_id')
+
+
+def codificar(fecha, pk):
+    """Convierte la clave (fecha, id) en un cursor opaco apto para la URL."""
+    return base64.urlsafe_b64encode(f'{fecha.isoformat()}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decodificar(cursor):
+    """
+    Recupera la clave (fecha, id) de un cursor.
+
+    Returns:
+        tuple: (fecha, id), o None si el cursor falta o no es válido
+    """
+    if not cursor:
+        return None
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        fecha, pk = texto.split('|')
+        return datetime.fromisoformat(fecha), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _clave(fuente, elemento):
+    return getattr(elemento, fuente.campo_fecha), getattr(elemento, fuente.campo_id)
+
+
+def _tramo(fuente, clave, anteriores, limite):
+    """
+    Lee hasta `limite` elementos de una fuente a un lado de la clave: los más antiguos
+    (anteriores=True) en orden descendente o los más recientes en orden ascendente.
+    """
+    fecha, id_ = fuente.campo_fecha, fuente.campo_id
+    orden = [f'-{fecha}', f'-{id_}'] if anteriores else [fecha, id_]
+    consulta = fuente.consulta
+    if clave is not None:
+        comparacion = 'lt' if anteriores else 'gt'
+        consulta = consulta.filter(
+            Q(**{f'{fecha}__{comparacion}': clave[0]}) |
+            Q(**{fecha: clave[0], f'{id_}__{comparacion}': clave[1]})
+        )
+    return [(_clave(fuente, elemento), elemento) for elemento in consulta.order_by(*orden)[:limite]]
+
+
+def paginar(fuentes, despues=None, antes=None, tamano=TAMANO_PAGINA):
+    """
+    Obtiene una página de una o varias fuentes ordenadas por (fecha, id) descendente.
+
+    Cada fuente se lee con una consulta de a lo sumo `tamano + 1` filas; con varias
+    fuentes (por ejemplo, el historial activo y el archivo) los tramos se mezclan en
+    memoria, así que las claves deben ser únicas entre fuentes.
+
+    Args:
+        fuentes: Lista de Fuente
+        despues: Cursor de la página siguiente (elementos más antiguos que la clave)
+        antes: Cursor de la página anterior (elementos más recientes que la clave)
+        tamano: Elementos por página
+
+    Returns:
+        Pagina: Elementos y cursores de las páginas siguiente y anterior
+    """
+    clave_antes = decodificar(antes)
+    clave = decodificar(despues) if clave_antes is None else clave_antes
+    anteriores = clave_antes is None
+
+    tramos = [_tramo(fuente, clave, anteriores, tamano + 1) for fuente in fuentes]
+    filas = list(merge(*tramos, key=lambda fila: fila[0], reverse=anteriores))
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+
+    if not anteriores:
+        # Página anterior: se leyó en orden ascendente desde la clave
+        filas.reverse()
+        if not filas:
+            # Los elementos más recientes desaparecieron: volver a la primera página
+            return paginar(fuentes, tamano=tamano)
+        return Pagina(
+            [elemento for _, elemento in filas],
+            codificar(*filas[-1][0]),
+            codificar(*filas[0][0]) if hay_mas else None
+        )
+
+    return Pagina(
+        [elemento for _, elemento in filas],
+        codificar(*filas[-1][0]) if hay_mas else None,
+        codificar(*(filas[0][0] if filas else clave)) if clave is not None else None
+    )
@@ -0,0 +1,49 @@
+# Señales que mantienen los contadores de inscripciones: los de la caché y los de cada
+# oportunidad (ver contadores.py)
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from permutaciones.models import HistorialPermutacion
+from .models import Inscripcion
+from . import contadores
+
+
+@receiver(post_save, sender=Inscripcion)
+@receiver(post_delete, sender=Inscripcion)
+@receiver(post_save, sender=HistorialPermutacion)
+def invalidar_contadores(sender, **kwargs):
+    """
+    Descarta los contadores en caché cuando cambia una inscripción o se registra
+    historial. El borrado de historial no tiene receptor (así Django puede borrarlo
+    en bloque sin cargar las filas): quien lo borra invalida una vez por lote.
+    """
+    contadores.invalidar()
+
+
+@receiver(post_save, sender=Inscripcion)
+def ajustar_contadores_guardado(sender, instance, created, **kwargs):
+    """
+    Ajusta el contador de pendientes y los de la oportunidad si la inscripción cambió
+    de estado o de oportunidad (un intercambio la mueve de una a otra).
+    """
+    anterior = None if created else getattr(instance, '_estado_guardado', None)
+    oportunidad_anterior = None if created else getattr(instance, '_oportunidad_guardada', None)
+    contadores.ajustar_pendientes((instance.estado == 'pendiente') - (anterior == 'pendiente'))
+    if (oportunidad_anterior, anterior) != (instance.oportunidad_id, instance.estado):
+        contadores.ajustar_oportunidades(
+            salidas=[(oportunidad_anterior, anterior)] if oportunidad_anterior else [],
+            entradas=[(instance.oportunidad_id, instance.estado)]
+        )
+    instance._estado_guardado = instance.estado
+    instance._oportunidad_guardada = instance.oportunidad_id
+
+
+@receiver(post_delete, sender=Inscripcion)
+def ajustar_contadores_borrado(sender, instance, **kwargs):
+    """Descuenta la inscripción borrada del contador de pendientes y de su oportunidad."""
+    estado = getattr(instance, '_estado_guardado', instance.estado)
+    if estado == 'pendiente':
+        contadores.ajustar_pendientes(-1)
+    contadores.ajustar_oportunidades(
+        salidas=[(getattr(instance, '_oportunidad_guardada', instance.oportunidad_id), estado)]
+    )
@@ -0,0 +1,448 @@
+import base64
+import csv
+import io
+import threading
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from oportunidades.models import OportunidadVoluntariado
+from organizaciones.models import Organizacion
+from permutaciones.models import HistorialPermutacion, HistorialPermutacionArchivo, SolicitudPermutacion
+from usuarios.models import Usuario
+from . import gestion, importacion, paginacion
+from .models import Inscripcion, ListaEspera
+
+
+class EscenarioInscripciones:
+    """Datos comunes: una oportunidad abierta con pocos cupos y voluntarios sin inscribir."""
+
+    CUPOS = 5
+
+    def setUp(self):
+        self.organizacion = Organizacion.objects.create(
+            nombre='Organización de prueba', descripcion='Pruebas', contacto_email='org@puce.edu.ec'
+        )
+        hoy = timezone.localdate()
+        self.oportunidad = OportunidadVoluntariado.objects.create(
+            titulo='Oportunidad popular',
+            descripcion='Oportunidad de prueba',
+            fecha_inicio=hoy,
+            fecha_fin=hoy + timedelta(days=30),
+            organizacion=self.organizacion,
+            ubicacion='Quito',
+            cupos=self.CUPOS
+        )
+        self.url = reverse('inscripciones:inscribirse', args=[self.oportunidad.id])
+
+    def crear_voluntarios(self, cantidad):
+        # Carga masiva: solo interesan las inscripciones que se crean después
+        return Usuario.objects.bulk_create([
+            Usuario(email=f'voluntario{indice}@puce.edu.ec', nombre_completo=f'Voluntario {indice}', password='!')
+            for indice in range(cantidad)
+        ])
+
+    def comprobar_sin_sobreventa(self, solicitantes):
+        """Todos los cupos vendidos una sola vez; el resto de solicitantes queda en espera."""
+        self.oportunidad.refresh_from_db()
+        self.assertEqual(Inscripcion.objects.filter(oportunidad=self.oportunidad).count(), self.CUPOS)
+        self.assertEqual(ListaEspera.objects.filter(oportunidad=self.oportunidad).count(), solicitantes - self.CUPOS)
+        self.assertEqual(self.oportunidad.cupos, 0)
+        self.assertEqual(self.oportunidad.estado, 'cerrada')
+        self.assertEqual(self.oportunidad.pendientes, self.CUPOS)
+
+
+class InscripcionCuposTests(EscenarioInscripciones, TestCase):
+    """La reserva de cupos al inscribirse nunca vende más cupos de los que hay."""
+
+    def test_inscripciones_sucesivas_sin_sobreventa(self):
+        voluntarios = self.crear_voluntarios(self.CUPOS + 3)
+        for voluntario in voluntarios:
+            self.client.force_login(voluntario)
+            self.assertEqual(self.client.post(self.url).status_code, 302)
+        self.comprobar_sin_sobreventa(len(voluntarios))
+
+    def test_segunda_peticion_del_mismo_usuario(self):
+        voluntario, = self.crear_voluntarios(1)
+        self.client.force_login(voluntario)
+        self.client.post(self.url)
+        self.client.post(self.url)
+        self.oportunidad.refresh_from_db()
+        self.assertEqual(Inscripcion.objects.filter(usuario=voluntario).count(), 1)
+        self.assertEqual(self.oportunidad.cupos, self.CUPOS - 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Requiere bloqueos de fila reales (PostgreSQL)')
+class RafagaInscripcionesTests(EscenarioInscripciones, TransactionTestCase):
+    """
+    Ráfaga de inscripciones simultáneas: 200 voluntarios repartidos en 40 hilos que
+    arrancan a la vez compiten por 50 cupos.
+    """
+
+    CUPOS = 50
+    HILOS = 40
+    VOLUNTARIOS = 200
+
+    def test_rafaga_sin_sobreventa(self):
+        voluntarios = self.crear_voluntarios(self.VOLUNTARIOS)
+        barrera = threading.Barrier(self.HILOS)
+        errores = []
+
+        def inscribir(lote):
+            try:
+                cliente = Client()
+                barrera.wait()
+                for voluntario in lote:
+                    cliente.force_login(voluntario)
+                    if cliente.post(self.url).status_code != 302:
+                        errores.append(voluntario.id)
+            finally:
+                connection.close()
+
+        hilos = [
+            threading.Thread(target=inscribir, args=(voluntarios[indice::self.HILOS],))
+            for indice in range(self.HILOS)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        self.comprobar_sin_sobreventa(self.VOLUNTARIOS)
+
+
+class LiberarCupoTests(EscenarioInscripciones, TestCase):
+    """Los cupos liberados pasan a la lista de espera solo si la oportunidad no terminó."""
+
+    CUPOS = 1
+
+    def setUp(self):
+        super().setUp()
+        self.inscrito, self.en_espera = self.crear_voluntarios(2)
+        self.admin = Usuario.objects.create_user('admin@puce.edu.ec', 'clave-de-prueba', nombre_completo='Admin')
+        for voluntario in (self.inscrito, self.en_espera):
+            self.client.force_login(voluntario)
+            self.client.post(self.url)
+        self.inscripcion = Inscripcion.objects.get(usuario=self.inscrito)
+
+    def rechazar(self):
+        gestion.decidir_en_bloque(Inscripcion.objects.filter(pk=self.inscripcion.pk), 'rechazada', self.admin)
+        self.oportunidad.refresh_from_db()
+
+    def test_promueve_al_primero_de_la_cola(self):
+        self.rechazar()
+        self.assertTrue(Inscripcion.objects.filter(usuario=self.en_espera, estado='pendiente').exists())
+        self.assertFalse(ListaEspera.objects.exists())
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.estado), (0, 'cerrada'))
+
+    def test_oportunidad_terminada_devuelve_el_cupo(self):
+        OportunidadVoluntariado.objects.filter(pk=self.oportunidad.pk).update(
+            fecha_fin=timezone.localdate() - timedelta(days=1)
+        )
+        self.rechazar()
+        self.assertFalse(Inscripcion.objects.filter(usuario=self.en_espera).exists())
+        self.assertTrue(ListaEspera.objects.filter(usuario=self.en_espera).exists())
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.estado), (1, 'cerrada'))
+
+    def esperar(self, indice):
+        """Agrega al final de la cola a un voluntario nuevo."""
+        voluntario = Usuario.objects.create_user(
+            f'espera{indice}@puce.edu.ec', 'clave-de-prueba', nombre_completo=f'Espera {indice}'
+        )
+        ListaEspera.objects.create(usuario=voluntario, oportunidad=self.oportunidad)
+        return voluntario
+
+    def ampliar(self, cantidad):
+        """Edita la oportunidad como lo haría el formulario, sumando `cantidad` cupos."""
+        oportunidad = OportunidadVoluntariado.objects.get(pk=self.oportunidad.pk)
+        oportunidad.cupos += cantidad
+        oportunidad.save()
+        self.oportunidad.refresh_from_db()
+        return oportunidad
+
+    def test_ampliar_cupos_promueve_la_cola_en_orden(self):
+        siguiente = self.esperar(1)
+        ultimo = self.esperar(2)
+
+        oportunidad = self.ampliar(3)
+        self.assertEqual(
+            set(Inscripcion.objects.filter(estado='pendiente').values_list('usuario_id', flat=True)),
+            {self.inscrito.pk, self.en_espera.pk, siguiente.pk, ultimo.pk}
+        )
+        self.assertFalse(ListaEspera.objects.exists())
+        # Los tres cupos nuevos se los lleva la cola: no queda ninguno libre (también en memoria)
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.estado), (0, 'cerrada'))
+        self.assertEqual((oportunidad.cupos, oportunidad.estado), (0, 'cerrada'))
+        self.assertEqual((self.oportunidad.pendientes, self.oportunidad.capacidad_total), (4, 4))
+
+        # Con la cola vacía, el cupo sobrante queda libre y reabre la oportunidad
+        self.ampliar(1)
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.estado), (1, 'abierta'))
+        self.assertEqual(self.oportunidad.capacidad_total, 5)
+
+    def test_ampliar_cupos_respeta_la_cola_frente_a_nuevos(self):
+        self.ampliar(1)
+        self.assertTrue(Inscripcion.objects.filter(usuario=self.en_espera, estado='pendiente').exists())
+        self.assertEqual(self.oportunidad.cupos, 0)
+
+    def test_no_promueve_con_conflicto_de_horario(self):
+        siguiente = self.esperar(1)
+        self.oportunidad.horario = 'Lunes 9:00 - 12:00'
+        self.oportunidad.save()
+        hoy = timezone.localdate()
+        otra = OportunidadVoluntariado.objects.create(
+            titulo='Misma hora', descripcion='Oportunidad de prueba', fecha_inicio=hoy,
+            fecha_fin=hoy + timedelta(days=30), organizacion=self.organizacion, ubicacion='Quito',
+            cupos=5, horario='Lunes 10:00 - 11:00'
+        )
+        Inscripcion.objects.create(usuario=self.en_espera, oportunidad=otra, estado='aceptada')
+
+        self.rechazar()
+        # El cupo pasa al siguiente; el que tiene el horario ocupado conserva su lugar
+        self.assertTrue(Inscripcion.objects.filter(
+            usuario=siguiente, oportunidad=self.oportunidad, estado='pendiente'
+        ).exists())
+        self.assertFalse(Inscripcion.objects.filter(usuario=self.en_espera, oportunidad=self.oportunidad).exists())
+        self.assertTrue(ListaEspera.objects.filter(usuario=self.en_espera).exists())
+
+    def test_elimina_de_la_cola_a_quien_ya_esta_inscrito(self):
+        Inscripcion.objects.create(usuario=self.en_espera, oportunidad=self.oportunidad, estado='aceptada')
+
+        self.rechazar()
+        self.assertFalse(ListaEspera.objects.exists())
+        self.assertEqual(Inscripcion.objects.filter(usuario=self.en_espera).count(), 1)
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.estado), (1, 'abierta'))
+
+    def test_pestana_pendientes_usa_el_contador(self):
+        self.admin.is_superuser = True
+        self.admin.save()
+        self.client.force_login(self.admin)
+        respuesta = self.client.get(reverse('inscripciones:gestion_inscripciones'), {'estado': 'pendiente'})
+        self.assertEqual(
+            [(fila.id, fila.pendientes) for fila in respuesta.context['oportunidades_pendientes']],
+            [(self.oportunidad.id, 1)]
+        )
+
+
+class AdminInscripcionesTests(EscenarioInscripciones, TestCase):
+    """El admin no cambia estados ni borra inscripciones sin mover los cupos."""
+
+    CUPOS = 2
+
+    def setUp(self):
+        super().setUp()
+        self.inscritos = self.crear_voluntarios(3)
+        for voluntario in self.inscritos:
+            self.client.force_login(voluntario)
+            self.client.post(self.url)
+        self.en_espera = self.inscritos[2]
+        self.admin = Usuario.objects.create_superuser('admin@puce.edu.ec', 'clave-de-prueba')
+        self.client.force_login(self.admin)
+        self.inscripciones = list(Inscripcion.objects.order_by('pk'))
+
+    def test_estado_no_es_editable(self):
+        respuesta = self.client.get(reverse('admin:inscripciones_inscripcion_changelist'))
+        self.assertNotContains(respuesta, 'form-0-estado')
+
+        url = reverse('admin:inscripciones_inscripcion_change', args=[self.inscripciones[0].pk])
+        self.assertNotContains(self.client.get(url), 'name="estado"')
+        self.client.post(url, {'comentarios': 'Revisada', 'estado': 'rechazada'})
+        self.inscripciones[0].refresh_from_db()
+        self.assertEqual((self.inscripciones[0].estado, self.inscripciones[0].comentarios), ('pendiente', 'Revisada'))
+
+    def test_borrar_libera_el_cupo(self):
+        url = reverse('admin:inscripciones_inscripcion_delete', args=[self.inscripciones[0].pk])
+        # Ejecutar los refrescos diferidos del índice de candidatos (ver candidatos.refrescar_usuarios_al_confirmar)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'post': 'yes'})
+        self.oportunidad.refresh_from_db()
+        self.assertTrue(Inscripcion.objects.filter(usuario=self.en_espera, estado='pendiente').exists())
+        self.assertFalse(ListaEspera.objects.exists())
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.pendientes), (0, 2))
+
+    def test_borrado_masivo_libera_los_cupos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:inscripciones_inscripcion_changelist'), {
+                'action': 'delete_selected',
+                '_selected_action': [inscripcion.pk for inscripcion in self.inscripciones],
+                'post': 'yes',
+            })
+        self.oportunidad.refresh_from_db()
+        # La cola recibe uno de los cupos; el otro queda libre y reabre la oportunidad
+        self.assertEqual(
+            list(Inscripcion.objects.values_list('usuario_id', 'estado')), [(self.en_espera.pk, 'pendiente')]
+        )
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.estado), (1, 'abierta'))
+        self.assertEqual(self.oportunidad.pendientes, 1)
+
+
+class PaginacionTests(EscenarioInscripciones, TestCase):
+    """La paginación por clave recorre todos los elementos una sola vez en ambos sentidos."""
+
+    TAMANO = 3
+
+    def setUp(self):
+        super().setUp()
+        ahora = timezone.now()
+        voluntarios = self.crear_voluntarios(8)
+        Inscripcion.objects.bulk_create([
+            Inscripcion(usuario=voluntario, oportunidad=self.oportunidad) for voluntario in voluntarios
+        ])
+        # Fechas repetidas de a pares: el id desempata dentro de la misma fecha
+        for indice, inscripcion in enumerate(Inscripcion.objects.order_by('pk')):
+            Inscripcion.objects.filter(pk=inscripcion.pk).update(fecha_inscripcion=ahora - timedelta(hours=indice // 2))
+        self.fuentes = [paginacion.Fuente(Inscripcion.objects.all(), 'fecha_inscripcion', 'id')]
+        self.esperados = list(Inscripcion.objects.order_by('-fecha_inscripcion', '-id').values_list('pk', flat=True))
+
+    def paginar(self, **cursores):
+        return paginacion.paginar(self.fuentes, tamano=self.TAMANO, **cursores)
+
+    def ids(self, pagina):
+        return [elemento.pk for elemento in pagina.elementos]
+
+    def test_recorre_hacia_adelante_y_hacia_atras(self):
+        pagina = self.paginar()
+        self.assertIsNone(pagina.anterior)
+        paginas = [pagina]
+        while pagina.siguiente:
+            pagina = self.paginar(despues=pagina.siguiente)
+            paginas.append(pagina)
+        self.assertEqual([len(pagina.elementos) for pagina in paginas], [3, 3, 2])
+        self.assertEqual([pk for pagina in paginas for pk in self.ids(pagina)], self.esperados)
+
+        # De vuelta desde la última página se obtienen las mismas páginas
+        vuelta = [pagina]
+        while pagina.anterior:
+            pagina = self.paginar(antes=pagina.anterior)
+            vuelta.append(pagina)
+        self.assertEqual([self.ids(pagina) for pagina in reversed(vuelta)], [self.ids(pagina) for pagina in paginas])
+        self.assertIsNotNone(vuelta[-1].siguiente)
+
+    def test_cursor_alterado_vuelve_a_la_primera_pagina(self):
+        primera = self.ids(self.paginar())
+        invalido = base64.urlsafe_b64encode(b'no-es-una-fecha|7').decode()
+        for cursor in ('%%%', 'YWJj', invalido, paginacion.codificar(timezone.now(), 1)[:-3]):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.ids(self.paginar(despues=cursor)), primera)
+                self.assertEqual(self.ids(self.paginar(antes=cursor)), primera)
+
+    def test_historial_archivado_se_mezcla_por_fecha_e_id_original(self):
+        organizador = Usuario.objects.create_user('organizador@puce.edu.ec', 'clave-de-prueba', nombre_completo='Organizador')
+        receptor = Usuario.objects.get(email='voluntario0@puce.edu.ec')
+        solicitud, = SolicitudPermutacion.objects.bulk_create([SolicitudPermutacion(
+            solicitante=organizador, receptor=receptor,
+            oportunidad_origen=self.oportunidad, oportunidad_destino=self.oportunidad
+        )])
+        HistorialPermutacion.objects.all().delete()
+        corte = HistorialPermutacion.fecha_corte()
+        registros = HistorialPermutacion.objects.bulk_create([
+            HistorialPermutacion(solicitud=solicitud, accion='creacion', datos={'motivo': 'nueva'})
+            for _ in range(6)
+        ])
+        # Todos anteriores a la ventana activa, con fechas repetidas entre ambas tablas
+        claves = [(corte - timedelta(days=1 + indice // 2), registro.pk) for indice, registro in enumerate(registros)]
+        for fecha, pk in claves:
+            HistorialPermutacion.objects.filter(pk=pk).update(fecha=fecha)
+        # Se archivan los de id impar: cada fecha queda con un registro en cada tabla
+        HistorialPermutacionArchivo.objects.bulk_create([
+            HistorialPermutacionArchivo.desde_historial(registro)
+            for registro in HistorialPermutacion.objects.filter(pk__in=[r.pk for r in registros[1::2]])
+        ])
+        HistorialPermutacion.objects.filter(pk__in=[r.pk for r in registros[1::2]]).delete()
+
+        fuentes = [
+            paginacion.Fuente(consulta, 'fecha', campo_id)
+            for consulta, campo_id in gestion.filtrar_historial(ver_archivo=True)
+        ]
+        recorrido = []
+        pagina = paginacion.paginar(fuentes, tamano=3)
+        while True:
+            recorrido += [getattr(elemento, 'historial_id', elemento.pk) for elemento in pagina.elementos]
+            if not pagina.siguiente:
+                break
+            pagina = paginacion.paginar(fuentes, despues=pagina.siguiente, tamano=3)
+        # Orden (fecha, id original) descendente: activo y archivado alternan dentro de cada
+        # fecha, también cuando el corte de página separa dos registros de la misma fecha
+        self.assertEqual(recorrido, [pk for _, pk in sorted(claves, reverse=True)])
+        self.assertEqual(HistorialPermutacionArchivo.objects.count(), 3)
+
+
+class ImportacionTests(EscenarioInscripciones, TestCase):
+    """Importación masiva desde CSV: validación por conjuntos, cupos y contadores."""
+
+    CUPOS = 3
+
+    def setUp(self):
+        super().setUp()
+        self.voluntarios = self.crear_voluntarios(5)
+        self.cerrada = OportunidadVoluntariado.objects.create(
+            titulo='Cerrada', descripcion='Oportunidad de prueba', fecha_inicio=timezone.localdate(),
+            fecha_fin=timezone.localdate() + timedelta(days=30), organizacion=self.organizacion,
+            ubicacion='Quito', cupos=5, estado='cerrada'
+        )
+        ListaEspera.objects.create(usuario=self.voluntarios[0], oportunidad=self.oportunidad)
+
+    def importar(self, lineas, simular=False):
+        entrada = io.StringIO('email,oportunidad,estado,comentarios\n' + '\n'.join(lineas) + '\n')
+        salida = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = importacion.importar(entrada, salida, simular=simular)
+        # Filas del archivo de rechazos, sin el encabezado
+        return resultado, list(csv.reader(io.StringIO(salida.getvalue())))[1:]
+
+    def lineas(self):
+        op = self.oportunidad.id
+        v = [voluntario.email for voluntario in self.voluntarios]
+        return [
+            f'{v[0].upper()},{op},,lista',          # válida (aceptada por defecto); deja la lista de espera
+            f'{v[1]},{op},pendiente,',               # válida
+            f'{v[1]},{op},aceptada,',                # duplicada en el archivo
+            f',{op},,',                              # sin correo
+            f'{v[2]},abc,,',                         # oportunidad no numérica
+            f'{v[2]},{op},completada,',              # estado no importable
+            f'nadie@puce.edu.ec,{op},,',             # usuario inexistente
+            f'{v[2]},999999,,',                      # oportunidad inexistente
+            f'{v[2]},{self.cerrada.id},,',           # oportunidad cerrada
+            f'{v[3]},{op},,',                        # válida: agota los cupos
+            f'{v[4]},{op},,',                        # sin cupo
+        ]
+
+    def test_importa_valida_y_rechaza(self):
+        resultado, rechazos = self.importar(self.lineas())
+
+        self.assertEqual(resultado['leidas'], 11)
+        self.assertEqual(resultado['creadas'], 3)
+        self.assertEqual(resultado['rechazadas'], 8)
+        self.assertEqual(resultado['por_motivo'], {
+            'duplicada': 1, 'email_vacio': 1, 'oportunidad_invalida': 1, 'estado_invalido': 1,
+            'usuario_inexistente': 1, 'oportunidad_inexistente': 1, 'oportunidad_cerrada': 1, 'sin_cupo': 1,
+        })
+        self.assertEqual([fila[0] for fila in rechazos], ['4', '5', '6', '7', '8', '9', '10', '12'])
+
+        self.assertEqual(
+            sorted(Inscripcion.objects.filter(oportunidad=self.oportunidad).values_list('usuario_id', 'estado')),
+            sorted([
+                (self.voluntarios[0].id, 'aceptada'),
+                (self.voluntarios[1].id, 'pendiente'),
+                (self.voluntarios[3].id, 'aceptada'),
+            ])
+        )
+        self.assertFalse(ListaEspera.objects.exists())
+        self.oportunidad.refresh_from_db()
+        self.assertEqual((self.oportunidad.cupos, self.oportunidad.estado), (0, 'cerrada'))
+        self.assertEqual((self.oportunidad.pendientes, self.oportunidad.aceptadas), (1, 2))
+
+    def test_simulacion_no_modifica_nada(self):
+        resultado, rechazos = self.importar(self.lineas(), simular=True)
+        self.assertEqual((resultado['creadas'], resultado['rechazadas']), (0, 8))
+        self.assertEqual(len(rechazos), 8)
+        self.assertFalse(Inscripcion.objects.exists())
+        self.assertTrue(ListaEspera.objects.exists())
+        self.oportunidad.refresh_from_db()
+        self.assertEqual(self.oportunidad.cupos, self.CUPOS)
+
@@ -22,6 +22,10 @@ urlpatterns = [
     # URL: /inscripciones/eliminar/1/ (donde 1 es el ID de la inscripción)
     path('eliminar/<int:pk>/', views.eliminar_inscripcion, name='eliminar_inscripcion'),
     
+    # Vista para abandonar una lista de espera
+    # URL: /inscripciones/lista-espera/salir/1/ (donde 1 es el ID de la entrada)
+    path('lista-espera/salir/<int:pk>/', views.salir_lista_espera, name='salir_lista_espera'),
+    
     # Vista de administración para gestionar inscripciones (solo administradores)
     # URL: /inscripciones/gestion/
     path('gestion/', views.GestionInscripcionesView.as_view(), name='gestion_inscripciones'),
@@ -33,4 +37,12 @@ urlpatterns = [
     # Vista para rechazar una inscripción (solo administradores)
     # URL: /inscripciones/rechazar/1/ (donde 1 es el ID de la inscripción)
     path('rechazar/<int:pk>/', views.rechazar_inscripcion, name='rechazar_inscripcion'),
-]
\ No newline at end of file
+    
+    # Vista para descargar la pestaña de gestión con sus filtros (solo administradores)
+    # URL: /inscripciones/exportar/?estado=pendiente&formato=csv
+    path('exportar/', views.exportar_inscripciones, name='exportar_inscripciones'),
+    
+    # Vista para aceptar o rechazar varias inscripciones a la vez (solo administradores)
+    # URL: /inscripciones/decidir/
+    path('decidir/', views.decidir_inscripciones, name='decidir_inscripciones'),
+]
@@ -1,15 +1,20 @@
 # Importaciones de Django y utilidades
+import tempfile  # Archivo temporal para la exportación a Excel
 from django.contrib import messages  # Para mensajes al usuario
 from django.contrib.auth.decorators import login_required, user_passes_test  # Para control de acceso
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin  # Mixins para vistas basadas en clases
 from django.shortcuts import render, get_object_or_404, redirect  # Funciones de utilidad para vistas
+from django.http import StreamingHttpResponse, FileResponse  # Respuestas de las exportaciones
 from django.views.generic import ListView, CreateView, DeleteView  # Vistas genéricas
-from django.urls import reverse_lazy  # Para URLs con evaluación perezosa
+from django.urls import reverse, reverse_lazy  # Para construir URLs
+from django.db import transaction, IntegrityError  # Para confirmar el cambio y su evento juntos
 
 # Importación de modelos
-from .models import Inscripcion
-from oportunidades.models import OportunidadVoluntariado
-from permutaciones.models import HistorialPermutacion
+from .models import Inscripcion, ListaEspera
+from oportunidades.models import OportunidadVoluntariado, FranjaHoraria
+from organizaciones.models import Organizacion
+from permutaciones import candidatos
+from . import gestion, contadores, paginacion, exportacion
 
 
 class MisInscripcionesView(LoginRequiredMixin, ListView):
@@ -21,6 +26,29 @@ class MisInscripcionesView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         """Retorna solo las inscripciones del usuario actual."""
         return Inscripcion.objects.filter(usuario=self.request.user)
+    
+    def get_context_data(self, **kwargs):
+        """Agrega las listas de espera del usuario con su posición en cada cola."""
+        context = super().get_context_data(**kwargs)
+        context['listas_espera'] = ListaEspera.con_posicion(
+            ListaEspera.objects.filter(usuario=self.request.user)
+        ).select_related('oportunidad')
+        return context
+
+
+def leer_filtros(parametros):
+    """
+    Lee los filtros de gestión (oportunidad y organización) de los parámetros GET.
+    
+    Returns:
+        tuple: (id de oportunidad o None, id de organización o None)
+    """
+    oportunidad = parametros.get('oportunidad', '')
+    organizacion = parametros.get('organizacion', '')
+    return (
+        int(oportunidad) if oportunidad.isdigit() else None,
+        int(organizacion) if organizacion.isdigit() else None
+    )
 
 
 class GestionInscripcionesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
@@ -33,42 +61,91 @@ class GestionInscripcionesView(LoginRequiredMixin, UserPassesTestMixin, ListView
         """Permite el acceso a superusuarios y administradores."""
         return self.request.user.is_superuser or getattr(self.request.user, 'acceso_admin', False)
         
+    def filtros(self):
+        """Oportunidad y organización seleccionadas en los filtros del listado."""
+        return leer_filtros(self.request.GET)
+        
     def get_queryset(self):
-        """Filtra las inscripciones según el estado seleccionado."""
+        """Filtra las inscripciones según el estado, la oportunidad y la organización."""
         estado = self.request.GET.get('estado', 'pendiente')
         
         # Si es la pestaña de historial, no necesitamos las inscripciones
         if estado == 'historial':
             return Inscripcion.objects.none()
             
-        queryset = Inscripcion.objects.all()
-        
-        if estado != 'todas':
-            queryset = queryset.filter(estado=estado)
+        queryset = gestion.filtrar_inscripciones(estado, *self.filtros())
             
         return queryset.select_related('usuario', 'oportunidad', 'oportunidad__organizacion')
     
+    def historial(self, ver_archivo):
+        """Fuentes paginables del historial de intercambios con los filtros aplicados."""
+        relaciones = (
+            'solicitud', 'solicitud__solicitante', 'solicitud__receptor',
+            'solicitud__oportunidad_origen', 'solicitud__oportunidad_destino',
+            'usuario'
+        )
+        return [
+            paginacion.Fuente(consulta.select_related(*relaciones), 'fecha', campo_id)
+            for consulta, campo_id in gestion.filtrar_historial(ver_archivo, *self.filtros())
+        ]
+    
     def get_context_data(self, **kwargs):
-        """Agrega contadores, estado actual y datos de historial al contexto."""
+        """Agrega la página actual, contadores, filtros y datos de historial al contexto."""
         context = super().get_context_data(**kwargs)
         estado_actual = self.request.GET.get('estado', 'pendiente')
+        oportunidad_id, organizacion_id = self.filtros()
         
-        # Contadores para las pestañas
-        context['contadores'] = {
-            'pendiente': Inscripcion.objects.filter(estado='pendiente').count(),
-            'aceptada': Inscripcion.objects.filter(estado='aceptada').count(),
-            'rechazada': Inscripcion.objects.filter(estado='rechazada').count(),
-            'historial': HistorialPermutacion.objects.count(),
-            'total': Inscripcion.objects.count()
-        }
+        # Contadores para las pestañas (desde la caché, ver contadores.py)
+        context['contadores'] = contadores.obtener()
         
-        # Si es la pestaña de historial, obtenemos los registros
+        # Paginación por clave: (fecha_inscripcion, id) o (fecha, id) en el historial
+        ver_archivo = self.request.GET.get('archivo') == '1'
         if estado_actual == 'historial':
-            context['historial_intercambios'] = HistorialPermutacion.objects.select_related(
-                'solicitud', 'solicitud__solicitante', 'solicitud__receptor',
-                'solicitud__oportunidad_origen', 'solicitud__oportunidad_destino',
-                'usuario'
-            ).order_by('-fecha')
+            fuentes = self.historial(ver_archivo)
+        else:
+            fuentes = [paginacion.Fuente(self.object_list, 'fecha_inscripcion', 'id')]
+        pagina = paginacion.paginar(
+            fuentes,
+            despues=self.request.GET.get('despues'),
+            antes=self.request.GET.get('antes')
+        )
+        if estado_actual == 'historial':
+            context['historial_intercambios'] = pagina.elementos
+            context['ver_archivo'] = ver_archivo
+        else:
+            context['inscripciones'] = context['object_list'] = pagina.elementos
+        
+        # Enlaces a las páginas vecinas conservando la pestaña y los filtros
+        parametros = self.request.GET.copy()
+        parametros.pop('despues', None)
+        parametros.pop('antes', None)
+        parametros['estado'] = estado_actual
+        context['parametros_exportacion'] = parametros.urlencode()
+        context['exportar_xlsx'] = exportacion.xlsxwriter is not None
+        for nombre, cursor in (('despues', pagina.siguiente), ('antes', pagina.anterior)):
+            if cursor:
+                parametros[nombre] = cursor
+                context[f'url_{nombre}'] = f'?{parametros.urlencode()}'
+                del parametros[nombre]
+        
+        # Total de la pestaña (solo sin filtros: con filtros costaría un conteo completo)
+        if not (oportunidad_id or organizacion_id or ver_archivo):
+            context['total_estado'] = context['contadores'].get(
+                'total' if estado_actual == 'todas' else estado_actual
+            )
+        
+        # Opciones de los filtros
+        context['filtro_oportunidad'] = oportunidad_id
+        context['filtro_organizacion'] = organizacion_id
+        context['oportunidades'] = OportunidadVoluntariado.objects.order_by('titulo').only('id', 'titulo')
+        context['organizaciones'] = Organizacion.objects.order_by('nombre').only('id', 'nombre')
+        
+        # Oportunidades con inscripciones pendientes, para decidirlas todas de una vez
+        # (del contador desnormalizado, sin agrupar las inscripciones en cada carga)
+        if estado_actual == 'pendiente':
+            context['oportunidades_pendientes'] = OportunidadVoluntariado.objects.filter(
+                pendientes__gt=0
+            ).order_by('titulo').only('id', 'titulo', 'pendientes')
         
         context['estado_actual'] = estado_actual
         
@@ -86,14 +163,51 @@ class GestionInscripcionesView(LoginRequiredMixin, UserPassesTestMixin, ListView
         return context
 
 
+@login_required
+@user_passes_test(lambda u: u.is_superuser or getattr(u, 'acceso_admin', False))
+def exportar_inscripciones(request):
+    """
+    Vista para que un administrador descargue la pestaña de gestión actual, con sus
+    filtros, como CSV (por defecto) o como XLSX (`formato=xlsx`).
+    
+    El CSV se envía con StreamingHttpResponse a medida que se leen las filas. El XLSX
+    se escribe en un archivo temporal en modo de memoria constante y se envía con
+    FileResponse, que lo lee por bloques.
+    """
+    estado = request.GET.get('estado', 'pendiente')
+    columnas, filas, nombre = exportacion.exportacion(
+        estado, *leer_filtros(request.GET), ver_archivo=request.GET.get('archivo') == '1'
+    )
+    
+    if request.GET.get('formato') == 'xlsx':
+        if exportacion.xlsxwriter is None:
+            messages.error(request, 'La exportación a Excel no está disponible en este servidor. Usa CSV.')
+            return redirect(f"{reverse('inscripciones:gestion_inscripciones')}?estado={estado}")
+        # El archivo temporal se elimina al cerrarlo, cuando termina la respuesta
+        archivo = tempfile.TemporaryFile()
+        exportacion.escribir_xlsx(archivo, columnas, filas, titulo='Historial' if estado == 'historial' else 'Inscripciones')
+        archivo.seek(0)
+        return FileResponse(archivo, as_attachment=True, filename=f'{nombre}.xlsx')
+    
+    respuesta = StreamingHttpResponse(
+        exportacion.csv_por_lineas(columnas, filas),
+        content_type='text/csv; charset=utf-8'
+    )
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}.csv"'
+    return respuesta
+
+
 @login_required
 @user_passes_test(lambda u: u.is_superuser or getattr(u, 'acceso_admin', False))
 def aceptar_inscripcion(request, pk):
     """Vista para que un administrador acepte una inscripción."""
-    inscripcion = get_object_or_404(Inscripcion, pk=pk)
+    inscripcion = get_object_or_404(Inscripcion.objects.select_related('usuario'), pk=pk)
     if request.method == 'POST':
-        inscripcion.estado = 'aceptada'
-        inscripcion.save()
+        # Misma lógica que la aceptación masiva: cupos, auditoría y notificación
+        _, sin_cupo = gestion.decidir_en_bloque(Inscripcion.objects.filter(pk=pk), 'aceptada', request.user)
+        if sin_cupo:
+            messages.error(request, 'No hay cupos disponibles para aceptar esta inscripción.')
+            return redirect('inscripciones:gestion_inscripciones')
         messages.success(request, f'Inscripción de {inscripcion.usuario.get_full_name()} aceptada correctamente.')
     return redirect('inscripciones:gestion_inscripciones')
 
@@ -102,17 +216,62 @@ def aceptar_inscripcion(request, pk):
 @user_passes_test(lambda u: u.is_superuser or getattr(u, 'acceso_admin', False))
 def rechazar_inscripcion(request, pk):
     """Vista para que un administrador rechace una inscripción."""
-    inscripcion = get_object_or_404(Inscripcion, pk=pk)
+    inscripcion = get_object_or_404(Inscripcion.objects.select_related('usuario'), pk=pk)
     if request.method == 'POST':
-        inscripcion.estado = 'rechazada'
-        inscripcion.save()
+        # El cupo que ocupaba pasa a la lista de espera (salvo si la oportunidad ya terminó:
+        # entonces se devuelve a la oportunidad sin reabrirla)
+        gestion.decidir_en_bloque(Inscripcion.objects.filter(pk=pk), 'rechazada', request.user)
         messages.warning(request, f'Inscripción de {inscripcion.usuario.get_full_name()} rechazada.')
     return redirect('inscripciones:gestion_inscripciones')
 
 
+@login_required
+@user_passes_test(lambda u: u.is_superuser or getattr(u, 'acceso_admin', False))
+def decidir_inscripciones(request):
+    """
+    Vista para que un administrador acepte o rechace varias inscripciones a la vez:
+    las seleccionadas en la tabla (`inscripciones`) o todas las pendientes de una
+    oportunidad (`oportunidad`). Se resuelve con un único UPDATE y se vuelve a la
+    pestaña desde la que se decidió.
+    """
+    estado_actual = request.POST.get('estado_actual', 'pendiente')
+    destino = f"{reverse('inscripciones:gestion_inscripciones')}?estado={estado_actual}"
+    if request.method != 'POST':
+        return redirect(destino)
+
+    estado = {'aceptar': 'aceptada', 'rechazar': 'rechazada'}.get(request.POST.get('accion'))
+    oportunidad_id = request.POST.get('oportunidad')
+    seleccionadas = [pk for pk in request.POST.getlist('inscripciones') if pk.isdigit()]
+    if estado is None:
+        messages.error(request, 'Acción no válida.')
+        return redirect(destino)
+
+    if oportunidad_id and oportunidad_id.isdigit():
+        inscripciones = Inscripcion.objects.filter(oportunidad_id=oportunidad_id, estado='pendiente')
+    elif seleccionadas:
+        inscripciones = Inscripcion.objects.filter(pk__in=seleccionadas)
+    else:
+        messages.warning(request, 'No seleccionaste ninguna inscripción.')
+        return redirect(destino)
+
+    cambiadas, sin_cupo = gestion.decidir_en_bloque(inscripciones, estado, request.user)
+    if cambiadas and estado == 'aceptada':
+        messages.success(request, f'{cambiadas} inscripciones aceptadas.')
+    elif cambiadas:
+        messages.warning(request, f'{cambiadas} inscripciones rechazadas.')
+    elif not sin_cupo:
+        messages.info(request, 'Las inscripciones seleccionadas ya estaban en ese estado.')
+    if sin_cupo:
+        messages.error(request, f'{sin_cupo} inscripciones no se aceptaron por falta de cupos.')
+    return redirect(destino)
+
+
 @login_required
 def inscribirse_oportunidad(request, oportunidad_id):
-    """Vista para que un usuario se inscriba a una oportunidad."""
+    """
+    Vista para que un usuario se inscriba a una oportunidad.
+    Si no quedan cupos, el usuario se une a la lista de espera.
+    """
     oportunidad = get_object_or_404(OportunidadVoluntariado, id=oportunidad_id)
     
     # Validaciones previas
@@ -120,55 +279,88 @@ def inscribirse_oportunidad(request, oportunidad_id):
         messages.warning(request, 'Ya estás inscrito en esta oportunidad.')
         return redirect('detalle_oportunidad', pk=oportunidad_id)
     
-    if oportunidad.cupos <= 0:
-        messages.error(request, 'Lo sentimos, no hay cupos disponibles para esta oportunidad.')
-        return redirect('detalle_oportunidad', pk=oportunidad_id)
+    en_espera = ListaEspera.objects.filter(usuario=request.user, oportunidad=oportunidad).first()
+    if en_espera and oportunidad.cupos <= 0:
+        messages.info(request, f'Ya estás en la lista de espera de esta oportunidad (posición {en_espera.posicion_en_cola()}).')
+        return redirect('inscripciones:mis_inscripciones')
     
-    if oportunidad.estado != 'abierta':
+    # Una oportunidad cerrada con cupos la cerró la organización; sin cupos, se llenó
+    if oportunidad.estado != 'abierta' and oportunidad.cupos > 0:
         messages.error(request, 'Esta oportunidad ya no está disponible para inscripciones.')
         return redirect('detalle_oportunidad', pk=oportunidad_id)
     
+    # Verificar que el horario no se superponga con otras inscripciones activas
+    if FranjaHoraria.conflictos_para_usuario(request.user, oportunidad):
+        messages.error(request, 'El horario de esta oportunidad se superpone con otra actividad en la que ya estás inscrito.')
+        return redirect('detalle_oportunidad', pk=oportunidad_id)
+    
     if request.method == 'POST':
         try:
-            if oportunidad.cupos <= 0:
-                messages.error(request, 'Lo sentimos, los cupos para esta oportunidad se han agotado.')
-                return redirect('detalle_oportunidad', pk=oportunidad_id)
+            # Reservar el cupo y crear la inscripción en una sola transacción: si la
+            # inscripción falla, el cupo se devuelve
+            with transaction.atomic():
+                reservado, cerrada = OportunidadVoluntariado.reservar_cupo(oportunidad.id)
+                if not reservado:
+                    # Sin cupos: unirse a la lista de espera
+                    entrada, _ = ListaEspera.objects.get_or_create(usuario=request.user, oportunidad=oportunidad)
+                    messages.info(
+                        request,
+                        f'No quedan cupos: te agregamos a la lista de espera (posición {entrada.posicion_en_cola()}). '
+                        'Si se libera un cupo te inscribiremos automáticamente.'
+                    )
+                    return redirect('inscripciones:mis_inscripciones')
                 
-            # Crear la inscripción
-            Inscripcion.objects.create(
-                usuario=request.user,
-                oportunidad=oportunidad,
-                estado='pendiente'
-            )
-            
-            # Actualizar cupos
-            oportunidad.cupos -= 1
-            if oportunidad.cupos <= 0:
-                oportunidad.estado = 'cerrada'
-            oportunidad.save()
+                # Crear la inscripción
+                Inscripcion.objects.create(
+                    usuario=request.user,
+                    oportunidad=oportunidad,
+                    estado='pendiente'
+                )
+                # Hubo cupos nuevos antes de llegar su turno: deja de esperar
+                if en_espera:
+                    en_espera.delete()
+                
+                # update() no emite señales: al cerrarse la oportunidad deja de ser
+                # destino de intercambios, así que se actualiza el índice de candidatos
+                if cerrada:
+                    candidatos.refrescar_oportunidades([oportunidad.id])
             
             messages.success(request, '¡Te has inscrito correctamente en la oportunidad!')
             return redirect('inscripciones:mis_inscripciones')
             
+        except IntegrityError:
+            # Otra petición simultánea del mismo usuario ya creó la inscripción
+            messages.warning(request, 'Ya estás inscrito en esta oportunidad.')
+            return redirect('detalle_oportunidad', pk=oportunidad_id)
         except Exception as e:
             messages.error(request, f'Ocurrió un error al procesar tu inscripción: {str(e)}')
             return redirect('detalle_oportunidad', pk=oportunidad_id)
             
     return render(request, 'inscripciones/confirmar_inscripcion.html', {
         'oportunidad': oportunidad,
-        'cupos_disponibles': oportunidad.cupos > 0
+        'cupos_disponibles': oportunidad.cupos > 0,
+        'personas_en_espera': oportunidad.lista_espera.count()
     })
 
 
 @login_required
 def eliminar_inscripcion(request, pk):
-    """Vista para que un usuario cancele su propia inscripción."""
+    """
+    Vista para que un usuario cancele su propia inscripción.
+    El cupo liberado pasa al primero de la lista de espera.
+    """
     try:
         inscripcion = Inscripcion.objects.get(pk=pk, usuario=request.user)
         
         if request.method == 'POST':
             titulo_oportunidad = str(inscripcion.oportunidad)
-            inscripcion.delete()
+            with transaction.atomic():
+                # Bloquear la fila: una doble cancelación no debe liberar dos cupos
+                inscripcion = Inscripcion.objects.select_for_update().filter(pk=pk).first()
+                if inscripcion is not None:
+                    if inscripcion.estado in Inscripcion.ESTADOS_CON_CUPO:
+                        gestion.liberar_cupo(inscripcion.oportunidad_id)
+                    inscripcion.delete()
             messages.success(request, f'Has cancelado tu inscripción en: {titulo_oportunidad}')
             return redirect('inscripciones:mis_inscripciones')
             
@@ -178,4 +370,16 @@ def eliminar_inscripcion(request, pk):
         
     except Inscripcion.DoesNotExist:
         messages.error(request, 'La inscripción que intentas cancelar no existe o no tienes permiso para hacerlo.')
-        return redirect('inscripciones:mis_inscripciones')
\ No newline at end of file
+        return redirect('inscripciones:mis_inscripciones')
+
+
+@login_required
+def salir_lista_espera(request, pk):
+    """Vista para que un usuario abandone una lista de espera."""
+    if request.method == 'POST':
+        eliminadas, _ = ListaEspera.objects.filter(pk=pk, usuario=request.user).delete()
+        if eliminadas:
+            messages.success(request, 'Saliste de la lista de espera.')
+        else:
+            messages.error(request, 'La entrada de la lista de espera no existe.')
+    return redirect('inscripciones:mis_inscripciones')
@@ -2,16 +2,41 @@
 from django.contrib import admin
 
 # Importa el modelo OportunidadVoluntariado del directorio actual
-from .models import OportunidadVoluntariado
+from .models import OportunidadVoluntariado, FranjaHoraria
+# Formulario base que envía los cupos y el estado mostrados (ver save() del modelo)
+from .forms import OportunidadBaseForm
+
+
+# Franjas horarias generadas a partir del texto de horario (solo lectura)
+class FranjaHorariaInline(admin.TabularInline):
+    model = FranjaHoraria
+    extra = 0
+    can_delete = False
+    readonly_fields = ('dia_semana', 'hora_inicio', 'hora_fin')
+    
+    def has_add_permission(self, request, obj=None):
+        return False
 
 # Registra el modelo en el panel de administración con configuración personalizada
 @admin.register(OportunidadVoluntariado)
 class OportunidadVoluntariadoAdmin(admin.ModelAdmin):
+    # Los cambios de cupos se aplican como diferencia respecto de lo mostrado
+    form = OportunidadBaseForm
+    
     # Campos que se mostrarán en la lista de objetos
-    list_display = ('titulo', 'organizacion', 'fecha_inicio', 'fecha_fin', 'estado', 'cupos')
+    list_display = (
+        'titulo', 'organizacion', 'fecha_inicio', 'fecha_fin', 'estado', 'cupos',
+        'pendientes', 'aceptadas', 'capacidad_total'
+    )
+    
+    # Contadores de inscripciones (se mantienen solos; ver reconciliar_contadores)
+    readonly_fields = ('pendientes', 'aceptadas', 'capacidad_total')
     
     # Filtros que aparecerán en la barra lateral
     list_filter = ('estado', 'organizacion')
     
     # Campos por los que se podrá buscar
     search_fields = ('titulo', 'descripcion', 'ubicacion')
+    
+    # Franjas horarias interpretadas del campo horario
+    inlines = [FranjaHorariaInline]
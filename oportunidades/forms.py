@@ -48,7 +48,44 @@ def validar_texto_con_sentido(texto, nombre_campo, min_palabras=2, min_caractere
     
     return texto
 
-class OportunidadVoluntariadoForm(forms.ModelForm):
+class OportunidadBaseForm(forms.ModelForm):
+    """
+    Base de los formularios de oportunidades (vista de edición y admin).
+
+    Los cupos y el estado cambian por reservas concurrentes mientras el formulario está
+    abierto. Cada uno se envía también con el valor que se mostró (show_hidden_initial)
+    y ese valor pasa a ser el "guardado" de la instancia: save() solo escribe el estado
+    si el usuario lo cambió y aplica a los cupos la diferencia respecto de lo mostrado.
+    """
+    CAMPOS_CONCURRENTES = {'cupos': '_cupos_guardados', 'estado': '_estado_guardado'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for nombre in self.CAMPOS_CONCURRENTES:
+            if nombre in self.fields:
+                self.fields[nombre].show_hidden_initial = True
+
+    def _post_clean(self):
+        super()._post_clean()
+        if not self.instance.pk:
+            return
+        for nombre, atributo in self.CAMPOS_CONCURRENTES.items():
+            campo = self.fields.get(nombre)
+            if campo is None:
+                continue
+            nombre_inicial = self.add_initial_prefix(nombre)
+            try:
+                mostrado = campo.to_python(
+                    campo.hidden_widget().value_from_datadict(self.data, self.files, nombre_inicial)
+                )
+            except ValidationError:
+                continue
+            # Sin el valor mostrado se conserva el leído de la base de datos
+            if mostrado not in campo.empty_values:
+                setattr(self.instance, atributo, mostrado)
+
+
+class OportunidadVoluntariadoForm(OportunidadBaseForm):
     class Meta:
         model = OportunidadVoluntariado
         fields = [
@@ -0,0 +1,232 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:23
+
+import re
+import unicodedata
+from datetime import time
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copia congelada del intérprete de oportunidades/horarios.py en el momento de esta
+# migración: así los cambios posteriores del módulo no alteran las franjas que genera
+
+# Nombres de los días de la semana, sin tildes; lunes = 0
+DIAS = {
+    'lunes': 0,
+    'martes': 1,
+    'miercoles': 2,
+    'jueves': 3,
+    'viernes': 4,
+    'sabado': 5, 'sabados': 5,
+    'domingo': 6, 'domingos': 6,
+}
+
+# Abreviaturas de los días. Algunas son palabras comunes ("mar", "sab"), por lo
+# que solo se aceptan dentro de una lista o rango de días o delante de una hora
+ABREVIATURAS = {
+    'lun': 0,
+    'mar': 1,
+    'mie': 2, 'mier': 2,
+    'jue': 3,
+    'vie': 4,
+    'sab': 5,
+    'dom': 6,
+}
+
+# Expresiones que equivalen a un conjunto de días
+GRUPOS_DIAS = {
+    'todos los dias': range(7),
+    'diariamente': range(7),
+    'diario': range(7),
+    'fines de semana': (5, 6),
+    'fin de semana': (5, 6),
+    'entre semana': range(5),
+    'dias laborables': range(5),
+    'dias habiles': range(5),
+}
+
+MINUTOS_DIA = 24 * 60
+
+_DIA = '|'.join(sorted(DIAS, key=len, reverse=True))
+_ABREVIATURA = '|'.join(sorted(ABREVIATURAS, key=len, reverse=True))
+_CUALQUIER_DIA = _DIA + '|' + _ABREVIATURA
+_HORA = r'(\d{1,2})(?:[:h.](\d{2}))?\s*(am|pm)?'
+_PATRON = re.compile(
+    r'(?P<grupo>' + '|'.join(GRUPOS_DIAS) + r')'
+    r'|\b(?P<desde>' + _CUALQUIER_DIA + r')\b\.?\s*(?:a|al|-|hasta)\s*\b(?P<hasta>' + _CUALQUIER_DIA + r')\b'
+    r'|\b(?P<dia>' + _DIA + r')\b'
+    # Abreviatura seguida de "-", ",", "a" o "y" y otro día, o de una hora, y no precedida
+    # de un artículo: "Lun, Mar y Mie 9 - 12" pero no "limpieza del mar, sábados 8 - 12"
+    r'|(?<!\bal )(?<!\bel )(?<!\bdel )\b(?P<abreviatura>' + _ABREVIATURA + r')\b\.?'
+    r'(?=\s*(?:(?:[-,]|y\b|a\b)\s*(?:' + _CUALQUIER_DIA + r')\b|:?\s*\d))'
+    r'|(?<![\d:])' + _HORA + r'\s*(?:-|a|hasta)\s*' + _HORA
+)
+
+def _normalizar(texto):
+    """Pasa a minúsculas, quita tildes y unifica las marcas a.m./p.m."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'a\.\s*m\.?', 'am', texto)
+    texto = re.sub(r'p\.\s*m\.?', 'pm', texto)
+    return texto.replace('–', '-').replace('—', '-')
+
+
+def _a_minutos(hora, minutos, sufijo):
+    """Convierte una hora del texto a minutos desde las 00:00 (None si no es válida)."""
+    hora = int(hora)
+    minutos = int(minutos or 0)
+    if minutos > 59:
+        return None
+    if sufijo:
+        if hora < 1 or hora > 12:
+            return None
+        hora = hora % 12 + (12 if sufijo == 'pm' else 0)
+    elif hora > 24:
+        return None
+    total = hora * 60 + minutos
+    return total if total <= MINUTOS_DIA else None
+
+
+def _rango_horas(h1, m1, p1, h2, m2, p2):
+    """
+    Interpreta un rango de horas. Si solo el final indica am/pm, el inicio usa el
+    mismo sufijo salvo que así quede después del final (p. ej. "11 - 2 pm").
+    """
+    fin = _a_minutos(h2, m2, p2)
+    if fin is None:
+        return None
+    if p1 or not p2:
+        inicio = _a_minutos(h1, m1, p1)
+    else:
+        inicio = _a_minutos(h1, m1, p2)
+        if inicio is not None and inicio >= fin:
+            inicio = _a_minutos(h1, m1, 'am')
+    if inicio is None:
+        return None
+    return inicio, fin
+
+
+def _numero_dia(nombre):
+    """Número del día (lunes = 0) a partir de su nombre o abreviatura."""
+    return DIAS[nombre] if nombre in DIAS else ABREVIATURAS[nombre]
+
+
+def _minutos_a_hora(minutos):
+    """Convierte minutos a time; las 24:00 se guardan como 23:59."""
+    minutos = min(minutos, MINUTOS_DIA - 1)
+    return time(minutos // 60, minutos % 60)
+
+
+def interpretar_horario(texto):
+    """
+    Extrae las franjas semanales de un horario escrito en texto libre.
+
+    Los días se acumulan hasta encontrar un rango de horas, que se aplica a todos
+    ellos; un rango sin días previos se aplica al último grupo de días. Ejemplos:
+    "Lunes a Viernes, 9:00 AM - 5:00 PM", "Lunes y Miércoles 14:00-16:00",
+    "Sábados 8 - 13, Domingos 9 - 12", "Lun, Mar y Mie 9 - 12". Las franjas que
+    cruzan la medianoche se dividen en dos. Los días sin un rango de horas y los
+    textos sin días reconocibles no producen franjas: su horario es desconocido.
+
+    Args:
+        texto: Horario en texto libre
+
+    Returns:
+        list: Tuplas (dia_semana, hora_inicio, hora_fin) ordenadas y sin repetir
+    """
+    if not texto:
+        return []
+
+    rangos = []       # (dias, inicio, fin) en minutos
+    pendientes = []   # días leídos que aún no tienen horas
+    ultimo_grupo = []
+    sin_dias = None   # rango de horas escrito antes de cualquier día
+    for coincidencia in _PATRON.finditer(_normalizar(texto)):
+        if coincidencia.group('grupo'):
+            pendientes.extend(GRUPOS_DIAS[coincidencia.group('grupo')])
+        elif coincidencia.group('desde'):
+            desde = _numero_dia(coincidencia.group('desde'))
+            hasta = _numero_dia(coincidencia.group('hasta'))
+            pendientes.extend((desde + i) % 7 for i in range((hasta - desde) % 7 + 1))
+        elif coincidencia.group('dia') or coincidencia.group('abreviatura'):
+            pendientes.append(_numero_dia(coincidencia.group('dia') or coincidencia.group('abreviatura')))
+        else:
+            rango = _rango_horas(*coincidencia.groups()[5:])
+            dias = pendientes or ultimo_grupo
+            if rango is None:
+                continue
+            if not dias:
+                sin_dias = sin_dias or rango
+                continue
+            rangos.append((dias, *rango))
+            ultimo_grupo, pendientes = dias, []
+
+    # Días mencionados al final sin horas: usan el rango escrito antes de ellos
+    # (p. ej. "9 - 12 sábados"). Si no lo hay, las horas son desconocidas y esos
+    # días no producen franjas (p. ej. "Mañanas de lunes a viernes")
+    if pendientes and sin_dias:
+        rangos.append((pendientes, *sin_dias))
+
+    franjas = set()
+    for dias, inicio, fin in rangos:
+        for dia in dias:
+            if fin > inicio:
+                franjas.add((dia, inicio, fin))
+            else:
+                # Cruza la medianoche: hasta el final del día y desde el inicio del siguiente
+                franjas.add((dia, inicio, MINUTOS_DIA))
+                if fin > 0:
+                    franjas.add(((dia + 1) % 7, 0, fin))
+
+    return [
+        (dia, _minutos_a_hora(inicio), _minutos_a_hora(fin))
+        for dia, inicio, fin in sorted(franjas)
+    ]
+
+
+def generar_franjas(apps, schema_editor):
+    """Genera las franjas horarias a partir del texto de horario existente."""
+    OportunidadVoluntariado = apps.get_model('oportunidades', 'OportunidadVoluntariado')
+    FranjaHoraria = apps.get_model('oportunidades', 'FranjaHoraria')
+    
+    lote = []
+    for oportunidad_id, horario in OportunidadVoluntariado.objects.exclude(
+        horario=''
+    ).values_list('id', 'horario').iterator(chunk_size=1000):
+        lote.extend(
+            FranjaHoraria(oportunidad_id=oportunidad_id, dia_semana=dia, hora_inicio=inicio, hora_fin=fin)
+            for dia, inicio, fin in interpretar_horario(horario)
+        )
+        if len(lote) >= 1000:
+            FranjaHoraria.objects.bulk_create(lote)
+            lote = []
+    if lote:
+        FranjaHoraria.objects.bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oportunidades', '0002_alter_oportunidadvoluntariado_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FranjaHoraria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fin', models.TimeField()),
+                ('oportunidad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='franjas', to='oportunidades.oportunidadvoluntariado')),
+            ],
+            options={
+                'verbose_name': 'Franja Horaria',
+                'verbose_name_plural': 'Franjas Horarias',
+                'ordering': ['oportunidad_id', 'dia_semana', 'hora_inicio'],
+                'indexes': [models.Index(fields=['oportunidad', 'dia_semana'], name='franja_oportunidad_dia_idx')],
+            },
+        ),
+        migrations.RunPython(generar_franjas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.23 on 2026-10-17 23:44
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def calcular_contadores(apps, schema_editor):
+    """Calcula los contadores de todas las oportunidades con una sola sentencia UPDATE."""
+    OportunidadVoluntariado = apps.get_model('oportunidades', 'OportunidadVoluntariado')
+    Inscripcion = apps.get_model('inscripciones', 'Inscripcion')
+
+    def conteo(estado):
+        return Coalesce(models.Subquery(
+            Inscripcion.objects.filter(
+                oportunidad_id=models.OuterRef('pk'), estado=estado
+            ).order_by().values('oportunidad_id').annotate(total=models.Count('id')).values('total'),
+            output_field=models.IntegerField()
+        ), 0)
+
+    OportunidadVoluntariado.objects.update(
+        pendientes=conteo('pendiente'),
+        aceptadas=conteo('aceptada'),
+        capacidad_total=models.F('cupos') + conteo('pendiente') + conteo('aceptada')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oportunidades', '0003_franjahoraria'),
+        ('inscripciones', '0005_inscripcion_paginacion_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oportunidadvoluntariado',
+            name='aceptadas',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='oportunidadvoluntariado',
+            name='capacidad_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='oportunidadvoluntariado',
+            name='pendientes',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(calcular_contadores, migrations.RunPython.noop),
+    ]
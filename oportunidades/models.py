@@ -1,7 +1,10 @@
 # Importa el módulo models de Django para definir los modelos
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 # Importa el modelo Organizacion para la relación ForeignKey
 from organizaciones.models import Organizacion
+# Utilidades para interpretar horarios y detectar superposiciones
+from .horarios import interpretar_horario, minutos, Franja, IndiceHorario
 
 class OportunidadVoluntariado(models.Model):
     """Modelo que representa una oportunidad de voluntariado."""
@@ -59,10 +62,210 @@ class OportunidadVoluntariado(models.Model):
         default=''
     )
 
+    # Contadores desnormalizados de inscripciones, mantenidos con incrementos atómicos
+    # (F) en cada cambio de estado de una inscripción: las vistas muestran "N inscritos
+    # / M aceptados" sin contar filas. No se editan en formularios y save() no los
+    # escribe, para no pisar los incrementos hechos por otras transacciones.
+    # El comando reconciliar_contadores los recalcula y reporta las diferencias. Son
+    # enteros con signo: un contador desviado no debe hacer fallar (por la restricción
+    # CHECK) la inscripción que lo ajusta.
+    pendientes = models.IntegerField(default=0, editable=False)
+    aceptadas = models.IntegerField(default=0, editable=False)
+    # Cupos totales: los disponibles más los ocupados por inscripciones pendientes o
+    # aceptadas. Solo cambia cuando se editan los cupos de la oportunidad.
+    capacidad_total = models.IntegerField(default=0, editable=False)
+
+    # Campos que save() nunca escribe (ver arriba)
+    CONTADORES = ('pendientes', 'aceptadas', 'capacidad_total')
+
     def __str__(self):
         """Representación en cadena del objeto (para el admin y shell)."""
         return self.titulo  
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Recuerda el horario, la fecha de fin, los cupos y el estado leídos para detectar cambios al guardar."""
+        instancia = super().from_db(db, field_names, values)
+        instancia._horario_guardado = instancia.__dict__.get('horario')
+        instancia._fecha_fin_guardada = instancia.__dict__.get('fecha_fin')
+        instancia._cupos_guardados = instancia.__dict__.get('cupos')
+        instancia._estado_guardado = instancia.__dict__.get('estado')
+        return instancia
+
+    def save(self, *args, **kwargs):
+        """
+        Guarda la oportunidad y regenera sus franjas horarias si el horario cambió.
+
+        Los contadores de inscripciones no se escriben al actualizar (sus valores en
+        memoria pueden estar desactualizados). Los cupos y el estado tampoco se escriben
+        con el valor en memoria, porque las reservas concurrentes los modifican mientras
+        un formulario está abierto: el estado solo se escribe si cambió, y un cambio de
+        cupos se aplica como diferencia con un incremento atómico, que también ajusta la
+        capacidad total. Los formularios (ver OportunidadBaseForm) fijan como valores
+        guardados los que mostraron, de modo que editar solo el título no modifica cupos.
+
+        Los cupos nuevos son primero de la lista de espera, en orden de llegada (ver
+        inscripciones.gestion.liberar_cupo); solo los que nadie espera quedan libres y,
+        si la oportunidad estaba cerrada por falta de cupos, la reabren.
+        """
+        creando = self._state.adding
+        campos = kwargs.get('update_fields')
+        cupos_guardados = getattr(self, '_cupos_guardados', None)
+        estado_guardado = getattr(self, '_estado_guardado', None)
+        diferencia = 0
+        escribir_estado = False
+        if creando:
+            self.capacidad_total = self.cupos + self.pendientes + self.aceptadas
+        elif campos is None:
+            excluidos = set(self.CONTADORES)
+            if cupos_guardados is not None:
+                diferencia = self.cupos - cupos_guardados
+                excluidos.add('cupos')
+            if estado_guardado is None or estado_guardado != self.estado:
+                escribir_estado = True
+            else:
+                excluidos.add('estado')
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in excluidos
+            ]
+        with transaction.atomic():
+            if not creando and campos is not None and 'cupos' in campos and cupos_guardados is not None:
+                # Cupos escritos explícitamente con su valor absoluto: solo ajustar la capacidad
+                OportunidadVoluntariado.objects.filter(pk=self.pk).update(
+                    capacidad_total=models.F('capacidad_total') + (self.cupos - cupos_guardados)
+                )
+            horario_cambiado = getattr(self, '_horario_guardado', None) != self.horario
+            # Al actualizar, las franjas nuevas se guardan antes de promover la lista de
+            # espera, que comprueba con ellas los conflictos de horario
+            if horario_cambiado and not creando:
+                self.sincronizar_franjas()
+            # Antes de guardar, para que las señales post_save lean los cupos nuevos
+            if diferencia > 0 and not (escribir_estado and self.estado == 'cerrada'):
+                self._ampliar_cupos(diferencia, escribir_estado)
+            elif diferencia:
+                self.cupos = OportunidadVoluntariado.ajustar_cupos(self.pk, diferencia)
+            super().save(*args, **kwargs)
+            if horario_cambiado and creando:
+                self.sincronizar_franjas()
+        self._cupos_guardados = self.cupos
+        self._estado_guardado = self.estado
+
+    def _ampliar_cupos(self, cantidad, escribir_estado):
+        """
+        Suma `cantidad` cupos a la capacidad total y los entrega a la lista de espera
+        (los sobrantes quedan libres). Actualiza en memoria los cupos y, si el usuario
+        no cambió el estado, también el estado con el que quedó la oportunidad.
+        """
+        # Importación diferida: inscripciones depende de este módulo
+        from inscripciones import gestion
+
+        OportunidadVoluntariado.objects.filter(pk=self.pk).update(
+            capacidad_total=models.F('capacidad_total') + cantidad
+        )
+        gestion.liberar_cupo(self.pk, cantidad)
+        cupos, estado = OportunidadVoluntariado.objects.values_list('cupos', 'estado').get(pk=self.pk)
+        self.cupos = cupos
+        if not escribir_estado:
+            self.estado = estado
+
+    @staticmethod
+    def ajustar_cupos(oportunidad_id, diferencia):
+        """
+        Suma `diferencia` a los cupos disponibles y a la capacidad total con un
+        incremento atómico (UPDATE ... SET cupos = cupos + n), sin pisar las reservas
+        hechas por otras transacciones. Si una reducción supera los cupos que siguen
+        libres, estos quedan en cero y la capacidad total se reduce solo en los que había.
+
+        Returns:
+            int: Cupos disponibles tras el ajuste
+        """
+        filas = OportunidadVoluntariado.objects.filter(pk=oportunidad_id)
+        if not filas.filter(cupos__gte=-diferencia).update(
+            cupos=models.F('cupos') + diferencia,
+            capacidad_total=models.F('capacidad_total') + diferencia
+        ):
+            # Las expresiones del UPDATE usan los valores anteriores de la fila
+            filas.update(cupos=0, capacidad_total=models.F('capacidad_total') - models.F('cupos'))
+        return filas.values_list('cupos', flat=True).get()
+
+    @staticmethod
+    def reservar_cupo(oportunidad_id, cantidad=1):
+        """
+        Reserva cupos de la oportunidad con un decremento condicional atómico
+        (UPDATE ... SET cupos = cupos - n WHERE cupos > n), sin leer ni guardar la fila
+        completa: dos reservas simultáneas nunca venden el mismo cupo y no se pisan los
+        cambios que un administrador haga a la vez en otros campos.
+
+        Los últimos cupos se toman con una segunda sentencia que además cierra la
+        oportunidad, de modo que el cierre ocurre en la misma sentencia que agota los
+        cupos. La reserva es de todo o nada: si no quedan `cantidad` cupos no se reserva
+        ninguno. Debe invocarse dentro de la transacción que crea o acepta las
+        inscripciones, para que los cupos se devuelvan si esta falla.
+
+        Args:
+            oportunidad_id: Id de la oportunidad
+            cantidad: Número de cupos a reservar
+
+        Returns:
+            tuple: (reservado, cerrada) - si se obtuvieron los cupos y si con ellos se cerró la oportunidad
+        """
+        abiertas = OportunidadVoluntariado.objects.filter(pk=oportunidad_id, estado='abierta')
+        if abiertas.filter(cupos__gt=cantidad).update(cupos=models.F('cupos') - cantidad):
+            return True, False
+        if abiertas.filter(cupos=cantidad).update(cupos=0, estado='cerrada'):
+            return True, True
+        return False, False
+
+    @staticmethod
+    def devolver_cupo(oportunidad_id, cantidad=1):
+        """
+        Devuelve cupos liberados con un incremento atómico. Si la oportunidad estaba
+        cerrada por falta de cupos y aún no terminó, la misma sentencia que devuelve los
+        cupos la reabre.
+
+        Returns:
+            bool: True si la oportunidad se reabrió
+        """
+        if OportunidadVoluntariado.objects.filter(
+            pk=oportunidad_id, cupos=0, estado='cerrada', fecha_fin__gte=timezone.localdate()
+        ).update(cupos=cantidad, estado='abierta'):
+            return True
+        OportunidadVoluntariado.objects.filter(pk=oportunidad_id).update(cupos=models.F('cupos') + cantidad)
+        return False
+
+    @staticmethod
+    def ajustar_inscritas(cambios):
+        """
+        Suma diferencias a los contadores de inscripciones pendientes y aceptadas con un
+        incremento atómico por oportunidad (UPDATE ... SET pendientes = pendientes + n),
+        sin leer las filas. Las oportunidades se actualizan en orden de clave para que dos
+        transacciones que tocan las mismas no se bloqueen mutuamente. Debe invocarse en
+        la transacción que cambia las inscripciones.
+
+        Args:
+            cambios: Diccionario {oportunidad_id: (diferencia de pendientes, diferencia de aceptadas)}
+        """
+        for oportunidad_id in sorted(cambios):
+            pendientes, aceptadas = cambios[oportunidad_id]
+            if pendientes or aceptadas:
+                OportunidadVoluntariado.objects.filter(pk=oportunidad_id).update(
+                    pendientes=models.F('pendientes') + pendientes,
+                    aceptadas=models.F('aceptadas') + aceptadas
+                )
+
+    def sincronizar_franjas(self):
+        """
+        Reemplaza las franjas horarias de la oportunidad por las que se obtienen
+        al interpretar el texto de `horario`.
+        """
+        self.franjas.all().delete()
+        FranjaHoraria.objects.bulk_create([
+            FranjaHoraria(oportunidad=self, dia_semana=dia, hora_inicio=inicio, hora_fin=fin)
+            for dia, inicio, fin in interpretar_horario(self.horario)
+        ])
+        self._horario_guardado = self.horario
+
     class Meta:
         """Metadatos del modelo."""
         # Nombre singular en el admin
@@ -72,4 +275,117 @@ class OportunidadVoluntariado(models.Model):
         verbose_name_plural = "Oportunidades de Voluntariado"
         
         # Orden por defecto (más recientes primero)
-        ordering = ['-fecha_creacion']
\ No newline at end of file
+        ordering = ['-fecha_creacion']
+
+
+class FranjaHoraria(models.Model):
+    """
+    Franja semanal recurrente en la que se realiza una oportunidad.
+    Se genera a partir del texto de `horario` y permite detectar superposiciones
+    entre oportunidades sin comparar cadenas.
+    """
+    DIAS_SEMANA = [
+        (0, 'Lunes'),
+        (1, 'Martes'),
+        (2, 'Miércoles'),
+        (3, 'Jueves'),
+        (4, 'Viernes'),
+        (5, 'Sábado'),
+        (6, 'Domingo'),
+    ]
+    
+    # Oportunidad a la que pertenece la franja
+    oportunidad = models.ForeignKey(
+        OportunidadVoluntariado,
+        on_delete=models.CASCADE,
+        related_name='franjas'
+    )
+    
+    # Día de la semana (lunes = 0)
+    dia_semana = models.PositiveSmallIntegerField(choices=DIAS_SEMANA)
+    
+    # Hora de inicio y de fin (las 23:59 representan el final del día)
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+
+    def __str__(self):
+        """Representación en cadena de la franja."""
+        return f"{self.get_dia_semana_display()} {self.hora_inicio:%H:%M} - {self.hora_fin:%H:%M}"
+
+    @staticmethod
+    def de_oportunidades(oportunidad_ids):
+        """
+        Obtiene en una consulta las franjas de varias oportunidades.
+        
+        Args:
+            oportunidad_ids: Ids de las oportunidades
+            
+        Returns:
+            dict: Id de oportunidad -> lista de Franja
+        """
+        franjas = {}
+        filas = FranjaHoraria.objects.filter(oportunidad_id__in=oportunidad_ids).values_list(
+            'oportunidad_id', 'dia_semana', 'hora_inicio', 'hora_fin',
+            'oportunidad__fecha_inicio', 'oportunidad__fecha_fin'
+        )
+        for oportunidad_id, dia, inicio, fin, fecha_inicio, fecha_fin in filas:
+            franjas.setdefault(oportunidad_id, []).append(
+                Franja(dia, minutos(inicio), minutos(fin), fecha_inicio, fecha_fin, oportunidad_id)
+            )
+        return franjas
+
+    @staticmethod
+    def indices_de_usuarios(usuario_ids, estados=('aceptada',)):
+        """
+        Construye en una consulta el índice de horarios de varios usuarios, a partir
+        de sus inscripciones vigentes en los estados indicados.
+        
+        Args:
+            usuario_ids: Ids de los usuarios
+            estados: Estados de inscripción que ocupan el horario del usuario
+            
+        Returns:
+            dict: Id de usuario -> IndiceHorario (solo usuarios con alguna franja)
+        """
+        por_usuario = {}
+        filas = FranjaHoraria.objects.filter(
+            oportunidad__inscripciones__usuario_id__in=usuario_ids,
+            oportunidad__inscripciones__estado__in=estados,
+            oportunidad__fecha_fin__gte=timezone.now().date()
+        ).values_list(
+            'oportunidad__inscripciones__usuario_id', 'oportunidad_id', 'dia_semana',
+            'hora_inicio', 'hora_fin', 'oportunidad__fecha_inicio', 'oportunidad__fecha_fin'
+        )
+        for usuario_id, oportunidad_id, dia, inicio, fin, fecha_inicio, fecha_fin in filas:
+            por_usuario.setdefault(usuario_id, []).append(
+                Franja(dia, minutos(inicio), minutos(fin), fecha_inicio, fecha_fin, oportunidad_id)
+            )
+        return {usuario_id: IndiceHorario(franjas) for usuario_id, franjas in por_usuario.items()}
+
+    @staticmethod
+    def conflictos_para_usuario(usuario, oportunidad, estados=('pendiente', 'aceptada')):
+        """
+        Indica con qué inscripciones del usuario se superpone el horario de una oportunidad.
+        
+        Args:
+            usuario: Usuario que desea inscribirse
+            oportunidad: Oportunidad a comprobar
+            estados: Estados de inscripción que ocupan el horario del usuario
+            
+        Returns:
+            bool: True si alguna franja de la oportunidad se superpone
+        """
+        franjas = FranjaHoraria.de_oportunidades([oportunidad.id]).get(oportunidad.id)
+        if not franjas:
+            return False
+        indice = FranjaHoraria.indices_de_usuarios([usuario.id], estados).get(usuario.id)
+        return bool(indice and indice.oportunidades_en_conflicto(franjas, ignorar=oportunidad.id))
+
+    class Meta:
+        """Metadatos del modelo."""
+        verbose_name = "Franja Horaria"
+        verbose_name_plural = "Franjas Horarias"
+        ordering = ['oportunidad_id', 'dia_semana', 'hora_inicio']
+        indexes = [
+            models.Index(fields=['oportunidad', 'dia_semana'], name='franja_oportunidad_dia_idx'),
+        ]
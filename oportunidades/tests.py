@@ -0,0 +1,150 @@
+from datetime import time, timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from organizaciones.models import Organizacion
+from usuarios.models import Usuario
+from .horarios import interpretar_horario
+from .models import OportunidadVoluntariado
+
+
+def franjas(texto):
+    """Franjas como (día, 'HH:MM', 'HH:MM') para comparar con facilidad."""
+    return [
+        (dia, inicio.strftime('%H:%M'), fin.strftime('%H:%M'))
+        for dia, inicio, fin in interpretar_horario(texto)
+    ]
+
+
+class InterpretarHorarioTests(SimpleTestCase):
+    """Interpretación de horarios en texto libre."""
+
+    def test_rango_de_dias_y_horas(self):
+        self.assertEqual(
+            franjas('Lunes a Viernes, 9:00 AM - 5:00 PM'),
+            [(dia, '09:00', '17:00') for dia in range(5)]
+        )
+
+    def test_abreviaturas_en_lista_o_rango(self):
+        self.assertEqual(franjas('Lun, Mar y Mie 9-12'), [(dia, '09:00', '12:00') for dia in range(3)])
+        self.assertEqual(franjas('Mar - Jue 14:00-16:00'), [(dia, '14:00', '16:00') for dia in (1, 2, 3)])
+        self.assertEqual(franjas('mar 9-11'), [(1, '09:00', '11:00')])
+
+    def test_mar_como_sustantivo_no_es_martes(self):
+        self.assertEqual(franjas('Limpieza del mar, sábados 8-12'), [(5, '08:00', '12:00')])
+        self.assertEqual(franjas('Cuidado de mar y playa los sábados 9-12'), [(5, '09:00', '12:00')])
+
+    def test_dias_sin_horas_son_desconocidos(self):
+        self.assertEqual(franjas('Mañanas de lunes a viernes'), [])
+        self.assertEqual(franjas('Todos los días'), [])
+        self.assertEqual(franjas('Lunes 9:00 - 12:00, martes'), [(0, '09:00', '12:00')])
+
+    def test_horas_antes_de_los_dias(self):
+        self.assertEqual(franjas('9 - 12 sábados'), [(5, '09:00', '12:00')])
+
+    def test_cruce_de_medianoche(self):
+        self.assertEqual(
+            interpretar_horario('Viernes 22:00 - 2:00'),
+            [(4, time(22), time(23, 59)), (5, time(0), time(2))]
+        )
+
+
+class EdicionConcurrenteTests(TestCase):
+    """Editar una oportunidad no pisa los cupos ni el estado que cambiaron las reservas."""
+
+    CUPOS = 5
+
+    def setUp(self):
+        self.organizacion = Organizacion.objects.create(
+            nombre='Organización de prueba', descripcion='Pruebas', contacto_email='org@puce.edu.ec'
+        )
+        hoy = timezone.localdate()
+        self.oportunidad = OportunidadVoluntariado.objects.create(
+            titulo='Apoyo escolar',
+            descripcion='Refuerzo de matemáticas para estudiantes de primaria',
+            fecha_inicio=hoy + timedelta(days=1),
+            fecha_fin=hoy + timedelta(days=30),
+            organizacion=self.organizacion,
+            ubicacion='Quito centro',
+            cupos=self.CUPOS,
+            horario='Lunes 9:00 - 12:00',
+            requisitos='Paciencia y puntualidad',
+            beneficios='Certificado de horas de voluntariado'
+        )
+        self.administrador = Usuario.objects.create_superuser('admin@puce.edu.ec', 'clave-de-prueba')
+        self.client.force_login(self.administrador)
+        self.url = reverse('editar_oportunidad', args=[self.oportunidad.pk])
+
+    def datos(self, mostrado, **cambios):
+        """Datos del formulario tal como se mostró (`mostrado`) con los cambios del usuario."""
+        datos = {
+            campo: getattr(mostrado, campo)
+            for campo in ('titulo', 'descripcion', 'ubicacion', 'horario', 'requisitos', 'beneficios', 'cupos', 'estado')
+        }
+        datos.update({
+            'organizacion': mostrado.organizacion_id,
+            'fecha_inicio': mostrado.fecha_inicio.isoformat(),
+            'fecha_fin': mostrado.fecha_fin.isoformat(),
+            'initial-cupos': mostrado.cupos,
+            'initial-estado': mostrado.estado,
+        })
+        datos.update(cambios)
+        return datos
+
+    def enviar(self, **cambios):
+        """Envía el formulario mostrado al inicio de la prueba con los cambios del usuario."""
+        respuesta = self.client.post(self.url, self.datos(self.oportunidad, **cambios))
+        self.assertRedirects(
+            respuesta, reverse('detalle_oportunidad', args=[self.oportunidad.pk]), fetch_redirect_response=False
+        )
+
+    def guardada(self):
+        return OportunidadVoluntariado.objects.values('titulo', 'cupos', 'estado', 'capacidad_total').get(
+            pk=self.oportunidad.pk
+        )
+
+    def test_formulario_envia_los_valores_mostrados(self):
+        respuesta = self.client.get(self.url)
+        self.assertContains(respuesta, 'name="initial-cupos" value="5"')
+        self.assertContains(respuesta, 'name="initial-estado" value="abierta"')
+
+    def test_cambiar_el_titulo_conserva_las_reservas(self):
+        # Se reservan dos cupos mientras el formulario está abierto
+        OportunidadVoluntariado.reservar_cupo(self.oportunidad.pk, 2)
+
+        self.enviar(titulo='Apoyo escolar vespertino')
+        self.assertEqual(self.guardada(), {
+            'titulo': 'Apoyo escolar vespertino', 'cupos': 3, 'estado': 'abierta', 'capacidad_total': 5
+        })
+
+    def test_cambiar_el_titulo_no_reabre_la_oportunidad(self):
+        OportunidadVoluntariado.reservar_cupo(self.oportunidad.pk, self.CUPOS)
+
+        self.enviar(titulo='Apoyo escolar vespertino')
+        self.assertEqual(self.guardada()['cupos'], 0)
+        self.assertEqual(self.guardada()['estado'], 'cerrada')
+
+    def test_aumento_de_cupos_se_suma_a_las_reservas(self):
+        OportunidadVoluntariado.reservar_cupo(self.oportunidad.pk, 2)
+
+        self.enviar(cupos=8)
+        self.assertEqual(self.guardada()['cupos'], 6)
+        self.assertEqual(self.guardada()['capacidad_total'], 8)
+
+    def test_reduccion_mayor_que_los_cupos_libres(self):
+        OportunidadVoluntariado.reservar_cupo(self.oportunidad.pk, 4)
+
+        self.enviar(cupos=2)
+        # Solo quedaba un cupo libre: los cuatro reservados se conservan
+        self.assertEqual(self.guardada()['cupos'], 0)
+        self.assertEqual(self.guardada()['capacidad_total'], 4)
+
+    def test_guardar_desde_codigo_aplica_la_diferencia(self):
+        oportunidad = OportunidadVoluntariado.objects.get(pk=self.oportunidad.pk)
+        OportunidadVoluntariado.reservar_cupo(oportunidad.pk, 2)
+        oportunidad.cupos += 1
+        oportunidad.save()
+        self.assertEqual(oportunidad.cupos, 4)
+        self.assertEqual(self.guardada()['cupos'], 4)
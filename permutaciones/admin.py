@@ -3,7 +3,7 @@ from django.contrib import admin
 from django.contrib.auth.models import User, Group
 
 # Importa los modelos del directorio actual
-from .models import SolicitudPermutacion, HistorialPermutacion
+from .models import SolicitudPermutacion, HistorialPermutacion, HistorialPermutacionArchivo
 
 # Registra el modelo en el panel de administración con configuración personalizada
 @admin.register(SolicitudPermutacion)
@@ -29,9 +29,14 @@ class HistorialPermutacionAdmin(admin.ModelAdmin):
     """
     list_display = ('solicitud', 'get_accion_display', 'fecha', 'usuario')
     list_filter = ('accion', 'fecha')
-    search_fields = ('solicitud__id', 'detalles', 'usuario__username')
+    search_fields = ('solicitud__id', 'datos__motivo', 'detalles', 'usuario__email')
     date_hierarchy = 'fecha'
-    readonly_fields = ('solicitud', 'accion', 'detalles', 'fecha', 'usuario')
+    readonly_fields = ('solicitud', 'accion', 'datos', 'detalles_texto', 'fecha', 'usuario')
+    
+    @admin.display(description='Detalles del Cambio')
+    def detalles_texto(self, obj):
+        # Texto legible generado a partir de los datos estructurados
+        return obj.detalles_texto
     
     def has_add_permission(self, request):
         # No permitir agregar manualmente registros de historial
@@ -50,4 +55,39 @@ class HistorialPermutacionAdmin(admin.ModelAdmin):
         qs = super().get_queryset(request)
         if request.user.is_superuser:
             return qs
-        return qs.none()
\ No newline at end of file
+        return qs.none()
+
+
+@admin.register(HistorialPermutacionArchivo)
+class HistorialPermutacionArchivoAdmin(admin.ModelAdmin):
+    """
+    Consulta bajo demanda del historial archivado.
+    Los registros se generan con el comando archivar_historial y son de solo lectura.
+    """
+    list_display = ('solicitud', 'get_accion_display', 'fecha', 'usuario', 'fecha_archivado')
+    list_filter = ('accion', 'fecha')
+    search_fields = ('solicitud__id', 'datos__motivo', 'usuario__email')
+    date_hierarchy = 'fecha'
+    readonly_fields = ('historial_id', 'solicitud', 'accion', 'datos', 'detalles_texto', 'fecha', 'usuario', 'fecha_archivado')
+    exclude = ('detalles_comprimidos',)
+    
+    @admin.display(description='Detalles del Cambio')
+    def detalles_texto(self, obj):
+        # Texto legible generado a partir de los datos estructurados
+        return obj.detalles_texto
+    
+    def has_add_permission(self, request):
+        return False
+        
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+        
+    def has_change_permission(self, request, obj=None):
+        return False
+        
+    def get_queryset(self, request):
+        # Al igual que el historial activo, solo visible para superusuarios
+        qs = super().get_queryset(request)
+        if request.user.is_superuser:
+            return qs
+        return qs.none()
@@ -7,4 +7,8 @@ class PermutacionesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     
     # Nombre completo de la aplicación (debe coincidir con el nombre del paquete)
-    name = 'permutaciones'
\ No newline at end of file
+    name = 'permutaciones'
+
+    def ready(self):
+        # Registra las señales que mantienen el índice de candidatos de permutación
+        from . import signals  # noqa: F401
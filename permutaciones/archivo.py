@@ -0,0 +1,63 @@
+# Traslado del historial de permutaciones de la tabla activa al archivo
+# Cada lote se procesa en una transacción corta e independiente, de modo que las
+# filas solo permanecen bloqueadas mientras se copian y eliminan.
+from django.db import transaction
+
+from inscripciones import contadores
+from .models import HistorialPermutacion, HistorialPermutacionArchivo
+
+# Número máximo de registros que se trasladan por transacción
+TAMANO_LOTE = 1000
+
+
+def archivar_lote(corte, tamano_lote=TAMANO_LOTE):
+    """
+    Traslada al archivo un lote de registros anteriores a la fecha de corte.
+    
+    Las filas se bloquean con SKIP LOCKED: si otra transacción las está usando se
+    dejan para un lote posterior en lugar de esperar.
+    
+    Args:
+        corte: Fecha límite; se archivan los registros anteriores a ella
+        tamano_lote: Número máximo de registros del lote
+        
+    Returns:
+        int: Número de registros archivados
+    """
+    with transaction.atomic():
+        registros = list(
+            HistorialPermutacion.objects.filter(
+                fecha__lt=corte
+            ).select_for_update(skip_locked=True).order_by('fecha', 'id')[:tamano_lote]
+        )
+        if not registros:
+            return 0
+        
+        HistorialPermutacionArchivo.objects.bulk_create([
+            HistorialPermutacionArchivo.desde_historial(registro)
+            for registro in registros
+        ])
+        HistorialPermutacion.objects.filter(pk__in=[registro.pk for registro in registros]).delete()
+        # El borrado de historial no emite señales que invaliden los contadores de
+        # gestión: se invalidan una vez por lote, al confirmarse
+        contadores.invalidar()
+    return len(registros)
+
+
+def archivar(corte=None, tamano_lote=TAMANO_LOTE):
+    """
+    Traslada al archivo todos los registros anteriores a la fecha de corte, lote a lote.
+    
+    Args:
+        corte: Fecha límite (por defecto, la de HistorialPermutacion.fecha_corte())
+        tamano_lote: Número máximo de registros por transacción
+        
+    Yields:
+        int: Número de registros archivados en cada lote
+    """
+    corte = corte or HistorialPermutacion.fecha_corte()
+    while True:
+        archivados = archivar_lote(corte, tamano_lote)
+        if archivados == 0:
+            return
+        yield archivados
@@ -0,0 +1,162 @@
+# Mantenimiento del índice materializado CandidatoPermutacion
+# Todas las operaciones son de conjunto: un DELETE y un INSERT ... SELECT por llamada,
+# independientemente del número de filas afectadas.
+from threading import local
+
+from django.db import connection, transaction
+
+from inscripciones.models import Inscripcion
+from oportunidades.models import OportunidadVoluntariado
+from .models import CandidatoPermutacion
+
+# Tamaño máximo de las listas de ids que se envían en una sola sentencia
+TAMANO_LOTE = 500
+
+# Usuarios pendientes de refrescar al confirmar la transacción en curso (por hilo)
+_pendientes = local()
+
+
+def _sql_candidatos(condicion):
+    """
+    Construye el SELECT que produce las filas del índice.
+
+    Replica las reglas de SolicitudPermutacion.inscripciones_candidatas:
+    - iu: inscripción aceptada del usuario en la oportunidad de origen
+    - ic: inscripción aceptada de la contraparte en la oportunidad de destino
+    - la oportunidad de destino debe estar abierta y con cupos
+    - el usuario no puede tener inscripción aceptada en el destino
+    - la contraparte no puede tener ninguna inscripción en el origen
+
+    La vigencia (fecha_fin) se filtra al consultar, ya que depende del día actual.
+
+    Args:
+        condicion: Fragmento SQL adicional para la cláusula WHERE
+    """
+    q = connection.ops.quote_name
+    inscripcion = q(Inscripcion._meta.db_table)
+    oportunidad = q(OportunidadVoluntariado._meta.db_table)
+    return f"""
+        SELECT iu.usuario_id, iu.oportunidad_id, ic.oportunidad_id, ic.usuario_id, ic.id
+        FROM {inscripcion} iu
+        INNER JOIN {inscripcion} ic
+            ON ic.oportunidad_id <> iu.oportunidad_id
+            AND ic.usuario_id <> iu.usuario_id
+            AND ic.estado = 'aceptada'
+        INNER JOIN {oportunidad} od
+            ON od.id = ic.oportunidad_id
+            AND od.estado = 'abierta'
+            AND od.cupos > 0
+        WHERE iu.estado = 'aceptada'
+            AND NOT EXISTS (
+                SELECT 1 FROM {inscripcion} x
+                WHERE x.usuario_id = iu.usuario_id
+                    AND x.oportunidad_id = ic.oportunidad_id
+                    AND x.estado = 'aceptada'
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM {inscripcion} y
+                WHERE y.usuario_id = ic.usuario_id
+                    AND y.oportunidad_id = iu.oportunidad_id
+            )
+            AND ({condicion})
+    """
+
+
+def _insertar(condicion, parametros):
+    """Inserta en el índice las filas que cumplen la condición indicada."""
+    q = connection.ops.quote_name
+    tabla = q(CandidatoPermutacion._meta.db_table)
+    columnas = ', '.join(q(c) for c in (
+        'usuario_id', 'oportunidad_origen_id', 'oportunidad_destino_id',
+        'contraparte_id', 'inscripcion_contraparte_id'
+    ))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {tabla} ({columnas}) {_sql_candidatos(condicion)}",
+            parametros
+        )
+        return cursor.rowcount
+
+
+def _lotes(ids):
+    """Divide una colección de ids en listas de tamaño acotado."""
+    ids = sorted(set(ids))
+    for inicio in range(0, len(ids), TAMANO_LOTE):
+        yield ids[inicio:inicio + TAMANO_LOTE]
+
+
+@transaction.atomic
+def refrescar_usuarios(usuario_ids):
+    """
+    Recalcula las filas del índice en las que los usuarios participan, ya sea como
+    solicitante potencial o como contraparte.
+
+    Args:
+        usuario_ids: Ids de los usuarios cuyas inscripciones cambiaron
+    """
+    for lote in _lotes(usuario_ids):
+        marcadores = ', '.join(['%s'] * len(lote))
+        CandidatoPermutacion.objects.filter(usuario_id__in=lote).delete()
+        CandidatoPermutacion.objects.filter(contraparte_id__in=lote).delete()
+        _insertar(
+            f"iu.usuario_id IN ({marcadores}) OR ic.usuario_id IN ({marcadores})",
+            lote + lote
+        )
+
+
+def refrescar_usuarios_al_confirmar(usuario_ids):
+    """
+    Acumula usuarios y los refresca con un único refrescar_usuarios() cuando se
+    confirme la transacción en curso (de inmediato fuera de una transacción). Un
+    borrado en cascada (de un usuario o de una oportunidad) elimina muchas
+    inscripciones en la misma transacción: así se refresca una vez por transacción en
+    lugar de una vez por inscripción.
+
+    Cada llamada programa su propia función on_commit, pero solo la primera en
+    ejecutarse encuentra usuarios pendientes. Si la transacción se revierte, los
+    usuarios que quedaron se refrescan en la siguiente confirmación (refrescar es
+    idempotente).
+
+    Args:
+        usuario_ids: Ids de los usuarios cuyas inscripciones se borraron
+    """
+    pendientes = getattr(_pendientes, 'usuarios', None)
+    if pendientes is None:
+        pendientes = _pendientes.usuarios = set()
+    pendientes.update(usuario_ids)
+    transaction.on_commit(_refrescar_pendientes)
+
+
+def _refrescar_pendientes():
+    """Refresca los usuarios acumulados por refrescar_usuarios_al_confirmar()."""
+    pendientes = getattr(_pendientes, 'usuarios', None)
+    if pendientes:
+        _pendientes.usuarios = set()
+        refrescar_usuarios(pendientes)
+
+
+@transaction.atomic
+def refrescar_oportunidades(oportunidad_ids):
+    """
+    Recalcula las filas del índice cuyo destino es alguna de las oportunidades.
+    El estado y los cupos de la oportunidad solo afectan a su papel como destino.
+
+    Args:
+        oportunidad_ids: Ids de las oportunidades modificadas
+    """
+    for lote in _lotes(oportunidad_ids):
+        marcadores = ', '.join(['%s'] * len(lote))
+        CandidatoPermutacion.objects.filter(oportunidad_destino_id__in=lote).delete()
+        _insertar(f"ic.oportunidad_id IN ({marcadores})", lote)
+
+
+@transaction.atomic
+def reconstruir():
+    """
+    Reconstruye el índice completo con un único INSERT ... SELECT.
+
+    Returns:
+        int: Número de filas insertadas
+    """
+    CandidatoPermutacion.objects.all().delete()
+    return _insertar("1 = 1", [])
@@ -0,0 +1,425 @@
+# Motor de intercambios en ciclo (permutaciones de k participantes)
+# Detecta ciclos disjuntos en el grafo de "deseos" formado por las solicitudes
+# pendientes y los ejecuta de forma atómica.
+from array import array
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from eventos import bandeja
+from inscripciones.models import Inscripcion
+from inscripciones import contadores
+from .models import SolicitudPermutacion, HistorialPermutacion
+from . import candidatos
+
+
+class GrafoDeseos:
+    """
+    Grafo dirigido de "deseos" construido a partir de las solicitudes pendientes.
+
+    Los nodos son oportunidades y cada arista (origen -> destino) agrupa, en orden
+    de llegada, las solicitudes cuyo solicitante tiene un turno aceptado en el origen
+    y desea moverse al destino. Toda la estructura se guarda en arreglos compactos
+    (formato CSR) para soportar decenas de miles de solicitudes en memoria.
+    """
+
+    def __init__(self, filas):
+        """
+        Args:
+            filas: Iterable de tuplas (id_solicitud, id_solicitante, id_origen, id_destino)
+                   ordenadas por antigüedad
+        """
+        # Datos de cada solicitud, indexados por posición
+        self.solicitud_ids = array('q')
+        self.usuarios = array('q')
+        self.origenes = array('l')
+        self.destinos = array('l')
+
+        # Mapeo entre id de oportunidad e índice denso del nodo
+        self.oportunidad_ids = array('q')
+        indice_oportunidad = {}
+
+        def indice(oportunidad_id):
+            if oportunidad_id not in indice_oportunidad:
+                indice_oportunidad[oportunidad_id] = len(self.oportunidad_ids)
+                self.oportunidad_ids.append(oportunidad_id)
+            return indice_oportunidad[oportunidad_id]
+
+        for solicitud_id, usuario_id, origen_id, destino_id in filas:
+            self.solicitud_ids.append(solicitud_id)
+            self.usuarios.append(usuario_id)
+            self.origenes.append(indice(origen_id))
+            self.destinos.append(indice(destino_id))
+
+        total_nodos = len(self.oportunidad_ids)
+        total_solicitudes = len(self.solicitud_ids)
+
+        # Agrupar solicitudes por arista manteniendo el orden de llegada
+        aristas = {}
+        for i in range(total_solicitudes):
+            aristas.setdefault((self.origenes[i], self.destinos[i]), array('l')).append(i)
+
+        # Adyacencia en formato CSR: vecinos[inicio[v]:inicio[v + 1]] son los destinos de v
+        # y arista_solicitudes[k] son las solicitudes de la arista k
+        grados = [0] * total_nodos
+        for origen, _ in aristas:
+            grados[origen] += 1
+        self.inicio = array('l', [0])
+        for grado in grados:
+            self.inicio.append(self.inicio[-1] + grado)
+
+        self.vecinos = array('l', [0] * len(aristas))
+        self.arista_solicitudes = [None] * len(aristas)
+        # Índice directo (origen, destino) -> arista para comprobar cierres de ciclo
+        self.indice_arista = {}
+        posicion = array('l', self.inicio[:-1])
+        for (origen, destino), solicitudes in sorted(aristas.items()):
+            k = posicion[origen]
+            self.vecinos[k] = destino
+            self.arista_solicitudes[k] = solicitudes
+            self.indice_arista[(origen, destino)] = k
+            posicion[origen] += 1
+
+        # Adyacencia inversa (predecesores) para calcular distancias de regreso al inicio
+        grados_entrada = [0] * total_nodos
+        for _, destino in aristas:
+            grados_entrada[destino] += 1
+        self.inicio_inverso = array('l', [0])
+        for grado in grados_entrada:
+            self.inicio_inverso.append(self.inicio_inverso[-1] + grado)
+        self.predecesores = array('l', [0] * len(aristas))
+        posicion = array('l', self.inicio_inverso[:-1])
+        for origen, destino in aristas:
+            self.predecesores[posicion[destino]] = origen
+            posicion[destino] += 1
+
+        # Puntero a la primera solicitud no consumida de cada arista
+        self.cursor = array('l', [0] * len(aristas))
+        # Marca de solicitudes ya asignadas a un ciclo
+        self.consumida = bytearray(total_solicitudes)
+        # Usuarios que ya participan en algún ciclo (los ciclos son disjuntos)
+        self.usuarios_usados = set()
+
+    def _tomar(self, arista, usuarios_en_ciclo):
+        """
+        Devuelve la solicitud más antigua disponible en la arista cuyo solicitante
+        no participe ya en otro ciclo ni en el ciclo en construcción, o None.
+        """
+        solicitudes = self.arista_solicitudes[arista]
+        # Avanzar el cursor sobre las solicitudes ya consumidas
+        while self.cursor[arista] < len(solicitudes) and self.consumida[solicitudes[self.cursor[arista]]]:
+            self.cursor[arista] += 1
+        for k in range(self.cursor[arista], len(solicitudes)):
+            i = solicitudes[k]
+            usuario = self.usuarios[i]
+            if self.consumida[i] or usuario in self.usuarios_usados or usuario in usuarios_en_ciclo:
+                continue
+            return i
+        return None
+
+    def _distancias_al_inicio(self, inicio, longitud_maxima):
+        """
+        Calcula, mediante una búsqueda en anchura sobre las aristas inversas, cuántos
+        saltos necesita cada oportunidad (con índice mayor que `inicio`) para volver a
+        `inicio`. Sirve para podar ramas que no pueden cerrar un ciclo de longitud k.
+        """
+        distancias = {inicio: 0}
+        frontera = [inicio]
+        for distancia in range(1, longitud_maxima):
+            siguiente_frontera = []
+            for nodo in frontera:
+                for k in range(self.inicio_inverso[nodo], self.inicio_inverso[nodo + 1]):
+                    previo = self.predecesores[k]
+                    if previo > inicio and previo not in distancias:
+                        distancias[previo] = distancia
+                        siguiente_frontera.append(previo)
+            frontera = siguiente_frontera
+        return distancias
+
+    def _buscar_desde(self, inicio, longitud_minima, longitud_maxima, distancias, max_pasos):
+        """
+        Búsqueda en profundidad acotada de un ciclo que empiece y termine en `inicio`.
+        Solo visita oportunidades con índice mayor que `inicio`, de modo que cada ciclo
+        se encuentra una única vez (desde su nodo de menor índice). La búsqueda se
+        abandona tras `max_pasos` aristas exploradas para acotar el peor caso.
+
+        Returns:
+            list: Índices de las solicitudes que forman el ciclo, o None
+        """
+        camino_nodos = [inicio]
+        camino_solicitudes = []
+        usuarios_en_ciclo = set()
+        # Pila de iteradores: posición del siguiente vecino a explorar por nivel
+        pila = [self.inicio[inicio]]
+
+        pasos = 0
+        while pila and pasos < max_pasos:
+            pasos += 1
+            nodo = camino_nodos[-1]
+            k = pila[-1]
+            if k >= self.inicio[nodo + 1]:
+                # Vecinos agotados: retroceder
+                pila.pop()
+                camino_nodos.pop()
+                if camino_solicitudes:
+                    usuarios_en_ciclo.discard(self.usuarios[camino_solicitudes.pop()])
+                continue
+            pila[-1] = k + 1
+
+            siguiente = self.vecinos[k]
+            longitud = len(camino_solicitudes) + 1
+
+            if siguiente == inicio:
+                # Cierre del ciclo
+                if longitud >= longitud_minima:
+                    i = self._tomar(k, usuarios_en_ciclo)
+                    if i is not None:
+                        return camino_solicitudes + [i]
+                continue
+
+            if siguiente < inicio or siguiente in camino_nodos:
+                continue
+
+            # Podar si desde `siguiente` no se puede volver al inicio sin exceder k
+            if longitud + distancias.get(siguiente, longitud_maxima) > longitud_maxima:
+                continue
+
+            i = self._tomar(k, usuarios_en_ciclo)
+            if i is None:
+                continue
+
+            if longitud == longitud_maxima - 1:
+                # En el último nivel solo sirve la arista de regreso: consultarla directamente
+                # en lugar de recorrer todos los vecinos de `siguiente`
+                cierre = self.indice_arista.get((siguiente, inicio))
+                if cierre is not None and longitud + 1 >= longitud_minima:
+                    usuarios_en_ciclo.add(self.usuarios[i])
+                    j = self._tomar(cierre, usuarios_en_ciclo)
+                    usuarios_en_ciclo.discard(self.usuarios[i])
+                    if j is not None:
+                        return camino_solicitudes + [i, j]
+                continue
+
+            # Avanzar un nivel
+            camino_nodos.append(siguiente)
+            camino_solicitudes.append(i)
+            usuarios_en_ciclo.add(self.usuarios[i])
+            pila.append(self.inicio[siguiente])
+
+        return None
+
+    def ciclos(self, longitud_minima=3, longitud_maxima=4, max_pasos=200000):
+        """
+        Genera ciclos disjuntos de solicitudes de forma voraz, priorizando las
+        solicitudes más antiguas.
+
+        Args:
+            longitud_minima: Número mínimo de participantes por ciclo
+            longitud_maxima: Número máximo de participantes por ciclo (k)
+            max_pasos: Límite de aristas exploradas en cada búsqueda
+
+        Yields:
+            list: Ids de las solicitudes de cada ciclo, en orden de recorrido
+        """
+        for inicio in range(len(self.oportunidad_ids)):
+            distancias = self._distancias_al_inicio(inicio, longitud_maxima)
+            while True:
+                ciclo = self._buscar_desde(inicio, longitud_minima, longitud_maxima, distancias, max_pasos)
+                if ciclo is None:
+                    break
+                for i in ciclo:
+                    self.consumida[i] = 1
+                    self.usuarios_usados.add(self.usuarios[i])
+                yield [self.solicitud_ids[i] for i in ciclo]
+
+
+def solicitudes_ejecutables():
+    """
+    Devuelve, en orden de antigüedad, las solicitudes pendientes que todavía son
+    ejecutables como tuplas (id, solicitante_id, origen_id, destino_id).
+
+    Una solicitud es ejecutable si el solicitante mantiene su inscripción aceptada en
+    la oportunidad de origen y no está inscrito ya en la oportunidad de destino.
+    """
+    inscrito_en_origen = Inscripcion.objects.filter(
+        usuario=models.OuterRef('solicitante'),
+        oportunidad=models.OuterRef('oportunidad_origen'),
+        estado='aceptada'
+    )
+    inscrito_en_destino = Inscripcion.objects.filter(
+        usuario=models.OuterRef('solicitante'),
+        oportunidad=models.OuterRef('oportunidad_destino')
+    )
+    return SolicitudPermutacion.objects.filter(
+        models.Exists(inscrito_en_origen),
+        estado='pendiente'
+    ).exclude(
+        models.Exists(inscrito_en_destino)
+    ).order_by('fecha_creacion', 'id').values_list(
+        'id', 'solicitante_id', 'oportunidad_origen_id', 'oportunidad_destino_id'
+    )
+
+
+def construir_grafo():
+    """
+    Carga las solicitudes pendientes que todavía son ejecutables en una sola consulta
+    y construye el grafo de deseos.
+    """
+    return GrafoDeseos(solicitudes_ejecutables().iterator(chunk_size=5000))
+
+
+def ejecutar_ciclo(solicitud_ids, usuario_accion=None):
+    """
+    Ejecuta atómicamente un ciclo de intercambios: cada solicitante pasa de su
+    oportunidad de origen a la de destino, y se registra el historial de todos
+    los participantes.
+
+    Args:
+        solicitud_ids: Ids de las solicitudes que forman el ciclo
+        usuario_accion: Usuario que ejecuta el ciclo (None para el sistema)
+
+    Returns:
+        bool: True si el ciclo se ejecutó, False si dejó de ser válido
+    """
+    return ejecutar_ciclos([solicitud_ids], usuario_accion)
+
+
+@transaction.atomic
+def ejecutar_ciclos(ciclos, usuario_accion=None, motivo='ciclo', motivo_conflicto='ciclo_conflicto'):
+    """
+    Ejecuta varios ciclos disjuntos en una sola transacción, con un número constante
+    de consultas: o se aplican todos o ninguno.
+
+    Las condiciones de las consultas se expresan con listas de ids (IN) y los pares
+    usuario/oportunidad se comprueban en memoria, de modo que el tamaño de la sentencia
+    no crece con el número de participantes.
+
+    Args:
+        ciclos: Lista de ciclos; cada uno es la lista de ids de sus solicitudes en orden
+        usuario_accion: Usuario que ejecuta los ciclos (None para el sistema)
+        motivo: Código de motivo del historial de aceptación
+        motivo_conflicto: Código de motivo de las solicitudes rechazadas por conflicto
+
+    Returns:
+        bool: True si se ejecutaron, False si alguno dejó de ser válido
+    """
+    solicitud_ids = [pk for ciclo in ciclos for pk in ciclo]
+
+    # Leer los datos de los ciclos (sin bloqueo) para saber qué inscripciones intervienen
+    solicitudes = list(
+        SolicitudPermutacion.objects.filter(
+            pk__in=solicitud_ids,
+            estado='pendiente'
+        ).order_by('pk')
+    )
+    if len(solicitudes) != len(solicitud_ids):
+        return False
+
+    usuario_ids = {s.solicitante_id for s in solicitudes}
+    oportunidad_ids = {s.oportunidad_origen_id for s in solicitudes} | {s.oportunidad_destino_id for s in solicitudes}
+    origenes = {(s.solicitante_id, s.oportunidad_origen_id) for s in solicitudes}
+    destinos = {(s.solicitante_id, s.oportunidad_destino_id) for s in solicitudes}
+
+    # Mismo orden de bloqueo que SolicitudPermutacion.aceptar: primero las
+    # inscripciones y después las solicitudes, ambas por clave primaria
+    bloqueadas = list(
+        Inscripcion.objects.select_for_update().filter(
+            usuario_id__in=usuario_ids,
+            oportunidad_id__in=oportunidad_ids
+        ).order_by('pk')
+    )
+    inscripciones = {
+        (i.usuario_id, i.oportunidad_id): i
+        for i in bloqueadas
+        if (i.usuario_id, i.oportunidad_id) in origenes and i.estado == 'aceptada'
+    }
+    if len(inscripciones) != len(solicitudes):
+        return False
+
+    # Ningún participante puede estar ya inscrito en su oportunidad de destino
+    if any((i.usuario_id, i.oportunidad_id) in destinos for i in bloqueadas):
+        return False
+
+    versiones = dict(
+        SolicitudPermutacion.objects.select_for_update().filter(
+            pk__in=solicitud_ids,
+            estado='pendiente'
+        ).order_by('pk').values_list('pk', 'version')
+    )
+    if any(versiones.get(s.pk) != s.version for s in solicitudes):
+        return False
+
+    ahora = timezone.now()
+
+    # Reasignar todas las inscripciones en una sola sentencia
+    movidas = []
+    for s in solicitudes:
+        inscripcion = inscripciones[(s.solicitante_id, s.oportunidad_origen_id)]
+        inscripcion.oportunidad_id = s.oportunidad_destino_id
+        movidas.append(inscripcion)
+    Inscripcion.objects.bulk_update(movidas, ['oportunidad'])
+
+    SolicitudPermutacion.objects.filter(pk__in=solicitud_ids).update(
+        estado='aceptada',
+        version=models.F('version') + 1,
+        fecha_actualizacion=ahora
+    )
+
+    # Historial de aceptación para cada participante, con su ciclo completo en orden
+    por_id = {s.pk: s for s in solicitudes}
+    historial = []
+    for ids in ciclos:
+        ciclo = [
+            [por_id[pk].solicitante_id, por_id[pk].oportunidad_origen_id, por_id[pk].oportunidad_destino_id]
+            for pk in ids
+        ]
+        historial.extend(
+            HistorialPermutacion(
+                solicitud=por_id[pk],
+                accion='aceptacion',
+                datos={'motivo': motivo, 'ciclo': ciclo},
+                usuario=usuario_accion
+            )
+            for pk in ids
+        )
+
+    HistorialPermutacion.objects.bulk_create(historial)
+    contadores.invalidar()
+    # Cada participante deja su turno de origen y ocupa el de destino (aceptadas)
+    contadores.ajustar_oportunidades(
+        salidas=[(s.oportunidad_origen_id, 'aceptada') for s in solicitudes],
+        entradas=[(s.oportunidad_destino_id, 'aceptada') for s in solicitudes]
+    )
+    bandeja.registrar_varios([
+        ('permutacion.aceptada', f'permutacion.aceptada:{s.pk}', {'solicitud_id': s.pk})
+        for s in solicitudes
+    ])
+
+    # Rechazar las solicitudes pendientes que dependían de los turnos intercambiados:
+    # las del mismo turno de origen y las que pedían ese turno como destino
+    conflictivas = [
+        pk for pk, solicitante_id, origen_id, receptor_id, destino_id in SolicitudPermutacion.objects.filter(
+            models.Q(solicitante_id__in=usuario_ids) | models.Q(receptor_id__in=usuario_ids),
+            estado='pendiente'
+        ).exclude(pk__in=solicitud_ids).values_list(
+            'pk', 'solicitante_id', 'oportunidad_origen_id', 'receptor_id', 'oportunidad_destino_id'
+        )
+        if (solicitante_id, origen_id) in origenes or (receptor_id, destino_id) in origenes
+    ]
+    # Las demás propuestas de una difusión aceptada se cancelan en lugar de rechazarse
+    grupos = {s.grupo for s in solicitudes if s.grupo}
+    if grupos:
+        SolicitudPermutacion.cancelar_en_bloque(
+            SolicitudPermutacion.objects.filter(pk__in=conflictivas, grupo__in=grupos),
+            'difusion_aceptada',
+            usuario_accion
+        )
+    SolicitudPermutacion.rechazar_en_bloque(
+        SolicitudPermutacion.objects.filter(pk__in=conflictivas),
+        motivo_conflicto,
+        usuario_accion
+    )
+
+    # bulk_update no emite señales: actualizar el índice de candidatos explícitamente
+    candidatos.refrescar_usuarios(list(usuario_ids))
+    return True
@@ -0,0 +1,144 @@
+# Emparejamiento de solicitudes recíprocas ("en espejo")
+# Si un voluntario pide pasar de X a Y y otro, por su cuenta, de Y a X, ambos deseos
+# se satisfacen con un único intercambio sin esperar a que nadie acepte. Es el caso
+# k = 2 de los ciclos de ciclos.py, resuelto con una búsqueda directa por la arista
+# inversa (destino, origen) en lugar de un recorrido del grafo.
+from collections import deque
+
+from django.db import models
+
+from .ciclos import solicitudes_ejecutables, ejecutar_ciclos
+
+# Número de parejas ejecutadas por transacción en el barrido
+TAMANO_LOTE = 200
+
+
+def buscar_pareja(solicitudes):
+    """
+    Busca la solicitud recíproca ejecutable de alguna de las solicitudes dadas (todas
+    del mismo solicitante y turno de origen, como las de una difusión), con una sola
+    consulta sobre el índice parcial (oportunidad_origen, oportunidad_destino).
+
+    Se prefiere la de uno de los receptores (ambos se eligieron mutuamente) y, a
+    igualdad, la más antigua.
+
+    Args:
+        solicitudes: Lista no vacía de SolicitudPermutacion recién creadas
+
+    Returns:
+        list: Pareja [id_recíproca, id_solicitud], o None
+    """
+    primera = solicitudes[0]
+    receptores = {s.receptor_id for s in solicitudes}
+    fila = solicitudes_ejecutables().filter(
+        oportunidad_origen_id__in={s.oportunidad_destino_id for s in solicitudes},
+        oportunidad_destino_id=primera.oportunidad_origen_id
+    ).exclude(
+        solicitante_id=primera.solicitante_id
+    ).order_by(
+        models.Case(models.When(solicitante_id__in=receptores, then=0), default=1),
+        'fecha_creacion', 'id'
+    ).values_list('id', 'solicitante_id', 'oportunidad_origen_id').first()
+    if fila is None:
+        return None
+
+    pareja_id, pareja_usuario, oportunidad_id = fila
+    # Entre las solicitudes hacia esa oportunidad, preferir la dirigida al autor de la recíproca
+    solicitud = min(
+        (s for s in solicitudes if s.oportunidad_destino_id == oportunidad_id),
+        key=lambda s: s.receptor_id != pareja_usuario
+    )
+    return [pareja_id, solicitud.pk]
+
+
+def emparejar(solicitudes, usuario_accion=None):
+    """
+    Ejecuta de inmediato el intercambio si alguna de las solicitudes tiene una
+    recíproca pendiente. Se invoca al crear una solicitud o una difusión.
+
+    Args:
+        solicitudes: Lista no vacía de SolicitudPermutacion del mismo solicitante y origen
+        usuario_accion: Usuario que se registra en el historial
+
+    Returns:
+        bool: True si se realizó el intercambio
+    """
+    pareja = buscar_pareja(solicitudes)
+    if pareja is None:
+        return False
+    return ejecutar_ciclos([pareja], usuario_accion, 'espejo', 'espejo_conflicto')
+
+
+def filas_ejecutables():
+    """
+    Solicitudes ejecutables en orden de antigüedad como tuplas
+    (id, solicitante_id, receptor_id, origen_id, destino_id).
+    """
+    return solicitudes_ejecutables().values_list(
+        'id', 'solicitante_id', 'receptor_id', 'oportunidad_origen_id', 'oportunidad_destino_id'
+    )
+
+
+def parejas(filas):
+    """
+    Empareja en memoria las solicitudes recíprocas con una tabla hash indexada por
+    (origen, destino). Cada solicitud se cruza con la más antigua disponible de la
+    arista inversa; un voluntario participa como mucho en una pareja.
+
+    Al ejecutar una pareja se rechazan las solicitudes que pedían alguno de los dos
+    turnos intercambiados (ver ejecutar_ciclos), por lo que también dejan de estar
+    disponibles aquí y las parejas de un mismo barrido no entran en conflicto.
+
+    Args:
+        filas: Iterable de tuplas (id_solicitud, id_solicitante, id_receptor, id_origen,
+               id_destino) ordenadas por antigüedad
+
+    Returns:
+        list: Parejas [id_anterior, id_posterior] en orden de antigüedad
+    """
+    esperando = {}
+    # Voluntarios ya emparejados y turnos (usuario, oportunidad) que dejan
+    usados = set()
+    turnos_movidos = set()
+
+    def disponible(usuario_id, receptor_id, destino_id):
+        return usuario_id not in usados and (receptor_id, destino_id) not in turnos_movidos
+
+    resultado = []
+    for solicitud_id, usuario_id, receptor_id, origen_id, destino_id in filas:
+        if not disponible(usuario_id, receptor_id, destino_id):
+            continue
+        cola = esperando.get((destino_id, origen_id))
+        while cola and not disponible(*cola[0][1:]):
+            cola.popleft()
+        if cola:
+            pareja_id, pareja_usuario, _, _ = cola.popleft()
+            usados.update((usuario_id, pareja_usuario))
+            turnos_movidos.update(((usuario_id, origen_id), (pareja_usuario, destino_id)))
+            resultado.append([pareja_id, solicitud_id])
+        else:
+            esperando.setdefault((origen_id, destino_id), deque()).append(
+                (solicitud_id, usuario_id, receptor_id, destino_id)
+            )
+    return resultado
+
+
+def barrer(tamano_lote=TAMANO_LOTE, usuario_accion=None):
+    """
+    Busca y ejecuta todas las parejas recíprocas entre las solicitudes pendientes.
+
+    Las parejas se ejecutan por lotes en una sola transacción cada uno; si algún par
+    del lote dejó de ser válido, el lote se reintenta pareja por pareja.
+
+    Yields:
+        tuple: (pareja, ejecutada)
+    """
+    encontradas = parejas(filas_ejecutables().iterator(chunk_size=5000))
+    for inicio in range(0, len(encontradas), tamano_lote):
+        lote = encontradas[inicio:inicio + tamano_lote]
+        if ejecutar_ciclos(lote, usuario_accion, 'espejo', 'espejo_conflicto'):
+            for pareja in lote:
+                yield pareja, True
+            continue
+        for pareja in lote:
+            yield pareja, ejecutar_ciclos([pareja], usuario_accion, 'espejo', 'espejo_conflicto')
@@ -0,0 +1,116 @@
+# Expiración de solicitudes de permutación pendientes
+# Una solicitud pendiente expira cuando supera SOLICITUD_PERMUTACION_DIAS_EXPIRACION
+# días sin respuesta o cuando finaliza (fecha_fin) su oportunidad de origen o de
+# destino. Cada lote se procesa en una transacción corta e independiente.
+from django.db import models, transaction
+from django.utils import timezone
+
+from eventos import bandeja
+from inscripciones import contadores
+from oportunidades.models import OportunidadVoluntariado
+from .models import SolicitudPermutacion, HistorialPermutacion
+
+# Número máximo de solicitudes que se expiran por transacción
+TAMANO_LOTE = 1000
+
+
+def expirar_lote(filtro, motivo, tamano_lote=TAMANO_LOTE):
+    """
+    Expira un lote de solicitudes pendientes que cumplen el filtro, con un número
+    constante de consultas: la lectura de las claves bloqueadas, un bulk_create del
+    historial, otro de los eventos y un único UPDATE.
+
+    Las filas se bloquean con SKIP LOCKED: las que otra transacción está aceptando o
+    rechazando se dejan para un lote posterior en lugar de esperar.
+
+    Args:
+        filtro: Q con la condición de expiración
+        motivo: Código de motivo del historial (ver HistorialPermutacion.MOTIVOS)
+        tamano_lote: Número máximo de solicitudes del lote
+
+    Returns:
+        int: Número de solicitudes expiradas
+    """
+    with transaction.atomic():
+        ids = list(
+            SolicitudPermutacion.objects.filter(
+                filtro, estado='pendiente'
+            ).select_for_update(skip_locked=True).order_by('fecha_creacion', 'id').values_list(
+                'pk', flat=True
+            )[:tamano_lote]
+        )
+        if not ids:
+            return 0
+
+        HistorialPermutacion.objects.bulk_create([
+            HistorialPermutacion(solicitud_id=pk, accion='expiracion', datos={'motivo': motivo})
+            for pk in ids
+        ])
+        contadores.invalidar()
+        bandeja.registrar_varios([
+            ('permutacion.expirada', f'permutacion.expirada:{pk}', {'solicitud_id': pk})
+            for pk in ids
+        ])
+        return SolicitudPermutacion.objects.filter(pk__in=ids, estado='pendiente').update(
+            estado='expirada',
+            version=models.F('version') + 1,
+            fecha_actualizacion=timezone.now()
+        )
+
+
+def _filtro_finalizadas(oportunidades):
+    """Solicitudes cuya oportunidad de origen o de destino está en el conjunto dado."""
+    return (
+        models.Q(oportunidad_origen__in=oportunidades) |
+        models.Q(oportunidad_destino__in=oportunidades)
+    )
+
+
+def expirar(corte=None, hoy=None, tamano_lote=TAMANO_LOTE):
+    """
+    Expira, lote a lote, las solicitudes pendientes creadas antes de la fecha de corte
+    y las de oportunidades ya finalizadas.
+
+    Args:
+        corte: Fecha de creación límite (por defecto, SolicitudPermutacion.fecha_limite_pendiente())
+        hoy: Día actual; finalizan las oportunidades con fecha_fin anterior (por defecto, hoy)
+        tamano_lote: Número máximo de solicitudes por transacción
+
+    Yields:
+        tuple: (motivo, número de solicitudes expiradas en el lote)
+    """
+    corte = corte or SolicitudPermutacion.fecha_limite_pendiente()
+    hoy = hoy or timezone.localdate()
+    finalizadas = OportunidadVoluntariado.objects.filter(fecha_fin__lt=hoy).values('pk')
+
+    for filtro, motivo in (
+        (models.Q(fecha_creacion__lt=corte), 'plazo_vencido'),
+        (_filtro_finalizadas(finalizadas), 'oportunidad_finalizada'),
+    ):
+        while True:
+            expiradas = expirar_lote(filtro, motivo, tamano_lote)
+            if expiradas == 0:
+                break
+            yield motivo, expiradas
+
+
+def expirar_oportunidad(oportunidad_id, tamano_lote=TAMANO_LOTE):
+    """
+    Expira las solicitudes pendientes de una oportunidad si ya finalizó. Lo invoca el
+    evento 'oportunidad.finalizada', programado para el día siguiente a su fecha_fin.
+
+    Returns:
+        int: Número de solicitudes expiradas
+    """
+    if not OportunidadVoluntariado.objects.filter(
+        pk=oportunidad_id, fecha_fin__lt=timezone.localdate()
+    ).exists():
+        # La fecha de fin se movió después de programar el evento
+        return 0
+
+    total = 0
+    while True:
+        expiradas = expirar_lote(_filtro_finalizadas([oportunidad_id]), 'oportunidad_finalizada', tamano_lote)
+        if expiradas == 0:
+            return total
+        total += expiradas
@@ -0,0 +1,64 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from permutaciones.models import HistorialPermutacion
+from permutaciones import archivo
+
+
+class Command(BaseCommand):
+    help = 'Traslada al archivo los registros del historial de permutaciones fuera de la ventana activa'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=None,
+            help='Días que permanecen en la tabla activa (por defecto HISTORIAL_PERMUTACION_DIAS_ACTIVOS)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=archivo.TAMANO_LOTE,
+            help='Número máximo de registros trasladados por transacción',
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=0,
+            help='Segundos de espera entre lotes para no competir con la carga normal',
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Mostrar cuántos registros se archivarían sin modificar nada',
+        )
+
+    def handle(self, *args, **options):
+        if options['dias'] is not None:
+            corte = timezone.now() - timedelta(days=options['dias'])
+        else:
+            corte = HistorialPermutacion.fecha_corte()
+
+        if options['simular']:
+            pendientes = HistorialPermutacion.objects.filter(fecha__lt=corte).count()
+            self.stdout.write(self.style.SUCCESS(
+                f'Se archivarían {pendientes} registros anteriores a {timezone.localtime(corte):%d/%m/%Y %H:%M}'
+            ))
+            return
+
+        total = 0
+        lotes = 0
+        for archivados in archivo.archivar(corte, options['lote']):
+            total += archivados
+            lotes += 1
+            self.stdout.write(f'Lote {lotes}: {archivados} registros archivados')
+            if options['pausa']:
+                time.sleep(options['pausa'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado.\n'
+            f'Lotes procesados: {lotes}\n'
+            f'Registros archivados: {total}'
+        ))
@@ -1,7 +1,149 @@
-from django.core.management.base import BaseCommand
-from permutaciones.models import SolicitudPermutacion, HistorialPermutacion
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Case, OuterRef, Subquery, When
+from permutaciones.models import SolicitudPermutacion, HistorialPermutacion, HistorialPermutacionArchivo
+from inscripciones import contadores
 from django.utils import timezone
 
+# Acción y código de motivo del historial según el estado de la solicitud
+ACCIONES_POR_ESTADO = {
+    'aceptada': ('aceptacion', 'intercambio'),
+    'rechazada': ('rechazo', 'manual'),
+    'cancelada': ('cancelacion', 'solicitante'),
+    'expirada': ('expiracion', 'plazo_vencido'),
+    'pendiente': ('creacion', 'nueva'),
+}
+
+# Número de solicitudes procesadas por lote
+TAMANO_LOTE = 1000
+
+
+def procesar_lote(solicitudes, force_update):
+    """
+    Crea o actualiza el historial de un lote de solicitudes con un número constante
+    de consultas: la lectura de los registros existentes (activos y archivados),
+    un bulk_create, un bulk_update (solo con --force-update) y un UPDATE de fechas.
+    bulk_create y update() no emiten señales: quien recorre los lotes invalida los
+    contadores una sola vez al terminar.
+
+    Args:
+        solicitudes: Lista de SolicitudPermutacion del lote
+        force_update: Si se deben actualizar los registros que ya existen
+
+    Returns:
+        tuple: (creados, actualizados, omitidos)
+    """
+    ids = [solicitud.id for solicitud in solicitudes]
+
+    # Registro más reciente por (solicitud, acción) en la tabla activa
+    existentes = {}
+    for registro in HistorialPermutacion.objects.filter(solicitud_id__in=ids).only(
+        'id', 'solicitud_id', 'accion'
+    ).order_by('solicitud_id', 'accion', '-fecha'):
+        existentes.setdefault((registro.solicitud_id, registro.accion), registro)
+
+    # Los registros archivados también cuentan como existentes (no se modifican)
+    archivados = set(HistorialPermutacionArchivo.objects.filter(
+        solicitud_id__in=ids
+    ).values_list('solicitud_id', 'accion'))
+
+    nuevos = []
+    actualizar = []
+    omitidos = 0
+    for solicitud in solicitudes:
+        accion, motivo = ACCIONES_POR_ESTADO.get(solicitud.estado, ('creacion', 'nueva'))
+        existente = existentes.get((solicitud.id, accion))
+
+        if (solicitud.id, accion) in archivados or (existente and not force_update):
+            omitidos += 1
+        elif existente:
+            existente.datos = {'motivo': motivo}
+            existente.detalles = ''
+            actualizar.append(existente)
+        else:
+            nuevos.append(HistorialPermutacion(
+                solicitud_id=solicitud.id,
+                accion=accion,
+                datos={'motivo': motivo},
+                usuario_id=solicitud.solicitante_id  # Asumimos que el solicitante realizó la acción
+            ))
+
+    with transaction.atomic():
+        if nuevos:
+            HistorialPermutacion.objects.bulk_create(nuevos)
+        if actualizar:
+            HistorialPermutacion.objects.bulk_update(actualizar, ['datos', 'detalles'])
+
+        # auto_now_add reemplaza la fecha al insertar: se copia la fecha de la acción
+        # desde la solicitud con un único UPDATE para todo el lote
+        if nuevos or actualizar:
+            solicitud = SolicitudPermutacion.objects.filter(pk=OuterRef('solicitud_id'))
+            HistorialPermutacion.objects.filter(
+                pk__in=[registro.pk for registro in nuevos + actualizar]
+            ).update(fecha=Case(
+                When(accion='creacion', then=Subquery(solicitud.values('fecha_creacion'))),
+                default=Subquery(solicitud.values('fecha_actualizacion')),
+            ))
+
+    return len(nuevos), len(actualizar), omitidos
+
+
+def procesar_rango(indice, inicio, fin, ultimo_id, tamano_lote, force_update, reportar):
+    """
+    Recorre las solicitudes con id en (ultimo_id, fin] por lotes en orden de id,
+    informando el progreso después de cada lote para poder reanudar.
+
+    Args:
+        indice: Posición del rango en el punto de control
+        inicio, fin: Límites del rango de ids
+        ultimo_id: Último id ya procesado del rango
+        tamano_lote: Número de solicitudes por lote
+        force_update: Si se deben actualizar los registros existentes
+        reportar: Función (indice, ultimo_id, creados, actualizados, omitidos)
+    """
+    while True:
+        lote = list(SolicitudPermutacion.objects.filter(
+            pk__gt=max(ultimo_id, inicio - 1),
+            pk__lte=fin
+        ).only(
+            'id', 'estado', 'solicitante_id'
+        ).order_by('pk')[:tamano_lote])
+        if not lote:
+            return
+        creados, actualizados, omitidos = procesar_lote(lote, force_update)
+        ultimo_id = lote[-1].id
+        reportar(indice, ultimo_id, creados, actualizados, omitidos)
+
+
+# Cola de progreso del proceso trabajador (heredada del principal al hacer fork)
+_cola = None
+
+
+def _iniciar_trabajador(cola):
+    """Inicializador de cada proceso del pool: guarda la cola y abre conexiones propias."""
+    global _cola
+    _cola = cola
+    connections.close_all()
+
+
+def _trabajador(indice, inicio, fin, ultimo_id, tamano_lote, force_update):
+    """Tarea de cada proceso: procesa su rango y envía el progreso de cada lote a la cola."""
+    try:
+        procesar_rango(
+            indice, inicio, fin, ultimo_id, tamano_lote, force_update,
+            lambda *progreso: _cola.put(progreso)
+        )
+    finally:
+        connections.close_all()
+
+
 class Command(BaseCommand):
     help = 'Crea registros de historial para solicitudes de permutación existentes'
 
@@ -11,88 +153,155 @@ class Command(BaseCommand):
             action='store_true',
             help='Forzar la actualización de todos los registros de historial existentes',
         )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=TAMANO_LOTE,
+            help='Número de solicitudes procesadas por lote',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Número de procesos que trabajan en paralelo sobre rangos de ids disjuntos',
+        )
+        parser.add_argument(
+            '--reanudar',
+            action='store_true',
+            help='Continuar desde el último punto de control en lugar de empezar de nuevo',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(tempfile.gettempdir(), 'crear_historial_solicitudes.json'),
+            help='Archivo donde se guarda el último id procesado de cada rango',
+        )
 
     def handle(self, *args, **options):
-        force_update = options.get('force_update', False)
-        # Obtener todas las solicitudes existentes
-        solicitudes = SolicitudPermutacion.objects.all()
-        
-        for solicitud in solicitudes:
-            # Determinar el tipo de acción basado en el estado
-            if solicitud.estado == 'aceptada':
-                accion = 'aceptacion'
-                detalles = (
-                    f"INTERCAMBIO ACEPTADO\n"
-                    f"• Solicitante: {solicitud.solicitante.get_full_name() or solicitud.solicitante.email}\n"
-                    f"• Receptor: {solicitud.receptor.get_full_name() or solicitud.receptor.email}\n"
-                    f"• Oportunidad Origen: {solicitud.oportunidad_origen.titulo}\n"
-                    f"• Oportunidad Destino: {solicitud.oportunidad_destino.titulo}\n"
-                    f"• Fecha: {timezone.localtime(solicitud.fecha_actualizacion).strftime('%d/%m/%Y %H:%M')}\n"
-                    f"• Detalles del Intercambio:\n"
-                    f"  - {solicitud.solicitante.get_short_name()}: {solicitud.oportunidad_origen.titulo} → {solicitud.oportunidad_destino.titulo}\n"
-                    f"  - {solicitud.receptor.get_short_name()}: {solicitud.oportunidad_destino.titulo} → {solicitud.oportunidad_origen.titulo}"
-                )
-            elif solicitud.estado == 'rechazada':
-                accion = 'rechazo'
-                detalles = (
-                    f"INTERCAMBIO RECHAZADO\n"
-                    f"• Solicitante: {solicitud.solicitante.get_full_name() or solicitud.solicitante.email}\n"
-                    f"• Receptor: {solicitud.receptor.get_full_name() or solicitud.receptor.email}\n"
-                    f"• Oportunidad Origen: {solicitud.oportunidad_origen.titulo}\n"
-                    f"• Oportunidad Destino: {solicitud.oportunidad_destino.titulo}\n"
-                    f"• Fecha: {timezone.localtime(solicitud.fecha_actualizacion).strftime('%d/%m/%Y %H:%M')}\n"
-                    f"• Acción realizada por: Sistema (actualización automática)"
-                )
-            elif solicitud.estado == 'cancelada':
-                accion = 'cancelacion'
-                detalles = (
-                    f"INTERCAMBIO CANCELADO\n"
-                    f"• Solicitante: {solicitud.solicitante.get_full_name() or solicitud.solicitante.email}\n"
-                    f"• Receptor: {solicitud.receptor.get_full_name() or solicitud.receptor.email}\n"
-                    f"• Oportunidad Origen: {solicitud.oportunidad_origen.titulo}\n"
-                    f"• Oportunidad Destino: {solicitud.oportunidad_destino.titulo}\n"
-                    f"• Fecha: {timezone.localtime(solicitud.fecha_actualizacion).strftime('%d/%m/%Y %H:%M')}\n"
-                    f"• Razón: Cancelación por el solicitante\n"
-                    f"• Acción realizada por: {solicitud.solicitante.get_full_name() or 'Sistema'}"
-                )
-            else:  # pendiente
-                accion = 'creacion'
-                detalles = (
-                    f"NUEVA SOLICITUD DE INTERCAMBIO\n"
-                    f"• Solicitante: {solicitud.solicitante.get_full_name() or solicitud.solicitante.email}\n"
-                    f"• Receptor: {solicitud.receptor.get_full_name() or solicitud.receptor.email}\n"
-                    f"• Oportunidad Origen: {solicitud.oportunidad_origen.titulo}\n"
-                    f"• Oportunidad Destino: {solicitud.oportunidad_destino.titulo}\n"
-                    f"• Mensaje: {solicitud.mensaje or 'Sin mensaje'}\n"
-                    f"• Fecha: {timezone.localtime(solicitud.fecha_creacion).strftime('%d/%m/%Y %H:%M')}\n"
-                    f"• Estado: Pendiente de revisión"
-                )
-            
-            # Buscar si ya existe un registro de historial para esta acción
-            historial_existente = solicitud.historial.filter(accion=accion).first()
-            
-            if historial_existente and not force_update:
-                self.stdout.write(self.style.SUCCESS(f'El historial para la solicitud {solicitud.id} ya existe (estado: {solicitud.estado})'))
-                continue
-                
-            # Crear o actualizar el registro de historial
-            fecha_accion = timezone.localtime(solicitud.fecha_actualizacion if accion != 'creacion' else solicitud.fecha_creacion)
-            
-            if historial_existente and force_update:
-                # Actualizar el registro existente
-                historial_existente.detalles = detalles
-                historial_existente.fecha = fecha_accion
-                historial_existente.save()
-                self.stdout.write(self.style.SUCCESS(f'Actualizado historial para solicitud {solicitud.id} (estado: {solicitud.estado})'))
+        self.archivo_checkpoint = options['checkpoint']
+        self.totales = [0, 0, 0]
+
+        # Rangos de ids [inicio, fin, ultimo_id]: del punto de control o calculados de nuevo
+        if options['reanudar'] and os.path.exists(self.archivo_checkpoint):
+            with open(self.archivo_checkpoint) as archivo:
+                self.rangos = json.load(archivo)['rangos']
+            self.stdout.write(f'Reanudando desde {self.archivo_checkpoint}')
+        else:
+            self.rangos = self._calcular_rangos(max(1, options['workers']))
+        self._guardar_checkpoint()
+
+        pendientes = [
+            (indice, inicio, fin, ultimo_id)
+            for indice, (inicio, fin, ultimo_id) in enumerate(self.rangos)
+            if ultimo_id < fin
+        ]
+
+        try:
+            if options['workers'] > 1 and len(pendientes) > 1:
+                self._procesar_en_paralelo(pendientes, options)
             else:
-                # Crear un nuevo registro de historial
-                HistorialPermutacion.objects.create(
-                    solicitud=solicitud,
-                    accion=accion,
-                    detalles=detalles,
-                    fecha=fecha_accion,
-                    usuario=solicitud.solicitante  # Asumimos que el solicitante realizó la acción
+                for indice, inicio, fin, ultimo_id in pendientes:
+                    procesar_rango(
+                        indice, inicio, fin, ultimo_id, options['lote'],
+                        options['force_update'], self._reportar
+                    )
+        finally:
+            # Los lotes se escriben sin señales: los contadores del historial se invalidan
+            # una sola vez, en el proceso principal, cuando terminaron todos los rangos
+            # (también si alguno falló, porque los lotes anteriores ya se guardaron)
+            contadores.invalidar()
+
+        # El proceso terminó completo: el punto de control ya no es necesario
+        if os.path.exists(self.archivo_checkpoint):
+            os.remove(self.archivo_checkpoint)
+
+        creados, actualizados, omitidos = self.totales
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso de actualización de historial completado.\n'
+            f'Registros creados: {creados}\n'
+            f'Registros actualizados: {actualizados}\n'
+            f'Solicitudes con historial existente: {omitidos}'
+        ))
+
+    def _calcular_rangos(self, workers):
+        """Divide el intervalo de ids de las solicitudes en rangos disjuntos."""
+        ids = SolicitudPermutacion.objects.order_by('pk').values_list('pk', flat=True)
+        primero = ids.first()
+        if primero is None:
+            return []
+        ultimo = ids.last()
+        tamano = (ultimo - primero) // workers + 1
+        return [
+            [inicio, min(inicio + tamano - 1, ultimo), inicio - 1]
+            for inicio in range(primero, ultimo + 1, tamano)
+        ]
+
+    def _guardar_checkpoint(self):
+        """Escribe el punto de control de forma atómica (archivo temporal y reemplazo)."""
+        temporal = f'{self.archivo_checkpoint}.tmp'
+        with open(temporal, 'w') as archivo:
+            json.dump({'rangos': self.rangos, 'fecha': timezone.now().isoformat()}, archivo)
+        os.replace(temporal, self.archivo_checkpoint)
+
+    def _reportar(self, indice, ultimo_id, creados, actualizados, omitidos):
+        """Registra el avance de un lote y actualiza el punto de control."""
+        self.rangos[indice][2] = ultimo_id
+        self._guardar_checkpoint()
+        self.totales[0] += creados
+        self.totales[1] += actualizados
+        self.totales[2] += omitidos
+        self.stdout.write(
+            f'Rango {indice + 1}: hasta la solicitud {ultimo_id} '
+            f'({creados} creados, {actualizados} actualizados, {omitidos} omitidos)'
+        )
+
+    def _procesar_en_paralelo(self, pendientes, options):
+        """
+        Procesa cada rango pendiente en un ProcessPoolExecutor. Los procesos se crean
+        con fork, por lo que este modo requiere un sistema tipo Unix; el proceso
+        principal es el único que escribe el punto de control. Si un proceso muere,
+        el pool queda roto (BrokenProcessPool) y se informa cómo reanudar.
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('--workers requiere un sistema que admita procesos con fork')
+        contexto = multiprocessing.get_context('fork')
+        cola = contexto.Queue()
+
+        # Cada proceso debe abrir su propia conexión a la base de datos
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=len(pendientes),
+            mp_context=contexto,
+            initializer=_iniciar_trabajador,
+            initargs=(cola,)
+        ) as pool:
+            tareas = [
+                pool.submit(
+                    _trabajador, indice, inicio, fin, ultimo_id, options['lote'], options['force_update']
                 )
-                self.stdout.write(self.style.SUCCESS(f'Creado historial para solicitud {solicitud.id} (estado: {solicitud.estado})'))
-        
-        self.stdout.write(self.style.SUCCESS('Proceso de actualización de historial completado'))
+                for indice, inicio, fin, ultimo_id in pendientes
+            ]
+
+            # Registrar el progreso mientras haya tareas en curso
+            en_curso = set(tareas)
+            while en_curso:
+                self._leer_progreso(cola, espera=0.5)
+                en_curso = wait(en_curso, timeout=0)[1]
+        # Los últimos lotes pueden haber llegado después de terminar su tarea
+        while self._leer_progreso(cola, espera=0.1):
+            pass
+
+        errores = [tarea.exception() for tarea in tareas if tarea.exception() is not None]
+        if errores:
+            raise CommandError(
+                f'Algún proceso terminó con error ({errores[0]!r}); ejecute de nuevo con --reanudar '
+                f'para continuar desde {self.archivo_checkpoint}'
+            )
+
+    def _leer_progreso(self, cola, espera):
+        """Registra un avance de la cola si llega uno antes de `espera` segundos."""
+        try:
+            progreso = cola.get(timeout=espera)
+        except queue.Empty:
+            return False
+        self._reportar(*progreso)
+        return True
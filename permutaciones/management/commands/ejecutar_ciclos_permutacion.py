@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from permutaciones.ciclos import construir_grafo, ejecutar_ciclo
+
+
+class Command(BaseCommand):
+    help = 'Detecta y ejecuta intercambios en ciclo (3 o más voluntarios) a partir de las solicitudes pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--longitud-minima',
+            type=int,
+            default=3,
+            help='Número mínimo de participantes por ciclo (por defecto: 3)',
+        )
+        parser.add_argument(
+            '--longitud-maxima',
+            type=int,
+            default=4,
+            help='Número máximo de participantes por ciclo (por defecto: 4)',
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Mostrar los ciclos encontrados sin ejecutarlos',
+        )
+
+    def handle(self, *args, **options):
+        longitud_minima = options['longitud_minima']
+        longitud_maxima = options['longitud_maxima']
+        if longitud_minima < 2 or longitud_maxima < longitud_minima:
+            raise CommandError('Las longitudes de ciclo deben cumplir 2 <= mínima <= máxima')
+
+        # Construir el grafo de deseos con una sola consulta
+        grafo = construir_grafo()
+        self.stdout.write(
+            f'Solicitudes ejecutables: {len(grafo.solicitud_ids)} '
+            f'en {len(grafo.oportunidad_ids)} oportunidades'
+        )
+
+        encontrados = 0
+        ejecutados = 0
+        for ciclo in grafo.ciclos(longitud_minima, longitud_maxima):
+            encontrados += 1
+            if options['simular']:
+                self.stdout.write(f'Ciclo de {len(ciclo)} participantes: solicitudes {ciclo}')
+                continue
+            if ejecutar_ciclo(ciclo):
+                ejecutados += 1
+                self.stdout.write(self.style.SUCCESS(f'Ejecutado ciclo de {len(ciclo)} participantes: solicitudes {ciclo}'))
+            else:
+                self.stdout.write(self.style.WARNING(f'Ciclo descartado (datos modificados): solicitudes {ciclo}'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado.\n'
+            f'Ciclos encontrados: {encontrados}\n'
+            f'Ciclos ejecutados: {ejecutados}'
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from permutaciones import espejo
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta los intercambios recíprocos pendientes: parejas de solicitudes en las que '
+        'un voluntario pide pasar de X a Y y otro de Y a X'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=espejo.TAMANO_LOTE,
+            help='Número de parejas ejecutadas por transacción',
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Mostrar las parejas encontradas sin ejecutarlas',
+        )
+
+    def handle(self, *args, **options):
+        if options['simular']:
+            encontradas = espejo.parejas(espejo.filas_ejecutables().iterator(chunk_size=5000))
+            for pareja in encontradas:
+                self.stdout.write(f'Pareja recíproca: solicitudes {pareja}')
+            self.stdout.write(self.style.SUCCESS(
+                f'\nSimulación completada.\n'
+                f'Parejas encontradas: {len(encontradas)}'
+            ))
+            return
+
+        encontradas = 0
+        ejecutadas = 0
+        for pareja, ejecutada in espejo.barrer(options['lote']):
+            encontradas += 1
+            if ejecutada:
+                ejecutadas += 1
+            else:
+                self.stdout.write(self.style.WARNING(f'Pareja descartada (datos modificados): solicitudes {pareja}'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado.\n'
+            f'Parejas encontradas: {encontradas}\n'
+            f'Intercambios ejecutados: {ejecutadas}'
+        ))
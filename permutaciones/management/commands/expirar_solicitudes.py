@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from oportunidades.models import OportunidadVoluntariado
+from permutaciones.models import SolicitudPermutacion
+from permutaciones import expiracion
+
+
+class Command(BaseCommand):
+    help = (
+        'Marca como expiradas las solicitudes de permutación pendientes que superaron el plazo '
+        'sin respuesta o cuyas oportunidades ya finalizaron'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=None,
+            help='Días que una solicitud puede seguir pendiente (por defecto SOLICITUD_PERMUTACION_DIAS_EXPIRACION)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=expiracion.TAMANO_LOTE,
+            help='Número máximo de solicitudes expiradas por transacción',
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=0,
+            help='Segundos de espera entre lotes para no competir con la carga normal',
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Mostrar cuántas solicitudes expirarían sin modificar nada',
+        )
+
+    def handle(self, *args, **options):
+        if options['dias'] is not None:
+            corte = timezone.now() - timedelta(days=options['dias'])
+        else:
+            corte = SolicitudPermutacion.fecha_limite_pendiente()
+
+        if options['simular']:
+            finalizadas = OportunidadVoluntariado.objects.filter(
+                fecha_fin__lt=timezone.localdate()
+            ).values('pk')
+            pendientes = SolicitudPermutacion.objects.filter(
+                Q(fecha_creacion__lt=corte) |
+                Q(oportunidad_origen__in=finalizadas) |
+                Q(oportunidad_destino__in=finalizadas),
+                estado='pendiente'
+            ).count()
+            self.stdout.write(self.style.SUCCESS(
+                f'Expirarían {pendientes} solicitudes pendientes '
+                f'(creadas antes de {timezone.localtime(corte):%d/%m/%Y %H:%M} o con oportunidades finalizadas)'
+            ))
+            return
+
+        totales = {}
+        lotes = 0
+        for motivo, expiradas in expiracion.expirar(corte, tamano_lote=options['lote']):
+            totales[motivo] = totales.get(motivo, 0) + expiradas
+            lotes += 1
+            self.stdout.write(f'Lote {lotes}: {expiradas} solicitudes expiradas ({motivo})')
+            if options['pausa']:
+                time.sleep(options['pausa'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado.\n'
+            f'Lotes procesados: {lotes}\n'
+            f'Expiradas por plazo vencido: {totales.get("plazo_vencido", 0)}\n'
+            f'Expiradas por oportunidad finalizada: {totales.get("oportunidad_finalizada", 0)}'
+        ))
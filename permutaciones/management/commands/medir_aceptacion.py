@@ -0,0 +1,109 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from inscripciones.models import Inscripcion
+from oportunidades.models import OportunidadVoluntariado
+from organizaciones.models import Organizacion
+from permutaciones.models import SolicitudPermutacion
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la duración y el número de consultas de SolicitudPermutacion.aceptar() según '
+        'la cantidad de solicitudes conflictivas, con datos sintéticos que se descartan al terminar'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--conflictivas',
+            default='1,10,100,1000',
+            help='Cantidades de solicitudes conflictivas a medir, separadas por comas',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            cantidades = [int(valor) for valor in options['conflictivas'].split(',') if valor.strip()]
+        except ValueError:
+            raise CommandError('--conflictivas debe ser una lista de enteros separados por comas.')
+        if not cantidades or min(cantidades) < 1:
+            raise CommandError('--conflictivas debe contener cantidades positivas.')
+
+        for cantidad in cantidades:
+            # Cada medición ocurre en una transacción que se deshace: la base de datos queda como estaba
+            with transaction.atomic():
+                solicitud, conflictivas = self._crear_datos(cantidad)
+
+                with CaptureQueriesContext(connection) as consultas:
+                    inicio = time.monotonic()
+                    estado, _ = solicitud.aceptar()
+                    duracion = time.monotonic() - inicio
+
+                rechazadas = SolicitudPermutacion.objects.filter(
+                    pk__in=conflictivas, estado='rechazada'
+                ).count()
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f'  {cantidad} conflictivas: {duracion * 1000:.1f} ms, {len(consultas)} consultas, '
+                f'estado {estado}, {rechazadas} rechazadas'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado (los datos sintéticos se descartaron).\n'
+            f'Mediciones: {len(cantidades)}'
+        ))
+
+    def _crear_datos(self, cantidad):
+        """
+        Crea un voluntario que ofrece su turno a `cantidad + 1` contrapartes, cada una
+        en su propia oportunidad: aceptar la primera solicitud rechaza las demás.
+
+        Returns:
+            tuple: (solicitud a aceptar, ids de las solicitudes conflictivas)
+        """
+        Usuario = get_user_model()
+        marca = timezone.now().strftime('%Y%m%d%H%M%S%f')
+        hoy = timezone.localdate()
+        organizacion = Organizacion.objects.create(
+            nombre=f'Medición de aceptación {marca}',
+            descripcion='Datos sintéticos',
+            contacto_email='medicion@puce.edu.ec'
+        )
+        oportunidades = OportunidadVoluntariado.objects.bulk_create([
+            OportunidadVoluntariado(
+                titulo=f'Medición {indice}',
+                descripcion='Datos sintéticos',
+                fecha_inicio=hoy,
+                fecha_fin=hoy + timedelta(days=30),
+                organizacion=organizacion,
+                ubicacion='Quito',
+                cupos=5,
+                capacidad_total=6,
+                aceptadas=1
+            )
+            for indice in range(cantidad + 2)
+        ])
+        usuarios = Usuario.objects.bulk_create([
+            Usuario(email=f'medicion{marca}.{indice}@puce.edu.ec', nombre_completo=f'Medición {indice}', password='!')
+            for indice in range(cantidad + 2)
+        ])
+        Inscripcion.objects.bulk_create([
+            Inscripcion(usuario=usuario, oportunidad=oportunidad, estado='aceptada')
+            for usuario, oportunidad in zip(usuarios, oportunidades)
+        ])
+        solicitudes = SolicitudPermutacion.objects.bulk_create([
+            SolicitudPermutacion(
+                solicitante=usuarios[0],
+                receptor=usuario,
+                oportunidad_origen=oportunidades[0],
+                oportunidad_destino=oportunidad
+            )
+            for usuario, oportunidad in zip(usuarios[1:], oportunidades[1:])
+        ])
+        solicitud = SolicitudPermutacion.objects.get(pk=solicitudes[0].pk)
+        return solicitud, [otra.pk for otra in solicitudes[1:]]
@@ -0,0 +1,99 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from oportunidades.models import OportunidadVoluntariado
+from permutaciones.models import SolicitudPermutacion
+from permutaciones import optimizador
+
+
+class Command(BaseCommand):
+    help = (
+        'Calcula el plan global de intercambios que satisface el mayor número de solicitudes '
+        'pendientes y, con --aplicar, lo ejecuta en una sola transacción'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--aplicar',
+            action='store_true',
+            help='Ejecutar el plan (por defecto solo se muestra la vista previa)',
+        )
+        parser.add_argument(
+            '--plan',
+            default=None,
+            help=(
+                'Archivo JSON del plan: la vista previa lo guarda y --aplicar ejecuta el '
+                'plan guardado en lugar de calcular uno nuevo'
+            ),
+        )
+        parser.add_argument(
+            '--resumen',
+            action='store_true',
+            help='Mostrar solo los totales, sin el detalle de cada ciclo',
+        )
+
+    def handle(self, *args, **options):
+        if options['aplicar'] and options['plan']:
+            ciclos = self._leer_plan(options['plan'])
+        else:
+            ciclos = optimizador.planificar()
+
+        movimientos = sum(len(ciclo) for ciclo in ciclos)
+        if not options['resumen']:
+            self._mostrar(ciclos)
+
+        if not options['aplicar']:
+            if options['plan']:
+                with open(options['plan'], 'w') as archivo:
+                    json.dump({'fecha': timezone.now().isoformat(), 'ciclos': ciclos}, archivo)
+                self.stdout.write(f'Plan guardado en {options["plan"]}')
+            self.stdout.write(self.style.SUCCESS(
+                f'\nVista previa completada.\n'
+                f'Ciclos: {len(ciclos)}\n'
+                f'Voluntarios reasignados: {movimientos}'
+            ))
+            return
+
+        if ciclos and not optimizador.aplicar(ciclos):
+            raise CommandError(
+                'Algunas solicitudes del plan cambiaron desde que se calculó; no se aplicó ningún '
+                'intercambio. Vuelve a generar el plan.'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nProceso completado.\n'
+            f'Ciclos ejecutados: {len(ciclos)}\n'
+            f'Voluntarios reasignados: {movimientos}'
+        ))
+
+    def _leer_plan(self, ruta):
+        """Carga un plan guardado por la vista previa."""
+        try:
+            with open(ruta) as archivo:
+                return json.load(archivo)['ciclos']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'No se pudo leer el plan {ruta}: {e}')
+
+    def _mostrar(self, ciclos):
+        """Muestra cada ciclo con los nombres de los voluntarios y las oportunidades (3 consultas)."""
+        solicitudes = SolicitudPermutacion.objects.in_bulk([pk for ciclo in ciclos for pk in ciclo])
+        usuarios = get_user_model().objects.in_bulk({s.solicitante_id for s in solicitudes.values()})
+        titulos = dict(OportunidadVoluntariado.objects.filter(
+            pk__in={s.oportunidad_origen_id for s in solicitudes.values()}
+        ).values_list('id', 'titulo'))
+
+        for numero, ciclo in enumerate(ciclos, 1):
+            self.stdout.write(f'Ciclo {numero} ({len(ciclo)} participantes):')
+            for pk in ciclo:
+                solicitud = solicitudes.get(pk)
+                if solicitud is None:
+                    self.stdout.write(f'  - Solicitud {pk}: ya no existe')
+                    continue
+                usuario = usuarios[solicitud.solicitante_id]
+                self.stdout.write(
+                    f'  - {usuario.get_full_name() or usuario.email}: '
+                    f'{titulos[solicitud.oportunidad_origen_id]} → {titulos[solicitud.oportunidad_destino_id]} '
+                    f'(solicitud {pk})'
+                )
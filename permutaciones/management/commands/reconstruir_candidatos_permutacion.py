@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from inscripciones.models import Inscripcion
+from permutaciones.models import SolicitudPermutacion, CandidatoPermutacion
+from permutaciones import candidatos
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de candidatos de permutación y opcionalmente lo verifica contra el cálculo en vivo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Comparar el índice con el cálculo en vivo para cada inscripción aceptada',
+        )
+        parser.add_argument(
+            '--solo-verificar',
+            action='store_true',
+            help='Verificar el índice existente sin reconstruirlo',
+        )
+
+    def handle(self, *args, **options):
+        if not options['solo_verificar']:
+            # Reconstrucción completa con una sola sentencia INSERT ... SELECT
+            filas = candidatos.reconstruir()
+            self.stdout.write(self.style.SUCCESS(f'Índice reconstruido: {filas} candidatos'))
+
+        if not (options['verificar'] or options['solo_verificar']):
+            return
+
+        # Comparar índice y cálculo en vivo para cada inscripción aceptada
+        inscripciones = Inscripcion.objects.filter(
+            estado='aceptada'
+        ).select_related('usuario', 'oportunidad').iterator(chunk_size=1000)
+
+        revisadas = 0
+        diferencias = 0
+        for inscripcion in inscripciones:
+            revisadas += 1
+            en_vivo = self._pares(SolicitudPermutacion.calcular_permutaciones_posibles(
+                inscripcion.usuario, inscripcion.oportunidad
+            ))
+            indexado = self._pares(CandidatoPermutacion.oportunidades_para(
+                inscripcion.usuario, inscripcion.oportunidad
+            ))
+            if en_vivo != indexado:
+                diferencias += 1
+                self.stdout.write(self.style.WARNING(
+                    f'Diferencia en inscripción {inscripcion.id}: '
+                    f'{len(en_vivo - indexado)} faltantes, {len(indexado - en_vivo)} sobrantes'
+                ))
+
+        estilo = self.style.SUCCESS if diferencias == 0 else self.style.ERROR
+        self.stdout.write(estilo(
+            f'\nVerificación completada.\n'
+            f'Inscripciones revisadas: {revisadas}\n'
+            f'Inscripciones con diferencias: {diferencias}'
+        ))
+
+    @staticmethod
+    def _pares(oportunidades):
+        """Convierte el resultado agrupado en un conjunto de pares (oportunidad, usuario)."""
+        return {
+            (op['oportunidad']['id'], usuario['id'])
+            for op in oportunidades
+            for usuario in op['usuarios_disponibles']
+        }
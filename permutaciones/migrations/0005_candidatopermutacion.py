@@ -0,0 +1,41 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def poblar_indice(apps, schema_editor):
+    """Construye el índice de candidatos a partir de las inscripciones existentes."""
+    from permutaciones import candidatos
+    candidatos.reconstruir()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inscripciones', '0003_alter_inscripcion_oportunidad'),
+        ('oportunidades', '0002_alter_oportunidadvoluntariado_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('permutaciones', '0004_historialpermutacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandidatoPermutacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contraparte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Contraparte')),
+                ('inscripcion_contraparte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inscripciones.inscripcion', verbose_name='Inscripción de la contraparte')),
+                ('oportunidad_destino', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oportunidades.oportunidadvoluntariado', verbose_name='Oportunidad de destino')),
+                ('oportunidad_origen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oportunidades.oportunidadvoluntariado', verbose_name='Oportunidad de origen')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidatos_permutacion', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'candidato de permutación',
+                'verbose_name_plural': 'candidatos de permutación',
+                'indexes': [models.Index(fields=['usuario', 'oportunidad_origen'], name='candidato_usuario_origen_idx'), models.Index(fields=['contraparte'], name='candidato_contraparte_idx'), models.Index(fields=['oportunidad_destino'], name='candidato_destino_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_indice, migrations.RunPython.noop),
+    ]
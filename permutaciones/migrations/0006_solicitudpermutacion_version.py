@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permutaciones', '0005_candidatopermutacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solicitudpermutacion',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Versión'),
+        ),
+    ]
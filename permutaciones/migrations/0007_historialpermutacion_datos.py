@@ -0,0 +1,124 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:13
+
+from django.db import migrations, models
+
+# Tamaño de los lotes de conversión
+TAMANO_LOTE = 1000
+
+# Título del texto original -> código de motivo (cuando el título basta)
+MOTIVO_POR_TITULO = {
+    'NUEVA SOLICITUD DE INTERCAMBIO': 'nueva',
+    'INTERCAMBIO REALIZADO CON ÉXITO': 'intercambio',
+    'INTERCAMBIO ACEPTADO': 'intercambio',
+    'INTERCAMBIO RECHAZADO': 'manual',
+    'INTERCAMBIO CANCELADO': 'solicitante',
+    'Solicitud de intercambio cancelada por el solicitante': 'solicitante',
+}
+
+# Texto de la línea "• Motivo:" -> código de motivo
+MOTIVO_POR_TEXTO = {
+    'El solicitante ya está inscrito en la oportunidad de destino': 'solicitante_en_destino',
+    'El receptor ya está inscrito en la oportunidad de origen': 'receptor_en_origen',
+    'Otra solicitud de intercambio fue aceptada para las mismas oportunidades': 'conflicto',
+    'Un intercambio en ciclo reasignó el turno involucrado': 'ciclo_conflicto',
+    'No se pudo completar el intercambio. Una de las inscripciones necesarias no existe.': 'inscripcion_inexistente',
+}
+
+
+def interpretar(detalles):
+    """
+    Convierte el texto de un registro antiguo en datos estructurados.
+    Devuelve None si el texto no sigue ninguno de los formatos conocidos, en cuyo caso
+    el registro conserva su texto original. Los ciclos se conservan como texto porque
+    los ids de sus participantes no pueden recuperarse de los nombres.
+    """
+    lineas = [linea.strip() for linea in detalles.strip().split('\n')]
+    titulo = lineas[0] if lineas else ''
+    motivo_texto = next(
+        (linea[len('• Motivo:'):].strip() for linea in lineas if linea.startswith('• Motivo:')),
+        None
+    )
+    
+    if titulo in MOTIVO_POR_TITULO:
+        return {'motivo': MOTIVO_POR_TITULO[titulo]}
+    if titulo in ('INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE', 'ERROR EN INTERCAMBIO') and motivo_texto:
+        if motivo_texto in MOTIVO_POR_TEXTO:
+            return {'motivo': MOTIVO_POR_TEXTO[motivo_texto]}
+        if motivo_texto.startswith('Error inesperado:'):
+            return {'motivo': 'inesperado', 'error': motivo_texto[len('Error inesperado:'):].strip()}
+    return None
+
+
+def convertir_textos(apps, schema_editor):
+    """Convierte los textos existentes en datos estructurados por lotes."""
+    HistorialPermutacion = apps.get_model('permutaciones', 'HistorialPermutacion')
+    
+    lote = []
+    registros = HistorialPermutacion.objects.exclude(detalles='').only('id', 'detalles')
+    for registro in registros.iterator(chunk_size=TAMANO_LOTE):
+        datos = interpretar(registro.detalles)
+        if datos is None:
+            continue
+        registro.datos = datos
+        registro.detalles = ''
+        lote.append(registro)
+        if len(lote) >= TAMANO_LOTE:
+            HistorialPermutacion.objects.bulk_update(lote, ['datos', 'detalles'])
+            lote = []
+    if lote:
+        HistorialPermutacion.objects.bulk_update(lote, ['datos', 'detalles'])
+
+
+def restaurar_textos(apps, schema_editor):
+    """
+    Al revertir, conserva al menos el título y el motivo de los registros estructurados
+    (el texto completo se generaba a partir de las relaciones de la solicitud).
+    """
+    HistorialPermutacion = apps.get_model('permutaciones', 'HistorialPermutacion')
+    titulos = {motivo: titulo for titulo, motivo in MOTIVO_POR_TITULO.items()}
+    textos = {motivo: texto for texto, motivo in MOTIVO_POR_TEXTO.items()}
+    
+    lote = []
+    for registro in HistorialPermutacion.objects.filter(detalles='').iterator(chunk_size=TAMANO_LOTE):
+        motivo = registro.datos.get('motivo')
+        if motivo in titulos:
+            registro.detalles = titulos[motivo]
+        elif registro.accion == 'error':
+            texto = textos.get(motivo) or f"Error inesperado: {registro.datos.get('error', '')}"
+            registro.detalles = f"ERROR EN INTERCAMBIO\n• Motivo: {texto}"
+        elif motivo == 'ciclo':
+            registro.detalles = 'INTERCAMBIO EN CICLO REALIZADO CON ÉXITO'
+        else:
+            registro.detalles = f"INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE\n• Motivo: {textos.get(motivo, motivo)}"
+        lote.append(registro)
+        if len(lote) >= TAMANO_LOTE:
+            HistorialPermutacion.objects.bulk_update(lote, ['detalles'])
+            lote = []
+    if lote:
+        HistorialPermutacion.objects.bulk_update(lote, ['detalles'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permutaciones', '0006_solicitudpermutacion_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historialpermutacion',
+            name='datos',
+            field=models.JSONField(blank=True, default=dict, help_text='Contenido estructurado del cambio (códigos de motivo e ids)', verbose_name='Datos del Cambio'),
+        ),
+        migrations.AlterField(
+            model_name='historialpermutacion',
+            name='accion',
+            field=models.CharField(choices=[('creacion', 'Creación de Solicitud'), ('aceptacion', 'Aceptación de Intercambio'), ('rechazo', 'Rechazo de Solicitud'), ('cancelacion', 'Cancelación de Solicitud'), ('error', 'Error en Intercambio')], max_length=20, verbose_name='Tipo de Acción'),
+        ),
+        migrations.AlterField(
+            model_name='historialpermutacion',
+            name='detalles',
+            field=models.TextField(blank=True, default='', help_text='Texto heredado de registros que no pudieron convertirse a datos estructurados', verbose_name='Detalles del Cambio'),
+        ),
+        migrations.RunPython(convertir_textos, restaurar_textos),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import permutaciones.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('permutaciones', '0007_historialpermutacion_datos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistorialPermutacionArchivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('historial_id', models.BigIntegerField(unique=True, verbose_name='ID Original')),
+                ('accion', models.CharField(choices=[('creacion', 'Creación de Solicitud'), ('aceptacion', 'Aceptación de Intercambio'), ('rechazo', 'Rechazo de Solicitud'), ('cancelacion', 'Cancelación de Solicitud'), ('error', 'Error en Intercambio')], max_length=20, verbose_name='Tipo de Acción')),
+                ('datos', models.JSONField(blank=True, default=dict, verbose_name='Datos del Cambio')),
+                ('detalles_comprimidos', models.BinaryField(blank=True, default=b'', verbose_name='Detalles Comprimidos')),
+                ('fecha', models.DateTimeField(verbose_name='Fecha del Cambio')),
+                ('fecha_archivado', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Archivado')),
+            ],
+            options={
+                'verbose_name': 'Historial Archivado de Permutación',
+                'verbose_name_plural': 'Historial Archivado de Permutaciones',
+                'ordering': ['-fecha'],
+            },
+            bases=(permutaciones.models.RegistroHistorialMixin, models.Model),
+        ),
+        migrations.AddIndex(
+            model_name='historialpermutacion',
+            index=models.Index(fields=['fecha'], name='historial_fecha_idx'),
+        ),
+        migrations.AddField(
+            model_name='historialpermutacionarchivo',
+            name='solicitud',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='historial_archivado', to='permutaciones.solicitudpermutacion', verbose_name='Solicitud de Permutación'),
+        ),
+        migrations.AddField(
+            model_name='historialpermutacionarchivo',
+            name='usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Usuario que realizó la acción'),
+        ),
+        migrations.AddIndex(
+            model_name='historialpermutacionarchivo',
+            index=models.Index(fields=['fecha'], name='historial_archivo_fecha_idx'),
+        ),
+    ]
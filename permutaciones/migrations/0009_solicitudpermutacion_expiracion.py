@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permutaciones', '0008_historialpermutacionarchivo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historialpermutacion',
+            name='accion',
+            field=models.CharField(choices=[('creacion', 'Creación de Solicitud'), ('aceptacion', 'Aceptación de Intercambio'), ('rechazo', 'Rechazo de Solicitud'), ('cancelacion', 'Cancelación de Solicitud'), ('error', 'Error en Intercambio'), ('expiracion', 'Expiración de Solicitud')], max_length=20, verbose_name='Tipo de Acción'),
+        ),
+        migrations.AlterField(
+            model_name='historialpermutacionarchivo',
+            name='accion',
+            field=models.CharField(choices=[('creacion', 'Creación de Solicitud'), ('aceptacion', 'Aceptación de Intercambio'), ('rechazo', 'Rechazo de Solicitud'), ('cancelacion', 'Cancelación de Solicitud'), ('error', 'Error en Intercambio'), ('expiracion', 'Expiración de Solicitud')], max_length=20, verbose_name='Tipo de Acción'),
+        ),
+        migrations.AlterField(
+            model_name='solicitudpermutacion',
+            name='estado',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('aceptada', 'Aceptada'), ('rechazada', 'Rechazada'), ('cancelada', 'Cancelada'), ('expirada', 'Expirada')], default='pendiente', max_length=20, verbose_name='Estado'),
+        ),
+        migrations.AddIndex(
+            model_name='solicitudpermutacion',
+            index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['estado', 'fecha_creacion'], name='solicitud_pendiente_fecha_idx'),
+        ),
+    ]
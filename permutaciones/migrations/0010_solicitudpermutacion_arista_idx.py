@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permutaciones', '0009_solicitudpermutacion_expiracion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='solicitudpermutacion',
+            index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['oportunidad_origen', 'oportunidad_destino', 'fecha_creacion'], name='solicitud_pendiente_arista_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permutaciones', '0010_solicitudpermutacion_arista_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solicitudpermutacion',
+            name='grupo',
+            field=models.UUIDField(blank=True, db_index=True, null=True, verbose_name='Grupo de difusión'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-17 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permutaciones', '0011_solicitudpermutacion_grupo'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='historialpermutacion',
+            name='historial_fecha_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='historialpermutacionarchivo',
+            name='historial_archivo_fecha_idx',
+        ),
+        migrations.AddIndex(
+            model_name='historialpermutacion',
+            index=models.Index(fields=['fecha', 'id'], name='historial_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historialpermutacionarchivo',
+            index=models.Index(fields=['fecha', 'historial_id'], name='historial_archivo_fecha_id_idx'),
+        ),
+    ]
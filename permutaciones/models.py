@@ -3,10 +3,25 @@ from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from oportunidades.models import OportunidadVoluntariado
+from oportunidades.models import OportunidadVoluntariado, FranjaHoraria
 from inscripciones.models import Inscripcion
+from inscripciones import contadores
+from eventos import bandeja
 from math import factorial
+from itertools import groupby
 from django.contrib.auth import get_user_model
+from datetime import timedelta
+import uuid
+import zlib
+
+
+class ConflictoConcurrencia(ValidationError):
+    """
+    Se lanza cuando una solicitud fue modificada por otra operación concurrente
+    entre su lectura y su actualización (control optimista de versión).
+    """
+    pass
+
 
 class SolicitudPermutacion(models.Model):
     """
@@ -19,7 +34,8 @@ class SolicitudPermutacion(models.Model):
         ('pendiente', 'Pendiente'),
         ('aceptada', 'Aceptada'),
         ('rechazada', 'Rechazada'),
-        ('cancelada', 'Cancelada')
+        ('cancelada', 'Cancelada'),
+        ('expirada', 'Expirada')  # Superó el tiempo de espera o terminó una de sus oportunidades
     ]
     
     # Relación con el usuario que envía la solicitud
@@ -76,6 +92,22 @@ class SolicitudPermutacion(models.Model):
         auto_now=True, 
         verbose_name='Fecha de actualización'
     )
+    
+    # Versión de la fila para control optimista de concurrencia
+    # Se incrementa en cada cambio de estado
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Versión'
+    )
+    
+    # Identificador común de las propuestas enviadas a la vez (difusión)
+    # Cuando se acepta una, las demás del grupo se cancelan
+    grupo = models.UUIDField(
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name='Grupo de difusión'
+    )
 
     class Meta:
         # Configuración de metadatos del modelo
@@ -91,6 +123,20 @@ class SolicitudPermutacion(models.Model):
                 condition=models.Q(estado='pendiente')
             )
         ]
+        indexes = [
+            # Índice parcial para el barrido de expiración (comando expirar_solicitudes)
+            models.Index(
+                fields=['estado', 'fecha_creacion'],
+                name='solicitud_pendiente_fecha_idx',
+                condition=models.Q(estado='pendiente')
+            ),
+            # Índice parcial por arista para buscar la solicitud recíproca (destino, origen)
+            models.Index(
+                fields=['oportunidad_origen', 'oportunidad_destino', 'fecha_creacion'],
+                name='solicitud_pendiente_arista_idx',
+                condition=models.Q(estado='pendiente')
+            ),
+        ]
 
     def __str__(self):
         """Representación en cadena de la solicitud"""
@@ -103,30 +149,23 @@ class SolicitudPermutacion(models.Model):
         # Verificar si es una creación nueva (no tiene ID aún)
         is_new = self._state.adding
         
-        # Guardar la instancia
-        super().save(*args, **kwargs)
-        
-        # Si es una creación nueva, registrar en el historial
-        if is_new:
-            # Obtener el usuario actual del request si está disponible
-            user = getattr(self, '_usuario_actual', None)
-            
-            detalles = (
-                f"NUEVA SOLICITUD DE INTERCAMBIO\n"
-                f"• Solicitante: {self.solicitante.get_full_name() or self.solicitante.email}\n"
-                f"• Receptor: {self.receptor.get_full_name() or self.receptor.email}\n"
-                f"• Oportunidad Origen: {self.oportunidad_origen.titulo} (ID: {self.oportunidad_origen.id})\n"
-                f"• Oportunidad Destino: {self.oportunidad_destino.titulo} (ID: {self.oportunidad_destino.id})\n"
-                f"• Mensaje: {self.mensaje or 'Sin mensaje'}\n"
-                f"• Fecha: {self.fecha_creacion.strftime('%d/%m/%Y %H:%M')}"
-            )
+        # La solicitud, su historial y el evento se confirman juntos
+        with transaction.atomic():
+            # Guardar la instancia
+            super().save(*args, **kwargs)
             
-            HistorialPermutacion.objects.create(
-                solicitud=self,
-                accion='creacion',
-                detalles=detalles,
-                usuario=user
-            )
+            # Si es una creación nueva, registrar en el historial y en la bandeja de salida
+            if is_new:
+                # Obtener el usuario actual del request si está disponible
+                user = getattr(self, '_usuario_actual', None)
+                
+                HistorialPermutacion.objects.create(
+                    solicitud=self,
+                    accion='creacion',
+                    datos={'motivo': 'nueva'},
+                    usuario=user
+                )
+                bandeja.registrar('permutacion.creada', f'permutacion.creada:{self.pk}', solicitud_id=self.pk)
 
     def clean(self):
         """
@@ -169,12 +208,172 @@ class SolicitudPermutacion(models.Model):
         ).exclude(pk=self.pk).exists():
             raise ValidationError('Ya existe una solicitud idéntica pendiente')
     
+    @staticmethod
+    @transaction.atomic
+    def crear_difusion(solicitante, oportunidad_origen, destinos, mensaje='', usuario_accion=None):
+        """
+        Crea de una vez varias propuestas de intercambio del mismo turno de origen
+        (difusión). Las validaciones de clean() se resuelven para todo el conjunto con
+        tres consultas, y las solicitudes, su historial de creación y sus eventos se
+        insertan con un bulk_create cada uno. Todas comparten el mismo `grupo`: cuando
+        se acepta una, las demás se cancelan.
+        
+        Args:
+            solicitante: Usuario que envía las propuestas
+            oportunidad_origen: Oportunidad cuyo turno se ofrece
+            destinos: Iterable de tuplas (id_receptor, id_oportunidad_destino)
+            mensaje: Mensaje común de las propuestas
+            usuario_accion: Usuario que se registra en el historial
+            
+        Returns:
+            tuple: (solicitudes creadas, lista de ((id_receptor, id_oportunidad), motivo) descartadas)
+            
+        Raises:
+            ValidationError: Si el solicitante no está inscrito en la oportunidad de origen
+        """
+        if not Inscripcion.objects.filter(
+            usuario=solicitante,
+            oportunidad=oportunidad_origen,
+            estado='aceptada'
+        ).exists():
+            raise ValidationError('Debes estar inscrito en la oportunidad de origen')
+        
+        # Eliminar duplicados conservando el orden de llegada
+        destinos = list(dict.fromkeys((int(u), int(o)) for u, o in destinos))
+        receptor_ids = {u for u, _ in destinos}
+        oportunidad_ids = {o for _, o in destinos}
+        
+        # Receptores con inscripción aceptada en su oportunidad de destino
+        inscritos = set(Inscripcion.objects.filter(
+            usuario_id__in=receptor_ids,
+            oportunidad_id__in=oportunidad_ids,
+            estado='aceptada'
+        ).values_list('usuario_id', 'oportunidad_id'))
+        
+        # Propuestas idénticas que ya están pendientes
+        existentes = set(SolicitudPermutacion.objects.filter(
+            solicitante=solicitante,
+            oportunidad_origen=oportunidad_origen,
+            receptor_id__in=receptor_ids,
+            oportunidad_destino_id__in=oportunidad_ids,
+            estado='pendiente'
+        ).values_list('receptor_id', 'oportunidad_destino_id'))
+        
+        validos = []
+        descartados = []
+        for destino in destinos:
+            receptor_id, oportunidad_id = destino
+            if receptor_id == solicitante.pk:
+                descartados.append((destino, 'No puedes enviar una solicitud a ti mismo'))
+            elif oportunidad_id == oportunidad_origen.pk:
+                descartados.append((destino, 'Las oportunidades de origen y destino deben ser diferentes'))
+            elif destino not in inscritos:
+                descartados.append((destino, 'El receptor debe estar inscrito en la oportunidad de destino'))
+            elif destino in existentes:
+                descartados.append((destino, 'Ya existe una solicitud idéntica pendiente'))
+            else:
+                validos.append(destino)
+        
+        if not validos:
+            return [], descartados
+        
+        grupo = uuid.uuid4()
+        solicitudes = SolicitudPermutacion.objects.bulk_create([
+            SolicitudPermutacion(
+                solicitante=solicitante,
+                receptor_id=receptor_id,
+                oportunidad_origen=oportunidad_origen,
+                oportunidad_destino_id=oportunidad_id,
+                mensaje=mensaje,
+                grupo=grupo
+            )
+            for receptor_id, oportunidad_id in validos
+        ])
+        
+        HistorialPermutacion.objects.bulk_create([
+            HistorialPermutacion(
+                solicitud=solicitud,
+                accion='creacion',
+                datos={'motivo': 'nueva'},
+                usuario=usuario_accion
+            )
+            for solicitud in solicitudes
+        ])
+        # bulk_create no emite señales: el contador del historial cambia
+        contadores.invalidar()
+        bandeja.registrar_varios([
+            ('permutacion.creada', f'permutacion.creada:{solicitud.pk}', {'solicitud_id': solicitud.pk})
+            for solicitud in solicitudes
+        ])
+        return solicitudes, descartados
+    
+    @staticmethod
+    def inscripciones_candidatas(usuario, oportunidad_actual):
+        """
+        Construye el conjunto de inscripciones con las que el usuario puede intercambiar
+        su turno en la oportunidad actual, resuelto en una única consulta.
+        
+        Cada fila es una inscripción aceptada de otro voluntario (la contraparte) en una
+        oportunidad vigente, abierta y con cupos. Las condiciones de elegibilidad se
+        expresan como anti-joins (NOT EXISTS) sobre Inscripcion:
+        - el usuario no debe estar ya inscrito (aceptado) en la oportunidad destino
+        - la contraparte no debe estar inscrita en la oportunidad actual
+        
+        Args:
+            usuario: El usuario que desea realizar la permutación
+            oportunidad_actual: La oportunidad actual del usuario
+            
+        Returns:
+            QuerySet: Inscripciones candidatas ordenadas por oportunidad destino
+        """
+        # Oportunidades destino donde el usuario ya tiene una inscripción aceptada
+        usuario_en_destino = Inscripcion.objects.filter(
+            usuario=usuario,
+            oportunidad=models.OuterRef('oportunidad'),
+            estado='aceptada'
+        )
+        
+        # Contrapartes que ya tienen cualquier inscripción en la oportunidad actual
+        contraparte_en_actual = Inscripcion.objects.filter(
+            usuario=models.OuterRef('usuario'),
+            oportunidad=oportunidad_actual
+        )
+        
+        return Inscripcion.objects.filter(
+            estado='aceptada',
+            oportunidad__fecha_fin__gte=timezone.now().date(),  # Oportunidades vigentes
+            oportunidad__estado='abierta',
+            oportunidad__cupos__gt=0  # Con cupos disponibles
+        ).exclude(
+            oportunidad=oportunidad_actual  # Excluir la oportunidad actual
+        ).exclude(
+            usuario=usuario  # Excluir al usuario actual
+        ).exclude(
+            models.Exists(usuario_en_destino)
+        ).exclude(
+            models.Exists(contraparte_en_actual)
+        ).select_related(
+            'usuario',
+            'oportunidad',
+            'oportunidad__organizacion'
+        ).order_by(
+            # Mismo orden que OportunidadVoluntariado.Meta.ordering, agrupando por oportunidad
+            '-oportunidad__fecha_creacion',
+            'oportunidad_id',
+            'fecha_inscripcion',
+            'id'
+        )
+
     @staticmethod
     def calcular_permutaciones_posibles(usuario, oportunidad_actual):
         """
         Calcula las permutaciones posibles para un usuario en una oportunidad específica.
         Devuelve información detallada de los usuarios con los que se puede intercambiar.
         
+        El cálculo usa un número constante de consultas (verificación de la inscripción
+        actual, una consulta con anti-joins y dos para los horarios), independientemente
+        del número de oportunidades abiertas o de inscripciones aceptadas.
+        
         Args:
             usuario: El usuario que desea realizar la permutación
             oportunidad_actual: La oportunidad actual del usuario
@@ -183,101 +382,198 @@ class SolicitudPermutacion(models.Model):
             list: Lista de diccionarios con información detallada de las oportunidades
                   y usuarios disponibles para intercambio
         """
-        # Obtener la inscripción actual del usuario
-        try:
-            inscripcion_actual = Inscripcion.objects.get(
-                usuario=usuario,
-                oportunidad=oportunidad_actual,
-                estado='aceptada'
-            )
-        except Inscripcion.DoesNotExist:
+        # Verificar que el usuario tenga una inscripción aceptada en la oportunidad actual
+        if not Inscripcion.objects.filter(
+            usuario=usuario,
+            oportunidad=oportunidad_actual,
+            estado='aceptada'
+        ).exists():
             return []
 
-        # Obtener todas las oportunidades disponibles para intercambio
-        # que no sean la actual, que estén abiertas y con cupos disponibles
-        oportunidades_disponibles = OportunidadVoluntariado.objects.filter(
-            fecha_fin__gte=timezone.now().date(),  # Oportunidades vigentes
-            estado='abierta',
-            cupos__gt=0  # Con cupos disponibles
-        ).exclude(
-            id=oportunidad_actual.id  # Excluir la oportunidad actual
-        ).select_related('organizacion')
+        candidatas = SolicitudPermutacion.inscripciones_candidatas(usuario, oportunidad_actual)
+
+        return SolicitudPermutacion.agrupar_por_oportunidad(
+            SolicitudPermutacion.descartar_conflictos_horario(
+                usuario,
+                oportunidad_actual,
+                [
+                    (inscripcion.oportunidad, inscripcion.usuario, inscripcion.fecha_inscripcion)
+                    for inscripcion in candidatas
+                ]
+            )
+        )
 
+    @staticmethod
+    def descartar_conflictos_horario(usuario, oportunidad_actual, filas):
+        """
+        Elimina los intercambios que dejarían a alguno de los dos voluntarios con
+        actividades superpuestas, con dos consultas para todas las filas:
+        - el usuario no puede pasar a un destino que choque con sus otras inscripciones
+        - la contraparte no puede pasar a la oportunidad actual si choca con las suyas
+        La oportunidad que cada uno deja no cuenta como conflicto.
+        
+        Args:
+            usuario: El usuario que desea realizar la permutación
+            oportunidad_actual: La oportunidad actual del usuario
+            filas: Lista de tuplas cuyos dos primeros elementos son
+                   (oportunidad destino, contraparte)
+            
+        Returns:
+            list: Las filas sin conflictos de horario, en el mismo orden
+        """
+        if not filas:
+            return filas
+        
+        destino_ids = {fila[0].id for fila in filas}
+        franjas = FranjaHoraria.de_oportunidades(destino_ids | {oportunidad_actual.id})
+        if not franjas:
+            return filas
+        indices = FranjaHoraria.indices_de_usuarios({usuario.id} | {fila[1].id for fila in filas})
+        
+        # Destinos que chocan con el horario del usuario, comprobados en una sola pasada
+        destinos_en_conflicto = set()
+        if usuario.id in indices:
+            destinos_en_conflicto = indices[usuario.id].oportunidades_en_conflicto(
+                (franja for destino_id in destino_ids for franja in franjas.get(destino_id, ())),
+                ignorar=oportunidad_actual.id
+            )
+        
+        franjas_actual = franjas.get(oportunidad_actual.id, [])
+        contrapartes_en_conflicto = {}
+        resultado = []
+        for fila in filas:
+            destino, contraparte = fila[0], fila[1]
+            if destino.id in destinos_en_conflicto:
+                continue
+            clave = (contraparte.id, destino.id)
+            if clave not in contrapartes_en_conflicto:
+                indice = indices.get(contraparte.id)
+                contrapartes_en_conflicto[clave] = bool(
+                    indice and franjas_actual and
+                    indice.oportunidades_en_conflicto(franjas_actual, ignorar=destino.id)
+                )
+            if not contrapartes_en_conflicto[clave]:
+                resultado.append(fila)
+        return resultado
+
+    @staticmethod
+    def agrupar_por_oportunidad(filas):
+        """
+        Agrupa pares (oportunidad destino, contraparte) en la estructura que consumen
+        las plantillas de permutaciones.
+        
+        Args:
+            filas: Iterable de tuplas (oportunidad, usuario, fecha_inscripcion) ordenadas
+                   por oportunidad destino
+            
+        Returns:
+            list: Lista de diccionarios con información detallada de las oportunidades
+                  y usuarios disponibles para intercambio
+        """
         # Lista para almacenar las oportunidades con usuarios disponibles
         oportunidades_con_usuarios = []
 
-        for oportunidad in oportunidades_disponibles:
-            # Buscar usuarios inscritos en esta oportunidad que podrían intercambiar
-            usuarios_disponibles = Inscripcion.objects.filter(
-                oportunidad=oportunidad,
-                estado='aceptada'
-            ).exclude(
-                usuario=usuario  # Excluir al usuario actual
-            ).select_related('usuario')
-
-            # Verificar que el usuario no esté ya en esta oportunidad
-            if Inscripcion.objects.filter(
-                usuario=usuario,
-                oportunidad=oportunidad,
-                estado='aceptada'
-            ).exists():
-                continue  # Saltar esta oportunidad si el usuario ya está inscrito
-
-
-            # Filtrar usuarios que no estén en la oportunidad actual
-            usuarios_filtrados = []
-            for usuario_disp in usuarios_disponibles:
-                # Verificar que el usuario no esté ya en la oportunidad actual
-                if not Inscripcion.objects.filter(
-                    usuario=usuario_disp.usuario,
-                    oportunidad=oportunidad_actual
-                ).exists():
-                    # Acceder a los campos directamente del modelo Usuario
-                    usuarios_filtrados.append({
-                        'id': usuario_disp.usuario.id,
-                        'nombre_completo': usuario_disp.usuario.get_full_name() or usuario_disp.usuario.email,
-                        'email': usuario_disp.usuario.email,
-                        'telefono': usuario_disp.usuario.telefono or 'No disponible',
-                        'foto_perfil': None,  # No hay campo de foto en el modelo actual
-                        'fecha_inscripcion': usuario_disp.fecha_inscripcion
-                    })
-
-            if usuarios_filtrados:
-                # Verificar que la oportunidad tenga organización asociada
-                org_nombre = 'Sin organización'
-                org_logo = None
-                
-                if hasattr(oportunidad, 'organizacion') and oportunidad.organizacion:
-                    org_nombre = oportunidad.organizacion.nombre
-                    if hasattr(oportunidad.organizacion, 'logo') and oportunidad.organizacion.logo:
-                        try:
-                            org_logo = oportunidad.organizacion.logo.url
-                        except:
-                            org_logo = None
-                
-                oportunidades_con_usuarios.append({
-                    'oportunidad': {
-                        'id': oportunidad.id,
-                        'titulo': oportunidad.titulo,
-                        'descripcion': oportunidad.descripcion,
-                        'fecha_inicio': oportunidad.fecha_inicio,
-                        'fecha_fin': oportunidad.fecha_fin,
-                        'ubicacion': oportunidad.ubicacion,
-                        'organizacion': {
-                            'nombre': org_nombre,
-                            'logo': org_logo
-                        }
-                    },
-                    'usuarios_disponibles': usuarios_filtrados
-                })
+        # Agrupar las filas por oportunidad destino (ya vienen ordenadas)
+        for oportunidad, grupo in groupby(filas, key=lambda fila: fila[0]):
+            usuarios_filtrados = [
+                {
+                    'id': usuario_disp.id,
+                    'nombre_completo': usuario_disp.get_full_name() or usuario_disp.email,
+                    'email': usuario_disp.email,
+                    'telefono': usuario_disp.telefono or 'No disponible',
+                    'foto_perfil': None,  # No hay campo de foto en el modelo actual
+                    'fecha_inscripcion': fecha_inscripcion
+                }
+                for _, usuario_disp, fecha_inscripcion in grupo
+            ]
+
+            # Verificar que la oportunidad tenga organización asociada
+            org_nombre = 'Sin organización'
+            org_logo = None
+            
+            if hasattr(oportunidad, 'organizacion') and oportunidad.organizacion:
+                org_nombre = oportunidad.organizacion.nombre
+                if hasattr(oportunidad.organizacion, 'logo') and oportunidad.organizacion.logo:
+                    try:
+                        org_logo = oportunidad.organizacion.logo.url
+                    except:
+                        org_logo = None
+            
+            oportunidades_con_usuarios.append({
+                'oportunidad': {
+                    'id': oportunidad.id,
+                    'titulo': oportunidad.titulo,
+                    'descripcion': oportunidad.descripcion,
+                    'fecha_inicio': oportunidad.fecha_inicio,
+                    'fecha_fin': oportunidad.fecha_fin,
+                    'ubicacion': oportunidad.ubicacion,
+                    'organizacion': {
+                        'nombre': org_nombre,
+                        'logo': org_logo
+                    }
+                },
+                'usuarios_disponibles': usuarios_filtrados
+            })
 
         return oportunidades_con_usuarios
     
+    def _filtro_conflictivas(self):
+        """
+        Filtro de las otras solicitudes que dependen de los mismos turnos que esta
+        y que deben rechazarse si esta se acepta.
+        """
+        return (
+            (models.Q(solicitante_id=self.solicitante_id) & models.Q(oportunidad_origen_id=self.oportunidad_origen_id)) |
+            (models.Q(solicitante_id=self.receptor_id) & models.Q(oportunidad_origen_id=self.oportunidad_destino_id)) |
+            (models.Q(receptor_id=self.solicitante_id) & models.Q(oportunidad_destino_id=self.oportunidad_origen_id)) |
+            (models.Q(receptor_id=self.receptor_id) & models.Q(oportunidad_destino_id=self.oportunidad_destino_id))
+        )
+
+    def _cambiar_estado(self, estado):
+        """
+        Cambia el estado de una solicitud pendiente con control optimista de versión.
+        La actualización solo se aplica si la fila sigue pendiente y conserva la
+        versión leída; en caso contrario otra operación la modificó antes.
+        El cambio se publica en la bandeja de salida dentro de la misma transacción.
+        
+        Raises:
+            ConflictoConcurrencia: Si la solicitud fue modificada concurrentemente
+        """
+        ahora = timezone.now()
+        actualizadas = SolicitudPermutacion.objects.filter(
+            pk=self.pk,
+            estado='pendiente',
+            version=self.version
+        ).update(
+            estado=estado,
+            version=models.F('version') + 1,
+            fecha_actualizacion=ahora
+        )
+        if actualizadas == 0:
+            raise ConflictoConcurrencia('La solicitud fue modificada por otra operación. Recarga la página e inténtalo de nuevo.')
+        # Una solicitud solo sale una vez del estado pendiente: la clave es única por estado
+        bandeja.registrar(f'permutacion.{estado}', f'permutacion.{estado}:{self.pk}', solicitud_id=self.pk)
+        self.estado = estado
+        self.version += 1
+        self.fecha_actualizacion = ahora
+
     @transaction.atomic
-    def aceptar(self):
+    def aceptar(self, version_esperada=None):
         """
         Acepta la solicitud de permutación y realiza el intercambio de turnos.
         Maneja la transacción atómicamente para mantener la integridad de los datos.
+        
+        Para evitar que dos aceptaciones simultáneas pasen las validaciones y corrompan
+        las inscripciones, se bloquean las filas afectadas en un orden determinista:
+        primero las inscripciones de ambos usuarios y después las solicitudes (esta y
+        las conflictivas), en ambos casos ordenadas por clave primaria.
+        
+        Args:
+            version_esperada: Versión de la solicitud que vio el usuario (opcional).
+                              Si no coincide con la actual se rechaza la operación.
+        
+        Raises:
+            ConflictoConcurrencia: Si la solicitud cambió desde que se leyó
         """
         if self.estado != 'pendiente':
             raise ValidationError('Solo se pueden aceptar solicitudes pendientes')
@@ -287,80 +583,67 @@ class SolicitudPermutacion(models.Model):
                 # Obtener el usuario que realiza la acción
                 usuario_accion = getattr(self, '_usuario_actual', None)
                 
+                # 1. Bloquear las inscripciones de ambos usuarios en ambas oportunidades
+                inscripciones = {
+                    (inscripcion.usuario_id, inscripcion.oportunidad_id): inscripcion
+                    for inscripcion in Inscripcion.objects.select_for_update().filter(
+                        usuario_id__in=[self.solicitante_id, self.receptor_id],
+                        oportunidad_id__in=[self.oportunidad_origen_id, self.oportunidad_destino_id]
+                    ).order_by('pk')
+                }
+                
+                # 2. Bloquear esta solicitud y las conflictivas en orden de clave primaria
+                bloqueadas = {
+                    solicitud.pk: solicitud
+                    for solicitud in SolicitudPermutacion.objects.select_for_update().filter(
+                        models.Q(pk=self.pk) |
+                        (models.Q(estado='pendiente') & self._filtro_conflictivas())
+                    ).only('id', 'estado', 'version').order_by('pk')
+                }
+                
+                # 3. Verificación optimista: la solicitud debe seguir pendiente y sin cambios
+                actual = bloqueadas.get(self.pk)
+                if actual is None or actual.estado != 'pendiente':
+                    raise ConflictoConcurrencia('La solicitud ya fue procesada por otra operación.')
+                if actual.version != self.version or (
+                    version_esperada is not None and int(version_esperada) != actual.version
+                ):
+                    raise ConflictoConcurrencia('La solicitud fue modificada por otra operación. Recarga la página e inténtalo de nuevo.')
+                
                 # Verificar si el solicitante ya está en la oportunidad de destino
-                if Inscripcion.objects.filter(usuario=self.solicitante, oportunidad=self.oportunidad_destino).exists():
-                    self.estado = 'rechazada'
-                    self.fecha_actualizacion = timezone.now()
-                    self.save()
-                    
-                    # Crear registro detallado del rechazo
-                    detalles = (
-                        f"INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE\n"
-                        f"• Motivo: El solicitante ya está inscrito en la oportunidad de destino\n"
-                        f"• Solicitante: {self.solicitante.get_full_name() or self.solicitante.email}\n"
-                        f"• Oportunidad Destino: {self.oportunidad_destino.titulo} (ID: {self.oportunidad_destino.id})\n"
-                        f"• Fecha: {self.fecha_actualizacion.strftime('%d/%m/%Y %H:%M')}\n"
-                        f"• Acción realizada por: {usuario_accion.get_full_name() if usuario_accion else 'Sistema'}"
-                    )
+                if (self.solicitante_id, self.oportunidad_destino_id) in inscripciones:
+                    self._cambiar_estado('rechazada')
                     
+                    # Registrar el rechazo con su código de motivo
                     HistorialPermutacion.objects.create(
                         solicitud=self,
                         accion='rechazo',
-                        detalles=detalles,
+                        datos={'motivo': 'solicitante_en_destino'},
                         usuario=usuario_accion
                     )
-                    raise ValidationError('El solicitante ya está inscrito en la oportunidad de destino')
+                    return 'rechazada', 'El solicitante ya está inscrito en la oportunidad de destino'
                     
                 # Verificar si el receptor ya está en la oportunidad de origen
-                if Inscripcion.objects.filter(usuario=self.receptor, oportunidad=self.oportunidad_origen).exists():
-                    self.estado = 'rechazada'
-                    self.fecha_actualizacion = timezone.now()
-                    self.save()
-                    
-                    # Crear registro detallado del rechazo
-                    detalles = (
-                        f"INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE\n"
-                        f"• Motivo: El receptor ya está inscrito en la oportunidad de origen\n"
-                        f"• Receptor: {self.receptor.get_full_name() or self.receptor.email}\n"
-                        f"• Oportunidad Origen: {self.oportunidad_origen.titulo} (ID: {self.oportunidad_origen.id})\n"
-                        f"• Fecha: {self.fecha_actualizacion.strftime('%d/%m/%Y %H:%M')}\n"
-                        f"• Acción realizada por: {usuario_accion.get_full_name() if usuario_accion else 'Sistema'}"
-                    )
+                if (self.receptor_id, self.oportunidad_origen_id) in inscripciones:
+                    self._cambiar_estado('rechazada')
                     
+                    # Registrar el rechazo con su código de motivo
                     HistorialPermutacion.objects.create(
                         solicitud=self,
                         accion='rechazo',
-                        detalles=detalles,
+                        datos={'motivo': 'receptor_en_origen'},
                         usuario=usuario_accion
                     )
-                    raise ValidationError('El receptor ya está inscrito en la oportunidad de origen')
+                    return 'rechazada', 'El receptor ya está inscrito en la oportunidad de origen'
                     
-                # Obtener las inscripciones
-                inscripcion_solicitante = Inscripcion.objects.get(
-                    usuario=self.solicitante,
-                    oportunidad=self.oportunidad_origen,
-                    estado='aceptada'
-                )
-                
-                inscripcion_receptor = Inscripcion.objects.get(
-                    usuario=self.receptor,
-                    oportunidad=self.oportunidad_destino,
-                    estado='aceptada'
-                )
-                
-                # Guardar información para el historial
-                info_intercambio = (
-                    f"INTERCAMBIO REALIZADO CON ÉXITO\n"
-                    f"• Solicitante: {self.solicitante.get_full_name() or self.solicitante.email}\n"
-                    f"• Receptor: {self.receptor.get_full_name() or self.receptor.email}\n"
-                    f"• Oportunidad Origen: {self.oportunidad_origen.titulo} (ID: {self.oportunidad_origen.id})\n"
-                    f"• Oportunidad Destino: {self.oportunidad_destino.titulo} (ID: {self.oportunidad_destino.id})\n"
-                    f"• Fecha: {timezone.now().strftime('%d/%m/%Y %H:%M')}\n"
-                    f"• Acción realizada por: {usuario_accion.get_full_name() if usuario_accion else 'Sistema'}\n"
-                    f"• Detalles del Intercambio:\n"
-                    f"  - {self.solicitante.get_short_name()}: {self.oportunidad_origen.titulo} → {self.oportunidad_destino.titulo}\n"
-                    f"  - {self.receptor.get_short_name()}: {self.oportunidad_destino.titulo} → {self.oportunidad_origen.titulo}"
-                )
+                # Obtener las inscripciones (ya bloqueadas)
+                inscripcion_solicitante = inscripciones.get((self.solicitante_id, self.oportunidad_origen_id))
+                inscripcion_receptor = inscripciones.get((self.receptor_id, self.oportunidad_destino_id))
+                if (
+                    inscripcion_solicitante is None or inscripcion_solicitante.estado != 'aceptada' or
+                    inscripcion_receptor is None or inscripcion_receptor.estado != 'aceptada'
+                ):
+                    raise Inscripcion.DoesNotExist
                 
                 # Realizar el intercambio
                 inscripcion_solicitante.oportunidad = self.oportunidad_destino
@@ -372,185 +655,395 @@ class SolicitudPermutacion(models.Model):
                 inscripcion_receptor.save()
                 
                 # Actualizar el estado de la solicitud
-                self.estado = 'aceptada'
-                self.fecha_actualizacion = timezone.now()
-                self.save()
+                self._cambiar_estado('aceptada')
                 
                 # Registrar la aceptación en el historial
                 HistorialPermutacion.objects.create(
                     solicitud=self,
                     accion='aceptacion',
-                    detalles=info_intercambio,
+                    datos={'motivo': 'intercambio'},
                     usuario=usuario_accion
                 )
                 
-                # Rechazar otras solicitudes pendientes conflictivas
-                solicitudes_a_rechazar = SolicitudPermutacion.objects.filter(
-                    models.Q(estado='pendiente') &
-                    ~models.Q(pk=self.pk) &
-                    (
-                        (models.Q(solicitante=self.solicitante) & models.Q(oportunidad_origen=self.oportunidad_origen)) |
-                        (models.Q(solicitante=self.receptor) & models.Q(oportunidad_origen=self.oportunidad_destino)) |
-                        (models.Q(receptor=self.solicitante) & models.Q(oportunidad_destino=self.oportunidad_origen)) |
-                        (models.Q(receptor=self.receptor) & models.Q(oportunidad_destino=self.oportunidad_destino))
+                # Retirar las demás propuestas de la misma difusión y rechazar el resto de
+                # solicitudes pendientes conflictivas en bloque (todas ya bloqueadas)
+                otras = [pk for pk in bloqueadas if pk != self.pk]
+                if self.grupo:
+                    SolicitudPermutacion.cancelar_en_bloque(
+                        SolicitudPermutacion.objects.filter(pk__in=otras, grupo=self.grupo),
+                        'difusion_aceptada',
+                        usuario_accion
                     )
-                )
-                
-                # Crear registros de historial para las solicitudes rechazadas automáticamente
-                for solicitud in solicitudes_a_rechazar:
-                    detalles_rechazo = (
-                        f"INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE\n"
-                        f"• Motivo: Otra solicitud de intercambio fue aceptada para las mismas oportunidades\n"
-                        f"• Solicitante: {solicitud.solicitante.get_full_name() or solicitud.solicitante.email}\n"
-                        f"• Oportunidad Origen: {solicitud.oportunidad_origen.titulo} (ID: {solicitud.oportunidad_origen.id})\n"
-                        f"• Oportunidad Destino: {solicitud.oportunidad_destino.titulo} (ID: {solicitud.oportunidad_destino.id})\n"
-                        f"• Fecha: {timezone.now().strftime('%d/%m/%Y %H:%M')}\n"
-                        f"• Acción realizada por: {usuario_accion.get_full_name() if usuario_accion else 'Sistema'}"
-                    )
-                    
-                    HistorialPermutacion.objects.create(
-                        solicitud=solicitud,
-                        accion='rechazo',
-                        detalles=detalles_rechazo,
-                        usuario=usuario_accion
-                    )
-                
-                # Actualizar el estado de las solicitudes rechazadas
-                solicitudes_a_rechazar.update(
-                    estado='rechazada',
-                    fecha_actualizacion=timezone.now()
+                SolicitudPermutacion.rechazar_en_bloque(
+                    SolicitudPermutacion.objects.filter(pk__in=otras),
+                    'conflicto',
+                    usuario_accion
                 )
                 
                 return 'aceptada', 'Intercambio realizado con éxito.'
                 
+            except ConflictoConcurrencia:
+                # Los conflictos de concurrencia no modifican la solicitud: se propagan
+                raise
+                
             except Inscripcion.DoesNotExist:
                 # Registrar el error en el historial
-                detalles_error = (
-                    f"ERROR EN INTERCAMBIO\n"
-                    f"• Motivo: No se pudo completar el intercambio. Una de las inscripciones necesarias no existe.\n"
-                    f"• Solicitante: {self.solicitante.get_full_name() or self.solicitante.email}\n"
-                    f"• Receptor: {self.receptor.get_full_name() or self.receptor.email}\n"
-                    f"• Oportunidad Origen: {self.oportunidad_origen.titulo} (ID: {self.oportunidad_origen.id})\n"
-                    f"• Oportunidad Destino: {self.oportunidad_destino.titulo} (ID: {self.oportunidad_destino.id})\n"
-                    f"• Fecha: {timezone.now().strftime('%d/%m/%Y %H:%M')}"
-                )
-                
                 HistorialPermutacion.objects.create(
                     solicitud=self,
                     accion='error',
-                    detalles=detalles_error,
+                    datos={'motivo': 'inscripcion_inexistente'},
                     usuario=usuario_accion
                 )
                 
-                self.estado = 'rechazada'
-                self.fecha_actualizacion = timezone.now()
-                self.save()
+                self._cambiar_estado('rechazada')
                 
                 return 'rechazada', 'No se pudo completar el intercambio. Una de las inscripciones necesarias no existe.'
                 
             except Exception as e:
                 # Registrar el error en el historial
-                detalles_error = (
-                    f"ERROR EN INTERCAMBIO\n"
-                    f"• Motivo: Error inesperado: {str(e)}\n"
-                    f"• Solicitante: {self.solicitante.get_full_name() or self.solicitante.email}\n"
-                    f"• Receptor: {self.receptor.get_full_name() or self.receptor.email}\n"
-                    f"• Oportunidad Origen: {self.oportunidad_origen.titulo} (ID: {self.oportunidad_origen.id})\n"
-                    f"• Oportunidad Destino: {self.oportunidad_destino.titulo} (ID: {self.oportunidad_destino.id})\n"
-                    f"• Fecha: {timezone.now().strftime('%d/%m/%Y %H:%M')}"
-                )
-                
                 HistorialPermutacion.objects.create(
                     solicitud=self,
                     accion='error',
-                    detalles=detalles_error,
+                    datos={'motivo': 'inesperado', 'error': str(e)},
                     usuario=usuario_accion
                 )
                 
-                self.estado = 'rechazada'
-                self.fecha_actualizacion = timezone.now()
-                self.save()
+                self._cambiar_estado('rechazada')
                 
                 return 'error', f'Error inesperado: {str(e)}'
     
-    def rechazar(self):
+    @staticmethod
+    def rechazar_en_bloque(solicitudes, motivo, usuario_accion=None):
+        """
+        Rechaza automáticamente un conjunto de solicitudes pendientes con un número
+        constante de consultas: una lectura de las claves bloqueadas, un
+        bulk_create del historial, otro de los eventos y un único UPDATE.
+        
+        Args:
+            solicitudes: QuerySet de SolicitudPermutacion a rechazar (se filtran las pendientes)
+            motivo: Código de motivo que se registra en el historial (ver HistorialPermutacion.MOTIVOS)
+            usuario_accion: Usuario que provoca el rechazo (None para el sistema)
+            
+        Returns:
+            int: Número de solicitudes rechazadas
+        
+        Debe invocarse dentro de una transacción, ya que bloquea las filas afectadas.
+        """
+        return SolicitudPermutacion._cerrar_en_bloque(solicitudes, 'rechazada', 'rechazo', motivo, usuario_accion)
+    
+    @staticmethod
+    def cancelar_en_bloque(solicitudes, motivo, usuario_accion=None):
+        """
+        Cancela automáticamente un conjunto de solicitudes pendientes, con las mismas
+        consultas que rechazar_en_bloque. Se usa para retirar las demás propuestas de
+        una difusión cuando una de ellas se acepta.
+        
+        Returns:
+            int: Número de solicitudes canceladas
+        
+        Debe invocarse dentro de una transacción, ya que bloquea las filas afectadas.
+        """
+        return SolicitudPermutacion._cerrar_en_bloque(solicitudes, 'cancelada', 'cancelacion', motivo, usuario_accion)
+    
+    @staticmethod
+    def _cerrar_en_bloque(solicitudes, estado, accion, motivo, usuario_accion):
+        """Pasa las solicitudes pendientes del conjunto a `estado` con su historial y eventos."""
+        # Bloquear las filas en orden de clave primaria antes de modificarlas
+        solicitudes_a_cerrar = list(
+            solicitudes.filter(estado='pendiente').select_for_update().order_by('pk').only('id')
+        )
+        if not solicitudes_a_cerrar:
+            return 0
+        
+        ahora = timezone.now()
+        
+        # Crear todos los registros de historial en una sola inserción
+        HistorialPermutacion.objects.bulk_create([
+            HistorialPermutacion(
+                solicitud=solicitud,
+                accion=accion,
+                datos={'motivo': motivo},
+                usuario=usuario_accion
+            )
+            for solicitud in solicitudes_a_cerrar
+        ])
+        contadores.invalidar()
+        
+        # Publicar los cambios en la bandeja de salida con una sola inserción
+        bandeja.registrar_varios([
+            (f'permutacion.{estado}', f'permutacion.{estado}:{solicitud.pk}', {'solicitud_id': solicitud.pk})
+            for solicitud in solicitudes_a_cerrar
+        ])
+        
+        # Actualizar el estado de las solicitudes en una sola sentencia
+        return SolicitudPermutacion.objects.filter(
+            pk__in=[solicitud.pk for solicitud in solicitudes_a_cerrar],
+            estado='pendiente'
+        ).update(
+            estado=estado,
+            version=models.F('version') + 1,
+            fecha_actualizacion=ahora
+        )
+    
+    @transaction.atomic
+    def rechazar(self, version_esperada=None):
         """
         Rechaza la solicitud de permutación.
         Actualiza el estado a 'rechazada' y la fecha de actualización.
+        
+        Args:
+            version_esperada: Versión de la solicitud que vio el usuario (opcional)
         """
         if self.estado != 'pendiente':
             raise ValidationError('Solo se pueden rechazar solicitudes pendientes')
-            
-        self.estado = 'rechazada'
-        self.fecha_actualizacion = timezone.now()
-        self.save()
+        
+        if version_esperada is not None:
+            self.version = int(version_esperada)
+        self._cambiar_estado('rechazada')
         
         # Obtener el usuario que realiza la acción
         usuario_accion = getattr(self, '_usuario_actual', None)
         
-        # Registrar el rechazo en el historial con detalles
-        detalles = (
-            f"INTERCAMBIO RECHAZADO\n"
-            f"• Solicitante: {self.solicitante.get_full_name() or self.solicitante.email}\n"
-            f"• Receptor: {self.receptor.get_full_name() or self.receptor.email}\n"
-            f"• Oportunidad Origen: {self.oportunidad_origen.titulo} (ID: {self.oportunidad_origen.id})\n"
-            f"• Oportunidad Destino: {self.oportunidad_destino.titulo} (ID: {self.oportunidad_destino.id})\n"
-            f"• Fecha: {self.fecha_actualizacion.strftime('%d/%m/%Y %H:%M')}\n"
-            f"• Acción realizada por: {usuario_accion.get_full_name() if usuario_accion else 'Sistema'}"
-        )
-        
+        # Registrar el rechazo en el historial
         HistorialPermutacion.objects.create(
             solicitud=self,
             accion='rechazo',
-            detalles=detalles,
+            datos={'motivo': 'manual'},
             usuario=usuario_accion
         )
     
-    def cancelar(self):
+    @transaction.atomic
+    def cancelar(self, version_esperada=None):
         """
         Cancela la solicitud de permutación.
         Actualiza el estado a 'cancelada' y la fecha de actualización.
+        
+        Args:
+            version_esperada: Versión de la solicitud que vio el usuario (opcional)
         """
         if self.estado != 'pendiente':
             raise ValidationError('Solo se pueden cancelar solicitudes pendientes')
-            
-        self.estado = 'cancelada'
-        self.fecha_actualizacion = timezone.now()
-        self.save()
+        
+        if version_esperada is not None:
+            self.version = int(version_esperada)
+        self._cambiar_estado('cancelada')
         
         # Obtener el usuario que realiza la acción
         usuario_accion = getattr(self, '_usuario_actual', None)
         
-        # Registrar la cancelación en el historial con detalles
-        detalles = (
-            f"INTERCAMBIO CANCELADO\n"
-            f"• Solicitante: {self.solicitante.get_full_name() or self.solicitante.email}\n"
-            f"• Receptor: {self.receptor.get_full_name() or self.receptor.email}\n"
-            f"• Oportunidad Origen: {self.oportunidad_origen.titulo} (ID: {self.oportunidad_origen.id})\n"
-            f"• Oportunidad Destino: {self.oportunidad_destino.titulo} (ID: {self.oportunidad_destino.id})\n"
-            f"• Fecha: {self.fecha_actualizacion.strftime('%d/%m/%Y %H:%M')}\n"
-            f"• Acción realizada por: {usuario_accion.get_full_name() if usuario_accion else 'Sistema'}\n"
-            f"• Razón: Cancelación por el solicitante"
-        )
-        
+        # Registrar la cancelación en el historial
         HistorialPermutacion.objects.create(
             solicitud=self,
             accion='cancelacion',
-            detalles=detalles,
+            datos={'motivo': 'solicitante'},
             usuario=usuario_accion
         )
+    
+    @staticmethod
+    def fecha_limite_pendiente():
+        """
+        Devuelve la fecha de creación a partir de la cual una solicitud pendiente sigue
+        vigente. Las creadas antes superaron SOLICITUD_PERMUTACION_DIAS_EXPIRACION días
+        sin respuesta y el comando expirar_solicitudes las marca como expiradas.
+        """
+        dias = getattr(settings, 'SOLICITUD_PERMUTACION_DIAS_EXPIRACION', 30)
+        return timezone.now() - timedelta(days=dias)
+
+
+class RegistroHistorialMixin:
+    """
+    Comportamiento común de los registros de historial (activos y archivados).
+    
+    Cada registro guarda un contenido estructurado y compacto en `datos` (códigos de
+    motivo e ids); el texto legible se genera solo al mostrarse, a partir de las
+    relaciones de la solicitud. Los participantes de la solicitud (solicitante,
+    receptor y oportunidades) no se copian en `datos` porque ya están en la solicitud.
+    """
+    # Códigos de motivo que se guardan en datos['motivo'] y su texto legible
+    MOTIVOS = {
+        'nueva': 'Nueva solicitud de intercambio',
+        'intercambio': 'Intercambio realizado con éxito',
+        'ciclo': 'Intercambio en ciclo realizado con éxito',
+        'manual': 'Rechazo por el receptor',
+        'solicitante_en_destino': 'El solicitante ya está inscrito en la oportunidad de destino',
+        'receptor_en_origen': 'El receptor ya está inscrito en la oportunidad de origen',
+        'conflicto': 'Otra solicitud de intercambio fue aceptada para las mismas oportunidades',
+        'ciclo_conflicto': 'Un intercambio en ciclo reasignó el turno involucrado',
+        'optimizacion': 'Intercambio asignado por la optimización global',
+        'optimizacion_conflicto': 'La optimización global reasignó el turno involucrado',
+        'espejo': 'Intercambio recíproco realizado automáticamente',
+        'espejo_conflicto': 'Un intercambio recíproco reasignó el turno involucrado',
+        'difusion_aceptada': 'Se aceptó otra de las propuestas enviadas a la vez',
+        'plazo_vencido': 'La solicitud superó el plazo máximo sin respuesta',
+        'oportunidad_finalizada': 'Una de las oportunidades del intercambio ya finalizó',
+        'solicitante': 'Cancelación por el solicitante',
+        'inscripcion_inexistente': 'No se pudo completar el intercambio. Una de las inscripciones necesarias no existe.',
+        'inesperado': 'Error inesperado',
+    }
+
+    # Títulos de los intercambios de varios participantes (datos['ciclo']) según su motivo
+    TITULOS_CICLO = {
+        'ciclo': 'INTERCAMBIO EN CICLO REALIZADO CON ÉXITO',
+        'optimizacion': 'INTERCAMBIO ASIGNADO POR LA OPTIMIZACIÓN GLOBAL',
+        'espejo': 'INTERCAMBIO RECÍPROCO REALIZADO AUTOMÁTICAMENTE',
+    }
+    
+    @property
+    def detalles_texto(self):
+        """
+        Devuelve el texto legible del registro, generado una sola vez por instancia.
+        Los registros heredados que conservan su texto original lo devuelven tal cual.
+        """
+        if not hasattr(self, '_detalles_texto'):
+            self._detalles_texto = self.detalles or self._renderizar()
+        return self._detalles_texto
+
+    @property
+    def detalles_lines(self):
+        """
+        Devuelve los detalles divididos en líneas para facilitar el formateo en plantillas.
+        """
+        if not hasattr(self, '_detalles_lines'):
+            self._detalles_lines = self.detalles_texto.split('\n') if self.detalles_texto else []
+        return self._detalles_lines
 
+    def _renderizar(self):
+        """
+        Construye el texto legible a partir de `datos` y de las relaciones de la solicitud.
+        Las vistas deben precargar solicitud, sus usuarios y oportunidades, y usuario
+        con select_related para que el renderizado no genere consultas adicionales.
+        """
+        if not self.datos:
+            return ''
+        
+        solicitud = self.solicitud
+        solicitante = solicitud.solicitante
+        receptor = solicitud.receptor
+        origen = solicitud.oportunidad_origen
+        destino = solicitud.oportunidad_destino
+        motivo = self.datos.get('motivo')
+        
+        linea_solicitante = f"• Solicitante: {solicitante.get_full_name() or solicitante.email}"
+        linea_receptor = f"• Receptor: {receptor.get_full_name() or receptor.email}"
+        linea_origen = f"• Oportunidad Origen: {origen.titulo} (ID: {origen.id})"
+        linea_destino = f"• Oportunidad Destino: {destino.titulo} (ID: {destino.id})"
+        linea_fecha = f"• Fecha: {timezone.localtime(self.fecha).strftime('%d/%m/%Y %H:%M')}"
+        linea_usuario = f"• Acción realizada por: {self.usuario.get_full_name() if self.usuario else 'Sistema'}"
+        
+        if self.accion == 'creacion':
+            lineas = [
+                "NUEVA SOLICITUD DE INTERCAMBIO",
+                linea_solicitante, linea_receptor, linea_origen, linea_destino,
+                f"• Mensaje: {solicitud.mensaje or 'Sin mensaje'}",
+                linea_fecha,
+            ]
+        elif self.accion == 'aceptacion' and motivo in self.TITULOS_CICLO:
+            participantes = self.datos.get('ciclo', [])
+            lineas = [
+                self.TITULOS_CICLO[motivo],
+                f"• Participantes: {len(participantes)}",
+                linea_solicitante, linea_origen, linea_destino, linea_fecha, linea_usuario,
+                "• Detalles del Intercambio:",
+            ] + self._lineas_ciclo(participantes)
+        elif self.accion == 'aceptacion':
+            lineas = [
+                "INTERCAMBIO REALIZADO CON ÉXITO",
+                linea_solicitante, linea_receptor, linea_origen, linea_destino,
+                linea_fecha, linea_usuario,
+                "• Detalles del Intercambio:",
+                f"  - {solicitante.get_short_name()}: {origen.titulo} → {destino.titulo}",
+                f"  - {receptor.get_short_name()}: {destino.titulo} → {origen.titulo}",
+            ]
+        elif self.accion == 'rechazo' and motivo == 'manual':
+            lineas = [
+                "INTERCAMBIO RECHAZADO",
+                linea_solicitante, linea_receptor, linea_origen, linea_destino,
+                linea_fecha, linea_usuario,
+            ]
+        elif self.accion == 'rechazo' and motivo == 'solicitante_en_destino':
+            lineas = [
+                "INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE",
+                f"• Motivo: {self.MOTIVOS[motivo]}",
+                linea_solicitante, linea_destino, linea_fecha, linea_usuario,
+            ]
+        elif self.accion == 'rechazo' and motivo == 'receptor_en_origen':
+            lineas = [
+                "INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE",
+                f"• Motivo: {self.MOTIVOS[motivo]}",
+                linea_receptor, linea_origen, linea_fecha, linea_usuario,
+            ]
+        elif self.accion == 'rechazo':
+            lineas = [
+                "INTERCAMBIO RECHAZADO AUTOMÁTICAMENTE",
+                f"• Motivo: {self.MOTIVOS.get(motivo, motivo)}",
+                linea_solicitante, linea_origen, linea_destino, linea_fecha, linea_usuario,
+            ]
+        elif self.accion == 'expiracion':
+            lineas = [
+                "SOLICITUD EXPIRADA",
+                f"• Motivo: {self.MOTIVOS.get(motivo, motivo)}",
+                linea_solicitante, linea_receptor, linea_origen, linea_destino,
+                linea_fecha,
+            ]
+        elif self.accion == 'cancelacion':
+            lineas = [
+                "INTERCAMBIO CANCELADO",
+                linea_solicitante, linea_receptor, linea_origen, linea_destino,
+                linea_fecha, linea_usuario,
+                f"• Razón: {self.MOTIVOS.get(motivo, motivo)}",
+            ]
+        else:
+            # Errores durante el intercambio
+            texto_motivo = self.MOTIVOS.get(motivo, motivo)
+            if self.datos.get('error'):
+                texto_motivo = f"{texto_motivo}: {self.datos['error']}"
+            lineas = [
+                "ERROR EN INTERCAMBIO",
+                f"• Motivo: {texto_motivo}",
+                linea_solicitante, linea_receptor, linea_origen, linea_destino,
+                linea_fecha,
+            ]
+        return "\n".join(lineas)
 
-class HistorialPermutacion(models.Model):
+    def _lineas_ciclo(self, participantes):
+        """
+        Genera las líneas de detalle de un intercambio en ciclo.
+        
+        Args:
+            participantes: Lista de [usuario_id, origen_id, destino_id] en orden del ciclo
+        """
+        # Dos consultas para todo el ciclo, solo cuando el registro se muestra
+        usuarios = get_user_model().objects.in_bulk([p[0] for p in participantes])
+        titulos = dict(OportunidadVoluntariado.objects.filter(
+            pk__in={p[1] for p in participantes} | {p[2] for p in participantes}
+        ).values_list('id', 'titulo'))
+        
+        lineas = []
+        for usuario_id, origen_id, destino_id in participantes:
+            usuario = usuarios.get(usuario_id)
+            nombre = usuario.get_short_name() if usuario else f"Usuario {usuario_id}"
+            lineas.append(
+                f"  - {nombre}: {titulos.get(origen_id, origen_id)} → {titulos.get(destino_id, destino_id)}"
+            )
+        return lineas
+
+
+class HistorialPermutacion(RegistroHistorialMixin, models.Model):
     """
     Modelo para registrar el historial de cambios en las solicitudes de permutación.
     Solo visible para superusuarios en el admin.
+    
+    Es la tabla activa: conserva los registros de los últimos
+    HISTORIAL_PERMUTACION_DIAS_ACTIVOS días. Los más antiguos se trasladan a
+    HistorialPermutacionArchivo con el comando archivar_historial.
     """
     TIPOS_ACCION = [
         ('creacion', 'Creación de Solicitud'),
         ('aceptacion', 'Aceptación de Intercambio'),
         ('rechazo', 'Rechazo de Solicitud'),
         ('cancelacion', 'Cancelación de Solicitud'),
+        ('error', 'Error en Intercambio'),
+        ('expiracion', 'Expiración de Solicitud'),
     ]
     
     solicitud = models.ForeignKey(
@@ -564,9 +1057,17 @@ class HistorialPermutacion(models.Model):
         choices=TIPOS_ACCION,
         verbose_name='Tipo de Acción'
     )
+    datos = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Datos del Cambio',
+        help_text='Contenido estructurado del cambio (códigos de motivo e ids)'
+    )
     detalles = models.TextField(
+        blank=True,
+        default='',
         verbose_name='Detalles del Cambio',
-        help_text='Información detallada sobre el cambio realizado'
+        help_text='Texto heredado de registros que no pudieron convertirse a datos estructurados'
     )
     fecha = models.DateTimeField(
         auto_now_add=True,
@@ -580,14 +1081,14 @@ class HistorialPermutacion(models.Model):
         verbose_name='Usuario que realizó la acción'
     )
 
-    @property
-    def detalles_lines(self):
+    @staticmethod
+    def fecha_corte():
         """
-        Devuelve los detalles divididos en líneas para facilitar el formateo en plantillas.
+        Devuelve la fecha a partir de la cual un registro pertenece a la ventana activa.
+        Los registros anteriores se consideran archivables.
         """
-        if not hasattr(self, '_detalles_lines'):
-            self._detalles_lines = self.detalles.split('\n') if self.detalles else []
-        return self._detalles_lines
+        dias = getattr(settings, 'HISTORIAL_PERMUTACION_DIAS_ACTIVOS', 180)
+        return timezone.now() - timedelta(days=dias)
 
     def __str__(self):
         """
@@ -601,4 +1102,213 @@ class HistorialPermutacion(models.Model):
         ordering = ['-fecha']
         permissions = [
             ('view_historial_permutacion', 'Puede ver el historial de permutaciones'),
-        ]
\ No newline at end of file
+        ]
+        indexes = [
+            # Lectura de la ventana activa, paginación por clave (fecha, id) y
+            # selección de registros a archivar
+            models.Index(fields=['fecha', 'id'], name='historial_fecha_id_idx'),
+        ]
+
+
+class HistorialPermutacionArchivo(RegistroHistorialMixin, models.Model):
+    """
+    Registros de historial que salieron de la ventana activa.
+    
+    Conserva el id original del registro y comprime con zlib el texto heredado
+    (`detalles`), de modo que la tabla activa se mantiene pequeña y las consultas
+    habituales no recorren el historial completo.
+    """
+    historial_id = models.BigIntegerField(
+        unique=True,
+        verbose_name='ID Original'
+    )
+    solicitud = models.ForeignKey(
+        SolicitudPermutacion,
+        on_delete=models.CASCADE,
+        related_name='historial_archivado',
+        verbose_name='Solicitud de Permutación'
+    )
+    accion = models.CharField(
+        max_length=20,
+        choices=HistorialPermutacion.TIPOS_ACCION,
+        verbose_name='Tipo de Acción'
+    )
+    datos = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Datos del Cambio'
+    )
+    detalles_comprimidos = models.BinaryField(
+        blank=True,
+        default=b'',
+        verbose_name='Detalles Comprimidos'
+    )
+    fecha = models.DateTimeField(
+        verbose_name='Fecha del Cambio'
+    )
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Usuario que realizó la acción'
+    )
+    fecha_archivado = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de Archivado'
+    )
+
+    @property
+    def detalles(self):
+        """Texto heredado del registro, descomprimido bajo demanda."""
+        if not self.detalles_comprimidos:
+            return ''
+        return zlib.decompress(bytes(self.detalles_comprimidos)).decode('utf-8')
+
+    @staticmethod
+    def desde_historial(registro):
+        """
+        Construye (sin guardar) el registro archivado equivalente a uno activo.
+        
+        Args:
+            registro: Instancia de HistorialPermutacion
+        """
+        return HistorialPermutacionArchivo(
+            historial_id=registro.id,
+            solicitud_id=registro.solicitud_id,
+            accion=registro.accion,
+            datos=registro.datos,
+            detalles_comprimidos=zlib.compress(registro.detalles.encode('utf-8')) if registro.detalles else b'',
+            fecha=registro.fecha,
+            usuario_id=registro.usuario_id
+        )
+
+    def __str__(self):
+        """
+        Representación en cadena del registro archivado.
+        """
+        return f"{self.get_accion_display()} - {self.fecha.strftime('%d/%m/%Y %H:%M')} (archivado)"
+
+    class Meta:
+        verbose_name = 'Historial Archivado de Permutación'
+        verbose_name_plural = 'Historial Archivado de Permutaciones'
+        ordering = ['-fecha']
+        indexes = [
+            # Paginación por clave (fecha, id original) junto con la tabla activa
+            models.Index(fields=['fecha', 'historial_id'], name='historial_archivo_fecha_id_idx'),
+        ]
+
+class CandidatoPermutacion(models.Model):
+    """
+    Índice materializado de candidatos a intercambio.
+    
+    Cada fila indica que `usuario`, inscrito en `oportunidad_origen`, puede intercambiar
+    su turno con `contraparte`, inscrita en `oportunidad_destino`. Se mantiene de forma
+    incremental mediante señales (ver permutaciones/candidatos.py) para que la vista de
+    permutaciones resuelva los candidatos con una única consulta indexada.
+    """
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='candidatos_permutacion',
+        verbose_name='Usuario'
+    )
+    oportunidad_origen = models.ForeignKey(
+        OportunidadVoluntariado,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Oportunidad de origen'
+    )
+    oportunidad_destino = models.ForeignKey(
+        OportunidadVoluntariado,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Oportunidad de destino'
+    )
+    contraparte = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Contraparte'
+    )
+    # Inscripción de la contraparte en la oportunidad destino (aporta la fecha de inscripción)
+    inscripcion_contraparte = models.ForeignKey(
+        Inscripcion,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Inscripción de la contraparte'
+    )
+
+    def __str__(self):
+        """Representación en cadena del candidato"""
+        return f"{self.usuario_id}: {self.oportunidad_origen_id} -> {self.oportunidad_destino_id} con {self.contraparte_id}"
+
+    @staticmethod
+    def oportunidades_para(usuario, oportunidad_actual):
+        """
+        Obtiene desde el índice las oportunidades y usuarios disponibles para intercambiar,
+        con la misma estructura que SolicitudPermutacion.calcular_permutaciones_posibles.
+        
+        Cada oportunidad incluye además `tiene_solicitud_pendiente`, resuelto en la misma
+        consulta mediante una anotación Exists.
+        
+        Args:
+            usuario: El usuario que desea realizar la permutación
+            oportunidad_actual: La oportunidad actual del usuario
+            
+        Returns:
+            list: Lista de diccionarios con las oportunidades y usuarios disponibles
+        """
+        # Solicitud pendiente del usuario hacia la oportunidad destino de cada fila
+        solicitud_pendiente = SolicitudPermutacion.objects.filter(
+            solicitante=usuario,
+            oportunidad_origen=oportunidad_actual,
+            oportunidad_destino=models.OuterRef('oportunidad_destino'),
+            estado='pendiente'
+        )
+        
+        candidatos = CandidatoPermutacion.objects.filter(
+            usuario=usuario,
+            oportunidad_origen=oportunidad_actual,
+            oportunidad_destino__fecha_fin__gte=timezone.now().date()  # Oportunidades vigentes
+        ).annotate(
+            tiene_solicitud_pendiente=models.Exists(solicitud_pendiente)
+        ).select_related(
+            'contraparte',
+            'inscripcion_contraparte',
+            'oportunidad_destino',
+            'oportunidad_destino__organizacion'
+        ).order_by(
+            '-oportunidad_destino__fecha_creacion',
+            'oportunidad_destino_id',
+            'inscripcion_contraparte__fecha_inscripcion',
+            'inscripcion_contraparte_id'
+        )
+        
+        # Oportunidades destino con solicitud pendiente, recogidas al recorrer las filas
+        con_solicitud_pendiente = set()
+        filas = []
+        for c in candidatos:
+            if c.tiene_solicitud_pendiente:
+                con_solicitud_pendiente.add(c.oportunidad_destino_id)
+            filas.append((c.oportunidad_destino, c.contraparte, c.inscripcion_contraparte.fecha_inscripcion))
+        
+        # Los conflictos de horario dependen de otras inscripciones: se filtran al consultar
+        oportunidades = SolicitudPermutacion.agrupar_por_oportunidad(
+            SolicitudPermutacion.descartar_conflictos_horario(usuario, oportunidad_actual, filas)
+        )
+        for op in oportunidades:
+            op['tiene_solicitud_pendiente'] = op['oportunidad']['id'] in con_solicitud_pendiente
+        return oportunidades
+
+    class Meta:
+        verbose_name = 'candidato de permutación'
+        verbose_name_plural = 'candidatos de permutación'
+        indexes = [
+            # Consulta principal: candidatos de un usuario para una oportunidad de origen
+            models.Index(fields=['usuario', 'oportunidad_origen'], name='candidato_usuario_origen_idx'),
+            # Actualización incremental cuando cambian las inscripciones de la contraparte
+            models.Index(fields=['contraparte'], name='candidato_contraparte_idx'),
+            # Actualización incremental cuando cambia la oportunidad de destino
+            models.Index(fields=['oportunidad_destino'], name='candidato_destino_idx'),
+        ]
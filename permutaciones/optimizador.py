@@ -0,0 +1,364 @@
+# Optimización global de intercambios de turnos
+# Reasigna de una sola vez los turnos de todos los voluntarios con solicitudes
+# pendientes, maximizando el número de deseos satisfechos. El problema de asignación
+# se resuelve como una circulación de costo mínimo sobre el grafo de oportunidades,
+# lo que generaliza la búsqueda voraz de ciclos cortos de ciclos.py.
+from heapq import heappop, heappush
+
+from .ciclos import solicitudes_ejecutables, ejecutar_ciclos
+
+INFINITO = float('inf')
+
+
+class RedFlujo:
+    """
+    Red de flujo con capacidades y costos enteros guardada en listas paralelas.
+    Cada arco e se crea junto con su residual inverso e ^ 1.
+    """
+
+    def __init__(self, total_nodos):
+        self.adyacencia = [[] for _ in range(total_nodos)]
+        self.destino = []
+        self.capacidad = []
+        self.costo = []
+
+    def agregar_arco(self, origen, destino, capacidad, costo):
+        """
+        Returns:
+            int: Índice del arco (su inverso es el índice ^ 1)
+        """
+        arco = len(self.destino)
+        self.destino.extend((destino, origen))
+        self.capacidad.extend((capacidad, 0))
+        self.costo.extend((costo, -costo))
+        self.adyacencia[origen].append(arco)
+        self.adyacencia[destino].append(arco + 1)
+        return arco
+
+    def _dijkstra(self, fuente, potencial):
+        """Distancias con costos reducidos (no negativos) y arco previo de cada nodo."""
+        distancia = [INFINITO] * len(self.adyacencia)
+        previo = [-1] * len(self.adyacencia)
+        distancia[fuente] = 0
+        cola = [(0, fuente)]
+        while cola:
+            d, nodo = heappop(cola)
+            if d > distancia[nodo]:
+                continue
+            base = d + potencial[nodo]
+            for arco in self.adyacencia[nodo]:
+                if self.capacidad[arco] > 0:
+                    vecino = self.destino[arco]
+                    nueva = base + self.costo[arco] - potencial[vecino]
+                    if nueva < distancia[vecino]:
+                        distancia[vecino] = nueva
+                        previo[vecino] = arco
+                        heappush(cola, (nueva, vecino))
+        return distancia, previo
+
+    def _aumentar(self, arcos):
+        """Envía por el camino el máximo flujo que admite su arco más estrecho."""
+        cantidad = min(self.capacidad[arco] for arco in arcos)
+        for arco in arcos:
+            self.capacidad[arco] -= cantidad
+            self.capacidad[arco ^ 1] += cantidad
+        return cantidad
+
+    def _camino_admisible(self, fuente, sumidero, potencial, puntero, descartado):
+        """
+        Busca en profundidad un camino de costo reducido cero. Los punteros por nodo y
+        los nodos descartados se conservan durante la fase para no repetir trabajo.
+        """
+        nodos = [fuente]
+        arcos = []
+        en_camino = {fuente}
+        while nodos:
+            nodo = nodos[-1]
+            if nodo == sumidero:
+                return arcos
+            adyacentes = self.adyacencia[nodo]
+            while puntero[nodo] < len(adyacentes):
+                arco = adyacentes[puntero[nodo]]
+                vecino = self.destino[arco]
+                if (
+                    self.capacidad[arco] > 0
+                    and not descartado[vecino]
+                    and vecino not in en_camino
+                    and self.costo[arco] + potencial[nodo] - potencial[vecino] == 0
+                ):
+                    arcos.append(arco)
+                    nodos.append(vecino)
+                    en_camino.add(vecino)
+                    break
+                puntero[nodo] += 1
+            else:
+                # Sin salida en esta fase: retroceder
+                descartado[nodo] = 1
+                nodos.pop()
+                en_camino.discard(nodo)
+                if arcos:
+                    arcos.pop()
+                    puntero[nodos[-1]] += 1
+        return None
+
+    def flujo_costo_minimo(self, fuente, sumidero):
+        """
+        Envía el flujo máximo de la fuente al sumidero con el menor costo total
+        (algoritmo primal-dual). Requiere costos no negativos en los arcos con capacidad.
+
+        Cada fase calcula con Dijkstra las distancias sobre los costos reducidos por los
+        potenciales, actualiza los potenciales y satura caminos de costo reducido cero:
+        primero el del árbol de Dijkstra y después los que encuentre la búsqueda en
+        profundidad, de modo que cada fase envía muchos caminos a la vez.
+
+        Returns:
+            int: Flujo enviado
+        """
+        total_nodos = len(self.adyacencia)
+        potencial = [0] * total_nodos
+        flujo = 0
+        while True:
+            distancia, previo = self._dijkstra(fuente, potencial)
+            limite = distancia[sumidero]
+            if limite == INFINITO:
+                return flujo
+            for nodo in range(total_nodos):
+                potencial[nodo] += min(distancia[nodo], limite)
+
+            # Camino del árbol de Dijkstra: garantiza avance en cada fase
+            camino = []
+            nodo = sumidero
+            while nodo != fuente:
+                camino.append(previo[nodo])
+                nodo = self.destino[previo[nodo] ^ 1]
+            flujo += self._aumentar(camino)
+
+            # Resto de caminos de costo reducido cero
+            puntero = [0] * total_nodos
+            descartado = bytearray(total_nodos)
+            while True:
+                camino = self._camino_admisible(fuente, sumidero, potencial, puntero, descartado)
+                if camino is None:
+                    break
+                flujo += self._aumentar(camino)
+
+
+def _componentes_fuertes(aristas):
+    """
+    Componentes fuertemente conexas del grafo de oportunidades (Tarjan iterativo).
+    Solo las solicitudes cuyo origen y destino están en la misma componente pueden
+    formar parte de un ciclo.
+
+    Args:
+        aristas: Iterable de pares (origen_id, destino_id)
+
+    Returns:
+        dict: Id de oportunidad -> representante de su componente
+    """
+    vecinos = {}
+    for origen, destino in aristas:
+        vecinos.setdefault(origen, []).append(destino)
+        vecinos.setdefault(destino, [])
+
+    indice = {}
+    bajo = {}
+    pila = []
+    en_pila = set()
+    componente = {}
+    for raiz in vecinos:
+        if raiz in indice:
+            continue
+        trabajo = [(raiz, 0)]
+        while trabajo:
+            nodo, i = trabajo.pop()
+            if i == 0:
+                indice[nodo] = bajo[nodo] = len(indice)
+                pila.append(nodo)
+                en_pila.add(nodo)
+            hijos = vecinos[nodo]
+            descender = False
+            while i < len(hijos):
+                hijo = hijos[i]
+                i += 1
+                if hijo not in indice:
+                    trabajo.append((nodo, i))
+                    trabajo.append((hijo, 0))
+                    descender = True
+                    break
+                if hijo in en_pila:
+                    bajo[nodo] = min(bajo[nodo], indice[hijo])
+            if descender:
+                continue
+            if bajo[nodo] == indice[nodo]:
+                while True:
+                    miembro = pila.pop()
+                    en_pila.discard(miembro)
+                    componente[miembro] = nodo
+                    if miembro == nodo:
+                        break
+            if trabajo:
+                padre = trabajo[-1][0]
+                bajo[padre] = min(bajo[padre], bajo[nodo])
+    return componente
+
+
+def _resolver(filas):
+    """
+    Elige el conjunto óptimo de solicitudes de una componente.
+
+    Red: cada turno (usuario, origen) recibe a lo sumo una unidad desde su oportunidad
+    y cada llegada (usuario, destino) entrega a lo sumo una unidad a su oportunidad; las
+    solicitudes unen turnos con llegadas. Se parte de todas las solicitudes satisfechas
+    y el flujo de costo mínimo decide cuáles deshacer para equilibrar salidas y llegadas
+    en cada oportunidad. Deshacer una solicitud cuesta K - prioridad, donde la
+    prioridad favorece la solicitud más antigua de cada turno y K garantiza que
+    primero se maximice el número de intercambios.
+
+    Args:
+        filas: Lista de (solicitud_id, usuario_id, origen_id, destino_id) por antigüedad
+
+    Returns:
+        list: Filas de las solicitudes elegidas
+    """
+    # Posición de cada solicitud entre las de su turno (0 para la más antigua)
+    posiciones = []
+    por_turno = {}
+    for _, usuario_id, origen_id, _ in filas:
+        posicion = por_turno.get((usuario_id, origen_id), 0)
+        por_turno[(usuario_id, origen_id)] = posicion + 1
+        posiciones.append(posicion)
+    maxima = max(posiciones)
+    k = len(filas) * maxima + maxima + 1
+
+    # Nodos: 0 fuente, 1 sumidero, después oportunidades, turnos y llegadas
+    nodos = {}
+
+    def nodo(clave):
+        if clave not in nodos:
+            nodos[clave] = len(nodos) + 2
+        return nodos[clave]
+
+    for _, usuario_id, origen_id, destino_id in filas:
+        nodo(('oportunidad', origen_id))
+        nodo(('oportunidad', destino_id))
+        nodo(('turno', usuario_id, origen_id))
+        nodo(('llegada', usuario_id, destino_id))
+
+    red = RedFlujo(len(nodos) + 2)
+
+    # Cada turno sale de su oportunidad una vez; cada llegada entra una vez
+    salidas = {}
+    llegadas = {}
+    for _, usuario_id, origen_id, destino_id in filas:
+        salidas[(usuario_id, origen_id)] = salidas.get((usuario_id, origen_id), 0) + 1
+        llegadas[(usuario_id, destino_id)] = llegadas.get((usuario_id, destino_id), 0) + 1
+    for (usuario_id, origen_id), cantidad in salidas.items():
+        turno = nodos[('turno', usuario_id, origen_id)]
+        red.agregar_arco(nodos[('oportunidad', origen_id)], turno, 1, 0)
+        red.agregar_arco(turno, 1, cantidad, 0)
+    for (usuario_id, destino_id), cantidad in llegadas.items():
+        llegada = nodos[('llegada', usuario_id, destino_id)]
+        red.agregar_arco(llegada, nodos[('oportunidad', destino_id)], 1, 0)
+        red.agregar_arco(0, llegada, cantidad, 0)
+
+    # Arco para deshacer cada solicitud (de la llegada al turno)
+    arcos = [
+        red.agregar_arco(
+            nodos[('llegada', usuario_id, destino_id)],
+            nodos[('turno', usuario_id, origen_id)],
+            1,
+            k - posicion
+        )
+        for (_, usuario_id, origen_id, destino_id), posicion in zip(filas, posiciones)
+    ]
+
+    red.flujo_costo_minimo(0, 1)
+
+    # Las solicitudes cuyo arco de deshacer no se usó quedan satisfechas
+    return [fila for fila, arco in zip(filas, arcos) if red.capacidad[arco] == 1]
+
+
+def _descomponer_en_ciclos(movimientos):
+    """
+    Descompone un conjunto equilibrado de movimientos (en cada oportunidad salen tantos
+    voluntarios como llegan) en ciclos simples.
+
+    Args:
+        movimientos: Filas (solicitud_id, usuario_id, origen_id, destino_id)
+
+    Returns:
+        list: Ciclos como listas de ids de solicitud en orden de recorrido
+    """
+    salientes = {}
+    for movimiento in reversed(movimientos):
+        salientes.setdefault(movimiento[2], []).append(movimiento)
+
+    usados = set()
+    ciclos = []
+    for inicial in movimientos:
+        if inicial[0] in usados:
+            continue
+        camino = []
+        # Oportunidad -> posición en el camino del movimiento que sale de ella
+        posiciones = {inicial[2]: 0}
+        actual = inicial
+        while True:
+            usados.add(actual[0])
+            camino.append(actual)
+            siguiente = actual[3]
+            if siguiente in posiciones:
+                # Se cerró un ciclo: separarlo y continuar desde esa oportunidad
+                inicio = posiciones[siguiente]
+                ciclos.append([movimiento[0] for movimiento in camino[inicio:]])
+                for movimiento in camino[inicio + 1:]:
+                    del posiciones[movimiento[2]]
+                camino = camino[:inicio]
+                if not camino:
+                    break
+            else:
+                posiciones[siguiente] = len(camino)
+            # Por el equilibrio siempre queda un movimiento sin usar que sale de aquí
+            candidatos = salientes[siguiente]
+            while candidatos[-1][0] in usados:
+                candidatos.pop()
+            actual = candidatos.pop()
+    return ciclos
+
+
+def planificar(filas=None):
+    """
+    Calcula el plan óptimo de intercambios para todas las solicitudes ejecutables.
+
+    Args:
+        filas: Filas (solicitud_id, usuario_id, origen_id, destino_id) por antigüedad;
+               por defecto se cargan con solicitudes_ejecutables()
+
+    Returns:
+        list: Ciclos disjuntos como listas de ids de solicitud
+    """
+    if filas is None:
+        filas = solicitudes_ejecutables().iterator(chunk_size=5000)
+    filas = list(filas)
+    if not filas:
+        return []
+
+    componente = _componentes_fuertes((fila[2], fila[3]) for fila in filas)
+    por_componente = {}
+    for fila in filas:
+        if componente[fila[2]] == componente[fila[3]]:
+            por_componente.setdefault(componente[fila[2]], []).append(fila)
+
+    ciclos = []
+    for grupo in por_componente.values():
+        ciclos.extend(_descomponer_en_ciclos(_resolver(grupo)))
+    return ciclos
+
+
+def aplicar(ciclos, usuario_accion=None):
+    """
+    Aplica un plan en una sola transacción con historial en bloque.
+
+    Returns:
+        bool: True si se aplicó, False si alguna solicitud dejó de ser válida
+    """
+    return ejecutar_ciclos(ciclos, usuario_accion, 'optimizacion', 'optimizacion_conflicto')
@@ -0,0 +1,62 @@
+# Señales que mantienen actualizado el índice CandidatoPermutacion
+from datetime import datetime, time, timedelta
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from eventos import bandeja
+
+from inscripciones.models import Inscripcion
+from oportunidades.models import OportunidadVoluntariado
+from . import candidatos
+
+
+@receiver(post_save, sender=Inscripcion)
+def actualizar_candidatos_inscripcion(sender, instance, raw=False, **kwargs):
+    """Recalcula los candidatos del usuario cuando cambia una de sus inscripciones."""
+    # No actualizar durante la carga de fixtures
+    if raw:
+        return
+    candidatos.refrescar_usuarios([instance.usuario_id])
+
+
+@receiver(post_delete, sender=Inscripcion)
+def actualizar_candidatos_borrado(sender, instance, **kwargs):
+    """
+    Recalcula los candidatos del usuario de una inscripción borrada, una sola vez por
+    transacción aunque se borren muchas (borrados en cascada).
+    """
+    candidatos.refrescar_usuarios_al_confirmar([instance.usuario_id])
+
+
+@receiver(post_save, sender=OportunidadVoluntariado)
+def actualizar_candidatos_oportunidad(sender, instance, raw=False, **kwargs):
+    """Recalcula los candidatos que apuntan a la oportunidad cuando cambia su estado o cupos."""
+    if raw:
+        return
+    candidatos.refrescar_oportunidades([instance.pk])
+
+
+@receiver(post_save, sender=OportunidadVoluntariado)
+def programar_expiracion_oportunidad(sender, instance, created, raw=False, **kwargs):
+    """
+    Programa en la bandeja de salida la expiración de las solicitudes pendientes de la
+    oportunidad para el día siguiente a su fecha de fin. Si la fecha cambia se programa
+    un nuevo evento; el anterior no expira nada porque comprueba la fecha al ejecutarse.
+    """
+    if raw:
+        return
+    fecha_fin = instance.fecha_fin
+    if not created and getattr(instance, '_fecha_fin_guardada', None) == fecha_fin:
+        return
+    instance._fecha_fin_guardada = fecha_fin
+    if isinstance(fecha_fin, str):
+        # Valor asignado desde un formulario o fixture sin convertir
+        fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+    bandeja.registrar(
+        'oportunidad.finalizada',
+        f'oportunidad.finalizada:{instance.pk}:{fecha_fin.isoformat()}',
+        disponible_desde=timezone.make_aware(datetime.combine(fecha_fin + timedelta(days=1), time.min)),
+        oportunidad_id=instance.pk
+    )
@@ -0,0 +1,942 @@
+import itertools
+import random
+import threading
+from collections import Counter
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, models
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inscripciones import contadores
+from eventos import bandeja
+from eventos.models import EventoSalida
+from inscripciones.models import Inscripcion
+from oportunidades.models import OportunidadVoluntariado
+from organizaciones.models import Organizacion
+from usuarios.models import Usuario
+from .models import (
+    SolicitudPermutacion, CandidatoPermutacion, HistorialPermutacion, HistorialPermutacionArchivo,
+    ConflictoConcurrencia
+)
+from .views import ListaPermutacionesView
+from . import archivo, candidatos, espejo, expiracion, optimizador
+from .ciclos import GrafoDeseos, ejecutar_ciclos
+
+
+def crear_usuario(indice):
+    """Crea un voluntario con un correo institucional único."""
+    return Usuario.objects.create_user(
+        f'voluntario{indice}@puce.edu.ec', 'clave-de-prueba', nombre_completo=f'Voluntario {indice}'
+    )
+
+
+def crear_oportunidad(organizacion, titulo, horario='', cupos=10):
+    """Crea una oportunidad abierta y vigente durante los próximos 30 días."""
+    hoy = timezone.localdate()
+    return OportunidadVoluntariado.objects.create(
+        titulo=titulo,
+        descripcion='Oportunidad de prueba',
+        fecha_inicio=hoy,
+        fecha_fin=hoy + timedelta(days=30),
+        organizacion=organizacion,
+        ubicacion='Quito',
+        cupos=cupos,
+        horario=horario
+    )
+
+
+def contar_consultas(funcion):
+    """Ejecuta la función y devuelve (número de consultas, resultado)."""
+    with CaptureQueriesContext(connection) as consultas:
+        resultado = funcion()
+    return len(consultas), resultado
+
+
+def pares(oportunidades):
+    """Convierte el resultado agrupado en un conjunto de pares (oportunidad, usuario)."""
+    return {
+        (op['oportunidad']['id'], usuario['id'])
+        for op in oportunidades
+        for usuario in op['usuarios_disponibles']
+    }
+
+
+class EscenarioPermutaciones:
+    """
+    Datos comunes: un voluntario aceptado en una oportunidad de origen (lunes) y
+    oportunidades de destino (martes, sin conflicto de horario) con contrapartes.
+    """
+
+    def setUp(self):
+        self.organizacion = Organizacion.objects.create(
+            nombre='Organización de prueba', descripcion='Pruebas', contacto_email='org@puce.edu.ec'
+        )
+        self.siguiente = 0
+        self.usuario = self.nuevo_usuario()
+        self.origen = crear_oportunidad(self.organizacion, 'Origen', 'Lunes 9:00 - 12:00')
+        Inscripcion.objects.create(usuario=self.usuario, oportunidad=self.origen, estado='aceptada')
+
+    def nuevo_usuario(self):
+        self.siguiente += 1
+        return crear_usuario(self.siguiente)
+
+    def agregar_destinos(self, cantidad, contrapartes):
+        """Crea `cantidad` oportunidades de destino con `contrapartes` aceptadas cada una."""
+        destinos = []
+        for _ in range(cantidad):
+            destino = crear_oportunidad(self.organizacion, f'Destino {len(destinos)}', 'Martes 9:00 - 12:00')
+            for _ in range(contrapartes):
+                Inscripcion.objects.create(usuario=self.nuevo_usuario(), oportunidad=destino, estado='aceptada')
+            destinos.append(destino)
+        return destinos
+
+    def solicitar(self, solicitante, origen, destino, receptor=None):
+        """
+        Crea una solicitud pendiente de `solicitante` desde `origen` hacia `destino`.
+        Si no se indica, el receptor es el primer otro voluntario aceptado en el destino.
+        """
+        if receptor is None:
+            receptor = Inscripcion.objects.filter(
+                oportunidad=destino, estado='aceptada'
+            ).exclude(usuario=solicitante).order_by('pk').first().usuario
+        return SolicitudPermutacion.objects.create(
+            solicitante=solicitante, receptor=receptor,
+            oportunidad_origen=origen, oportunidad_destino=destino
+        )
+
+    def anillo(self, cantidad):
+        """
+        Crea `cantidad` oportunidades (en días distintos del origen) con un voluntario
+        aceptado en cada una.
+
+        Returns:
+            tuple: (oportunidades, voluntarios) en el mismo orden
+        """
+        oportunidades = []
+        voluntarios = []
+        for indice in range(cantidad):
+            oportunidad = crear_oportunidad(self.organizacion, f'Anillo {indice}', 'Miércoles 9:00 - 12:00')
+            voluntario = self.nuevo_usuario()
+            Inscripcion.objects.create(usuario=voluntario, oportunidad=oportunidad, estado='aceptada')
+            oportunidades.append(oportunidad)
+            voluntarios.append(voluntario)
+        return oportunidades, voluntarios
+
+    def contadores_de(self, oportunidades):
+        """Contadores (pendientes, aceptadas) guardados de cada oportunidad."""
+        return [
+            tuple(OportunidadVoluntariado.objects.values_list('pendientes', 'aceptadas').get(pk=oportunidad.pk))
+            for oportunidad in oportunidades
+        ]
+
+    def inscripciones(self):
+        return sorted(Inscripcion.objects.values_list('usuario_id', 'oportunidad_id', 'estado'))
+
+
+class CalculoPermutacionesTests(EscenarioPermutaciones, TestCase):
+    """El cálculo de candidatos usa un número de consultas que no depende de los datos."""
+
+    def test_calculo_en_vivo_no_crece_con_los_datos(self):
+        self.agregar_destinos(2, contrapartes=2)
+        consultas, resultado = contar_consultas(
+            lambda: SolicitudPermutacion.calcular_permutaciones_posibles(self.usuario, self.origen)
+        )
+        self.assertEqual(len(pares(resultado)), 4)
+
+        self.agregar_destinos(20, contrapartes=5)
+        with self.assertNumQueries(consultas):
+            resultado = SolicitudPermutacion.calcular_permutaciones_posibles(self.usuario, self.origen)
+        self.assertEqual(len(resultado), 22)
+        self.assertEqual(len(pares(resultado)), 4 + 20 * 5)
+
+    def test_indice_no_crece_con_los_datos(self):
+        self.agregar_destinos(2, contrapartes=2)
+        consultas, _ = contar_consultas(
+            lambda: CandidatoPermutacion.oportunidades_para(self.usuario, self.origen)
+        )
+
+        self.agregar_destinos(20, contrapartes=5)
+        with self.assertNumQueries(consultas):
+            indexado = CandidatoPermutacion.oportunidades_para(self.usuario, self.origen)
+        # El índice y el cálculo en vivo coinciden
+        self.assertEqual(
+            pares(indexado),
+            pares(SolicitudPermutacion.calcular_permutaciones_posibles(self.usuario, self.origen))
+        )
+
+    def test_excluye_contrapartes_ya_inscritas_en_el_origen(self):
+        destino, = self.agregar_destinos(1, contrapartes=2)
+        contraparte = Inscripcion.objects.filter(oportunidad=destino).first().usuario
+        Inscripcion.objects.create(usuario=contraparte, oportunidad=self.origen, estado='pendiente')
+
+        resultado = SolicitudPermutacion.calcular_permutaciones_posibles(self.usuario, self.origen)
+        self.assertNotIn((destino.id, contraparte.id), pares(resultado))
+        self.assertEqual(len(pares(resultado)), 1)
+
+
+class BorradoEnCascadaTests(EscenarioPermutaciones, TestCase):
+    """Los borrados en cascada refrescan el índice una vez por transacción."""
+
+    def filas_indice(self):
+        return sorted(CandidatoPermutacion.objects.values_list(
+            'usuario_id', 'oportunidad_origen_id', 'oportunidad_destino_id', 'contraparte_id'
+        ))
+
+    def test_borrar_oportunidad_refresca_una_vez(self):
+        destino, otro = self.agregar_destinos(2, contrapartes=5)
+        self.assertTrue(CandidatoPermutacion.objects.filter(oportunidad_destino=destino).exists())
+
+        with mock.patch.object(candidatos, 'refrescar_usuarios', wraps=candidatos.refrescar_usuarios) as refrescar:
+            with self.captureOnCommitCallbacks(execute=True):
+                destino.delete()
+        refrescar.assert_called_once()
+        self.assertEqual(len(refrescar.call_args.args[0]), 5)
+
+        # El índice queda igual que si se reconstruyera desde cero
+        filas = self.filas_indice()
+        candidatos.reconstruir()
+        self.assertEqual(filas, self.filas_indice())
+        self.assertFalse(CandidatoPermutacion.objects.filter(oportunidad_destino_id=destino.id).exists())
+
+
+class AceptacionEnBloqueTests(EscenarioPermutaciones, TestCase):
+    """Aceptar una solicitud rechaza las conflictivas con un número constante de consultas."""
+
+    def escenario(self, conflictivas):
+        """
+        Crea la solicitud a aceptar y `conflictivas` solicitudes pendientes del mismo
+        solicitante desde el mismo origen hacia otros destinos.
+        """
+        destinos = self.agregar_destinos(conflictivas + 1, contrapartes=1)
+        solicitudes = [
+            SolicitudPermutacion.objects.create(
+                solicitante=self.usuario,
+                receptor=Inscripcion.objects.get(oportunidad=destino).usuario,
+                oportunidad_origen=self.origen,
+                oportunidad_destino=destino
+            )
+            for destino in destinos
+        ]
+        return solicitudes[0], solicitudes[1:]
+
+    def test_consultas_constantes_con_las_conflictivas(self):
+        solicitud, otras = self.escenario(1)
+        consultas, resultado = contar_consultas(solicitud.aceptar)
+        self.assertEqual(resultado[0], 'aceptada')
+        self.assertEqual(SolicitudPermutacion.objects.get(pk=otras[0].pk).estado, 'rechazada')
+
+        # Mismo escenario con un voluntario nuevo y 40 solicitudes conflictivas
+        self.usuario = self.nuevo_usuario()
+        Inscripcion.objects.create(usuario=self.usuario, oportunidad=self.origen, estado='aceptada')
+        solicitud, otras = self.escenario(40)
+        with self.assertNumQueries(consultas):
+            estado, _ = solicitud.aceptar()
+        self.assertEqual(estado, 'aceptada')
+        self.assertEqual(
+            SolicitudPermutacion.objects.filter(pk__in=[otra.pk for otra in otras], estado='rechazada').count(),
+            40
+        )
+        self.assertEqual(
+            HistorialPermutacion.objects.filter(
+                solicitud__in=otras, accion='rechazo', datos__motivo='conflicto'
+            ).count(),
+            40
+        )
+
+
+class AceptacionConcurrenteTests(EscenarioPermutaciones, TestCase):
+    """La vista de aceptación informa los conflictos de versión sin fallar."""
+
+    def test_version_desactualizada_redirige(self):
+        destino, = self.agregar_destinos(1, contrapartes=1)
+        receptor = Inscripcion.objects.get(oportunidad=destino).usuario
+        solicitud = SolicitudPermutacion.objects.create(
+            solicitante=self.usuario, receptor=receptor,
+            oportunidad_origen=self.origen, oportunidad_destino=destino
+        )
+        self.client.force_login(receptor)
+
+        respuesta = self.client.post(
+            reverse('permutaciones:aceptar', args=[solicitud.pk]),
+            {'version': solicitud.version + 1}
+        )
+        self.assertRedirects(respuesta, reverse('permutaciones:lista'), fetch_redirect_response=False)
+        solicitud.refresh_from_db()
+        self.assertEqual(solicitud.estado, 'pendiente')
+        self.assertTrue(Inscripcion.objects.filter(usuario=self.usuario, oportunidad=self.origen).exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Requiere bloqueos de fila reales (PostgreSQL)')
+class AceptacionEnParaleloTests(EscenarioPermutaciones, TransactionTestCase):
+    """
+    Aceptaciones simultáneas desde varios hilos sobre solicitudes que comparten
+    turnos: solo una puede intercambiar y ninguna inscripción se pierde ni se duplica.
+    """
+
+    HILOS = 8
+
+    def aceptar_en_paralelo(self, solicitudes):
+        """Acepta cada solicitud en su propio hilo, todos liberados a la vez."""
+        barrera = threading.Barrier(len(solicitudes))
+        resultados = []
+
+        def aceptar(pk):
+            try:
+                solicitud = SolicitudPermutacion.objects.get(pk=pk)
+                barrera.wait()
+                try:
+                    resultados.append(solicitud.aceptar()[0])
+                except ConflictoConcurrencia:
+                    resultados.append('conflicto')
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=aceptar, args=(solicitud.pk,)) for solicitud in solicitudes]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return resultados
+
+    def test_solicitudes_conflictivas(self):
+        destinos = self.agregar_destinos(self.HILOS, contrapartes=1)
+        solicitudes = [
+            SolicitudPermutacion.objects.create(
+                solicitante=self.usuario,
+                receptor=Inscripcion.objects.get(oportunidad=destino).usuario,
+                oportunidad_origen=self.origen,
+                oportunidad_destino=destino
+            )
+            for destino in destinos
+        ]
+        antes = Inscripcion.objects.count()
+
+        resultados = self.aceptar_en_paralelo(solicitudes)
+
+        self.assertEqual(resultados.count('aceptada'), 1)
+        self.assertEqual(Inscripcion.objects.count(), antes)
+        # El solicitante quedó en exactamente una oportunidad y el origen tiene un solo ocupante
+        self.assertEqual(Inscripcion.objects.filter(usuario=self.usuario).count(), 1)
+        self.assertEqual(Inscripcion.objects.filter(oportunidad=self.origen).count(), 1)
+        self.assertFalse(SolicitudPermutacion.objects.filter(estado='pendiente').exists())
+
+    def test_misma_solicitud(self):
+        destino, = self.agregar_destinos(1, contrapartes=1)
+        receptor = Inscripcion.objects.get(oportunidad=destino).usuario
+        solicitud = SolicitudPermutacion.objects.create(
+            solicitante=self.usuario, receptor=receptor,
+            oportunidad_origen=self.origen, oportunidad_destino=destino
+        )
+
+        resultados = self.aceptar_en_paralelo([solicitud] * self.HILOS)
+
+        self.assertEqual(resultados.count('aceptada'), 1)
+        self.assertEqual(resultados.count('conflicto'), self.HILOS - 1)
+        self.assertEqual(self.inscripciones(), sorted([
+            (self.usuario.id, destino.id, 'aceptada'),
+            (receptor.id, self.origen.id, 'aceptada'),
+        ]))
+
+
+class ListaPermutacionesTests(EscenarioPermutaciones, TestCase):
+    """La lista de permutaciones se renderiza con un número constante de consultas."""
+
+    def agregar_solicitudes(self, cantidad):
+        """Crea `cantidad` destinos con una contraparte y una solicitud en cada sentido."""
+        for destino in self.agregar_destinos(cantidad, contrapartes=1):
+            contraparte = Inscripcion.objects.get(oportunidad=destino).usuario
+            SolicitudPermutacion.objects.create(
+                solicitante=self.usuario, receptor=contraparte,
+                oportunidad_origen=self.origen, oportunidad_destino=destino
+            )
+            SolicitudPermutacion.objects.create(
+                solicitante=contraparte, receptor=self.usuario,
+                oportunidad_origen=destino, oportunidad_destino=self.origen
+            )
+
+    def test_consultas_constantes(self):
+        self.client.force_login(self.usuario)
+        url = f"{reverse('permutaciones:lista')}?oportunidad_id={self.origen.id}"
+
+        self.agregar_solicitudes(1)
+        consultas, respuesta = contar_consultas(lambda: self.client.get(url))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.context['oportunidades_permutables']), 1)
+
+        self.agregar_solicitudes(15)
+        with self.assertNumQueries(consultas):
+            respuesta = self.client.get(url)
+        self.assertEqual(len(respuesta.context['solicitudes_enviadas']), 16)
+        self.assertEqual(len(respuesta.context['solicitudes_recibidas']), 16)
+        self.assertEqual(len(respuesta.context['oportunidades_permutables']), 16)
+
+
+class ContrapartesDisponiblesTests(EscenarioPermutaciones, TestCase):
+    """
+    Las contrapartes de un intercambio se resuelven en una sola consulta, también
+    con 5.000 voluntarios inscritos en la oportunidad de destino.
+    """
+
+    VOLUNTARIOS = 5000
+
+    def test_una_consulta_con_5000_inscritos(self):
+        destino = crear_oportunidad(self.organizacion, 'Destino', 'Martes 9:00 - 12:00')
+        choque = crear_oportunidad(self.organizacion, 'Choque', 'Lunes 11:00 - 13:00')
+        libre = crear_oportunidad(self.organizacion, 'Libre', 'Miércoles 9:00 - 12:00')
+        # Carga masiva sin señales: solo interesa la consulta de contrapartes
+        usuarios = Usuario.objects.bulk_create([
+            Usuario(email=f'masivo{indice}@puce.edu.ec', nombre_completo=f'Masivo {indice}', password='!')
+            for indice in range(self.VOLUNTARIOS)
+        ])
+        inscripciones = []
+        esperados = set()
+        for indice, usuario in enumerate(usuarios):
+            inscripciones.append(Inscripcion(usuario=usuario, oportunidad=destino, estado='aceptada'))
+            if indice % 10 == 0:
+                # Ya tiene una inscripción (aunque esté pendiente) en el origen
+                inscripciones.append(Inscripcion(usuario=usuario, oportunidad=self.origen, estado='pendiente'))
+            elif indice % 10 == 1:
+                # Conflicto de horario con el origen
+                inscripciones.append(Inscripcion(usuario=usuario, oportunidad=choque, estado='aceptada'))
+            else:
+                if indice % 10 == 2:
+                    inscripciones.append(Inscripcion(usuario=usuario, oportunidad=libre, estado='aceptada'))
+                elif indice % 10 == 3:
+                    # Las inscripciones pendientes no generan conflicto
+                    inscripciones.append(Inscripcion(usuario=usuario, oportunidad=choque, estado='pendiente'))
+                esperados.add(usuario.id)
+        Inscripcion.objects.bulk_create(inscripciones)
+
+        vista = ListaPermutacionesView()
+        with self.assertNumQueries(1):
+            disponibles = set(
+                vista.obtener_usuarios_disponibles_para_intercambio(self.usuario, self.origen, destino)
+                .values_list('id', flat=True)
+            )
+        self.assertEqual(disponibles, esperados)
+        self.assertEqual(len(disponibles), self.VOLUNTARIOS * 8 // 10)
+
+
+class ArchivoHistorialTests(EscenarioPermutaciones, TestCase):
+    """El traslado al archivo invalida los contadores de gestión una vez por lote."""
+
+    def test_archivar_invalida_una_vez_por_lote(self):
+        destinos = self.agregar_destinos(3, contrapartes=1)
+        for destino in destinos:
+            SolicitudPermutacion.objects.create(
+                solicitante=self.usuario,
+                receptor=Inscripcion.objects.get(oportunidad=destino).usuario,
+                oportunidad_origen=self.origen,
+                oportunidad_destino=destino
+            )
+        corte = timezone.now()
+        HistorialPermutacion.objects.update(fecha=corte - timedelta(days=1))
+        contadores.obtener()
+
+        with mock.patch.object(contadores, 'invalidar', wraps=contadores.invalidar) as invalidar:
+            with self.captureOnCommitCallbacks(execute=True):
+                archivados = list(archivo.archivar(corte, tamano_lote=2))
+        self.assertEqual(archivados, [2, 1])
+        self.assertEqual(invalidar.call_count, 2)
+        self.assertIsNone(cache.get(contadores.CLAVE))
+        self.assertFalse(HistorialPermutacion.objects.exists())
+        self.assertEqual(HistorialPermutacionArchivo.objects.count(), 3)
+
+
+class GrafoDeseosTests(SimpleTestCase):
+    """La búsqueda voraz devuelve ciclos válidos y disjuntos."""
+
+    def comprobar_ciclos(self, filas, longitud_minima, longitud_maxima):
+        """Busca los ciclos del grafo y comprueba que sean cerrados, de longitud válida y disjuntos."""
+        por_id = {fila[0]: fila for fila in filas}
+        ciclos = list(GrafoDeseos(filas).ciclos(longitud_minima, longitud_maxima))
+        usados = set()
+        for ciclo in ciclos:
+            self.assertGreaterEqual(len(ciclo), longitud_minima)
+            self.assertLessEqual(len(ciclo), longitud_maxima)
+            # Cada solicitante llega al turno que deja el siguiente, y el último cierra el ciclo
+            for actual, siguiente in zip(ciclo, ciclo[1:] + ciclo[:1]):
+                self.assertEqual(por_id[actual][3], por_id[siguiente][2])
+            usuarios = [por_id[pk][1] for pk in ciclo]
+            self.assertEqual(len(set(usuarios)), len(usuarios))
+            self.assertFalse(usados & set(usuarios))
+            usados.update(usuarios)
+        return ciclos
+
+    def test_ciclos_aleatorios_validos_y_disjuntos(self):
+        aleatorio = random.Random(2024)
+        for _ in range(30):
+            filas = []
+            for usuario in range(40):
+                origen = aleatorio.randrange(8)
+                for destino in aleatorio.sample([o for o in range(8) if o != origen], aleatorio.randint(1, 3)):
+                    filas.append((len(filas) + 1, usuario, origen, destino))
+            for longitud_maxima in (3, 4, 5):
+                self.comprobar_ciclos(filas, 3, longitud_maxima)
+
+    def test_respeta_la_longitud_minima(self):
+        # Un intercambio directo (k = 2) y un ciclo de tres entre otras oportunidades
+        filas = [(1, 10, 0, 1), (2, 11, 1, 0), (3, 12, 2, 3), (4, 13, 3, 4), (5, 14, 4, 2)]
+        self.assertEqual(self.comprobar_ciclos(filas, 3, 4), [[3, 4, 5]])
+        self.assertEqual(self.comprobar_ciclos(filas, 2, 4), [[1, 2], [3, 4, 5]])
+
+    def test_un_voluntario_no_participa_en_dos_ciclos(self):
+        # El voluntario 10 cierra dos ciclos posibles: solo se usa el más antiguo
+        filas = [(1, 10, 0, 1), (2, 11, 1, 2), (3, 12, 2, 0), (4, 10, 0, 3), (5, 13, 3, 4), (6, 14, 4, 0)]
+        self.assertEqual(self.comprobar_ciclos(filas, 3, 4), [[1, 2, 3]])
+
+
+class EjecutarCiclosTests(EscenarioPermutaciones, TestCase):
+    """La ejecución de ciclos es atómica y mantiene los contadores de las oportunidades."""
+
+    def setUp(self):
+        super().setUp()
+        self.oportunidades, self.voluntarios = self.anillo(3)
+        # Cada voluntario pide el turno del siguiente: 0 -> 1 -> 2 -> 0
+        self.ciclo = [
+            self.solicitar(voluntario, oportunidad, self.oportunidades[(indice + 1) % 3]).pk
+            for indice, (voluntario, oportunidad) in enumerate(zip(self.voluntarios, self.oportunidades))
+        ]
+
+    def estado(self):
+        """Instantánea de todo lo que ejecutar_ciclos puede escribir."""
+        return (
+            self.inscripciones(),
+            sorted(SolicitudPermutacion.objects.values_list('pk', 'estado', 'version')),
+            HistorialPermutacion.objects.count(),
+            EventoSalida.objects.count(),
+            self.contadores_de(self.oportunidades)
+        )
+
+    def test_ejecuta_el_ciclo(self):
+        contadores_previos = self.contadores_de(self.oportunidades)
+
+        self.assertTrue(ejecutar_ciclos([self.ciclo]))
+
+        for indice, voluntario in enumerate(self.voluntarios):
+            self.assertEqual(
+                list(Inscripcion.objects.filter(usuario=voluntario).values_list('oportunidad_id', 'estado')),
+                [(self.oportunidades[(indice + 1) % 3].pk, 'aceptada')]
+            )
+        self.assertEqual(
+            SolicitudPermutacion.objects.filter(pk__in=self.ciclo, estado='aceptada').count(), 3
+        )
+        self.assertEqual(
+            HistorialPermutacion.objects.filter(
+                solicitud_id__in=self.ciclo, accion='aceptacion', datos__motivo='ciclo'
+            ).count(),
+            3
+        )
+        # Cada oportunidad pierde y gana un aceptado: los contadores no cambian
+        self.assertEqual(self.contadores_de(self.oportunidades), contadores_previos)
+        self.assertEqual(contadores_previos, [
+            (
+                Inscripcion.objects.filter(oportunidad=oportunidad, estado='pendiente').count(),
+                Inscripcion.objects.filter(oportunidad=oportunidad, estado='aceptada').count()
+            )
+            for oportunidad in self.oportunidades
+        ])
+
+    def test_solicitud_cerrada_no_escribe_nada(self):
+        SolicitudPermutacion.objects.filter(pk=self.ciclo[1]).update(estado='cancelada')
+        previo = self.estado()
+
+        self.assertFalse(ejecutar_ciclos([self.ciclo]))
+        self.assertEqual(self.estado(), previo)
+
+    def test_inscripcion_cambiada_no_escribe_nada(self):
+        Inscripcion.objects.filter(usuario=self.voluntarios[2]).update(estado='pendiente')
+        previo = self.estado()
+
+        self.assertFalse(ejecutar_ciclos([self.ciclo]))
+        self.assertEqual(self.estado(), previo)
+
+    def test_version_cambiada_no_escribe_nada(self):
+        previo = self.estado()
+        cambiada = []
+
+        def modificar_antes_del_bloqueo(execute, sql, params, many, context):
+            # Simula otra transacción que confirma un cambio entre la lectura y el bloqueo
+            if not cambiada and sql.startswith(
+                'SELECT "permutaciones_solicitudpermutacion"."id", "permutaciones_solicitudpermutacion"."version"'
+            ):
+                cambiada.append(True)
+                SolicitudPermutacion.objects.filter(pk=self.ciclo[0]).update(version=models.F('version') + 1)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(modificar_antes_del_bloqueo):
+            self.assertFalse(ejecutar_ciclos([self.ciclo]))
+        self.assertTrue(cambiada)
+        # Nada cambió salvo la versión modificada por la otra transacción
+        inscripciones, _, historial, eventos, contadores_oportunidades = self.estado()
+        self.assertEqual(
+            (inscripciones, historial, eventos, contadores_oportunidades),
+            (previo[0], previo[2], previo[3], previo[4])
+        )
+        self.assertEqual(SolicitudPermutacion.objects.filter(pk__in=self.ciclo, estado='pendiente').count(), 3)
+
+    def test_rechaza_conflictivas_y_cancela_la_difusion(self):
+        # El primer voluntario difunde su turno: una propuesta entra en el ciclo y la otra no
+        otro_destino, = self.agregar_destinos(1, contrapartes=1)
+        receptor = Inscripcion.objects.get(oportunidad=otro_destino).usuario
+        SolicitudPermutacion.objects.filter(pk=self.ciclo[0]).delete()
+        difusion, _ = SolicitudPermutacion.crear_difusion(
+            self.voluntarios[0], self.oportunidades[0],
+            [(self.voluntarios[1].pk, self.oportunidades[1].pk), (receptor.pk, otro_destino.pk)]
+        )
+        self.ciclo[0] = difusion[0].pk
+        # Otra solicitud del segundo voluntario desde el mismo turno y otra que pide ese turno
+        misma_salida = self.solicitar(self.voluntarios[1], self.oportunidades[1], otro_destino)
+        mismo_turno = self.solicitar(receptor, otro_destino, self.oportunidades[1], self.voluntarios[1])
+
+        self.assertTrue(ejecutar_ciclos([self.ciclo]))
+
+        self.assertEqual(SolicitudPermutacion.objects.get(pk=difusion[1].pk).estado, 'cancelada')
+        self.assertTrue(HistorialPermutacion.objects.filter(
+            solicitud=difusion[1], accion='cancelacion', datos__motivo='difusion_aceptada'
+        ).exists())
+        for solicitud in (misma_salida, mismo_turno):
+            self.assertEqual(SolicitudPermutacion.objects.get(pk=solicitud.pk).estado, 'rechazada')
+            self.assertTrue(HistorialPermutacion.objects.filter(
+                solicitud=solicitud, accion='rechazo', datos__motivo='ciclo_conflicto'
+            ).exists())
+
+
+class OptimizadorTests(SimpleTestCase):
+    """La optimización global satisface el máximo de solicitudes con ciclos equilibrados."""
+
+    def maximo_por_fuerza_bruta(self, filas):
+        """
+        Prueba todas las combinaciones de a lo sumo una solicitud por voluntario y
+        devuelve el mayor número de movimientos que deja equilibrada cada oportunidad.
+        """
+        por_usuario = {}
+        for fila in filas:
+            por_usuario.setdefault(fila[1], [None]).append(fila)
+        maximo = 0
+        for eleccion in itertools.product(*por_usuario.values()):
+            elegidas = [fila for fila in eleccion if fila is not None]
+            if Counter(fila[2] for fila in elegidas) == Counter(fila[3] for fila in elegidas):
+                maximo = max(maximo, len(elegidas))
+        return maximo
+
+    def comprobar_plan(self, filas, ciclos):
+        """Comprueba que los ciclos sean cerrados y disjuntos y que equilibren cada oportunidad."""
+        por_id = {fila[0]: fila for fila in filas}
+        elegidas = [por_id[pk] for ciclo in ciclos for pk in ciclo]
+        self.assertEqual(len({fila[0] for fila in elegidas}), len(elegidas))
+        self.assertEqual(len({fila[1] for fila in elegidas}), len(elegidas))
+        self.assertEqual(Counter(fila[2] for fila in elegidas), Counter(fila[3] for fila in elegidas))
+        for ciclo in ciclos:
+            for actual, siguiente in zip(ciclo, ciclo[1:] + ciclo[:1]):
+                self.assertEqual(por_id[actual][3], por_id[siguiente][2])
+            # Ciclo simple: no pasa dos veces por la misma oportunidad
+            self.assertEqual(len({por_id[pk][2] for pk in ciclo}), len(ciclo))
+        return elegidas
+
+    def test_coincide_con_la_fuerza_bruta(self):
+        aleatorio = random.Random(7)
+        for _ in range(40):
+            filas = []
+            for usuario in range(7):
+                origen = aleatorio.randrange(5)
+                for destino in aleatorio.sample([o for o in range(5) if o != origen], aleatorio.randint(1, 3)):
+                    filas.append((len(filas) + 1, usuario, origen, destino))
+            ciclos = optimizador.planificar(filas)
+            elegidas = self.comprobar_plan(filas, ciclos)
+            self.assertEqual(len(elegidas), self.maximo_por_fuerza_bruta(filas))
+
+    def test_prefiere_mas_intercambios_que_el_ciclo_corto(self):
+        # El voluntario 10 puede cerrar un intercambio directo con 12 o un ciclo de tres
+        filas = [(1, 10, 0, 2), (2, 10, 0, 1), (3, 11, 1, 2), (4, 12, 2, 0)]
+        ciclos = optimizador.planificar(filas)
+        self.assertEqual(sorted(pk for ciclo in ciclos for pk in ciclo), [2, 3, 4])
+
+    def test_descomposicion_cubre_cada_movimiento_una_vez(self):
+        # Dos ciclos que comparten oportunidades (un "ocho") y un intercambio directo
+        movimientos = [
+            (1, 10, 0, 1), (2, 11, 1, 0), (3, 12, 0, 2), (4, 13, 2, 1),
+            (5, 14, 1, 3), (6, 15, 3, 0), (7, 16, 4, 5), (8, 17, 5, 4),
+        ]
+        aleatorio = random.Random(3)
+        for _ in range(20):
+            aleatorio.shuffle(movimientos)
+            ciclos = optimizador._descomponer_en_ciclos(movimientos)
+            self.assertEqual(sorted(pk for ciclo in ciclos for pk in ciclo), list(range(1, 9)))
+            self.comprobar_plan(movimientos, ciclos)
+
+
+class AplicarOptimizacionTests(EscenarioPermutaciones, TestCase):
+    """El plan óptimo se aplica con historial en bloque y contadores consistentes."""
+
+    def test_aplicar_registra_historial_y_mantiene_contadores(self):
+        oportunidades, voluntarios = self.anillo(3)
+        ciclo = [
+            self.solicitar(voluntario, oportunidad, oportunidades[(indice + 1) % 3])
+            for indice, (voluntario, oportunidad) in enumerate(zip(voluntarios, oportunidades))
+        ]
+        # Alternativa de dos movimientos que el óptimo descarta y rechaza por conflicto
+        descartada = self.solicitar(voluntarios[0], oportunidades[0], oportunidades[2])
+        contadores_previos = self.contadores_de(oportunidades)
+
+        plan = optimizador.planificar()
+        self.assertEqual(sorted(pk for c in plan for pk in c), sorted(s.pk for s in ciclo))
+        self.assertTrue(optimizador.aplicar(plan))
+
+        self.assertEqual(
+            HistorialPermutacion.objects.filter(
+                solicitud__in=ciclo, accion='aceptacion', datos__motivo='optimizacion'
+            ).count(),
+            3
+        )
+        self.assertTrue(HistorialPermutacion.objects.filter(
+            solicitud=descartada, accion='rechazo', datos__motivo='optimizacion_conflicto'
+        ).exists())
+        self.assertEqual(
+            EventoSalida.objects.filter(tipo='permutacion.aceptada').count(), 3
+        )
+        for indice, voluntario in enumerate(voluntarios):
+            self.assertEqual(
+                Inscripcion.objects.get(usuario=voluntario).oportunidad_id, oportunidades[(indice + 1) % 3].pk
+            )
+        self.assertEqual(self.contadores_de(oportunidades), contadores_previos)
+
+        # El plan ya aplicado deja de ser válido y no escribe nada
+        historial = HistorialPermutacion.objects.count()
+        self.assertFalse(optimizador.aplicar(plan))
+        self.assertEqual(HistorialPermutacion.objects.count(), historial)
+
+
+class ExpiracionTests(EscenarioPermutaciones, TestCase):
+    """Las solicitudes pendientes expiran por plazo o por fin de sus oportunidades, lote a lote."""
+
+    def setUp(self):
+        super().setUp()
+        self.destinos = self.agregar_destinos(5, contrapartes=1)
+        self.solicitudes = [self.solicitar(self.usuario, self.origen, destino) for destino in self.destinos]
+
+    def expiradas(self, motivo):
+        """Ids de las solicitudes expiradas con historial del motivo dado."""
+        return set(SolicitudPermutacion.objects.filter(
+            estado='expirada', historial__accion='expiracion', historial__datos__motivo=motivo
+        ).values_list('pk', flat=True))
+
+    def test_plazo_vencido(self):
+        corte = timezone.now()
+        anteriores = [solicitud.pk for solicitud in self.solicitudes[:3]]
+        SolicitudPermutacion.objects.filter(pk__in=anteriores).update(fecha_creacion=corte - timedelta(seconds=1))
+        # Creadas justo en el corte o después: siguen vigentes
+        SolicitudPermutacion.objects.filter(pk=self.solicitudes[3].pk).update(fecha_creacion=corte)
+        SolicitudPermutacion.objects.filter(pk=self.solicitudes[4].pk).update(fecha_creacion=corte + timedelta(seconds=1))
+
+        self.assertEqual(list(expiracion.expirar(corte=corte)), [('plazo_vencido', 3)])
+        self.assertEqual(self.expiradas('plazo_vencido'), set(anteriores))
+        self.assertEqual(
+            SolicitudPermutacion.objects.filter(estado='pendiente').count(), 2
+        )
+
+    def test_oportunidad_de_destino_u_origen_finalizada(self):
+        ayer = timezone.localdate() - timedelta(days=1)
+        OportunidadVoluntariado.objects.filter(pk=self.destinos[0].pk).update(fecha_fin=ayer)
+
+        self.assertEqual(list(expiracion.expirar()), [('oportunidad_finalizada', 1)])
+        self.assertEqual(self.expiradas('oportunidad_finalizada'), {self.solicitudes[0].pk})
+
+        # Si finaliza el origen expiran todas las demás
+        OportunidadVoluntariado.objects.filter(pk=self.origen.pk).update(fecha_fin=ayer)
+        self.assertEqual(list(expiracion.expirar()), [('oportunidad_finalizada', 4)])
+        self.assertFalse(SolicitudPermutacion.objects.filter(estado='pendiente').exists())
+
+    def test_evento_con_fecha_de_fin_aplazada_no_expira(self):
+        hoy = timezone.localdate()
+        # La fecha de fin pasa a ayer (el evento queda disponible) y después se aplaza
+        self.origen.fecha_fin = hoy - timedelta(days=1)
+        self.origen.save()
+        self.origen.fecha_fin = hoy + timedelta(days=10)
+        self.origen.save()
+        anterior = EventoSalida.objects.get(
+            tipo='oportunidad.finalizada', clave=f'oportunidad.finalizada:{self.origen.pk}:{hoy - timedelta(days=1)}'
+        )
+        self.assertTrue(EventoSalida.objects.filter(
+            tipo='oportunidad.finalizada', clave=f'oportunidad.finalizada:{self.origen.pk}:{hoy + timedelta(days=10)}',
+            disponible_desde__gt=timezone.now()
+        ).exists())
+
+        bandeja.procesar_lote()
+        anterior.refresh_from_db()
+        self.assertEqual(anterior.estado, 'procesado')
+        self.assertEqual(SolicitudPermutacion.objects.filter(estado='pendiente').count(), 5)
+
+        # Con la fecha de fin realmente vencida el mismo manejador sí expira
+        OportunidadVoluntariado.objects.filter(pk=self.origen.pk).update(fecha_fin=hoy - timedelta(days=1))
+        self.assertEqual(expiracion.expirar_oportunidad(self.origen.pk), 5)
+
+    def test_historial_y_eventos_por_lote(self):
+        SolicitudPermutacion.objects.update(fecha_creacion=timezone.now() - timedelta(days=1))
+
+        with mock.patch.object(bandeja, 'registrar_varios', wraps=bandeja.registrar_varios) as registrar_varios, \
+                mock.patch.object(contadores, 'invalidar', wraps=contadores.invalidar) as invalidar:
+            lotes = list(expiracion.expirar(corte=timezone.now(), tamano_lote=2))
+
+        self.assertEqual(lotes, [('plazo_vencido', 2), ('plazo_vencido', 2), ('plazo_vencido', 1)])
+        # Una inserción de eventos y una invalidación por lote
+        self.assertEqual([len(llamada.args[0]) for llamada in registrar_varios.call_args_list], [2, 2, 1])
+        self.assertEqual(invalidar.call_count, 3)
+        self.assertEqual(
+            EventoSalida.objects.filter(tipo='permutacion.expirada').count(), 5
+        )
+        self.assertEqual(
+            HistorialPermutacion.objects.filter(accion='expiracion', datos__motivo='plazo_vencido').count(), 5
+        )
+
+
+class ParejasEspejoTests(SimpleTestCase):
+    """El emparejamiento en memoria usa a cada voluntario y cada turno una sola vez."""
+
+    def test_no_repite_voluntarios_ni_turnos_movidos(self):
+        # Filas (id, solicitante, receptor, origen, destino) por antigüedad; oportunidades X=1, Y=2, Z=3, W=4
+        filas = [
+            (1, 'g', 'a', 3, 1),   # Espera el turno de "a" en X
+            (2, 'a', 'b', 1, 2),
+            (3, 'b', 'a', 2, 1),   # Pareja con 2: "a" deja X y "b" deja Y
+            (4, 'c', 'a', 2, 1),   # Misma arista que 3: "a" ya está emparejado
+            (5, 'a', 'd', 1, 3),   # "a" ya participa en una pareja
+            (6, 'd', 'a', 3, 1),
+            (7, 'e', 'b', 4, 2),   # Pide el turno de "b" en Y, que ya se movió
+            (8, 'f', 'e', 2, 4),
+            (9, 'h', 'g', 1, 3),   # Encontraría a 1, pero el turno de "a" en X ya se movió
+        ]
+        self.assertEqual(espejo.parejas(filas), [[2, 3]])
+
+    def test_empareja_con_la_mas_antigua_disponible(self):
+        filas = [
+            (1, 'a', 'c', 1, 2),
+            (2, 'b', 'd', 1, 2),
+            (3, 'c', 'a', 2, 1),
+            (4, 'd', 'b', 2, 1),
+        ]
+        self.assertEqual(espejo.parejas(filas), [[1, 3], [2, 4]])
+
+
+class EmparejamientoEspejoTests(EscenarioPermutaciones, TestCase):
+    """Las solicitudes recíprocas se ejecutan al crearse y en el barrido por lotes."""
+
+    def pareja(self):
+        """Crea dos voluntarios en oportunidades distintas que se piden el turno mutuamente."""
+        (primera, segunda), (uno, otro) = self.anillo(2)
+        return [self.solicitar(uno, primera, segunda).pk, self.solicitar(otro, segunda, primera).pk]
+
+    def test_pareja_ejecutada_al_crear(self):
+        destino, = self.agregar_destinos(1, contrapartes=1)
+        receptor = Inscripcion.objects.get(oportunidad=destino).usuario
+        reciproca = self.solicitar(receptor, destino, self.origen, self.usuario)
+        self.client.force_login(self.usuario)
+
+        respuesta = self.client.post(
+            reverse('permutaciones:crear', args=[self.origen.pk]),
+            {'oportunidad_destino': destino.pk, 'usuario_destino': receptor.pk}
+        )
+        self.assertRedirects(respuesta, reverse('permutaciones:lista'), fetch_redirect_response=False)
+        self.assertEqual(Inscripcion.objects.get(usuario=self.usuario).oportunidad_id, destino.pk)
+        self.assertEqual(Inscripcion.objects.get(usuario=receptor).oportunidad_id, self.origen.pk)
+        self.assertEqual(
+            HistorialPermutacion.objects.filter(accion='aceptacion', datos__motivo='espejo').count(), 2
+        )
+        self.assertEqual(SolicitudPermutacion.objects.get(pk=reciproca.pk).estado, 'aceptada')
+
+    def test_barrido_no_empareja_dos_veces_al_mismo_voluntario(self):
+        (x, y, z), (a, b, c) = self.anillo(3)
+        self.solicitar(a, x, y)
+        self.solicitar(b, y, x)
+        # "a" también tiene una pareja posible con "c", pero ya se movió en la primera
+        conflictiva = self.solicitar(a, x, z)
+        self.solicitar(c, z, x)
+
+        resultados = list(espejo.barrer())
+        self.assertEqual([ejecutada for _, ejecutada in resultados], [True])
+        self.assertEqual(Inscripcion.objects.get(usuario=a).oportunidad_id, y.pk)
+        self.assertEqual(Inscripcion.objects.get(usuario=c).oportunidad_id, z.pk)
+        self.assertTrue(HistorialPermutacion.objects.filter(
+            solicitud=conflictiva, accion='rechazo', datos__motivo='espejo_conflicto'
+        ).exists())
+
+    def test_lote_fallido_se_reintenta_pareja_por_pareja(self):
+        primera = self.pareja()
+        segunda = self.pareja()
+        parejas = espejo.parejas
+
+        def invalidar_segunda(filas):
+            encontradas = parejas(filas)
+            # Otra operación cancela una solicitud entre la búsqueda y la ejecución
+            SolicitudPermutacion.objects.filter(pk=segunda[1]).update(estado='cancelada')
+            return encontradas
+
+        with mock.patch.object(espejo, 'parejas', side_effect=invalidar_segunda), \
+                mock.patch.object(espejo, 'ejecutar_ciclos', wraps=espejo.ejecutar_ciclos) as ejecutar:
+            resultados = list(espejo.barrer(tamano_lote=10))
+
+        self.assertEqual(resultados, [(primera, True), (segunda, False)])
+        # El lote completo y después cada pareja por separado
+        self.assertEqual(
+            [llamada.args[0] for llamada in ejecutar.call_args_list],
+            [[primera, segunda], [primera], [segunda]]
+        )
+        self.assertEqual(
+            SolicitudPermutacion.objects.filter(pk__in=primera, estado='aceptada').count(), 2
+        )
+        self.assertEqual(SolicitudPermutacion.objects.get(pk=segunda[0]).estado, 'pendiente')
+
+
+class DifusionTests(EscenarioPermutaciones, TestCase):
+    """Propuestas enviadas a varias contrapartes desde el formulario de difusión."""
+
+    def setUp(self):
+        super().setUp()
+        self.destinos = self.agregar_destinos(2, contrapartes=2)
+        self.client.force_login(self.usuario)
+        self.url = reverse('permutaciones:crear', args=[self.origen.pk])
+
+    def valores(self):
+        """Valores "<id_oportunidad>:<id_usuario>" de todas las contrapartes."""
+        return [
+            f'{oportunidad_id}:{usuario_id}'
+            for usuario_id, oportunidad_id in Inscripcion.objects.filter(
+                oportunidad__in=self.destinos
+            ).order_by('pk').values_list('usuario_id', 'oportunidad_id')
+        ]
+
+    def test_formulario_ofrece_las_contrapartes(self):
+        respuesta = self.client.get(f"{reverse('permutaciones:lista')}?oportunidad_id={self.origen.pk}")
+        self.assertContains(respuesta, 'name="destinos" multiple')
+        for valor in self.valores():
+            self.assertContains(respuesta, f'<option value="{valor}">')
+
+    def test_aceptar_una_propuesta_cancela_las_demas(self):
+        elegidas = self.valores()[1:]
+        respuesta = self.client.post(self.url, {'destinos': elegidas, 'mensaje': 'Difusión'})
+        self.assertRedirects(respuesta, reverse('permutaciones:lista'), fetch_redirect_response=False)
+        propuestas = list(SolicitudPermutacion.objects.order_by('pk'))
+        self.assertEqual(len(propuestas), 3)
+        self.assertEqual(len({propuesta.grupo for propuesta in propuestas}), 1)
+
+        estado, _ = propuestas[1].aceptar()
+        self.assertEqual(estado, 'aceptada')
+        for hermana in (propuestas[0], propuestas[2]):
+            hermana.refresh_from_db()
+            self.assertEqual(hermana.estado, 'cancelada')
+            self.assertTrue(HistorialPermutacion.objects.filter(
+                solicitud=hermana, accion='cancelacion', datos__motivo='difusion_aceptada'
+            ).exists())
+
+    def test_difusion_concurrente_identica(self):
+        # La otra petición insertó primero: la restricción única hace fallar la inserción
+        with mock.patch.object(SolicitudPermutacion, 'crear_difusion', side_effect=IntegrityError):
+            respuesta = self.client.post(self.url, {'destinos': self.valores()}, follow=True)
+        self.assertRedirects(respuesta, reverse('permutaciones:lista'))
+        self.assertContains(respuesta, 'Ya existe una solicitud pendiente')
+        self.assertFalse(SolicitudPermutacion.objects.exists())
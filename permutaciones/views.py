@@ -4,7 +4,7 @@ from django.core.exceptions import ValidationError  # Para manejo de validacione
 from django.shortcuts import render, get_object_or_404, redirect  # Utilidades para vistas basadas en funciones
 from django.contrib.auth.decorators import login_required  # Decorador para requerir autenticación
 from django.contrib import messages  # Sistema de mensajes para el usuario
-from django.db import transaction, models  # Utilidades de base de datos
+from django.db import IntegrityError, transaction, models  # Utilidades de base de datos
 from django.views.generic import ListView, DetailView, TemplateView  # Vistas genéricas basadas en clases
 from django.contrib.auth.mixins import LoginRequiredMixin  # Mixin para requerir autenticación en VBC
 from django.urls import reverse_lazy  # Para URLs con evaluación perezosa
@@ -12,9 +12,11 @@ from django.utils import timezone  # Manejo de zonas horarias
 from django.contrib.auth import get_user_model  # Obtener el modelo de usuario activo
 
 # Importaciones de modelos locales
-from .models import SolicitudPermutacion, HistorialPermutacion  # Modelos de la aplicación
+from .models import SolicitudPermutacion, HistorialPermutacion, CandidatoPermutacion  # Modelos de la aplicación
 from inscripciones.models import Inscripcion  # Modelo de inscripciones
-from oportunidades.models import OportunidadVoluntariado  # Modelo de oportunidades de voluntariado
+from oportunidades.models import OportunidadVoluntariado, FranjaHoraria  # Oportunidades y sus franjas horarias
+from oportunidades.horarios import IndiceHorario  # Índice para detectar superposiciones de horario
+from . import espejo  # Emparejamiento de solicitudes recíprocas
 
 class ListaPermutacionesView(LoginRequiredMixin, ListView):
     """
@@ -58,16 +60,27 @@ class ListaPermutacionesView(LoginRequiredMixin, ListView):
             oportunidad__fecha_fin__gte=timezone.now().date()
         ).select_related('oportunidad')
         
-        # Separar solicitudes enviadas y recibidas
-        context['solicitudes_enviadas'] = [s for s in context['solicitudes'] if s.solicitante == user]
-        context['solicitudes_recibidas'] = [s for s in context['solicitudes'] if s.receptor == user]
+        # Separar solicitudes enviadas y recibidas en una sola pasada (sin consultas extra)
+        enviadas = []
+        recibidas = []
+        recibidas_pendientes = 0
+        for solicitud in context['solicitudes']:
+            if solicitud.solicitante_id == user.id:
+                enviadas.append(solicitud)
+            if solicitud.receptor_id == user.id:
+                recibidas.append(solicitud)
+                if solicitud.estado == 'pendiente':
+                    recibidas_pendientes += 1
+        context['solicitudes_enviadas'] = enviadas
+        context['solicitudes_recibidas'] = recibidas
+        context['recibidas_pendientes'] = recibidas_pendientes
         
         # Obtener oportunidades disponibles para permutar
         oportunidad_id = self.request.GET.get('oportunidad_id')
         if oportunidad_id:
             try:
                 # Verificar que el usuario esté inscrito en la oportunidad seleccionada
-                inscripcion = Inscripcion.objects.get(
+                inscripcion = Inscripcion.objects.select_related('oportunidad').get(
                     oportunidad_id=oportunidad_id,
                     usuario=user,
                     estado='aceptada'
@@ -76,20 +89,12 @@ class ListaPermutacionesView(LoginRequiredMixin, ListView):
                 oportunidad_actual = inscripcion.oportunidad
                 context['oportunidad_actual'] = oportunidad_actual
                 
-                # Usar el método mejorado del modelo para obtener oportunidades con usuarios disponibles
-                oportunidades_permutables = SolicitudPermutacion.calcular_permutaciones_posibles(
+                # Consultar el índice materializado de candidatos (una sola consulta indexada
+                # que también indica si ya hay una solicitud pendiente por oportunidad)
+                oportunidades_permutables = CandidatoPermutacion.oportunidades_para(
                     user, oportunidad_actual
                 )
                 
-                # Verificar solicitudes pendientes existentes para cada oportunidad
-                for op in oportunidades_permutables:
-                    op['tiene_solicitud_pendiente'] = SolicitudPermutacion.objects.filter(
-                        solicitante=user,
-                        oportunidad_origen=oportunidad_actual,
-                        oportunidad_destino_id=op['oportunidad']['id'],
-                        estado='pendiente'
-                    ).exists()
-                
                 context['oportunidades_permutables'] = oportunidades_permutables
                 
             except (OportunidadVoluntariado.DoesNotExist, Inscripcion.DoesNotExist):
@@ -100,57 +105,81 @@ class ListaPermutacionesView(LoginRequiredMixin, ListView):
     def obtener_usuarios_disponibles_para_intercambio(self, usuario, oportunidad_origen, oportunidad_destino):
         """
         Obtiene los usuarios con los que se puede hacer intercambio para una oportunidad específica.
+        
+        Se resuelve en una única consulta: los usuarios aceptados en la oportunidad
+        destino, con anti-joins (NOT EXISTS) para descartar a quienes ya tienen una
+        inscripción en la oportunidad origen y a quienes tendrían un conflicto de horario
+        al pasar a ella. El conflicto se evalúa en SQL sobre las franjas horarias: alguna
+        inscripción aceptada vigente del usuario (salvo la del destino, que deja) tiene
+        una franja del mismo día que se cruza en horas y fechas con una del origen.
         """
-        # 1. Usuarios que están inscritos en la oportunidad destino
-        usuarios_en_destino = Inscripcion.objects.filter(
-            oportunidad=oportunidad_destino,
-            estado='aceptada'
-        ).exclude(usuario=usuario)  # Excluir al usuario actual
+        hoy = timezone.now().date()
         
-        # 2. Filtrar usuarios que no estén ya en la oportunidad de origen
-        #    y que no tengan conflictos de horario
-        usuarios_disponibles = get_user_model().objects.none()
+        # Franjas del origen que se cruzan con la franja externa (mismo día y horas solapadas)
+        franjas_origen_solapadas = FranjaHoraria.objects.filter(
+            oportunidad=oportunidad_origen,
+            dia_semana=models.OuterRef('dia_semana'),
+            hora_inicio__lt=models.OuterRef('hora_fin'),
+            hora_fin__gt=models.OuterRef('hora_inicio')
+        )
         
-        for inscripcion in usuarios_en_destino.select_related('usuario'):
-            usuario_destino = inscripcion.usuario
-            
-            # Verificar que el usuario no esté ya en la oportunidad de origen
-            if not Inscripcion.objects.filter(
-                usuario=usuario_destino,
-                oportunidad=oportunidad_origen
-            ).exists():
-                # Verificar que no haya conflictos de horario
-                if not self.tiene_conflicto_horario(usuario_destino, oportunidad_origen):
-                    usuarios_disponibles |= get_user_model().objects.filter(id=usuario_destino.id)
+        # Franjas de las demás actividades del usuario candidato que chocan con el origen
+        franjas_en_conflicto = FranjaHoraria.objects.filter(
+            oportunidad__inscripciones__usuario=models.OuterRef('pk'),
+            oportunidad__inscripciones__estado='aceptada',
+            oportunidad__fecha_inicio__lte=oportunidad_origen.fecha_fin,
+            oportunidad__fecha_fin__gte=max(hoy, oportunidad_origen.fecha_inicio)
+        ).exclude(
+            oportunidad=oportunidad_destino  # La oportunidad que deja no cuenta
+        ).filter(
+            models.Exists(franjas_origen_solapadas)
+        )
         
-        return usuarios_disponibles
+        return get_user_model().objects.filter(
+            # 1. Usuarios que están inscritos en la oportunidad destino
+            models.Exists(Inscripcion.objects.filter(
+                usuario=models.OuterRef('pk'),
+                oportunidad=oportunidad_destino,
+                estado='aceptada'
+            ))
+        ).exclude(
+            pk=usuario.pk  # Excluir al usuario actual
+        ).exclude(
+            # 2. Usuarios que ya están en la oportunidad de origen
+            models.Exists(Inscripcion.objects.filter(
+                usuario=models.OuterRef('pk'),
+                oportunidad=oportunidad_origen
+            ))
+        ).exclude(
+            # 3. Usuarios con conflictos de horario
+            models.Exists(franjas_en_conflicto)
+        )
     
     def tiene_conflicto_horario(self, usuario, oportunidad):
         """
-        Verifica si el usuario ya tiene una actividad en el mismo horario.
+        Verifica si el usuario ya tiene una actividad en el mismo horario,
+        comparando las franjas horarias de sus inscripciones aceptadas vigentes.
         """
-        # Obtener todas las inscripciones activas del usuario
-        inscripciones = Inscripcion.objects.filter(
-            usuario=usuario,
-            estado='aceptada',
-            oportunidad__fecha_fin__gte=timezone.now().date()
-        ).exclude(oportunidad=oportunidad).select_related('oportunidad')
-        
-        # Verificar conflictos de horario
-        for inscripcion in inscripciones:
-            if self.horarios_se_superponen(inscripcion.oportunidad, oportunidad):
-                return True
-        
-        return False
+        return FranjaHoraria.conflictos_para_usuario(usuario, oportunidad, estados=('aceptada',))
     
     def horarios_se_superponen(self, op1, op2):
         """
-        Verifica si dos oportunidades tienen horarios que se superponen.
-        Como no tenemos campos separados para día y hora, asumimos que si tienen el mismo horario,
-        hay superposición. Esto es una simplificación.
+        Verifica si dos oportunidades tienen horarios que se superponen
+        (mismo día, horas que se cruzan y fechas que coinciden).
         """
-        # Si los horarios son iguales, hay superposición
-        return op1.horario == op2.horario
+        franjas = FranjaHoraria.de_oportunidades([op1.id, op2.id])
+        indice = IndiceHorario(franjas.get(op1.id, []))
+        return bool(indice.oportunidades_en_conflicto(franjas.get(op2.id, [])))
+
+def version_enviada(request):
+    """
+    Obtiene la versión de la solicitud enviada en el formulario (control optimista).
+    
+    Returns:
+        int o None: Versión enviada, o None si no se envió o no es válida
+    """
+    version = request.POST.get('version', '')
+    return int(version) if version.isdigit() else None
 
 @login_required  # Requiere que el usuario esté autenticado
 def crear_solicitud(request, oportunidad_id):
@@ -177,6 +206,9 @@ def crear_solicitud(request, oportunidad_id):
         messages.error(request, 'No estás inscrito en esta oportunidad o no está aceptada')
         return redirect('permutaciones:lista')
     
+    if request.method == 'POST' and request.POST.getlist('destinos'):
+        return crear_difusion(request, oportunidad_origen)
+    
     if request.method == 'POST':
         oportunidad_destino_id = request.POST.get('oportunidad_destino')
         usuario_destino_id = request.POST.get('usuario_destino')
@@ -223,6 +255,15 @@ def crear_solicitud(request, oportunidad_id):
             solicitud.full_clean()
             solicitud.save()
             
+            # Si otro voluntario ya pidió el intercambio inverso, realizarlo de inmediato
+            if espejo.emparejar([solicitud], request.user):
+                messages.success(
+                    request,
+                    'Otro voluntario había solicitado el intercambio inverso: '
+                    'el cambio de turno se realizó automáticamente'
+                )
+                return redirect('permutaciones:lista')
+            
             messages.success(request, 'Solicitud de intercambio enviada correctamente')
             return redirect('permutaciones:lista')
             
@@ -236,6 +277,55 @@ def crear_solicitud(request, oportunidad_id):
     # Redirigir a la lista de permutaciones
     return redirect('permutaciones:lista')
 
+def crear_difusion(request, oportunidad_origen):
+    """
+    Crea en una sola petición propuestas de intercambio para varios voluntarios.
+    Cada valor de `destinos` tiene la forma "<id_oportunidad>:<id_usuario>".
+    
+    Args:
+        request: Objeto HttpRequest (POST)
+        oportunidad_origen: Oportunidad cuyo turno se ofrece
+        
+    Returns:
+        HttpResponse: Redirección a la lista de permutaciones con mensaje de estado
+    """
+    destinos = []
+    for valor in request.POST.getlist('destinos'):
+        oportunidad_id, _, usuario_id = valor.partition(':')
+        if oportunidad_id.isdigit() and usuario_id.isdigit():
+            destinos.append((int(usuario_id), int(oportunidad_id)))
+    mensaje = request.POST.get('mensaje', 'Solicitud de intercambio de turno')
+    
+    try:
+        creadas, descartadas = SolicitudPermutacion.crear_difusion(
+            request.user, oportunidad_origen, destinos, mensaje, usuario_accion=request.user
+        )
+    except ValidationError as e:
+        messages.error(request, f'Error de validación: {e}')
+        return redirect('permutaciones:lista')
+    except IntegrityError:
+        # Una difusión idéntica enviada a la vez (doble envío del formulario) insertó
+        # primero alguna de las propuestas: la restricción solicitud_permutacion_unica
+        # deshace esta difusión completa
+        messages.warning(request, 'Ya existe una solicitud pendiente para alguno de estos intercambios')
+        return redirect('permutaciones:lista')
+    
+    # Si alguno de los voluntarios ya pidió el intercambio inverso, realizarlo de inmediato
+    # (al aceptarse una propuesta, las demás de la difusión se cancelan)
+    if creadas and espejo.emparejar(creadas, request.user):
+        messages.success(
+            request,
+            'Otro voluntario había solicitado el intercambio inverso: '
+            'el cambio de turno se realizó automáticamente'
+        )
+        return redirect('permutaciones:lista')
+    
+    if creadas:
+        messages.success(request, f'Se enviaron {len(creadas)} solicitudes de intercambio')
+    if descartadas:
+        messages.warning(request, f'{len(descartadas)} propuestas no se enviaron porque ya no eran válidas')
+    return redirect('permutaciones:lista')
+
 @login_required  # Requiere que el usuario esté autenticado
 def aceptar_solicitud(request, pk):
     """
@@ -261,8 +351,8 @@ def aceptar_solicitud(request, pk):
     try:
         # Establecer el usuario actual para el historial
         solicitud._usuario_actual = request.user
-        # Aceptar la solicitud
-        resultado, mensaje = solicitud.aceptar()
+        # Aceptar la solicitud comprobando la versión que vio el usuario
+        resultado, mensaje = solicitud.aceptar(version_esperada=version_enviada(request))
         
         # Mostrar el mensaje solo una vez
         if resultado == 'aceptada':
@@ -271,12 +361,13 @@ def aceptar_solicitud(request, pk):
             messages.warning(request, mensaje)
         else:  # error
             messages.error(request, mensaje)
-        
-        return redirect('permutaciones:lista')
     except ValidationError as e:
+        # Incluye ConflictoConcurrencia (otra operación modificó la solicitud)
         messages.error(request, f'Error al aceptar la solicitud: {e}')
     except Exception as e:
         messages.error(request, f'Error inesperado: {str(e)}')
+    
+    return redirect('permutaciones:lista')
 
 @login_required  # Requiere que el usuario esté autenticado
 def rechazar_solicitud(request, pk):
@@ -299,8 +390,8 @@ def rechazar_solicitud(request, pk):
     try:
         # Establecer el usuario actual para el historial
         solicitud._usuario_actual = request.user
-        # Rechazar la solicitud
-        solicitud.rechazar()
+        # Rechazar la solicitud comprobando la versión que vio el usuario
+        solicitud.rechazar(version_esperada=version_enviada(request))
         messages.success(request, 'Has rechazado la solicitud de permutación')
     except ValidationError as e:
         messages.error(request, f'Error al rechazar la solicitud: {e}')
@@ -329,19 +420,8 @@ def cancelar_solicitud(request, pk):
     try:
         # Establecer el usuario actual para el historial
         solicitud._usuario_actual = request.user
-        # Cancelar la solicitud
-        solicitud.estado = 'cancelada'
-        solicitud.fecha_actualizacion = timezone.now()
-        
-        # Registrar la cancelación en el historial
-        HistorialPermutacion.objects.create(
-            solicitud=solicitud,
-            accion='cancelacion',
-            detalles='Solicitud de intercambio cancelada por el solicitante',
-            usuario=request.user
-        )
-        
-        solicitud.save()
+        # Cancelar la solicitud (con control de versión) y registrar el historial
+        solicitud.cancelar(version_esperada=version_enviada(request))
         messages.success(request, 'La solicitud de permutación ha sido cancelada.')
     except ValidationError as e:
         messages.error(request, str(e))